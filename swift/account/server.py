@@ -23,7 +23,8 @@ from eventlet import Timeout
 import swift.common.db
 from swift.account.backend import AccountBroker, DATADIR
 from swift.account.utils import account_listing_response, get_response_headers
-from swift.common.db import DatabaseConnectionError, DatabaseAlreadyExists
+from swift.common.db import ConnectionCache, DatabaseConnectionError, \
+    DatabaseAlreadyExists
 from swift.common.request_helpers import get_param, \
     split_and_validate_path
 from swift.common.utils import get_logger, hash_path, public, \
@@ -61,6 +62,14 @@ class AccountController(BaseStorageServer):
             conf.get('auto_create_account_prefix') or '.'
         swift.common.db.DB_PREALLOCATION = \
             config_true_value(conf.get('db_preallocation', 'f'))
+        swift.common.db.BINARY_PENDING = \
+            config_true_value(conf.get('binary_pending', 'f'))
+        swift.common.db.WAL_MODE = \
+            config_true_value(conf.get('db_wal_mode', 'f'))
+        connection_cache_size = int(
+            conf.get('db_connection_cache_size', 0))
+        self.connection_cache = ConnectionCache(connection_cache_size) \
+            if connection_cache_size > 0 else None
         self.fallocate_reserve, self.fallocate_is_percent = \
             config_fallocate_value(conf.get('fallocate_reserve', '1%'))
 
@@ -70,6 +79,7 @@ class AccountController(BaseStorageServer):
         db_path = os.path.join(self.root, drive, db_dir, hsh + '.db')
         kwargs.setdefault('account', account)
         kwargs.setdefault('logger', self.logger)
+        kwargs.setdefault('connection_cache', self.connection_cache)
         return AccountBroker(db_path, **kwargs)
 
     def _deleted_response(self, broker, req, resp, body=''):
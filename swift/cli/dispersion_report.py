@@ -128,8 +128,9 @@ def container_dispersion_report(coropool, connpool, account, container_ring,
                       end='')
                 stdout.flush()
     container_parts = {}
-    for container in containers:
-        part, nodes = container_ring.get_nodes(account, container)
+    placements = container_ring.get_nodes_many(
+        (account, container) for container in containers)
+    for container, (part, nodes) in zip(containers, placements):
         if part not in container_parts:
             container_copies_expected[0] += len(nodes)
             container_parts[part] = part
@@ -241,8 +242,9 @@ def object_dispersion_report(coropool, connpool, account, object_ring,
                       end='')
             stdout.flush()
     object_parts = {}
-    for obj in objects:
-        part, nodes = object_ring.get_nodes(account, container, obj)
+    placements = object_ring.get_nodes_many(
+        (account, container, obj) for obj in objects)
+    for obj, (part, nodes) in zip(objects, placements):
         if part not in object_parts:
             object_copies_expected[0] += len(nodes)
             object_parts[part] = part
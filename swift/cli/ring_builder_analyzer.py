@@ -24,7 +24,9 @@ parameters for a ring builder plus a certain number of rounds. In each
 round, some modifications are made to the builder, e.g. add a device, remove
 a device, change a device's weight. Then, the builder is repeatedly
 rebalanced until it settles down. Data about that round is printed, and the
-next round begins.
+next round begins. For each rebalance, the analyzer also prints how long it
+took and the peak memory use of the process so far, so that changes in the
+builder's speed and memory use can be tracked too.
 
 Scenarios are specified in JSON. Example scenario for a gradual device
 addition::
@@ -79,7 +81,9 @@ addition::
 
 import argparse
 import json
+import resource
 import sys
+import time
 
 from swift.common.ring import builder
 from swift.common.ring.utils import parse_add_value
@@ -277,6 +281,26 @@ def parse_scenario(scenario_data):
     return parsed_scenario
 
 
+def _peak_memory_mib():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes rather than KiB
+        maxrss /= 1024.0
+    return maxrss / 1024.0
+
+
+def _rebalance(rb, seed, rebalance_number):
+    start = time.time()
+    parts_moved, balance, removed_devs = rb.rebalance(seed=seed)
+    elapsed = time.time() - start
+    rb.pretend_min_part_hours_passed()
+    print("\tRebalance %d: moved %d parts, balance is %.6f, %d removed "
+          "devs, took %.3fs, peak memory %.1f MiB" % (
+              rebalance_number, parts_moved, balance, removed_devs,
+              elapsed, _peak_memory_mib()))
+    return parts_moved, balance, removed_devs
+
+
 def run_scenario(scenario):
     """
     Takes a parsed scenario (like from parse_scenario()) and runs it.
@@ -305,18 +329,13 @@ def run_scenario(scenario):
             command_f(*command)
 
         rebalance_number = 1
-        parts_moved, old_balance, removed_devs = rb.rebalance(seed=seed)
-        rb.pretend_min_part_hours_passed()
-        print("\tRebalance 1: moved %d parts, balance is %.6f, %d removed "
-              "devs" % (parts_moved, old_balance, removed_devs))
+        parts_moved, old_balance, removed_devs = _rebalance(
+            rb, seed, rebalance_number)
 
         while True:
             rebalance_number += 1
-            parts_moved, new_balance, removed_devs = rb.rebalance(seed=seed)
-            rb.pretend_min_part_hours_passed()
-            print("\tRebalance %d: moved %d parts, balance is %.6f, "
-                  "%d removed devs" % (rebalance_number, parts_moved,
-                                       new_balance, removed_devs))
+            parts_moved, new_balance, removed_devs = _rebalance(
+                rb, seed, rebalance_number)
             if parts_moved == 0 and removed_devs == 0:
                 break
             if abs(new_balance - old_balance) < 1 and not (
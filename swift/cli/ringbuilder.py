@@ -16,6 +16,7 @@
 from __future__ import print_function
 import logging
 
+from array import array
 from collections import defaultdict
 from errno import EEXIST
 from itertools import islice
@@ -374,6 +375,14 @@ def _parse_remove_values(argvish):
         exit(EXIT_ERROR)
 
 
+def _add_format_version_option(parser):
+    parser.add_option('--format-version', type='choice', choices=['1', '2'],
+                      default='1',
+                      help='ring file format to write: 1 (the default) can '
+                      'be read by any release, 2 is mapped into memory by '
+                      'servers but can only be read by newer releases')
+
+
 def _make_display_device_table(builder):
     ip_width = 10
     port_width = 4
@@ -876,6 +885,7 @@ swift-ring-builder <builder_file> rebalance [options]
         parser.add_option('-s', '--seed', help="seed to use for rebalance")
         parser.add_option('-d', '--debug', action='store_true',
                           help="print debug information")
+        _add_format_version_option(parser)
         options, args = parser.parse_args(argv)
 
         def get_seed(index):
@@ -990,10 +1000,12 @@ swift-ring-builder <builder_file> rebalance [options]
             print('-' * 79)
             status = EXIT_WARNING
         ts = time()
+        format_version = int(options.format_version)
         builder.get_ring().save(
-            pathjoin(backup_dir, '%d.' % ts + basename(ring_file)))
+            pathjoin(backup_dir, '%d.' % ts + basename(ring_file)),
+            format_version=format_version)
         builder.save(pathjoin(backup_dir, '%d.' % ts + basename(builder_file)))
-        builder.get_ring().save(ring_file)
+        builder.get_ring().save(ring_file, format_version=format_version)
         builder.save(builder_file)
         exit(status)
 
@@ -1112,12 +1124,17 @@ swift-ring-builder <builder_file> validate
     @staticmethod
     def write_ring():
         """
-swift-ring-builder <builder_file> write_ring
+swift-ring-builder <builder_file> write_ring [options]
     Just rewrites the distributable ring file. This is done automatically after
     a successful rebalance, so really this is only useful after one or more
     'set_info' calls when no rebalance is needed but you want to send out the
     new device information.
         """
+        usage = Commands.write_ring.__doc__.strip()
+        parser = optparse.OptionParser(usage)
+        _add_format_version_option(parser)
+        options, args = parser.parse_args(argv)
+
         if not builder.devs:
             print('Unable to write empty ring.')
             exit(EXIT_ERROR)
@@ -1128,9 +1145,11 @@ swift-ring-builder <builder_file> write_ring
                 print('Warning: Writing a ring with no partition '
                       'assignments but with devices; did you forget to run '
                       '"rebalance"?')
+        format_version = int(options.format_version)
         ring_data.save(
-            pathjoin(backup_dir, '%d.' % time() + basename(ring_file)))
-        ring_data.save(ring_file)
+            pathjoin(backup_dir, '%d.' % time() + basename(ring_file)),
+            format_version=format_version)
+        ring_data.save(ring_file, format_version=format_version)
         exit(EXIT_SUCCESS)
 
     @staticmethod
@@ -1168,7 +1187,10 @@ swift-ring-builder <ring_file> write_builder [min_part_hours]
             'devs': ring.devs,
             'devs_changed': False,
             'version': 0,
-            '_replica2part2dev': ring._replica2part2dev_id,
+            # a v2 ring's assignments are mapped from the ring file, which
+            # can't be pickled into the builder
+            '_replica2part2dev': [array('H', part2dev_id) for part2dev_id
+                                  in ring._replica2part2dev_id],
             '_last_part_moves_epoch': None,
             '_last_part_moves': None,
             '_last_part_gather_start': 0,
@@ -15,12 +15,14 @@
 
 """ Database code for Swift """
 
+from collections import OrderedDict
 from contextlib import contextmanager, closing
 import base64
 import hashlib
 import json
 import logging
 import os
+import struct
 from uuid import uuid4
 import sys
 import time
@@ -50,6 +52,123 @@ PICKLE_PROTOCOL = 2
 #: Max size of .pending file in bytes. When this is exceeded, the pending
 # records will be merged.
 PENDING_CAP = 131072
+#: Whether records are written to .pending files in the binary format
+BINARY_PENDING = False
+# A binary .pending entry starts with a marker that can't be in the base64
+# entries of the original format, then the format's version and the length of
+# the pickled record that follows.
+PENDING_BINARY_MARKER = b'\x00'
+PENDING_BINARY_VERSION = 1
+PENDING_ENTRY_HEADER = struct.Struct('!cBI')
+#: Size of the reads of .pending files when committing them
+PENDING_READ_SIZE = 65536
+#: Whether databases are put in write-ahead log (WAL) journal mode
+WAL_MODE = False
+#: Suffixes of the files SQLite keeps next to a database in WAL mode
+WAL_SUFFIXES = ('-wal', '-shm')
+
+
+def _load_pending_entries(entries, loads, on_error):
+    try:
+        return list(map(loads, entries))
+    except Exception:
+        records = []
+        for entry in entries:
+            try:
+                records.append(loads(entry))
+            except Exception:
+                on_error(entry)
+        return records
+
+
+def _load_base64_entry(entry):
+    return pickle.loads(base64.b64decode(entry))
+
+
+def _invalid_pending_entry(on_error, entry, msg):
+    try:
+        raise ValueError(msg)
+    except ValueError:
+        on_error(entry)
+
+
+def iter_pending_records(fp, on_error, read_size=None):
+    """
+    Read and unpickle the records in a .pending file, whose entries may be in
+    either format. The file is read in chunks, and the entries of each chunk
+    are unpickled together.
+
+    :param fp: the .pending file
+    :param on_error: called with an entry that can't be unpickled, while the
+                     exception is being handled
+    :param read_size: the size of the reads from the file; defaults to
+                      PENDING_READ_SIZE
+    :returns: an iterator of lists of record tuples
+    """
+    read_size = read_size or PENDING_READ_SIZE
+    header_size = PENDING_ENTRY_HEADER.size
+    unpack_header = PENDING_ENTRY_HEADER.unpack_from
+    buf = b''
+    pos = 0
+    eof = False
+    while True:
+        buf_len = len(buf)
+        start = pos
+        pickles = []
+        while buf.startswith(PENDING_BINARY_MARKER, pos) and \
+                pos + header_size <= buf_len:
+            _junk, version, length = unpack_header(buf, pos)
+            end = pos + header_size + length
+            if end > buf_len:
+                break
+            if version == PENDING_BINARY_VERSION:
+                pickles.append(buf[pos + header_size:end])
+            else:
+                _invalid_pending_entry(
+                    on_error, buf[pos:end],
+                    'Unknown pending entry version %d' % version)
+            pos = end
+        if pickles:
+            yield _load_pending_entries(pickles, pickle.loads, on_error)
+
+        if pos < buf_len and not buf.startswith(PENDING_BINARY_MARKER, pos):
+            # the original format's colon separated entries run until the
+            # next binary entry; those before the last colon are complete
+            end = buf.find(PENDING_BINARY_MARKER, pos)
+            if end < 0:
+                end = buf_len if eof else buf.rfind(b':', pos + 1)
+            if end > pos:
+                entries = [entry for entry in buf[pos:end].split(b':')
+                           if entry]
+                pos = end
+                yield _load_pending_entries(
+                    entries, _load_base64_entry, on_error)
+
+        if pos == start:
+            if eof:
+                if pos < buf_len:
+                    _invalid_pending_entry(on_error, buf[pos:],
+                                           'Truncated pending entry')
+                return
+            chunk = fp.read(read_size)
+            buf = buf[pos:] + chunk
+            pos = 0
+            eof = not chunk
+
+
+def dump_pending_entry(record):
+    """
+    Make an entry for a .pending file, in the format BINARY_PENDING chooses.
+
+    :param record: the record tuple
+    :returns: the entry, as bytes
+    """
+    data = pickle.dumps(record, protocol=PICKLE_PROTOCOL)
+    if BINARY_PENDING:
+        return PENDING_ENTRY_HEADER.pack(
+            PENDING_BINARY_MARKER, PENDING_BINARY_VERSION, len(data)) + data
+    # Colons aren't used in base64 encoding; so they are our delimiter
+    return b':' + base64.b64encode(data)
 
 
 def utf8encode(*args):
@@ -204,10 +323,19 @@ def get_db_connection(path, timeout=30, okay_to_create=False):
         conn.row_factory = sqlite3.Row
         conn.text_factory = str
         with closing(conn.cursor()) as cur:
-            cur.execute('PRAGMA synchronous = NORMAL')
             cur.execute('PRAGMA count_changes = OFF')
             cur.execute('PRAGMA temp_store = MEMORY')
-            cur.execute('PRAGMA journal_mode = DELETE')
+            if WAL_MODE and path != ':memory:':
+                # with NORMAL, a commit in WAL mode could be lost to a crash
+                cur.execute('PRAGMA synchronous = FULL')
+                cur.execute('PRAGMA journal_mode = WAL')
+            else:
+                cur.execute('PRAGMA synchronous = NORMAL')
+                # WAL mode sticks to a database, and leaving it needs every
+                # other connection closed, so leave it to its other users
+                journal_mode = cur.execute('PRAGMA journal_mode').fetchone()
+                if journal_mode[0] != 'wal':
+                    cur.execute('PRAGMA journal_mode = DELETE')
         conn.create_function('chexor', 3, chexor)
     except sqlite3.DatabaseError:
         import traceback
@@ -216,12 +344,161 @@ def get_db_connection(path, timeout=30, okay_to_create=False):
     return conn
 
 
+def unlink_wal_files(db_file):
+    """
+    Remove the write-ahead log and shared-memory index files of a database,
+    if it has any.
+
+    :param db_file: path to the database
+    """
+    for suffix in WAL_SUFFIXES:
+        try:
+            os.unlink(db_file + suffix)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+
+def _wal_has_pages(db_file):
+    try:
+        return os.path.getsize(db_file + '-wal') > 0
+    except OSError:
+        return False
+
+
+def replace_db_file(new_db_file, db_file, timeout=BROKER_TIMEOUT):
+    """
+    Rename a closed database over another. SQLite finds a database's
+    write-ahead log by name, so pages in the log of the database being
+    replaced would be applied to the new one: the log is emptied first, and
+    kept empty by holding the database's write lock until the rename is done.
+
+    :param new_db_file: path to the database to rename
+    :param db_file: path to rename it to
+    :param timeout: how long to wait for the write lock
+    :returns: True if the database was renamed, False if readers kept the
+              existing database's log from being emptied
+    """
+    unlink_wal_files(new_db_file)
+    if not os.path.exists(db_file):
+        # any log left here belonged to a database that has gone
+        unlink_wal_files(db_file)
+        renamer(new_db_file, db_file)
+        return True
+    conn = get_db_connection(db_file, timeout)
+    try:
+        if os.path.exists(db_file + '-wal'):
+            busy, log_pages, checkpointed_pages = conn.execute(
+                'PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+            if busy or log_pages != checkpointed_pages:
+                return False
+        conn.isolation_level = None
+        conn.execute('BEGIN IMMEDIATE')
+        # a writer may have got in between the checkpoint and the lock
+        if _wal_has_pages(db_file):
+            return False
+        renamer(new_db_file, db_file)
+        return True
+    finally:
+        conn.close()
+
+
+class ConnectionCache(object):
+    """
+    A bounded cache of idle database connections, keyed by database file, so
+    that a server's brokers can reuse connections across requests rather than
+    open one for each.
+
+    A cached connection is only reused while its database file is still the
+    file it was opened on, so a database that another process has replaced,
+    quarantined or removed gets a fresh connection.
+
+    :param size: the most idle connections to keep; the least recently used
+                 are closed to make room
+    """
+
+    def __init__(self, size):
+        self.size = size
+        # db_file -> list of (connection, (st_dev, st_ino) of the db_file)
+        self._idle = OrderedDict()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def get(self, db_file, timeout):
+        """
+        Take a cached connection to a database, or open a new one.
+
+        :param db_file: path to the database
+        :param timeout: timeout for the connection
+        :returns: a database connection, to be handed back with :meth:`put`
+        :raises DatabaseConnectionError: if the database doesn't exist
+        """
+        try:
+            stat = os.stat(db_file)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            raise DatabaseConnectionError(db_file, "DB doesn't exist")
+        file_id = (stat.st_dev, stat.st_ino)
+        entries = self._idle.pop(db_file, [])
+        conn = None
+        while entries and conn is None:
+            cached_conn, cached_file_id = entries.pop()
+            self._count -= 1
+            if cached_file_id == file_id:
+                conn = cached_conn
+            else:
+                cached_conn.close()
+        if entries:
+            self._idle[db_file] = entries
+        if conn is None:
+            conn = get_db_connection(db_file, timeout)
+        conn.timeout = timeout
+        conn.file_id = file_id
+        return conn
+
+    def put(self, conn):
+        """
+        Hand back a connection taken with :meth:`get`, to be cached.
+        Connections that weren't are closed.
+
+        :param conn: a database connection with no open transaction
+        """
+        file_id = getattr(conn, 'file_id', None)
+        if file_id is None or self.size <= 0:
+            conn.close()
+            return
+        entries = self._idle.pop(conn.db_file, [])
+        entries.append((conn, file_id))
+        self._idle[conn.db_file] = entries
+        self._count += 1
+        while self._count > self.size:
+            db_file, entries = next(iter(self._idle.items()))
+            entries.pop(0)[0].close()
+            self._count -= 1
+            if not entries:
+                del self._idle[db_file]
+
+    def invalidate(self, db_file):
+        """
+        Close the cached connections to a database.
+
+        :param db_file: path to the database
+        """
+        for conn, _junk in self._idle.pop(db_file, []):
+            conn.close()
+            self._count -= 1
+
+
 class DatabaseBroker(object):
     """Encapsulates working with a database."""
 
     def __init__(self, db_file, timeout=BROKER_TIMEOUT, logger=None,
                  account=None, container=None, pending_timeout=None,
-                 stale_reads_ok=False, skip_commits=False):
+                 stale_reads_ok=False, skip_commits=False,
+                 connection_cache=None):
         """Encapsulates working with a database.
 
         :param db_file: path to a database file.
@@ -238,8 +515,12 @@ class DatabaseBroker(object):
             commit records from the pending file to the database;
             :meth:`~swift.common.db.DatabaseBroker.put_record` should not
             called on brokers with skip_commits True.
+        :param connection_cache: a :class:`ConnectionCache` to take
+            connections from and hand them back to, or None to open a
+            connection for the broker alone.
         """
         self.conn = None
+        self.connection_cache = connection_cache
         self._db_file = db_file
         self.pending_file = self._db_file + '.pending'
         self.pending_timeout = pending_timeout or 10
@@ -358,6 +639,7 @@ class DatabaseBroker(object):
         with self.get() as conn:
             self._delete_db(conn, timestamp)
             conn.commit()
+        self._invalidate_connections(self.db_file)
 
     @property
     def db_file(self):
@@ -378,6 +660,7 @@ class DatabaseBroker(object):
         quar_path = os.path.join(device_path, 'quarantined',
                                  self.db_type + 's',
                                  os.path.basename(self.db_dir))
+        self._invalidate_connections(self.db_file)
         try:
             renamer(self.db_dir, quar_path, fsync=False)
         except OSError as e:
@@ -436,13 +719,29 @@ class DatabaseBroker(object):
             with self.get() as conn:
                 yield conn
 
+    def _connect(self):
+        if self.connection_cache is not None:
+            return self.connection_cache.get(self.db_file, self.timeout)
+        return get_db_connection(self.db_file, self.timeout)
+
+    def _release(self, conn):
+        if self.connection_cache is not None and \
+                self.db_file != ':memory:':
+            self.connection_cache.put(conn)
+        else:
+            self.conn = conn
+
+    def _invalidate_connections(self, db_file):
+        if self.connection_cache is not None:
+            self.connection_cache.invalidate(db_file)
+
     @contextmanager
     def get(self):
         """Use with the "with" statement; returns a database connection."""
         if not self.conn:
             if self.db_file != ':memory:' and os.path.exists(self.db_file):
                 try:
-                    self.conn = get_db_connection(self.db_file, self.timeout)
+                    self.conn = self._connect()
                 except (sqlite3.DatabaseError, DatabaseConnectionError):
                     self.possibly_quarantine(*sys.exc_info())
             else:
@@ -452,7 +751,7 @@ class DatabaseBroker(object):
         try:
             yield conn
             conn.rollback()
-            self.conn = conn
+            self._release(conn)
         except sqlite3.DatabaseError:
             try:
                 conn.close()
@@ -468,7 +767,7 @@ class DatabaseBroker(object):
         """Use with the "with" statement; locks a database."""
         if not self.conn:
             if self.db_file != ':memory:' and os.path.exists(self.db_file):
-                self.conn = get_db_connection(self.db_file, self.timeout)
+                self.conn = self._connect()
             else:
                 raise DatabaseConnectionError(self.db_file, "DB doesn't exist")
         conn = self.conn
@@ -483,12 +782,45 @@ class DatabaseBroker(object):
         try:
             conn.execute('ROLLBACK')
             conn.isolation_level = orig_isolation_level
-            self.conn = conn
+            self._release(conn)
         except (Exception, Timeout):
             logging.exception(
                 _('Broker error trying to rollback locked connection'))
             conn.close()
 
+    def close(self):
+        """
+        Close the broker's connection, if it has one. When the last
+        connection to a database in WAL mode closes, SQLite checkpoints the
+        write-ahead log and removes it.
+        """
+        if self.conn:
+            conn = self.conn
+            self.conn = None
+            conn.close()
+
+    def checkpoint(self, mode='TRUNCATE'):
+        """
+        Copy the pages in a database's write-ahead log into the database
+        file, using a connection of its own so that it can run while this
+        broker holds :meth:`lock`. A TRUNCATE checkpoint then empties the log,
+        unless a reader is still using it.
+
+        :param mode: the kind of checkpoint; see SQLite's ``wal_checkpoint``
+        :returns: True if the checkpoint completed, or the database has no
+                  log; False if readers kept it from completing
+        """
+        if self.db_file == ':memory:' or \
+                not os.path.exists(self.db_file + '-wal'):
+            return True
+        conn = get_db_connection(self.db_file, self.timeout)
+        try:
+            busy, log_pages, checkpointed_pages = conn.execute(
+                'PRAGMA wal_checkpoint(%s)' % mode).fetchone()
+        finally:
+            conn.close()
+        return not busy and log_pages == checkpointed_pages
+
     def newid(self, remote_id):
         """
         Re-id the database.  This should be called after an rsync.
@@ -691,12 +1023,8 @@ class DatabaseBroker(object):
                 self._commit_puts([record])
             else:
                 with open(self.pending_file, 'a+b') as fp:
-                    # Colons aren't used in base64 encoding; so they are our
-                    # delimiter
-                    fp.write(b':')
-                    fp.write(base64.b64encode(pickle.dumps(
-                        self.make_tuple_for_pickle(record),
-                        protocol=PICKLE_PROTOCOL)))
+                    fp.write(dump_pending_entry(
+                        self.make_tuple_for_pickle(record)))
                     fp.flush()
 
     def _skip_commit_puts(self):
@@ -727,15 +1055,17 @@ class DatabaseBroker(object):
                 self.merge_items(item_list)
             return
         with open(self.pending_file, 'r+b') as fp:
-            for entry in fp.read().split(b':'):
-                if entry:
+            def log_invalid_entry(entry):
+                self.logger.exception(
+                    _('Invalid pending entry %(file)s: %(entry)r'),
+                    {'file': self.pending_file, 'entry': entry})
+
+            for records in iter_pending_records(fp, log_invalid_entry):
+                for data in records:
                     try:
-                        data = pickle.loads(base64.b64decode(entry))
                         self._commit_puts_load(item_list, data)
                     except Exception:
-                        self.logger.exception(
-                            _('Invalid pending entry %(file)s: %(entry)s'),
-                            {'file': self.pending_file, 'entry': entry})
+                        log_invalid_entry(data)
             if item_list:
                 self.merge_items(item_list)
             try:
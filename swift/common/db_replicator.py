@@ -28,6 +28,7 @@ from eventlet import GreenPool, sleep, Timeout
 from eventlet.green import subprocess
 
 import swift.common.db
+from swift.common.db import _wal_has_pages, replace_db_file
 from swift.common.constraints import check_drive
 from swift.common.utils import get_logger, whataremyips, storage_directory, \
     renamer, mkdirs, lock_parent_directory, config_true_value, \
@@ -42,7 +43,7 @@ from swift.common.bufferedhttp import BufferedHTTPConnection
 from swift.common.exceptions import DriveNotMounted
 from swift.common.daemon import Daemon
 from swift.common.swob import Response, HTTPNotFound, HTTPNoContent, \
-    HTTPAccepted, HTTPBadRequest
+    HTTPAccepted, HTTPBadRequest, HTTPServiceUnavailable
 
 
 DEBUG_TIMINGS_THRESHOLD = 10
@@ -214,6 +215,8 @@ class Replicator(Daemon):
         self.reclaim_age = float(conf.get('reclaim_age', 86400 * 7))
         swift.common.db.DB_PREALLOCATION = \
             config_true_value(conf.get('db_preallocation', 'f'))
+        swift.common.db.WAL_MODE = \
+            config_true_value(conf.get('db_wal_mode', 'f'))
         self._zero_stats()
         self.recon_cache_path = conf.get('recon_cache_path',
                                          '/var/cache/swift')
@@ -312,15 +315,21 @@ class Replicator(Daemon):
         rsync_module = rsync_module_interpolation(self.rsync_module, device)
         rsync_path = '%s/tmp/%s' % (device['device'], local_id)
         remote_file = '%s/%s' % (rsync_module, rsync_path)
+        # only the db file is sent, so pages in a write-ahead log must be
+        # copied into it first
+        broker.checkpoint()
         mtime = os.path.getmtime(broker.db_file)
         if not self._rsync_file(broker.db_file, remote_file,
                                 different_region=different_region):
             return False
         # perform block-level sync if the db was modified during the first sync
         if os.path.exists(broker.db_file + '-journal') or \
+                _wal_has_pages(broker.db_file) or \
                 os.path.getmtime(broker.db_file) > mtime:
             # grab a lock so nobody else can modify it
             with broker.lock():
+                if not broker.checkpoint('PASSIVE'):
+                    return False
                 if not self._rsync_file(broker.db_file, remote_file,
                                         whole_file=False,
                                         different_region=different_region):
@@ -579,6 +588,8 @@ class Replicator(Daemon):
             broker = self.brokerclass(object_file, pending_timeout=30)
             broker.reclaim(now - self.reclaim_age,
                            now - (self.reclaim_age * 2))
+            # keep the write-ahead log of a db in WAL mode from growing
+            broker.checkpoint()
             info = broker.get_replication_info()
             bpart = self.ring.get_part(
                 info['account'], info.get('container'))
@@ -964,7 +975,9 @@ class ReplicatorRpc(object):
             return HTTPNotFound()
         broker = self.broker_class(old_filename)
         broker.newid(args[0])
-        renamer(old_filename, db_file)
+        broker.close()
+        if not replace_db_file(old_filename, db_file):
+            return HTTPServiceUnavailable()
         return HTTPNoContent()
 
     def _abort_rsync_then_merge(self, db_file, tmp_filename):
@@ -993,9 +1006,12 @@ class ReplicatorRpc(object):
         self._post_rsync_then_merge_hook(existing_broker, new_broker)
         new_broker.newid(args[0])
         new_broker.update_metadata(existing_broker.metadata)
+        new_broker.close()
         if self._abort_rsync_then_merge(db_file, tmp_filename):
             return HTTPNotFound()
-        renamer(tmp_filename, db_file)
+        existing_broker.close()
+        if not replace_db_file(tmp_filename, db_file):
+            return HTTPServiceUnavailable()
         return HTTPNoContent()
 
 # Footnote [1]:
@@ -0,0 +1,216 @@
+# Copyright (c) 2018 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Erasure code encoding and decoding, optionally done in helper processes.
+
+PyECLib holds the GIL while it encodes or decodes, so doing that work in a
+proxy worker ties up the worker's one core and stalls every other request it
+is handling. An :class:`ECCodecExecutor` with ``processes`` greater than zero
+instead hands batches of segments to a set of helper processes over pipes;
+the worker's other greenthreads carry on while a helper works, and the
+helpers can run on other cores.
+"""
+
+import struct
+import sys
+
+from eventlet.green import subprocess
+from eventlet.queue import Queue
+from pyeclib.ec_iface import ECDriver, ECDriverError
+from six.moves import cPickle as pickle
+
+# requests and responses are pickles preceded by their length
+LENGTH = struct.Struct('!I')
+# how many bytes of segments callers should try to hand a helper process
+# at once; every request costs a round trip through the pipes, which only
+# matters next to the cost of copying the data when segments are small
+BATCH_BYTES = 512 * 1024
+
+
+def _read_exactly(fp, size):
+    data = b''
+    while len(data) < size:
+        more = fp.read(size - len(data))
+        if not more:
+            raise EOFError('EC codec process closed its pipe')
+        data += more
+    return data
+
+
+def _read_message(fp):
+    length, = LENGTH.unpack(_read_exactly(fp, LENGTH.size))
+    return pickle.loads(_read_exactly(fp, length))
+
+
+def _write_message(fp, message):
+    data = pickle.dumps(message, 2)
+    fp.write(LENGTH.pack(len(data)) + data)
+    fp.flush()
+
+
+def _driver_key(policy):
+    return (policy.ec_type, policy.ec_ndata, policy.ec_nparity)
+
+
+def _run(driver, op, items):
+    if op == 'encode':
+        return [driver.encode(segment) for segment in items]
+    return [driver.decode(fragments) for fragments in items]
+
+
+class _CodecProcess(object):
+    """
+    A helper process, and the pipes to and from it.
+    """
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, '-c',
+             'from swift.common.ec_codec import main; main()'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+
+    def call(self, key, op, items):
+        _write_message(self.proc.stdin, (key, op, items))
+        ok, result = _read_message(self.proc.stdout)
+        if not ok:
+            raise ECDriverError(result)
+        return result
+
+    def kill(self):
+        try:
+            self.proc.kill()
+            self.proc.wait()
+        except OSError:
+            pass
+
+
+class ECCodecExecutor(object):
+    """
+    Encodes and decodes erasure coded segments, either inline or in a pool of
+    helper processes.
+
+    Helper processes are started the first time they are needed, so an
+    executor created before a server forks its workers gives each worker its
+    own helpers. A helper is only reused after a complete exchange with it;
+    one that fails or is interrupted mid-request is killed and replaced.
+
+    Callers that have several segments at hand should pass up to
+    :meth:`batch_segments` of them in one call to :meth:`encode` or
+    :meth:`decode`.
+
+    :param processes: the number of helper processes; 0 to encode and
+                      decode inline
+    :param logger: a logger, used to report helper processes that fail
+    """
+
+    def __init__(self, processes=0, logger=None):
+        self.processes = processes
+        self.logger = logger
+        self._idle = None
+
+    def _call(self, policy, op, items):
+        if not self.processes or not items:
+            return _run(policy.pyeclib_driver, op, items)
+        if self._idle is None:
+            self._idle = Queue()
+            for _junk in range(self.processes):
+                self._idle.put(None)
+        proc = self._idle.get()
+        try:
+            if proc is None:
+                proc = _CodecProcess()
+            result = proc.call(_driver_key(policy), op, items)
+        except ECDriverError:
+            # the helper replied, so it's ready for another request
+            self._idle.put(proc)
+            raise
+        except (IOError, OSError, EOFError, struct.error):
+            if self.logger:
+                self.logger.exception('EC codec process failed; restarting')
+            self._discard(proc)
+            return _run(policy.pyeclib_driver, op, items)
+        except BaseException:
+            # the reply to this request may still be in the pipe, where the
+            # next caller would read it as its own
+            self._discard(proc)
+            raise
+        self._idle.put(proc)
+        return result
+
+    def _discard(self, proc):
+        if proc is not None:
+            proc.kill()
+        # a new helper is started when the slot is next used
+        self._idle.put(None)
+
+    def batch_segments(self, policy):
+        """
+        Get how many segments of a policy are worth encoding or decoding in
+        one call. That's one when the work is done inline, where a batch
+        saves nothing.
+
+        :param policy: an EC storage policy
+        """
+        if not self.processes:
+            return 1
+        return max(1, BATCH_BYTES // policy.ec_segment_size)
+
+    def encode(self, policy, segments):
+        """
+        Encode segments.
+
+        :param policy: an EC storage policy
+        :param segments: a list of segments, as bytes
+        :returns: a list with a list of fragments for each segment
+        :raises ECDriverError: if a segment can't be encoded
+        """
+        return self._call(policy, 'encode', segments)
+
+    def decode(self, policy, fragment_sets):
+        """
+        Decode segments.
+
+        :param policy: an EC storage policy
+        :param fragment_sets: a list with a list of fragments for each
+                              segment
+        :returns: a list of the decoded segments
+        :raises ECDriverError: if a segment can't be decoded
+        """
+        return self._call(policy, 'decode', fragment_sets)
+
+
+def main():
+    """
+    Serve encode and decode requests from a parent ECCodecExecutor on stdin,
+    until it goes away.
+    """
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    drivers = {}
+    while True:
+        try:
+            key, op, items = _read_message(stdin)
+        except EOFError:
+            return
+        try:
+            if key not in drivers:
+                ec_type, ec_ndata, ec_nparity = key
+                drivers[key] = ECDriver(k=ec_ndata, m=ec_nparity,
+                                        ec_type=ec_type)
+            reply = (True, _run(drivers[key], op, items))
+        except ECDriverError as err:
+            reply = (False, str(err))
+        _write_message(stdout, reply)
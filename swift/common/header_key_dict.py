@@ -21,6 +21,8 @@ class HeaderKeyDict(dict):
     A dict that title-cases all keys on the way in, so as to be
     case-insensitive.
     """
+    __slots__ = ()
+
     def __init__(self, base_headers=None, **kwargs):
         if base_headers:
             self.update(base_headers)
@@ -47,13 +47,18 @@ http://github.com/memcached/memcached/blob/1.4.2/doc/protocol.txt
 import six.moves.cPickle as pickle
 import json
 import logging
+import math
+import struct
 import time
-from bisect import bisect
+from bisect import bisect, bisect_left
+from collections import defaultdict, OrderedDict
+from copy import deepcopy
 from hashlib import md5
 
+import eventlet
 from eventlet.green import socket
 from eventlet.pools import Pool
-from eventlet import Timeout
+from eventlet import GreenPile, Timeout
 from six.moves import range
 from swift.common import utils
 
@@ -65,6 +70,9 @@ IO_TIMEOUT = 2.0
 PICKLE_FLAG = 1
 JSON_FLAG = 2
 NODE_WEIGHT = 50
+# ketama takes four points from each md5 hash, and libketama uses 40 hashes
+# per server (of average weight)
+KETAMA_POINTS_PER_HASH = 40
 PICKLE_PROTOCOL = 2
 TRY_COUNT = 3
 
@@ -148,23 +156,72 @@ class MemcacheConnPool(Pool):
         return fp, sock
 
 
+def ketama_points(server, weight, total_weight, num_servers):
+    """
+    Returns the points on a ketama continuum for a server, as libketama
+    places them, except that a server with any weight gets at least one
+    hash's worth of points.
+    """
+    num_hashes = max(1, int(math.floor(
+        float(weight) / total_weight * KETAMA_POINTS_PER_HASH * num_servers)))
+    points = []
+    for i in range(num_hashes):
+        digest = md5(('%s-%d' % (server, i)).encode('utf-8')).digest()
+        points.extend(struct.unpack('<4I', digest))
+    return points
+
+
+def ketama_hash(key):
+    """
+    Returns the position of a key on a ketama continuum.
+    """
+    return struct.unpack_from('<I', md5(key).digest())[0]
+
+
 class MemcacheRing(object):
     """
     Simple, consistent-hashed memcache client.
+
+    By default each server gets ``NODE_WEIGHT`` points on the hash ring, times
+    its weight, but always at least one. With ``ketama`` the servers are
+    placed on a ketama continuum instead, as libketama and the clients based
+    on it place them, so keys are spread in proportion to the servers'
+    weights and adding or removing a server moves only that server's share
+    of them. Changing either
+    placement for an existing cluster moves most keys to a different
+    server, which will look like a cache flush.
+
+    :param servers: a list of servers
+    :param weights: a dict of the servers' weights; servers not in it have a
+                    weight of 1
+    :param ketama: if True, place servers with ketama
     """
 
     def __init__(self, servers, connect_timeout=CONN_TIMEOUT,
                  io_timeout=IO_TIMEOUT, pool_timeout=POOL_TIMEOUT,
                  tries=TRY_COUNT, allow_pickle=False, allow_unpickle=False,
-                 max_conns=2):
+                 max_conns=2, weights=None, ketama=False):
         self._ring = {}
         self._errors = dict(((serv, []) for serv in servers))
         self._error_limited = dict(((serv, 0) for serv in servers))
-        for server in sorted(servers):
-            for i in range(NODE_WEIGHT):
-                self._ring[md5hash('%s-%s' % (server, i))] = server
+        weights = weights or {}
+        self._ketama = ketama
+        if ketama:
+            total_weight = sum(weights.get(server, 1) for server in servers)
+            for server in sorted(servers):
+                for point in ketama_points(server, weights.get(server, 1),
+                                           total_weight, len(servers)):
+                    self._ring[point] = server
+        else:
+            for server in sorted(servers):
+                num_points = max(1, int(NODE_WEIGHT * weights.get(server, 1)))
+                for i in range(num_points):
+                    self._ring[md5hash('%s-%s' % (server, i))] = server
         self._tries = tries if tries <= len(servers) else len(servers)
         self._sorted = sorted(self._ring)
+        # servers found down by check_health, which are left out of the ring
+        self._unhealthy = set()
+        self._health_check = None
         self._client_cache = dict(((server,
                                     MemcacheConnPool(server, max_conns,
                                                      connect_timeout))
@@ -211,41 +268,149 @@ class MemcacheRing(object):
                 self._error_limited[server] = now + ERROR_LIMIT_DURATION
                 logging.error('Error limiting server %s', server)
 
-    def _get_conns(self, key):
+    def _get_servers(self, key):
         """
-        Retrieves a server conn from the pool, or connects a new one.
-        Chooses the server based on a consistent hash of "key".
+        Returns the servers to try for "key", in the order to try them,
+        based on a consistent hash of "key".
         """
-        pos = bisect(self._sorted, key)
+        if self._ketama:
+            pos = bisect_left(self._sorted, ketama_hash(key)) - 1
+        else:
+            pos = bisect(self._sorted, key)
         served = []
-        while len(served) < self._tries:
+        skipped = []
+        for _junk in range(len(self._sorted)):
+            if len(served) >= self._tries:
+                break
             pos = (pos + 1) % len(self._sorted)
             server = self._ring[self._sorted[pos]]
-            if server in served:
+            if server in served or server in skipped:
                 continue
-            served.append(server)
-            if self._error_limited[server] > time.time():
+            if server in self._unhealthy:
+                skipped.append(server)
                 continue
-            sock = None
-            try:
-                with MemcachePoolTimeout(self._pool_timeout):
-                    fp, sock = self._client_cache[server].get()
+            served.append(server)
+        # if too few servers are healthy, try the others after them
+        return served + skipped[:self._tries - len(served)]
+
+    def _get_conn(self, server):
+        """
+        Retrieves a conn to a server from its pool, or connects a new one.
+
+        :returns: a tuple of (fp, sock), or None if the server is error
+                  limited or can't be reached
+        """
+        if self._error_limited[server] > time.time():
+            return None
+        sock = None
+        try:
+            with MemcachePoolTimeout(self._pool_timeout):
+                fp, sock = self._client_cache[server].get()
+            return fp, sock
+        except MemcachePoolTimeout as e:
+            self._exception_occurred(
+                server, e, action='getting a connection',
+                got_connection=False)
+        except (Exception, Timeout) as e:
+            # Typically a Timeout exception caught here is the one raised
+            # by the create() method of this server's MemcacheConnPool
+            # object.
+            self._exception_occurred(
+                server, e, action='connecting', sock=sock)
+        return None
+
+    def _get_conns(self, key):
+        """
+        Retrieves a server conn from the pool, or connects a new one.
+        Chooses the server based on a consistent hash of "key".
+        """
+        for server in self._get_servers(key):
+            conn = self._get_conn(server)
+            if conn is not None:
+                fp, sock = conn
                 yield server, fp, sock
-            except MemcachePoolTimeout as e:
-                self._exception_occurred(
-                    server, e, action='getting a connection',
-                    got_connection=False)
-            except (Exception, Timeout) as e:
-                # Typically a Timeout exception caught here is the one raised
-                # by the create() method of this server's MemcacheConnPool
-                # object.
-                self._exception_occurred(
-                    server, e, action='connecting', sock=sock)
 
     def _return_conn(self, server, fp, sock):
         """Returns a server connection to the pool."""
         self._client_cache[server].put((fp, sock))
 
+    def _prewarm_server(self, server):
+        pool = self._client_cache[server]
+        conns = []
+        try:
+            while pool.current_size < pool.max_size or \
+                    (pool.free_items and pool.free_items[0][0] is None):
+                conn = self._get_conn(server)
+                if conn is None:
+                    break
+                conns.append(conn)
+        finally:
+            for fp, sock in conns:
+                self._return_conn(server, fp, sock)
+
+    def prewarm(self):
+        """
+        Fill each server's connection pool, connecting to the servers in
+        parallel, so that requests don't have to wait to connect.
+        """
+        pile = GreenPile(len(self._client_cache) or 1)
+        for server in self._client_cache:
+            pile.spawn(self._prewarm_server, server)
+        for _junk in pile:
+            pass
+
+    def _server_is_healthy(self, server):
+        fp = sock = None
+        try:
+            with Timeout(self._connect_timeout + self._io_timeout):
+                fp, sock = self._client_cache[server].create()
+                sock.sendall(b'version\r\n')
+                return fp.readline().startswith(b'VERSION')
+        except (Exception, Timeout):
+            return False
+        finally:
+            for closeable in (fp, sock):
+                try:
+                    if closeable:
+                        closeable.close()
+                except Exception:
+                    pass
+
+    def check_health(self):
+        """
+        Ask each server for its version, on connections of its own, and take
+        servers that don't answer out of the ring until they do.
+        """
+        pile = GreenPile(len(self._client_cache) or 1)
+        servers = sorted(self._client_cache)
+        for server in servers:
+            pile.spawn(self._server_is_healthy, server)
+        for server, healthy in zip(servers, pile):
+            if healthy and server in self._unhealthy:
+                logging.warning('Memcached server %s is back', server)
+                self._unhealthy.discard(server)
+            elif not healthy and server not in self._unhealthy:
+                logging.error('Memcached server %s is down; taking it out '
+                              'of the ring', server)
+                self._unhealthy.add(server)
+
+    def _run_health_check(self, interval):
+        while True:
+            eventlet.sleep(interval)
+            try:
+                self.check_health()
+            except Exception:
+                logging.exception('Error checking memcached servers')
+
+    def start_health_check(self, interval):
+        """
+        Check the servers' health every interval seconds in a greenthread,
+        if that's not already being done.
+        """
+        if self._health_check is None and interval > 0:
+            self._health_check = eventlet.spawn(
+                self._run_health_check, interval)
+
     def set(self, key, value, serialize=True, time=0,
             min_compress_len=0):
         """
@@ -453,6 +618,35 @@ class MemcacheRing(object):
             except (Exception, Timeout) as e:
                 self._exception_occurred(server, e, sock=sock, fp=fp)
 
+    def _read_values(self, fp):
+        """
+        Reads the reply to a get of one or more keys.
+
+        :returns: a dict of the values found, by (hashed) key
+        :raises MemcacheConnectionError: if the reply is cut short
+        """
+        line = fp.readline().strip().split()
+        responses = {}
+        while True:
+            if not line:
+                raise MemcacheConnectionError('incomplete read')
+            if line[0].upper() == b'END':
+                break
+            if line[0].upper() == b'VALUE':
+                size = int(line[3])
+                value = fp.read(size)
+                if int(line[2]) & PICKLE_FLAG:
+                    if self._allow_unpickle:
+                        value = pickle.loads(value)
+                    else:
+                        value = None
+                elif int(line[2]) & JSON_FLAG:
+                    value = json.loads(value.decode('ascii'))
+                responses[line[1]] = value
+                fp.readline()
+            line = fp.readline().strip().split()
+        return responses
+
     def get_multi(self, keys, server_key):
         """
         Gets multiple values from memcache for the given keys.
@@ -468,26 +662,7 @@ class MemcacheRing(object):
             try:
                 with Timeout(self._io_timeout):
                     sock.sendall(b'get ' + b' '.join(keys) + b'\r\n')
-                    line = fp.readline().strip().split()
-                    responses = {}
-                    while True:
-                        if not line:
-                            raise MemcacheConnectionError('incomplete read')
-                        if line[0].upper() == b'END':
-                            break
-                        if line[0].upper() == b'VALUE':
-                            size = int(line[3])
-                            value = fp.read(size)
-                            if int(line[2]) & PICKLE_FLAG:
-                                if self._allow_unpickle:
-                                    value = pickle.loads(value)
-                                else:
-                                    value = None
-                            elif int(line[2]) & JSON_FLAG:
-                                value = json.loads(value.decode('ascii'))
-                            responses[line[1]] = value
-                            fp.readline()
-                        line = fp.readline().strip().split()
+                    responses = self._read_values(fp)
                     values = []
                     for key in keys:
                         if key in responses:
@@ -498,3 +673,259 @@ class MemcacheRing(object):
                     return values
             except (Exception, Timeout) as e:
                 self._exception_occurred(server, e, sock=sock, fp=fp)
+
+    def _get_many_from_server(self, server, keys):
+        """
+        Gets the values for keys from one server with a single request.
+
+        :returns: a dict of the values found, by (hashed) key, or None if the
+                  server couldn't be asked
+        """
+        conn = self._get_conn(server)
+        if conn is None:
+            return None
+        fp, sock = conn
+        try:
+            with Timeout(self._io_timeout):
+                sock.sendall(b'get ' + b' '.join(keys) + b'\r\n')
+                responses = self._read_values(fp)
+                self._return_conn(server, fp, sock)
+                return responses
+        except (Exception, Timeout) as e:
+            self._exception_occurred(server, e, sock=sock, fp=fp)
+        return None
+
+    def get_many(self, keys):
+        """
+        Gets multiple values from memcache for the given keys. Unlike
+        get_multi, each key is looked for on the server its own hash chooses,
+        just as get would. The keys for each server are fetched with a single
+        request, and the servers are asked in parallel; keys whose server
+        can't be asked are tried on their next server.
+
+        :param keys: keys for values to be retrieved from memcache
+        :returns: list of values, with None for keys that weren't found
+        """
+        keys = [md5hash(key) for key in keys]
+        servers_by_key = dict((key, self._get_servers(key)) for key in keys)
+        responses = {}
+        pending = sorted(servers_by_key)
+        for attempt in range(self._tries):
+            if not pending:
+                break
+            keys_by_server = defaultdict(list)
+            for key in pending:
+                # a key may have fewer servers than there are tries
+                if attempt < len(servers_by_key[key]):
+                    keys_by_server[servers_by_key[key][attempt]].append(key)
+            if not keys_by_server:
+                break
+            requests = sorted(keys_by_server.items())
+            if len(requests) == 1:
+                results = [self._get_many_from_server(*requests[0])]
+            else:
+                pile = GreenPile(len(requests))
+                for server, server_keys in requests:
+                    pile.spawn(self._get_many_from_server, server, server_keys)
+                results = list(pile)
+            pending = []
+            for (server, server_keys), result in zip(requests, results):
+                if result is None:
+                    pending.extend(server_keys)
+                else:
+                    responses.update(result)
+        return [responses.get(key) for key in keys]
+
+
+def parse_near_cache_ttls(value):
+    """
+    Parse a near_cache_ttls option, a comma separated list of
+    ``<key prefix>:<ttl>`` items, e.g. ``account/:10, container/:10``.
+
+    :returns: a dict mapping key prefixes to TTLs in seconds
+    :raises ValueError: if an item can't be parsed
+    """
+    ttls = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        prefix, sep, ttl = item.rpartition(':')
+        if not prefix or not sep:
+            raise ValueError('Invalid near_cache_ttls item %r; expected '
+                             '<key prefix>:<ttl>' % item)
+        ttl = float(ttl)
+        if ttl < 0:
+            raise ValueError('near_cache_ttls TTL must be >= 0: %r' % item)
+        ttls[prefix] = ttl
+    return ttls
+
+
+class NearCache(object):
+    """
+    An in-process cache in front of a :class:`MemcacheRing`, so that keys
+    read on nearly every request, such as tokens and account and container
+    info, don't cost a round trip to memcache every time.
+
+    Only keys with one of the configured prefixes are kept, each for its
+    prefix's TTL; the longest matching prefix wins. Keys that weren't in
+    memcache are remembered as misses for at most ``negative_ttl`` seconds.
+    Once an entry's TTL has passed it may still be served for up to
+    ``stale_ttl`` seconds while it is fetched again in the background.
+
+    Sets, deletes and incrs made through a NearCache drop the keys they
+    touch from it, but changes made by other processes are only seen once
+    entries expire, so TTLs should be short. Everything else is passed
+    straight to the MemcacheRing.
+
+    Hits, stale hits and misses are counted in
+    ``near_cache.<prefix>.hit``, ``near_cache.<prefix>.stale_hit`` and
+    ``near_cache.<prefix>.miss`` metrics.
+
+    :param memcache: the MemcacheRing to put the cache in front of
+    :param ttls: a dict mapping key prefixes to TTLs in seconds
+    :param max_entries: the most entries to keep, evicting the least
+                        recently used
+    :param negative_ttl: seconds for which to remember that a key wasn't
+                         in memcache; 0 to not remember misses
+    :param stale_ttl: seconds for which to serve an expired entry while it
+                      is fetched again
+    :param logger: a logger, used for metrics
+    """
+
+    def __init__(self, memcache, ttls, max_entries=10000, negative_ttl=0,
+                 stale_ttl=0, logger=None):
+        self.memcache = memcache
+        # longest prefixes first, so that the most specific one matches
+        self.ttls = sorted(ttls.items(), key=lambda item: -len(item[0]))
+        self._ttl_by_prefix = dict(ttls)
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.logger = logger
+        self._metric_names = dict(
+            (prefix, ''.join(c if c.isalnum() or c in '-_' else '_'
+                             for c in prefix.strip('/')))
+            for prefix in ttls)
+        # key -> (value, expires, stale_until)
+        self._entries = OrderedDict()
+        self._refreshing = set()
+
+    def __getattr__(self, name):
+        return getattr(self.memcache, name)
+
+    def _prefix_for(self, key):
+        if not isinstance(key, str):
+            return None
+        for prefix, ttl in self.ttls:
+            if key.startswith(prefix):
+                # a ttl of 0 keeps keys with a more specific prefix out
+                return prefix if ttl else None
+        return None
+
+    def _increment(self, prefix, metric):
+        if self.logger:
+            self.logger.increment('near_cache.%s.%s' % (
+                self._metric_names[prefix], metric))
+
+    def _store(self, key, prefix, value):
+        ttl = self._ttl_by_prefix[prefix]
+        if value is None:
+            ttl = min(ttl, self.negative_ttl)
+            if not ttl:
+                self._entries.pop(key, None)
+                return
+        now = time.time()
+        self._entries.pop(key, None)
+        self._entries[key] = (value, now + ttl, now + ttl + self.stale_ttl)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _refresh(self, key, prefix):
+        try:
+            self._store(key, prefix, self.memcache.get(key))
+        finally:
+            self._refreshing.discard(key)
+
+    def _get_entry(self, key, prefix):
+        """
+        Look for a key in the cache, starting a background fetch of it if
+        its entry is stale.
+
+        :returns: the cache entry, or None if the key must be fetched
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        _value, expires, stale_until = entry
+        now = time.time()
+        if now >= stale_until:
+            return None
+        self._entries[key] = entry
+        if now < expires:
+            self._increment(prefix, 'hit')
+        else:
+            self._increment(prefix, 'stale_hit')
+            if key not in self._refreshing:
+                self._refreshing.add(key)
+                eventlet.spawn_n(self._refresh, key, prefix)
+        return entry
+
+    def get(self, key):
+        prefix = self._prefix_for(key)
+        if prefix is None:
+            return self.memcache.get(key)
+        entry = self._get_entry(key, prefix)
+        if entry is None:
+            self._increment(prefix, 'miss')
+            value = self.memcache.get(key)
+            self._store(key, prefix, value)
+        else:
+            value = entry[0]
+        # callers may change what they're given, as they may what they get
+        # from memcache
+        return deepcopy(value)
+
+    def get_many(self, keys):
+        values = [None] * len(keys)
+        to_fetch = []
+        for i, key in enumerate(keys):
+            prefix = self._prefix_for(key)
+            entry = None if prefix is None else self._get_entry(key, prefix)
+            if entry is None:
+                to_fetch.append((i, prefix))
+            else:
+                values[i] = deepcopy(entry[0])
+        if to_fetch:
+            fetched = self.memcache.get_many([keys[i] for i, _ in to_fetch])
+            for (i, prefix), value in zip(to_fetch, fetched):
+                if prefix is not None:
+                    self._increment(prefix, 'miss')
+                    self._store(keys[i], prefix, value)
+                    value = deepcopy(value)
+                values[i] = value
+        return values
+
+    def _forget(self, key):
+        self._entries.pop(key, None)
+
+    def set(self, key, value, *args, **kwargs):
+        self._forget(key)
+        return self.memcache.set(key, value, *args, **kwargs)
+
+    def set_multi(self, mapping, *args, **kwargs):
+        for key in mapping:
+            self._forget(key)
+        return self.memcache.set_multi(mapping, *args, **kwargs)
+
+    def incr(self, key, *args, **kwargs):
+        self._forget(key)
+        return self.memcache.incr(key, *args, **kwargs)
+
+    def decr(self, key, *args, **kwargs):
+        self._forget(key)
+        return self.memcache.decr(key, *args, **kwargs)
+
+    def delete(self, key):
+        self._forget(key)
+        return self.memcache.delete(key)
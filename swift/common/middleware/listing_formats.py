@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import codecs
+import itertools
 import json
 import six
 from xml.etree.cElementTree import Element, SubElement, tostring
@@ -22,6 +24,7 @@ from swift.common.http import HTTP_NO_CONTENT
 from swift.common.request_helpers import get_param
 from swift.common.swob import HTTPException, HTTPNotAcceptable, Request, \
     RESPONSE_REASONS, HTTPBadRequest
+from swift.common.utils import closing_if_possible
 
 
 #: Mapping of query string ``format=`` values to their corresponding
@@ -34,6 +37,9 @@ FORMAT2CONTENT_TYPE = {'plain': 'text/plain', 'json': 'application/json',
 # Default max object length is 1024, default container listing limit is 1e4;
 # add a fudge factor for things like hash, last_modified, etc.
 MAX_CONTAINER_LISTING_CONTENT_LENGTH = 1024 * 10000 * 2
+#: Number of listing records to serialize into each chunk of a listing that is
+#: streamed rather than built whole.
+LISTING_RECORDS_PER_CHUNK = 100
 
 
 def get_listing_content_type(req):
@@ -72,50 +78,192 @@ def to_xml(document_element):
     return result
 
 
-def account_to_xml(listing, account_name):
+def _chunked(parts, parts_per_chunk=LISTING_RECORDS_PER_CHUNK):
+    """
+    Join the byte strings from ``parts`` into chunks of up to
+    ``parts_per_chunk`` parts, so that a listing is written in a few large
+    chunks rather than many tiny ones.
+    """
+    chunk = []
+    for part in parts:
+        chunk.append(part)
+        if len(chunk) >= parts_per_chunk:
+            yield b''.join(chunk)
+            chunk = []
+    if chunk:
+        yield b''.join(chunk)
+
+
+def _iter_xml(document_element, records, to_element, separator=b''):
+    """
+    Serialize a listing as XML a record at a time, making the same document
+    as :func:`to_xml` would if the elements for every record were added to
+    ``document_element``.
+    """
+    started = False
+    for record in records:
+        if not started:
+            # the open tag is that of an empty copy of the document element,
+            # less the " />"
+            empty = Element(document_element.tag, document_element.attrib)
+            yield to_xml(empty)[:-3] + b'>' + (
+                document_element.text or u'').encode('utf-8')
+            started = True
+        yield tostring(to_element(record), encoding='utf-8') + separator
+    if started:
+        yield b'</' + document_element.tag.encode('ascii') + b'>'
+    else:
+        yield to_xml(document_element)
+
+
+def _account_record_to_element(record):
+    if 'subdir' in record:
+        return Element('subdir', name=record.pop('subdir'))
+    sub = Element('container')
+    for field in ('name', 'count', 'bytes', 'last_modified'):
+        SubElement(sub, field).text = six.text_type(record.pop(field))
+    return sub
+
+
+def _container_record_to_element(record):
+    if 'subdir' in record:
+        name = record.pop('subdir')
+        sub = Element('subdir', name=name)
+        SubElement(sub, 'name').text = name
+        return sub
+    sub = Element('object')
+    for field in ('name', 'hash', 'bytes', 'content_type', 'last_modified'):
+        SubElement(sub, field).text = six.text_type(record.pop(field))
+    return sub
+
+
+def iter_account_xml(listing, account_name):
+    """
+    Serialize an account listing as XML, yielding chunks of the document.
+
+    :param listing: an iterable of account listing records, as dicts
+    :param account_name: the name of the account
+    """
     if isinstance(account_name, bytes):
         account_name = account_name.decode('utf-8')
     doc = Element('account', name=account_name)
     doc.text = '\n'
-    for record in listing:
-        if 'subdir' in record:
-            name = record.pop('subdir')
-            sub = SubElement(doc, 'subdir', name=name)
-        else:
-            sub = SubElement(doc, 'container')
-            for field in ('name', 'count', 'bytes', 'last_modified'):
-                SubElement(sub, field).text = six.text_type(
-                    record.pop(field))
-        sub.tail = '\n'
-    return to_xml(doc)
+    return _chunked(_iter_xml(doc, listing, _account_record_to_element,
+                              separator=b'\n'))
 
 
-def container_to_xml(listing, base_name):
+def iter_container_xml(listing, base_name):
+    """
+    Serialize a container listing as XML, yielding chunks of the document.
+
+    :param listing: an iterable of container listing records, as dicts
+    :param base_name: the name of the container
+    """
     if isinstance(base_name, bytes):
         base_name = base_name.decode('utf-8')
     doc = Element('container', name=base_name)
-    for record in listing:
-        if 'subdir' in record:
-            name = record.pop('subdir')
-            sub = SubElement(doc, 'subdir', name=name)
-            SubElement(sub, 'name').text = name
+    return _chunked(_iter_xml(doc, listing, _container_record_to_element))
+
+
+def iter_listing_json(listing):
+    """
+    Serialize a listing as a JSON array, yielding chunks of the document.
+
+    :param listing: an iterable of listing records, as dicts
+    """
+    def get_parts():
+        separator = b'['
+        for record in listing:
+            yield separator + json.dumps(record).encode('ascii')
+            separator = b', '
+        if separator == b'[':
+            yield b'[]'
         else:
-            sub = SubElement(doc, 'object')
-            for field in ('name', 'hash', 'bytes', 'content_type',
-                          'last_modified'):
-                SubElement(sub, field).text = six.text_type(
-                    record.pop(field))
-    return to_xml(doc)
+            yield b']'
+    return _chunked(get_parts())
 
 
-def listing_to_text(listing):
+def iter_listing_text(listing):
+    """
+    Serialize a listing as plain text, a name per line, yielding chunks of
+    the document.
+
+    :param listing: an iterable of listing records, as dicts
+    """
     def get_lines():
         for item in listing:
             if 'name' in item:
                 yield item['name'].encode('utf-8') + b'\n'
             else:
                 yield item['subdir'].encode('utf-8') + b'\n'
-    return b''.join(get_lines())
+    return _chunked(get_lines())
+
+
+def account_to_xml(listing, account_name):
+    return b''.join(iter_account_xml(listing, account_name))
+
+
+def container_to_xml(listing, base_name):
+    return b''.join(iter_container_xml(listing, base_name))
+
+
+def listing_to_text(listing):
+    return b''.join(iter_listing_text(listing))
+
+
+def iter_json_listing_records(body_iter):
+    """
+    Parse a JSON array of objects from an iterable of byte chunks, yielding
+    each object as a dict as soon as it has been read.
+
+    :param body_iter: an iterable of chunks of a JSON document
+    :raises ValueError: if the document isn't a JSON array of objects
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(body_iter)
+    buf = u''
+    pos = 0
+
+    def skip_whitespace(buf, pos):
+        # returns the text left to parse, and the position in it of the next
+        # non-whitespace character
+        while True:
+            while pos < len(buf) and buf[pos] in u' \t\r\n':
+                pos += 1
+            if pos < len(buf):
+                return buf, pos
+            buf, pos = read_more(buf, pos)
+
+    def read_more(buf, pos):
+        for chunk in chunks:
+            text = text_decoder.decode(chunk)
+            if text:
+                return buf[pos:] + text, 0
+        raise ValueError('Listing ended early')
+
+    buf, pos = skip_whitespace(buf, pos)
+    if buf[pos] != u'[':
+        raise ValueError('Listing is not a JSON array')
+    buf, pos = skip_whitespace(buf, pos + 1)
+    if buf[pos] == u']':
+        return
+    while True:
+        try:
+            record, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # maybe we haven't read all of it yet
+            buf, pos = read_more(buf, pos)
+            continue
+        if not isinstance(record, dict):
+            raise ValueError('Listing record is not a JSON object')
+        yield record
+        buf, pos = skip_whitespace(buf, pos)
+        if buf[pos] == u']':
+            return
+        if buf[pos] != u',':
+            raise ValueError('Expected "," in listing')
+        buf, pos = skip_whitespace(buf, pos + 1)
 
 
 class ListingFilter(object):
@@ -165,13 +313,16 @@ class ListingFilter(object):
             start_response(status, headers)
             return resp_iter
 
-        if resp_length is None or \
+        if resp_length is not None and \
                 resp_length > MAX_CONTAINER_LISTING_CONTENT_LENGTH:
             start_response(status, headers)
             return resp_iter
 
         def set_header(header, value):
-            if value is None:
+            if header not in header_to_index:
+                if value is not None:
+                    headers.append((header.title(), str(value)))
+            elif value is None:
                 del headers[header_to_index[header]]
             else:
                 headers[header_to_index[header]] = (
@@ -183,6 +334,11 @@ class ListingFilter(object):
             start_response(status, headers)
             return resp_iter
 
+        if resp_length is None:
+            return self._stream_listing(
+                status, headers, resp_iter, out_content_type, acct, cont,
+                set_header, start_response)
+
         body = b''.join(resp_iter)
         try:
             listing = json.loads(body.decode('ascii'))
@@ -220,6 +376,72 @@ class ListingFilter(object):
         start_response(status, headers)
         return [body]
 
+    def _stream_listing(self, status, headers, app_iter, out_content_type,
+                        acct, cont, set_header, start_response):
+        """
+        Convert a JSON listing that is being streamed, with no Content-Length,
+        a record at a time as it is read.
+
+        The converted listing is still sent to the client with a
+        Content-Length, but the whole listing is never held as both JSON and
+        parsed records.
+        """
+        resp_iter = iter(app_iter)
+        # don't start the response until the start of the listing has been
+        # seen to be good, so that anything else can be passed through
+        read_chunks = []
+
+        def read_body():
+            for chunk in resp_iter:
+                if read_chunks is not None:
+                    read_chunks.append(chunk)
+                yield chunk
+
+        def respond(body_iter):
+            with closing_if_possible(app_iter):
+                for chunk in body_iter:
+                    yield chunk
+
+        records = iter_json_listing_records(read_body())
+        try:
+            first_record = next(records, None)
+            if first_record is not None and \
+                    'name' not in first_record and \
+                    'subdir' not in first_record:
+                raise ValueError
+        except ValueError:
+            # Static web listing that's returning invalid JSON?
+            # Just pass it straight through; that's about all we *can* do.
+            start_response(status, headers)
+            return respond(itertools.chain(read_chunks, resp_iter))
+
+        set_header('content-type', out_content_type + '; charset=utf-8')
+        if out_content_type == 'application/json':
+            body = b''.join(respond(itertools.chain(read_chunks, resp_iter)))
+            set_header('content-length', len(body))
+            start_response(status, headers)
+            return [body]
+
+        read_chunks = None
+        if first_record is None:
+            listing = iter([])
+        else:
+            listing = itertools.chain([first_record], records)
+        if out_content_type.endswith('/xml'):
+            if cont:
+                body_iter = iter_container_xml(listing, cont)
+            else:
+                body_iter = iter_account_xml(listing, acct)
+        else:
+            body_iter = iter_listing_text(listing)
+            if first_record is None:
+                status = '%s %s' % (HTTP_NO_CONTENT,
+                                    RESPONSE_REASONS[HTTP_NO_CONTENT][0])
+        body = b''.join(respond(body_iter))
+        set_header('content-length', len(body))
+        start_response(status, headers)
+        return [body]
+
 
 def filter_factory(global_conf, **local_conf):
     return ListingFilter
@@ -15,10 +15,43 @@
 
 import os
 
+import eventlet
 from six.moves.configparser import ConfigParser, NoSectionError, NoOptionError
 
 from swift.common.memcached import (MemcacheRing, CONN_TIMEOUT, POOL_TIMEOUT,
-                                    IO_TIMEOUT, TRY_COUNT)
+                                    IO_TIMEOUT, TRY_COUNT, NearCache,
+                                    parse_near_cache_ttls)
+from swift.common.utils import get_logger, config_true_value
+
+
+def parse_memcache_servers(value):
+    """
+    Parse a comma separated list of memcache servers, each optionally
+    followed by a slash and its weight, e.g. ``10.1.2.3:11211/2``.
+
+    :returns: a tuple of the list of servers and a dict of their weights
+    :raises ValueError: if a weight is not a positive number
+    """
+    servers = []
+    weights = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        server, sep, weight = item.rpartition('/')
+        if not sep:
+            servers.append(item)
+            continue
+        server = server.strip()
+        try:
+            weight = float(weight)
+        except ValueError:
+            weight = 0
+        if weight <= 0:
+            raise ValueError('Invalid weight for memcache server %r' % item)
+        servers.append(server)
+        weights[server] = weight
+    return servers, weights
 
 
 class MemcacheMiddleware(object):
@@ -94,17 +127,50 @@ class MemcacheMiddleware(object):
         else:
             serialization_format = int(serialization_format)
 
+        servers, weights = parse_memcache_servers(self.memcache_servers)
         self.memcache = MemcacheRing(
-            [s.strip() for s in self.memcache_servers.split(',') if s.strip()],
+            servers,
             connect_timeout=connect_timeout,
             pool_timeout=pool_timeout,
             tries=tries,
             io_timeout=io_timeout,
             allow_pickle=(serialization_format == 0),
             allow_unpickle=(serialization_format <= 1),
-            max_conns=max_conns)
+            max_conns=max_conns,
+            weights=weights,
+            ketama=config_true_value(
+                memcache_options.get('ketama_hashing', 'false')))
+        self.prewarm_connections = config_true_value(
+            memcache_options.get('prewarm_connections', 'false'))
+        self.health_check_interval = float(
+            memcache_options.get('health_check_interval', 0))
+        self._started = False
+
+        near_cache_ttls = parse_near_cache_ttls(
+            memcache_options.get('near_cache_ttls'))
+        if near_cache_ttls:
+            self.memcache = NearCache(
+                self.memcache, near_cache_ttls,
+                max_entries=int(memcache_options.get(
+                    'near_cache_max_entries', 10000)),
+                negative_ttl=float(memcache_options.get(
+                    'near_cache_negative_ttl', 0)),
+                stale_ttl=float(memcache_options.get(
+                    'near_cache_stale_ttl', 0)),
+                logger=get_logger(conf, log_route='memcache'))
+
+    def _start(self):
+        # this is left until the first request, so that it's done in each
+        # worker once it has forked
+        self._started = True
+        if self.prewarm_connections:
+            eventlet.spawn_n(self.memcache.prewarm)
+        if self.health_check_interval > 0:
+            self.memcache.start_health_check(self.health_check_interval)
 
     def __call__(self, env, start_response):
+        if not self._started:
+            self._start()
         env['swift.cache'] = self.memcache
         return self.app(env, start_response)
 
@@ -0,0 +1,327 @@
+# Copyright (c) 2018 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+============
+Object Cache
+============
+
+Middleware that caches small, frequently read objects in the proxy, so that
+GETs of e.g. thumbnails and manifests don't each go to the object servers.
+
+Only whole object GETs without a query string are cached, and only objects no
+bigger than ``max_object_size``. Cache entries are keyed by path and remember
+the object's timestamp and ETag. An entry is served without checking with the
+object servers for ``cache_ttl`` seconds; after that, if ``revalidate`` is
+true, a HEAD checks that the timestamp and ETag still match before the entry is
+served again, otherwise the object is fetched afresh.
+
+A cached object is served with the same headers as it was fetched with, and
+Range and conditional requests are answered from the cached object in the same
+way the object server would answer them. Requests are authorized just as the
+proxy server would authorize them; requests with an ``Origin`` or
+``X-Newest`` header always go to the object servers.
+
+PUTs, POSTs and DELETEs of an object through the proxy drop it from the cache.
+With the ``memory`` backend each proxy worker has its own cache, so a change
+made through one worker is seen by the others only once their entries are
+revalidated or expire. With the ``memcache`` backend, entries are shared
+through the memcache servers used by the ``cache`` middleware, but should not
+be bigger than the memcache item size limit.
+
+If the encryption middleware is used, this middleware must be placed to its
+right, so that only encrypted object data and metadata is cached::
+
+    [pipeline:main]
+    pipeline = ... keymaster encryption object_cache proxy-logging proxy-server
+
+Hits, misses and revalidations are counted in the ``object_cache.hit``,
+``object_cache.miss`` and ``object_cache.revalidate`` metrics, and the bytes
+served from the cache in the ``object_cache.hit_bytes`` metric.
+
+-------------
+Configuration
+-------------
+
+================ ========= ==================================================
+Option           Default   Description
+---------------- --------- --------------------------------------------------
+backend          memory    Where to keep cached objects, ``memory`` or
+                           ``memcache``.
+max_object_size  65536     The largest object to cache, in bytes.
+max_cache_size   67108864  The most bytes to keep in the ``memory`` backend.
+cache_ttl        10        Seconds for which an entry is served without
+                           checking with the object servers.
+revalidate       true      Whether to check entries older than cache_ttl with
+                           a HEAD, rather than fetch the object again.
+================ ========= ==================================================
+"""
+
+import base64
+import time
+from collections import OrderedDict
+
+import six
+from six.moves.urllib.parse import quote
+
+from swift.common.request_helpers import resolve_etag_is_at_header
+from swift.common.swob import Request, Response
+from swift.common.utils import get_logger, config_true_value, \
+    cache_from_env, closing_if_possible
+from swift.common.wsgi import make_pre_authed_request
+from swift.proxy.controllers.base import get_container_info
+
+DEFAULT_MAX_OBJECT_SIZE = 65536
+DEFAULT_MAX_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_CACHE_TTL = 10
+CONDITIONAL_HEADERS = ('If-Match', 'If-None-Match', 'If-Modified-Since',
+                       'If-Unmodified-Since')
+
+
+def _entry_size(entry):
+    return len(entry['body']) + sum(len(k) + len(v)
+                                    for k, v in entry['headers'])
+
+
+class MemoryStore(object):
+    """
+    Keeps cache entries in this process, evicting the least recently used
+    once they total more than ``max_size`` bytes.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._entries[key] = entry
+        return entry
+
+    def set(self, key, entry):
+        self.delete(key)
+        entry_size = _entry_size(entry)
+        if entry_size > self.max_size:
+            return
+        while self.size + entry_size > self.max_size:
+            _junk, old_entry = self._entries.popitem(last=False)
+            self.size -= _entry_size(old_entry)
+        self._entries[key] = entry
+        self.size += entry_size
+
+    def delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= _entry_size(entry)
+
+
+class MemcacheStore(object):
+    """
+    Keeps cache entries in memcache.
+    """
+
+    def __init__(self, memcache, cache_ttl, revalidate):
+        self.memcache = memcache
+        # entries that can be revalidated are worth keeping until memcache
+        # needs the space
+        self.time = 0 if revalidate else cache_ttl
+
+    def get(self, key):
+        value = self.memcache.get(key)
+        if not value:
+            return None
+        try:
+            headers = value['headers']
+            if six.PY2:
+                # get back to native strings
+                headers = [(k.encode('utf-8'), v.encode('utf-8'))
+                           for k, v in headers]
+            return {
+                'headers': [(k, v) for k, v in headers],
+                'body': base64.b64decode(value['body']),
+                'timestamp': str(value['timestamp']),
+                'etag': str(value['etag']),
+                'validated_at': float(value['validated_at'])}
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def set(self, key, entry):
+        value = dict(entry)
+        value['body'] = base64.b64encode(entry['body']).decode('ascii')
+        try:
+            self.memcache.set(key, value, time=self.time)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            # metadata that won't serialize; don't cache it
+            pass
+
+    def delete(self, key):
+        self.memcache.delete(key)
+
+
+class ObjectCacheMiddleware(object):
+    """
+    Middleware that caches small objects in the proxy.
+    """
+
+    def __init__(self, app, conf, logger=None):
+        self.app = app
+        self.logger = logger or get_logger(conf, log_route='object_cache')
+        self.backend = conf.get('backend', 'memory').lower()
+        if self.backend not in ('memory', 'memcache'):
+            raise ValueError('object_cache backend must be "memory" or '
+                             '"memcache", not %r' % self.backend)
+        self.max_object_size = int(conf.get('max_object_size',
+                                            DEFAULT_MAX_OBJECT_SIZE))
+        self.cache_ttl = float(conf.get('cache_ttl', DEFAULT_CACHE_TTL))
+        self.revalidate = config_true_value(conf.get('revalidate', 'true'))
+        self.memory_store = MemoryStore(
+            int(conf.get('max_cache_size', DEFAULT_MAX_CACHE_SIZE)))
+
+    def _get_store(self, env):
+        if self.backend == 'memory':
+            return self.memory_store
+        memcache = cache_from_env(env, True)
+        if memcache is None:
+            return None
+        return MemcacheStore(memcache, self.cache_ttl, self.revalidate)
+
+    def _is_cacheable_request(self, req):
+        return (req.method == 'GET' and not req.query_string and
+                'Origin' not in req.headers and
+                'X-Newest' not in req.headers and
+                'X-Backend-Storage-Policy-Index' not in req.headers)
+
+    def _is_cacheable_response(self, resp):
+        return (resp.status_int == 200 and resp.etag and
+                resp.content_length is not None and
+                resp.content_length <= self.max_object_size and
+                self._resp_timestamp(resp) is not None)
+
+    def _resp_timestamp(self, resp):
+        return resp.headers.get('X-Backend-Timestamp',
+                                resp.headers.get('X-Timestamp'))
+
+    def _authorize(self, req):
+        """
+        Authorize a request as the proxy server would.
+
+        :returns: a denial response, or None if the request is authorized
+        """
+        if 'swift.authorize' not in req.environ:
+            return None
+        if not req.environ['swift.authorize'](req):
+            return None
+        # like the proxy server, retry with the container's read ACL
+        container_info = get_container_info(req.environ, self.app,
+                                            swift_source='OC')
+        req.acl = container_info['read_acl']
+        return req.environ['swift.authorize'](req)
+
+    def _is_fresh(self, req, store, key, entry):
+        """
+        Check that a cache entry may still be served.
+        """
+        now = time.time()
+        if entry['validated_at'] + self.cache_ttl > now:
+            return True
+        if not self.revalidate:
+            return False
+        self.logger.increment('revalidate')
+        head_req = make_pre_authed_request(
+            req.environ, method='HEAD', path=quote(req.path_info),
+            swift_source='OC')
+        head_resp = head_req.get_response(self.app)
+        with closing_if_possible(head_resp.app_iter):
+            pass
+        if head_resp.status_int != 200 or \
+                self._resp_timestamp(head_resp) != entry['timestamp'] or \
+                head_resp.etag != entry['etag']:
+            return False
+        entry['validated_at'] = now
+        store.set(key, entry)
+        return True
+
+    def _serve_entry(self, req, entry):
+        resp = Response(
+            request=req, headers=entry['headers'], body=entry['body'],
+            conditional_response=True,
+            conditional_etag=resolve_etag_is_at_header(
+                req, dict(entry['headers'])))
+        self.logger.increment('hit')
+        self.logger.update_stats('hit_bytes', len(entry['body']))
+        return resp
+
+    def handle_get(self, req):
+        store = self._get_store(req.environ)
+        if store is None:
+            return self.app
+        key = 'object_cache%s' % req.path_info
+        entry = store.get(key)
+        if entry is not None:
+            denial = self._authorize(req)
+            if denial:
+                return denial
+            if self._is_fresh(req, store, key, entry):
+                return self._serve_entry(req, entry)
+            store.delete(key)
+
+        self.logger.increment('miss')
+        if 'Range' in req.headers or any(
+                header in req.headers for header in CONDITIONAL_HEADERS):
+            # the response won't be the whole object
+            return self.app
+        resp = req.get_response(self.app)
+        if not self._is_cacheable_response(resp):
+            return resp
+        store.set(key, {
+            'headers': list(resp.headers.items()),
+            'body': resp.body,
+            'timestamp': self._resp_timestamp(resp),
+            'etag': resp.etag,
+            'validated_at': time.time()})
+        return resp
+
+    def __call__(self, env, start_response):
+        req = Request(env)
+        try:
+            req.split_path(4, 4, True)
+        except ValueError:
+            return self.app(env, start_response)
+
+        if req.method in ('PUT', 'POST', 'DELETE'):
+            store = self._get_store(env)
+            if store is None:
+                return self.app(env, start_response)
+            key = 'object_cache%s' % req.path_info
+            store.delete(key)
+            resp = self.app(env, start_response)
+            # a GET may have refilled the cache while the object was changing
+            store.delete(key)
+            return resp
+
+        if not self._is_cacheable_request(req):
+            return self.app(env, start_response)
+        return self.handle_get(req)(env, start_response)
+
+
+def filter_factory(global_conf, **local_conf):
+    conf = global_conf.copy()
+    conf.update(local_conf)
+
+    def object_cache_filter(app):
+        return ObjectCacheMiddleware(app, conf)
+    return object_cache_filter
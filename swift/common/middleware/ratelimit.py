@@ -18,7 +18,8 @@ from swift import gettext_ as _
 import eventlet
 
 from swift.common.utils import cache_from_env, get_logger, register_swift_info
-from swift.proxy.controllers.base import get_account_info, get_container_info
+from swift.proxy.controllers.base import get_account_info, \
+    get_container_info, prefetch_info
 from swift.common.constraints import valid_api_version
 from swift.common.memcached import MemcacheConnectionError
 from swift.common.swob import Request, Response
@@ -85,6 +86,24 @@ class MaxSleepTimeHitError(Exception):
     pass
 
 
+class LocalBucket(object):
+    """
+    A worker's view of a ratelimit key, for ratelimiting with
+    ``memcache_sync_interval``.
+
+    :param running_time_m: the time by which the key's requests so far will
+                           have been allowed, as far as this worker knows
+    :param now_m: the time now
+    """
+
+    def __init__(self, running_time_m, now_m):
+        self.running_time_m = running_time_m
+        # time used by requests this worker has allowed since it last synced
+        # with memcache
+        self.pending_m = 0
+        self.synced_m = now_m
+
+
 class RateLimitMiddleware(object):
     """
     Rate limiting middleware
@@ -98,7 +117,12 @@ class RateLimitMiddleware(object):
     def __init__(self, app, conf, logger=None):
 
         self.app = app
-        self.logger = logger or get_logger(conf, log_route='ratelimit')
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = get_logger(conf, log_route='ratelimit')
+            # metrics are named ratelimit.*, whatever the log_name
+            self.logger.set_statsd_prefix('ratelimit')
         self.memcache_client = None
         self.account_ratelimit = float(conf.get('account_ratelimit', 0))
         self.max_sleep_time_seconds = \
@@ -127,6 +151,10 @@ class RateLimitMiddleware(object):
             conf, 'container_ratelimit_')
         self.container_listing_ratelimits = interpret_conf_limits(
             conf, 'container_listing_ratelimit_')
+        self.memcache_sync_interval = \
+            float(conf.get('memcache_sync_interval', 0))
+        self.local_buckets = {}
+        self._last_prune_m = 0
 
     def get_container_size(self, env):
         rv = 0
@@ -229,6 +257,79 @@ class RateLimitMiddleware(object):
         except MemcacheConnectionError:
             return 0
 
+    def _sync_local_bucket(self, key, bucket, now_m):
+        """
+        Add the time used by this worker's requests for a key to the key's
+        running time in memcache, and catch up with the time used by other
+        workers' requests.
+        """
+        bucket.synced_m = now_m
+        pending_m, bucket.pending_m = bucket.pending_m, 0
+        try:
+            running_time_m = self.memcache_client.incr(key, delta=pending_m)
+        except MemcacheConnectionError:
+            return
+        if (now_m - running_time_m >
+                self.rate_buffer_seconds * self.clock_accuracy):
+            self.memcache_client.set(key, str(bucket.running_time_m),
+                                     serialize=False)
+        else:
+            bucket.running_time_m = max(bucket.running_time_m,
+                                        running_time_m)
+
+    def _prune_local_buckets(self, now_m):
+        sync_interval_m = self.memcache_sync_interval * self.clock_accuracy
+        if now_m - self._last_prune_m < sync_interval_m:
+            return
+        self._last_prune_m = now_m
+        oldest_m = now_m - self.rate_buffer_seconds * self.clock_accuracy
+        for key, bucket in list(self.local_buckets.items()):
+            if bucket.running_time_m < oldest_m:
+                # the bucket is full again, and its running time would be
+                # reset anyway
+                del self.local_buckets[key]
+
+    def _get_local_sleep_time(self, key, max_rate):
+        """
+        Returns the amount of time (a float in seconds) that the app
+        should sleep, keeping the key's running time in this worker and
+        syncing it with memcache every memcache_sync_interval seconds.
+
+        Between syncs a worker doesn't see other workers' requests, so each
+        of W workers may allow up to memcache_sync_interval * max_rate
+        requests more than it should; the rate across all workers is at most
+        max_rate plus (W - 1) * max_rate * memcache_sync_interval requests
+        per sync interval.
+
+        :param key: a memcache key
+        :param max_rate: maximum rate allowed in requests per second
+        :raises MaxSleepTimeHitError: if max sleep time is exceeded.
+        """
+        now_m = int(round(time.time() * self.clock_accuracy))
+        time_per_request_m = int(round(self.clock_accuracy / max_rate))
+        self._prune_local_buckets(now_m)
+        bucket = self.local_buckets.get(key)
+        if bucket is None:
+            bucket = self.local_buckets[key] = LocalBucket(now_m, now_m)
+            self._sync_local_bucket(key, bucket, now_m)
+        if (now_m - bucket.running_time_m >
+                self.rate_buffer_seconds * self.clock_accuracy):
+            bucket.running_time_m = now_m
+        need_to_sleep_m = max(bucket.running_time_m - now_m, 0)
+
+        max_sleep_m = self.max_sleep_time_seconds * self.clock_accuracy
+        if max_sleep_m - need_to_sleep_m <= self.clock_accuracy * 0.01:
+            raise MaxSleepTimeHitError(
+                "Max Sleep Time Exceeded: %.2f" %
+                (float(need_to_sleep_m) / self.clock_accuracy))
+
+        bucket.running_time_m += time_per_request_m
+        bucket.pending_m += time_per_request_m
+        if (now_m - bucket.synced_m >=
+                self.memcache_sync_interval * self.clock_accuracy):
+            self._sync_local_bucket(key, bucket, now_m)
+        return float(need_to_sleep_m) / self.clock_accuracy
+
     def handle_ratelimit(self, req, account_name, container_name, obj_name):
         """
         Performs rate limiting and account white/black listing.  Sleeps
@@ -242,6 +343,10 @@ class RateLimitMiddleware(object):
         if not self.memcache_client:
             return None
 
+        if container_name:
+            # the container's info will be wanted too, if not here then by
+            # the proxy, so get both from memcache at once
+            prefetch_info(req.environ, self.app, account_name, container_name)
         try:
             account_info = get_account_info(req.environ, self.app,
                                             swift_source='RL')
@@ -267,7 +372,10 @@ class RateLimitMiddleware(object):
                 req, account_name, container_name=container_name,
                 obj_name=obj_name, global_ratelimit=account_global_ratelimit):
             try:
-                need_to_sleep = self._get_sleep_time(key, max_rate)
+                if self.memcache_sync_interval > 0:
+                    need_to_sleep = self._get_local_sleep_time(key, max_rate)
+                else:
+                    need_to_sleep = self._get_sleep_time(key, max_rate)
                 if self.log_sleep_time_seconds and \
                         need_to_sleep > self.log_sleep_time_seconds:
                     self.logger.warning(
@@ -276,8 +384,11 @@ class RateLimitMiddleware(object):
                         {'sleep': need_to_sleep, 'account': account_name,
                          'container': container_name, 'object': obj_name})
                 if need_to_sleep > 0:
+                    self.logger.increment('sleeps')
+                    self.logger.timing('sleep_time', need_to_sleep * 1000)
                     eventlet.sleep(need_to_sleep)
             except MaxSleepTimeHitError as e:
+                self.logger.increment('rejections')
                 self.logger.error(
                     _('Returning 498 for %(meth)s to %(acc)s/%(cont)s/%(obj)s '
                       '. Ratelimit (Max Sleep) %(e)s'),
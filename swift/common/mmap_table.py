@@ -0,0 +1,347 @@
+# Copyright (c) 2018 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A fixed size hash table of fixed size records kept in a memory-mapped file.
+
+All the processes on a host that open the same file (e.g. the workers of a
+proxy server) share one table, and its contents outlive any one of them.
+Records are read and written under ``fcntl`` byte-range locks so that
+updates from different processes don't interleave. If no path is given the
+table lives in anonymous memory and is private to the process.
+"""
+
+import errno
+import fcntl
+import mmap
+import os
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+from hashlib import md5
+from tempfile import mkstemp
+
+import six
+
+__all__ = ['MmapTable']
+
+
+MAGIC = b'SWMT'
+VERSION = 1
+# magic, version, num_slots, key_size, record format
+HEADER_FORMAT = '<4sHIH48s'
+HEADER_SIZE = 64
+# how often to log that a table is full
+FULL_LOG_INTERVAL = 60
+# how many slots from the one a key hashes to may hold it; this bounds the
+# cost of looking up a missing key in a nearly full table
+MAX_PROBES = 64
+
+
+class MmapTable(object):
+    """
+    A hash table of records, each a tuple of values packed with
+    ``record_format``, keyed by strings. A key longer than ``key_size`` bytes
+    is stored as its MD5 hex digest, cut to ``key_size``.
+
+    A key is kept in one of the ``MAX_PROBES`` slots following the one it
+    hashes to. Keys are only removed by :meth:`clear`, but if ``expired`` is
+    given, a new key that finds those slots full takes over the slot of a key
+    whose record has expired. When there's no such slot, the fact is logged
+    and :meth:`update` for the new key is a no-op.
+
+    :param path: the file to map, or None for a table private to the process
+    :param record_format: a :mod:`struct` format describing a record
+    :param num_slots: the number of keys the table can hold
+    :param key_size: the number of bytes of a key that are kept
+    :param expired: called with a record's values, returns True if the slot
+                    holding it may be given to another key
+    :param logger: a logger for reporting a full table
+    """
+
+    def __init__(self, path, record_format, num_slots=16384, key_size=64,
+                 expired=None, logger=None):
+        self.path = path
+        self.record_format = record_format
+        self.record = struct.Struct(record_format)
+        self.num_slots = int(num_slots)
+        self.max_probes = min(self.num_slots, MAX_PROBES)
+        self.key_size = int(key_size)
+        self.expired = expired
+        self.logger = logger
+        self._last_full_log = 0
+        # keep records 8 byte aligned
+        self.slot_size = (self.key_size + self.record.size + 7) & ~7
+        self.size = HEADER_SIZE + self.num_slots * self.slot_size
+        self.empty_record = self.record.unpack(b'\x00' * self.record.size)
+        self._header = struct.pack(
+            HEADER_FORMAT, MAGIC, VERSION, self.num_slots, self.key_size,
+            record_format.encode('ascii'))
+        self._fd = None
+        if path is None:
+            self._map = mmap.mmap(-1, self.size)
+            self._map[:HEADER_SIZE] = self._header.ljust(HEADER_SIZE, b'\x00')
+        else:
+            self._open()
+
+    def _open(self):
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        while self._fd is None:
+            try:
+                fd = os.open(self.path, os.O_RDWR)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                # link rather than rename, so that a table another process
+                # has just created isn't replaced
+                self._create(os.link)
+                continue
+            try:
+                self._map_file(fd)
+            finally:
+                if self._fd is None:
+                    os.close(fd)
+
+    def _map_file(self, fd):
+        """
+        Map an opened table file, if it was written with our parameters;
+        otherwise replace it.
+        """
+        fcntl.lockf(fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+        try:
+            try:
+                if os.stat(self.path).st_ino != os.fstat(fd).st_ino:
+                    # replaced while we waited for the lock
+                    return
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                return
+            header = os.read(fd, len(self._header))
+            if header == self._header and \
+                    os.fstat(fd).st_size == self.size:
+                self._map = mmap.mmap(fd, self.size)
+                self._fd = fd
+                return
+            # written with different parameters; other processes may have
+            # the file mapped, and would get SIGBUS if it was resized under
+            # them, so it's replaced rather than reused
+            self._create(os.rename)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+
+    def _create(self, install):
+        """
+        Write an empty table to a temporary file and install it at the
+        table's path.
+
+        :param install: os.link or os.rename
+        """
+        fd, tmp_path = mkstemp(dir=os.path.dirname(self.path),
+                               prefix='.' + os.path.basename(self.path))
+        try:
+            os.fchmod(fd, 0o644)
+            os.ftruncate(fd, self.size)
+            os.write(fd, self._header)
+            try:
+                install(tmp_path, self.path)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+        finally:
+            os.close(fd)
+            try:
+                os.unlink(tmp_path)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+
+    def close(self):
+        self._map.close()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @contextmanager
+    def _lock(self, offset, length, exclusive=True):
+        if self._fd is None:
+            # only one process can see the table, and there's no IO between
+            # reading and writing a record for another greenthread to sneak
+            # into
+            yield
+            return
+        fcntl.lockf(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH,
+                    length, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, length, offset)
+
+    def _encode_key(self, key):
+        if isinstance(key, six.text_type):
+            key = key.encode('utf-8')
+        if len(key) > self.key_size:
+            key = md5(key).hexdigest().encode('ascii')[:self.key_size]
+        return key
+
+    def _claim(self, offset, slot_key, padded_key):
+        """
+        Give a slot to a key, if it still holds ``slot_key`` and, unless it
+        is empty, its record has still expired. The record starts out as all
+        zeros.
+
+        :returns: True if the slot was claimed
+        """
+        with self._lock(offset, self.slot_size):
+            # another process may have claimed the slot since we looked at it
+            if self._map[offset:offset + self.key_size] != slot_key:
+                return False
+            if slot_key[:1] != b'\x00' and not self.expired(
+                    self.record.unpack_from(self._map,
+                                            offset + self.key_size)):
+                return False
+            self._map[offset:offset + self.slot_size] = \
+                padded_key.ljust(self.slot_size, b'\x00')
+            return True
+
+    def _log_full(self):
+        now = time.time()
+        if self.logger and now - self._last_full_log >= FULL_LOG_INTERVAL:
+            self._last_full_log = now
+            self.logger.error('Table %s is full; no room for more keys',
+                              self.path or '(anonymous)')
+
+    def _find_slot(self, key, insert=False):
+        """
+        Find the offset of the slot holding a key, probing linearly from the
+        slot the key hashes to, for at most ``max_probes`` slots.
+
+        :param key: an encoded key
+        :param insert: if True, claim a slot for a missing key, preferring
+                       one with an expired record to an empty one
+        :returns: the offset of the slot, or None
+        """
+        padded_key = key.ljust(self.key_size, b'\x00')
+        slot = (zlib.crc32(key) & 0xffffffff) % self.num_slots
+        reusable = None
+        for _junk in range(self.max_probes):
+            offset = HEADER_SIZE + slot * self.slot_size
+            slot_key = self._map[offset:offset + self.key_size]
+            if slot_key == padded_key:
+                return offset
+            if slot_key[:1] == b'\x00':
+                if not insert:
+                    return None
+                if reusable and self._claim(reusable[0], reusable[1],
+                                            padded_key):
+                    return reusable[0]
+                reusable = None
+                if self._claim(offset, slot_key, padded_key):
+                    return offset
+                if self._map[offset:offset + self.key_size] == padded_key:
+                    return offset
+            elif insert and self.expired and not reusable and self.expired(
+                    self.record.unpack_from(self._map,
+                                            offset + self.key_size)):
+                reusable = (offset, slot_key)
+            slot = (slot + 1) % self.num_slots
+        if insert:
+            if reusable and self._claim(reusable[0], reusable[1], padded_key):
+                return reusable[0]
+            self._log_full()
+        return None
+
+    def get(self, key, default=None):
+        """
+        Get the record for a key.
+
+        :param key: the key to look up
+        :param default: returned if there's no record for the key
+        :returns: a tuple of record values
+        """
+        key = self._encode_key(key)
+        offset = self._find_slot(key)
+        if offset is None:
+            return default
+        with self._lock(offset, self.slot_size, exclusive=False):
+            if self._map[offset:offset + self.key_size] != \
+                    key.ljust(self.key_size, b'\x00'):
+                # the slot was given to another key since we found it
+                return default
+            return self.record.unpack_from(self._map, offset + self.key_size)
+
+    def update(self, key, func):
+        """
+        Atomically update the record for a key.
+
+        :param key: the key to update
+        :param func: called with the current record values (all zeros if the
+                     key is new) and returns the new values, or None to leave
+                     the record alone
+        :returns: the new record values, or None if the record was left alone
+                  or the table is full
+        """
+        key = self._encode_key(key)
+        padded_key = key.ljust(self.key_size, b'\x00')
+        while True:
+            offset = self._find_slot(key, insert=True)
+            if offset is None:
+                return None
+            with self._lock(offset, self.slot_size):
+                if self._map[offset:offset + self.key_size] != padded_key:
+                    # the slot was given to another key since we found it
+                    continue
+                offset += self.key_size
+                values = func(self.record.unpack_from(self._map, offset))
+                if values is not None:
+                    self.record.pack_into(self._map, offset, *values)
+                return values
+
+    def set(self, key, values):
+        """
+        Set the record for a key.
+
+        :param key: the key to set
+        :param values: a tuple of record values
+        """
+        return self.update(key, lambda _junk: values)
+
+    def clear(self):
+        """
+        Remove every key from the table.
+        """
+        with self._lock(HEADER_SIZE, self.size - HEADER_SIZE):
+            self._map[HEADER_SIZE:] = b'\x00' * (self.size - HEADER_SIZE)
+
+    def items(self):
+        """
+        Iterate over the (key, record values) pairs in the table.
+        """
+        for slot in range(self.num_slots):
+            offset = HEADER_SIZE + slot * self.slot_size
+            key = self._map[offset:offset + self.key_size].rstrip(b'\x00')
+            if not key:
+                continue
+            offset += self.key_size
+            with self._lock(offset, self.record.size, exclusive=False):
+                values = self.record.unpack_from(self._map, offset)
+            if six.PY3:
+                key = key.decode('utf-8')
+            yield key, values
@@ -19,12 +19,14 @@ import errno
 import itertools
 import logging
 import math
+import operator
 import random
 import uuid
 
 import six.moves.cPickle as pickle
 from copy import deepcopy
 from contextlib import contextmanager
+from hashlib import md5
 
 from array import array
 from collections import defaultdict
@@ -67,6 +69,18 @@ def _set_random_seed(seed):
             random.setstate(random_state)
 
 
+def _replica2part2dev_checksum(replica2part2dev):
+    """
+    Returns a checksum of a replica2part2dev table, used to tell whether it
+    has changed since the dispersion graph was built.
+    """
+    checksum = md5()
+    for part2dev in replica2part2dev:
+        checksum.update(('%d:' % len(part2dev)).encode('ascii'))
+        checksum.update(array('H', part2dev))
+    return checksum.hexdigest()
+
+
 class RingBuilder(object):
     """
     Used to build swift.common.ring.RingData instances to be written to disk
@@ -131,6 +145,11 @@ class RingBuilder(object):
 
         self._dispersion_graph = {}
         self.dispersion = 0.0
+        # the device tiers and the checksum of _replica2part2dev that the
+        # _dispersion_graph was built for, so that the next rebalance can
+        # update it rather than build it again
+        self._dispersion_tiers = None
+        self._dispersion_checksum = None
         self._remove_devs = []
         self._ring = None
 
@@ -265,6 +284,8 @@ class RingBuilder(object):
             self._last_part_gather_start = builder['_last_part_gather_start']
             self._dispersion_graph = builder.get('_dispersion_graph', {})
             self.dispersion = builder.get('dispersion')
+            self._dispersion_tiers = builder.get('_dispersion_tiers')
+            self._dispersion_checksum = builder.get('_dispersion_checksum')
             self._remove_devs = builder['_remove_devs']
             self._id = builder.get('id')
         self._ring = None
@@ -302,6 +323,8 @@ class RingBuilder(object):
                 '_last_part_gather_start': self._last_part_gather_start,
                 '_dispersion_graph': self._dispersion_graph,
                 'dispersion': self.dispersion,
+                '_dispersion_tiers': self._dispersion_tiers,
+                '_dispersion_checksum': self._dispersion_checksum,
                 '_remove_devs': self._remove_devs,
                 'id': self._id}
 
@@ -580,6 +603,10 @@ class RingBuilder(object):
             ...
         }
 
+        If the graph was last built for old_replica2part2dev, and the devices
+        in it haven't moved tiers since, only the parts that changed are
+        counted again.
+
         :param old_replica2part2dev: if called from rebalance, the
             old_replica2part2dev can be used to count moved parts.
 
@@ -587,9 +614,69 @@ class RingBuilder(object):
             old_replica2part2dev if provided
         """
 
+        old_replica2part2dev = old_replica2part2dev or []
+        # work out each device's tiers once, rather than for every replica
+        # of every part
+        tiers_for_dev_id = [
+            (dev.get('tiers') or tiers_for_dev(dev)) if dev else None
+            for dev in self.devs]
+
+        if self._can_update_dispersion_graph(tiers_for_dev_id,
+                                             old_replica2part2dev):
+            changed_parts = self._update_dispersion_graph(
+                tiers_for_dev_id, old_replica2part2dev)
+        else:
+            changed_parts = self._rebuild_dispersion_graph(
+                tiers_for_dev_id, old_replica2part2dev)
+        self._dispersion_tiers = tiers_for_dev_id
+        self._dispersion_checksum = _replica2part2dev_checksum(
+            self._replica2part2dev)
+        self.version += 1
+        return changed_parts
+
+    def _can_update_dispersion_graph(self, tiers_for_dev_id,
+                                     old_replica2part2dev):
+        """
+        Check that the dispersion graph was built for old_replica2part2dev and
+        the devices it uses still have the same tiers, so that it can be
+        brought up to date by looking only at the parts that changed.
+        """
+        if not (self._dispersion_graph and self._dispersion_tiers and
+                old_replica2part2dev):
+            return False
+        if list(map(len, old_replica2part2dev)) != \
+                list(map(len, self._replica2part2dev)):
+            # replica count adjustment
+            return False
+        if self._dispersion_checksum != _replica2part2dev_checksum(
+                old_replica2part2dev):
+            return False
+        old_tiers_for_dev_id = self._dispersion_tiers
+        used_dev_ids = set()
+        for part2dev in old_replica2part2dev:
+            used_dev_ids.update(part2dev)
+        for dev_id in used_dev_ids:
+            if dev_id >= len(old_tiers_for_dev_id) or \
+                    old_tiers_for_dev_id[dev_id] is None:
+                return False
+            # removed devices keep their old tiers, but a device that has
+            # moved (e.g. a new ip) has to be counted afresh in every part
+            if dev_id < len(tiers_for_dev_id) and \
+                    tiers_for_dev_id[dev_id] is not None and \
+                    tiers_for_dev_id[dev_id] != old_tiers_for_dev_id[dev_id]:
+                return False
+        return True
+
+    def _rebuild_dispersion_graph(self, tiers_for_dev_id,
+                                  old_replica2part2dev):
+        """
+        Build the dispersion graph from scratch.
+
+        :returns: number of parts with different assignments than
+            old_replica2part2dev
+        """
         # Since we're going to loop over every replica of every part we'll
         # also count up changed_parts if old_replica2part2dev is passed in
-        old_replica2part2dev = old_replica2part2dev or []
         # Compare the partition allocation before and after the rebalance
         # Only changed device ids are taken into account; devices might be
         # "touched" during the rebalance, but actually not really moved
@@ -599,16 +686,16 @@ class RingBuilder(object):
         max_allowed_replicas = self._build_max_replicas_by_tier()
         parts_at_risk = 0
 
-        dispersion_graph = {}
+        # count of parts by (tier, replicas in that tier)
+        parts_by_tier_replicas = defaultdict(int)
         # go over all the devices holding each replica part by part
         for part_id, dev_ids in enumerate(
                 six.moves.zip(*self._replica2part2dev)):
             # count the number of replicas of this part for each tier of each
             # device, some devices may have overlapping tiers!
             replicas_at_tier = defaultdict(int)
-            for rep_id, dev in enumerate(iter(
-                    self.devs[dev_id] for dev_id in dev_ids)):
-                for tier in (dev.get('tiers') or tiers_for_dev(dev)):
+            for rep_id, dev_id in enumerate(dev_ids):
+                for tier in tiers_for_dev_id[dev_id]:
                     replicas_at_tier[tier] += 1
                 # IndexErrors will be raised if the replicas are increased or
                 # decreased, and that actually means the partition has changed
@@ -618,27 +705,126 @@ class RingBuilder(object):
                     changed_parts += 1
                     continue
 
-                if old_device != dev['id']:
+                if old_device != dev_id:
                     changed_parts += 1
             # update running totals for each tiers' number of parts with a
             # given replica count
-            part_risk_depth = defaultdict(int)
-            part_risk_depth[0] = 0
+            part_risk_depth = None
             for tier, replicas in replicas_at_tier.items():
-                if tier not in dispersion_graph:
-                    dispersion_graph[tier] = [self.parts] + [0] * int_replicas
-                dispersion_graph[tier][0] -= 1
-                dispersion_graph[tier][replicas] += 1
-                if replicas > max_allowed_replicas[tier]:
-                    part_risk_depth[len(tier)] += (
-                        replicas - max_allowed_replicas[tier])
+                parts_by_tier_replicas[tier, replicas] += 1
+                excess_replicas = replicas - max_allowed_replicas[tier]
+                if excess_replicas > 0:
+                    if part_risk_depth is None:
+                        part_risk_depth = defaultdict(int)
+                    part_risk_depth[len(tier)] += excess_replicas
             # count each part-replica once at tier where dispersion is worst
-            parts_at_risk += max(part_risk_depth.values())
+            if part_risk_depth:
+                parts_at_risk += max(part_risk_depth.values())
+
+        dispersion_graph = {}
+        for (tier, replicas), parts in parts_by_tier_replicas.items():
+            if tier not in dispersion_graph:
+                dispersion_graph[tier] = [self.parts] + [0] * int_replicas
+            dispersion_graph[tier][0] -= parts
+            dispersion_graph[tier][replicas] += parts
         self._dispersion_graph = dispersion_graph
         self.dispersion = 100.0 * parts_at_risk / (self.parts * self.replicas)
-        self.version += 1
         return changed_parts
 
+    def _update_dispersion_graph(self, tiers_for_dev_id,
+                                 old_replica2part2dev):
+        """
+        Bring the dispersion graph up to date with a rebalance by moving the
+        parts that changed from the counts for their old tiers to the counts
+        for their new ones.
+
+        :returns: number of parts with different assignments than
+            old_replica2part2dev
+        """
+        int_replicas = int(math.ceil(self.replicas))
+        old_tiers_for_dev_id = self._dispersion_tiers
+        # like the full build, only parts with every replica assigned count
+        num_parts = min(len(part2dev) for part2dev in self._replica2part2dev)
+
+        changed_parts = 0
+        parts_to_update = set()
+        for old_part2dev, part2dev in six.moves.zip(old_replica2part2dev,
+                                                    self._replica2part2dev):
+            if old_part2dev == part2dev:
+                continue
+            changed = [part for part, old_dev_id, dev_id in six.moves.zip(
+                range(num_parts), old_part2dev, part2dev)
+                if old_dev_id != dev_id]
+            changed_parts += len(changed)
+            parts_to_update.update(changed)
+
+        graph = self._dispersion_graph
+        vacated_tiers = set()
+        for part in parts_to_update:
+            replicas_at_tier = defaultdict(int)
+            for old_part2dev in old_replica2part2dev:
+                for tier in old_tiers_for_dev_id[old_part2dev[part]]:
+                    replicas_at_tier[tier] += 1
+            for tier, replicas in replicas_at_tier.items():
+                graph[tier][replicas] -= 1
+                graph[tier][0] += 1
+                vacated_tiers.add(tier)
+            replicas_at_tier = defaultdict(int)
+            for part2dev in self._replica2part2dev:
+                for tier in tiers_for_dev_id[part2dev[part]]:
+                    replicas_at_tier[tier] += 1
+            for tier, replicas in replicas_at_tier.items():
+                if tier not in graph:
+                    graph[tier] = [self.parts] + [0] * int_replicas
+                graph[tier][0] -= 1
+                graph[tier][replicas] += 1
+        # tiers that no longer hold any replicas aren't in the graph
+        for tier in vacated_tiers:
+            if graph[tier][0] == self.parts:
+                del graph[tier]
+
+        self.dispersion = 100.0 * self._count_parts_at_risk(
+            tiers_for_dev_id, num_parts) / (self.parts * self.replicas)
+        return changed_parts
+
+    def _count_parts_at_risk(self, tiers_for_dev_id, num_parts):
+        """
+        Count the part-replicas in excess of what their tiers should hold,
+        each counted once at the tier where its part's dispersion is worst.
+
+        Only parts with a replica in a tier that the dispersion graph shows to
+        be holding too many replicas of some part need to be looked at.
+        """
+        max_allowed_replicas = self._build_max_replicas_by_tier()
+        over_tiers = set(
+            tier for tier, replica_counts in self._dispersion_graph.items()
+            if any(replica_counts[int(max_allowed_replicas[tier]) + 1:]))
+        if not over_tiers:
+            return 0
+        dev_at_risk = bytearray(len(tiers_for_dev_id))
+        for dev_id, tiers in enumerate(tiers_for_dev_id):
+            if tiers and over_tiers.intersection(tiers):
+                dev_at_risk[dev_id] = 1
+        parts = set()
+        for part2dev in self._replica2part2dev:
+            parts.update(part for part, dev_id in six.moves.zip(
+                range(num_parts), part2dev) if dev_at_risk[dev_id])
+
+        parts_at_risk = 0
+        for part in parts:
+            replicas_at_tier = defaultdict(int)
+            for part2dev in self._replica2part2dev:
+                for tier in tiers_for_dev_id[part2dev[part]]:
+                    replicas_at_tier[tier] += 1
+            part_risk_depth = defaultdict(int)
+            for tier, replicas in replicas_at_tier.items():
+                excess_replicas = replicas - max_allowed_replicas[tier]
+                if excess_replicas > 0:
+                    part_risk_depth[len(tier)] += excess_replicas
+            if part_risk_depth:
+                parts_at_risk += max(part_risk_depth.values())
+        return parts_at_risk
+
     def validate(self, stats=False):
         """
         Validate the ring.
@@ -686,36 +872,39 @@ class RingBuilder(object):
                     (dev['id'], dev['port']))
 
         int_replicas = int(math.ceil(self.replicas))
-        rep2part_len = list(map(len, self._replica2part2dev))
-        # check the assignments of each part's replicas
-        for part in range(self.parts):
-            devs_for_part = []
-            for replica, part_len in enumerate(rep2part_len):
-                if part_len <= part:
-                    # last replica may be short on parts because of floating
-                    # replica count
-                    if replica + 1 < int_replicas:
+        # look over the assignments of all the parts at once, and only go
+        # part by part to find what is wrong if something is
+        if not self._assignments_look_valid(dev_len, int_replicas):
+            rep2part_len = list(map(len, self._replica2part2dev))
+            # check the assignments of each part's replicas
+            for part in range(self.parts):
+                devs_for_part = []
+                for replica, part_len in enumerate(rep2part_len):
+                    if part_len <= part:
+                        # last replica may be short on parts because of
+                        # floating replica count
+                        if replica + 1 < int_replicas:
+                            raise exceptions.RingValidationError(
+                                "The partition assignments of replica %r "
+                                "were shorter than expected (%s < %s) - this "
+                                "should only happen for the last replica" % (
+                                    replica,
+                                    len(self._replica2part2dev[replica]),
+                                    self.parts,
+                                ))
+                        break
+                    dev_id = self._replica2part2dev[replica][part]
+                    if dev_id >= dev_len or not self.devs[dev_id]:
                         raise exceptions.RingValidationError(
-                            "The partition assignments of replica %r were "
-                            "shorter than expected (%s < %s) - this should "
-                            "only happen for the last replica" % (
-                                replica,
-                                len(self._replica2part2dev[replica]),
-                                self.parts,
-                            ))
-                    break
-                dev_id = self._replica2part2dev[replica][part]
-                if dev_id >= dev_len or not self.devs[dev_id]:
+                            "Partition %d, replica %d was not allocated "
+                            "to a device." %
+                            (part, replica))
+                    devs_for_part.append(dev_id)
+                if len(devs_for_part) != len(set(devs_for_part)):
                     raise exceptions.RingValidationError(
-                        "Partition %d, replica %d was not allocated "
-                        "to a device." %
-                        (part, replica))
-                devs_for_part.append(dev_id)
-            if len(devs_for_part) != len(set(devs_for_part)):
-                raise exceptions.RingValidationError(
-                    "The partition %s has been assigned to "
-                    "duplicate devices %r" % (
-                        part, devs_for_part))
+                        "The partition %s has been assigned to "
+                        "duplicate devices %r" % (
+                            part, devs_for_part))
 
         if stats:
             weight_of_one_part = self.weight_of_one_part()
@@ -737,6 +926,26 @@ class RingBuilder(object):
             return dev_usage, worst
         return None, None
 
+    def _assignments_look_valid(self, dev_len, int_replicas):
+        """
+        Check every part's replicas are assigned to distinct, existing
+        devices, a whole replica at a time.
+
+        :returns: False if validate() should look at the assignments part by
+                  part to find the problem
+        """
+        for replica, part2dev in enumerate(self._replica2part2dev):
+            if replica + 1 < int_replicas and len(part2dev) < self.parts:
+                return False
+            for dev_id in set(part2dev):
+                if dev_id >= dev_len or not self.devs[dev_id]:
+                    return False
+        for replica, part2dev in enumerate(self._replica2part2dev):
+            for other_part2dev in self._replica2part2dev[replica + 1:]:
+                if any(six.moves.map(operator.eq, part2dev, other_part2dev)):
+                    return False
+        return True
+
     def _build_balance_per_dev(self):
         """
         Build a map of <device_id> => <balance> where <balance> is a float
@@ -1306,6 +1515,9 @@ class RingBuilder(object):
             tiers_list = new_tiers_list
             depth += 1
 
+        max_replicas_at_tier = defaultdict(int, (
+            (tier, plan['max']) for tier, plan in replica_plan.items()))
+        log_placements = self.logger.isEnabledFor(logging.DEBUG)
         for part, replace_replicas in reassign_parts:
             # always update part_moves for min_part_hours
             self._last_part_moves[part] = 0
@@ -1327,7 +1539,7 @@ class RingBuilder(object):
                     # to the replica_plan.
                     candidates = [t for t in tier2children[tier] if
                                   replicas_at_tier[t] <
-                                  replica_plan[t]['max']]
+                                  max_replicas_at_tier[t]]
 
                     if not candidates:
                         raise Exception('no home for %s/%s %s' % (
@@ -1335,8 +1547,8 @@ class RingBuilder(object):
                                 replicas_at_tier[t],
                                 replica_plan[t]['max'],
                             ) for t in tier2children[tier]}))
-                    tier = max(candidates, key=lambda t:
-                               parts_available_in_tier[t])
+                    tier = max(candidates,
+                               key=parts_available_in_tier.__getitem__)
 
                     depth += 1
 
@@ -1348,8 +1560,9 @@ class RingBuilder(object):
                     replicas_at_tier[tier] += 1
 
                 self._replica2part2dev[replica][part] = dev['id']
-                self.logger.debug(
-                    "Placed %d/%d onto dev %s", part, replica, pretty_dev(dev))
+                if log_placements:
+                    self.logger.debug("Placed %d/%d onto dev %s",
+                                      part, replica, pretty_dev(dev))
 
         # Just to save memory and keep from accidental reuse.
         for dev in self._iter_devs():
@@ -14,6 +14,8 @@
 # limitations under the License.
 
 import array
+import ctypes
+import mmap
 import six.moves.cPickle as pickle
 import json
 from collections import defaultdict
@@ -35,6 +37,16 @@ from swift.common.utils import hash_path, validate_configuration
 from swift.common.ring.utils import tiers_for_dev
 
 
+# the most partitions to remember handoff sequences for
+HANDOFF_CACHE_SIZE = 1024
+
+
+def _v2_data_offset(json_len):
+    # magic, version and json length, then the json, then padding up to a
+    # multiple of 8 bytes
+    return (10 + json_len + 7) & ~7
+
+
 def calc_replica_count(replica2part2dev_id):
     base = len(replica2part2dev_id) - 1
     extra = 1.0 * len(replica2part2dev_id[-1]) / len(replica2part2dev_id[0])
@@ -96,14 +108,70 @@ class RingData(object):
         return ring_dict
 
     @classmethod
-    def load(cls, filename, metadata_only=False):
+    def deserialize_v2(cls, fp, metadata_only=False, map_data=False):
+        """
+        Deserialize a v2 ring file into a dictionary with `devs`,
+        `part_shift`, and `replica2part2dev_id` keys.
+
+        A v2 ring file isn't compressed, and its partition assignments are
+        laid out so that they can be mapped into memory rather than read.
+
+        :param file fp: An opened file which has already consumed the 6 bytes
+                        of magic and version.
+        :param bool metadata_only: If True, only load `devs` and `part_shift`
+        :param bool map_data: If True, map the partition assignments from the
+                              file rather than reading them into memory
+        :returns: A dict containing `devs`, `part_shift`, and
+                  `replica2part2dev_id`
+        """
+        json_len, = struct.unpack('!I', fp.read(4))
+        ring_dict = json.loads(fp.read(json_len).decode('ascii'))
+        ring_dict['replica2part2dev_id'] = []
+
+        if metadata_only:
+            return ring_dict
+
+        byteswap = (ring_dict['byteorder'] != sys.byteorder)
+        offset = _v2_data_offset(json_len)
+        if map_data and not byteswap:
+            # a private mapping shares the page cache with every other
+            # process that maps the file, for as long as nobody writes to it
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY)
+            for length in ring_dict['replica_lengths']:
+                ring_dict['replica2part2dev_id'].append(
+                    (ctypes.c_uint16 * length).from_buffer(data, offset))
+                offset += 2 * length
+            return ring_dict
+
+        fp.seek(offset)
+        for length in ring_dict['replica_lengths']:
+            part2dev = array.array('H', fp.read(2 * length))
+            if byteswap:
+                part2dev.byteswap()
+            ring_dict['replica2part2dev_id'].append(part2dev)
+        return ring_dict
+
+    @classmethod
+    def load(cls, filename, metadata_only=False, map_data=False):
         """
         Load ring data from a file.
 
         :param filename: Path to a file serialized by the save() method.
         :param bool metadata_only: If True, only load `devs` and `part_shift`.
+        :param bool map_data: If True and the file is in the v2 format, map
+                              the partition assignments from the file rather
+                              than reading them into memory.
         :returns: A RingData instance containing the loaded data.
         """
+        with open(filename, 'rb') as fp:
+            magic = fp.read(6)
+            if magic == struct.pack('!4sH', b'R1NG', 2):
+                ring_data = cls.deserialize_v2(
+                    fp, metadata_only=metadata_only, map_data=map_data)
+                return RingData(ring_data['replica2part2dev_id'],
+                                ring_data['devs'], ring_data['part_shift'],
+                                ring_data.get('next_part_power'))
+
         gz_file = BufferedReader(GzipFile(filename, 'rb'))
 
         # See if the file is in the new format
@@ -150,21 +218,58 @@ class RingData(object):
         for part2dev_id in ring['replica2part2dev_id']:
             file_obj.write(part2dev_id.tostring())
 
-    def save(self, filename, mtime=1300507380.0):
+    def serialize_v2(self, file_obj):
+        file_obj.write(struct.pack('!4sH', b'R1NG', 2))
+        ring = self.to_dict()
+
+        _text = {'devs': ring['devs'], 'part_shift': ring['part_shift'],
+                 'replica_lengths': [len(part2dev_id) for part2dev_id in
+                                     ring['replica2part2dev_id']],
+                 'byteorder': sys.byteorder}
+
+        next_part_power = ring.get('next_part_power')
+        if next_part_power is not None:
+            _text['next_part_power'] = next_part_power
+
+        json_text = json.dumps(_text, sort_keys=True,
+                               ensure_ascii=True).encode('ascii')
+        json_len = len(json_text)
+        file_obj.write(struct.pack('!I', json_len))
+        file_obj.write(json_text)
+        # pad so that the partition assignments start on a word boundary
+        file_obj.write(b'\x00' * (_v2_data_offset(json_len) - 10 - json_len))
+        for part2dev_id in ring['replica2part2dev_id']:
+            file_obj.write(part2dev_id.tostring())
+
+    def save(self, filename, mtime=1300507380.0, format_version=1):
         """
         Serialize this RingData instance to disk.
 
+        Version 1 ring files are gzipped, and can be read by any release of
+        Swift. Version 2 ring files are bigger, but are mapped into memory by
+        the processes that use them rather than read, so they load faster and
+        all the processes on a server share one copy; older releases of Swift
+        can't read them.
+
         :param filename: File into which this instance should be serialized.
         :param mtime: time used to override mtime for gzip, default or None
                       if the caller wants to include time
+        :param format_version: the ring file format to write, 1 or 2
         """
-        # Override the timestamp so that the same ring data creates
-        # the same bytes on disk. This makes a checksum comparison a
-        # good way to see if two rings are identical.
+        if format_version not in (1, 2):
+            raise ValueError('Unknown ring format version %r' %
+                             format_version)
         tempf = NamedTemporaryFile(dir=".", prefix=filename, delete=False)
-        gz_file = GzipFile(filename, mode='wb', fileobj=tempf, mtime=mtime)
-        self.serialize_v1(gz_file)
-        gz_file.close()
+        if format_version == 2:
+            self.serialize_v2(tempf)
+        else:
+            # Override the timestamp so that the same ring data creates
+            # the same bytes on disk. This makes a checksum comparison a
+            # good way to see if two rings are identical.
+            gz_file = GzipFile(filename, mode='wb', fileobj=tempf,
+                               mtime=mtime)
+            self.serialize_v1(gz_file)
+            gz_file.close()
         tempf.flush()
         os.fsync(tempf.fileno())
         tempf.close()
@@ -178,6 +283,35 @@ class RingData(object):
                 'next_part_power': self.next_part_power}
 
 
+class _HandoffSequence(object):
+    """
+    The handoff devices for a partition, worked out as they are first asked
+    for and then remembered for later callers.
+
+    :param devs: the ring's list of devices
+    :param dev_ids: an iterator of the handoff device ids, in order
+    """
+
+    def __init__(self, devs, dev_ids):
+        self.devs = devs
+        self.dev_ids = []
+        self._more_dev_ids = dev_ids
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i == len(self.dev_ids):
+                if self._more_dev_ids is None:
+                    return
+                try:
+                    self.dev_ids.append(next(self._more_dev_ids))
+                except StopIteration:
+                    self._more_dev_ids = None
+                    return
+            yield self.devs[self.dev_ids[i]]
+            i += 1
+
+
 class Ring(object):
     """
     Partitioned consistent hashing ring.
@@ -206,7 +340,7 @@ class Ring(object):
     def _reload(self, force=False):
         self._rtime = time() + self.reload_time
         if force or self.has_changed():
-            ring_data = RingData.load(self.serialized_path)
+            ring_data = RingData.load(self.serialized_path, map_data=True)
 
             try:
                 self._validation_hook(ring_data)
@@ -248,8 +382,7 @@ class Ring(object):
             # bailouts in get_more_nodes() working.
             dev_ids_with_parts = set()
             for part2dev_id in self._replica2part2dev_id:
-                for dev_id in part2dev_id:
-                    dev_ids_with_parts.add(dev_id)
+                dev_ids_with_parts.update(part2dev_id)
 
             regions = set()
             zones = set()
@@ -275,6 +408,7 @@ class Ring(object):
         return 32 - self._part_shift
 
     def _rebuild_tier_data(self):
+        self._handoff_cache = {}
         self.tier2devs = defaultdict(list)
         for dev in self._devs:
             if not dev:
@@ -390,6 +524,35 @@ class Ring(object):
         part = self.get_part(account, container, obj)
         return part, self._get_part_nodes(part)
 
+    def get_nodes_many(self, names):
+        """
+        Get the partitions and nodes for many accounts, containers or
+        objects at once, e.g. to check on where each of a list of objects is.
+
+        :param names: an iterable of (account, container, obj) tuples, where
+                      container and obj may be None or left off
+        :returns: a list of (partition, list of node dicts) tuples, one for
+                  each name
+
+        See :func:`get_nodes` for a description of the node dicts.
+        """
+        if time() > self._rtime:
+            self._reload()
+        part_shift = self._part_shift
+        part_nodes = {}
+        results = []
+        for name in names:
+            key = hash_path(*name, raw_digest=True)
+            part = struct.unpack_from('>I', key)[0] >> part_shift
+            nodes = part_nodes.get(part)
+            if nodes is None:
+                nodes = part_nodes[part] = self._get_part_nodes(part)
+            else:
+                # callers may change the node dicts they're given
+                nodes = [dict(node) for node in nodes]
+            results.append((part, nodes))
+        return results
+
     def get_more_nodes(self, part):
         """
         Generator to get extra nodes for a partition for hinted handoff.
@@ -406,6 +569,18 @@ class Ring(object):
         """
         if time() > self._rtime:
             self._reload()
+        handoffs = self._handoff_cache.get(part)
+        if handoffs is None:
+            if len(self._handoff_cache) >= HANDOFF_CACHE_SIZE:
+                self._handoff_cache.clear()
+            handoffs = self._handoff_cache[part] = _HandoffSequence(
+                self._devs, self._iter_handoff_dev_ids(part))
+        return iter(handoffs)
+
+    def _iter_handoff_dev_ids(self, part):
+        """
+        Work out the ids of the handoff devices for a partition, in order.
+        """
         primary_nodes = self._get_part_nodes(part)
 
         used = set(d['id'] for d in primary_nodes)
@@ -434,7 +609,7 @@ class Ring(object):
                     dev = self._devs[dev_id]
                     region = dev['region']
                     if dev_id not in used and region not in same_regions:
-                        yield dev
+                        yield dev_id
                         used.add(dev_id)
                         same_regions.add(region)
                         zone = dev['zone']
@@ -459,7 +634,7 @@ class Ring(object):
                     dev = self._devs[dev_id]
                     zone = (dev['region'], dev['zone'])
                     if dev_id not in used and zone not in same_zones:
-                        yield dev
+                        yield dev_id
                         used.add(dev_id)
                         same_zones.add(zone)
                         ip = zone + (dev['ip'],)
@@ -482,7 +657,7 @@ class Ring(object):
                     dev = self._devs[dev_id]
                     ip = (dev['region'], dev['zone'], dev['ip'])
                     if dev_id not in used and ip not in same_ips:
-                        yield dev
+                        yield dev_id
                         used.add(dev_id)
                         same_ips.add(ip)
                         if len(same_ips) == self._num_ips:
@@ -501,7 +676,7 @@ class Ring(object):
                 if handoff_part < len(part2dev_id):
                     dev_id = part2dev_id[handoff_part]
                     if dev_id not in used:
-                        yield self._devs[dev_id]
+                        yield dev_id
                         used.add(dev_id)
                         if len(used) == self._num_devs:
                             hit_all_devs = True
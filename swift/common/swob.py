@@ -220,17 +220,32 @@ def _header_int_property(header):
                     doc="Retrieve and set the %s header as an int" % header)
 
 
+# header names seen recently, and their environ keys; a proxy looks up the
+# same few dozen headers over and over
+_environ_key_cache = {}
+ENVIRON_KEY_CACHE_SIZE = 1024
+
+
 def header_to_environ_key(header_name):
+    try:
+        return _environ_key_cache[header_name]
+    except KeyError:
+        pass
     # Why the to/from wsgi dance? Headers that include something like b'\xff'
     # on the wire get translated to u'\u00ff' on py3, which gets upper()ed to
     # u'\u0178', which is nonsense in a WSGI string.
     real_header = wsgi_to_str(header_name)
-    header_name = 'HTTP_' + str_to_wsgi(real_header.upper()).replace('-', '_')
-    if header_name == 'HTTP_CONTENT_LENGTH':
-        return 'CONTENT_LENGTH'
-    if header_name == 'HTTP_CONTENT_TYPE':
-        return 'CONTENT_TYPE'
-    return header_name
+    environ_key = 'HTTP_' + str_to_wsgi(real_header.upper()).replace('-', '_')
+    if environ_key == 'HTTP_CONTENT_LENGTH':
+        environ_key = 'CONTENT_LENGTH'
+    elif environ_key == 'HTTP_CONTENT_TYPE':
+        environ_key = 'CONTENT_TYPE'
+    if len(_environ_key_cache) >= ENVIRON_KEY_CACHE_SIZE:
+        # clients can send any headers they like, so don't let them grow the
+        # cache without bound
+        _environ_key_cache.clear()
+    _environ_key_cache[header_name] = environ_key
+    return environ_key
 
 
 class HeaderEnvironProxy(MutableMapping):
@@ -241,6 +256,8 @@ class HeaderEnvironProxy(MutableMapping):
     For example, headers['Content-Range'] sets and gets the value of
     headers.environ['HTTP_CONTENT_RANGE']
     """
+    __slots__ = ('environ',)
+
     def __init__(self, environ):
         self.environ = environ
 
@@ -454,12 +471,27 @@ def _req_fancy_property(cls, header, even_if_nonexistent=False):
         exist.  Classes using this should be prepared to accept None as a
         parameter.
     """
+    environ_key = header_to_environ_key(header)
+
     def getter(self):
+        value = self.environ.get(environ_key)
+        if value is None and not even_if_nonexistent:
+            return None
+        # parsing e.g. a Range header isn't cheap, and the same request's
+        # properties get looked at by several middlewares; the parsed value
+        # is kept for as long as the header doesn't change
         try:
-            if header in self.headers or even_if_nonexistent:
-                return cls(self.headers.get(header))
+            cached_value, parsed = self._fancy_cache[header]
+            if cached_value == value:
+                return parsed
+        except KeyError:
+            pass
+        try:
+            parsed = cls(value)
         except ValueError:
-            return None
+            parsed = None
+        self._fancy_cache[header] = (value, parsed)
+        return parsed
 
     def setter(self, value):
         self.headers[header] = value
@@ -859,12 +891,14 @@ class Request(object):
     body = _req_body_property()
     charset = None
     _params_cache = None
+    _params_query_string = None
     _timestamp = None
     acl = _req_environ_property('swob.ACL', is_wsgi_string_field=False)
 
     def __init__(self, environ):
         self.environ = environ
         self.headers = HeaderEnvironProxy(self.environ)
+        self._fancy_cache = {}
 
     @classmethod
     def blank(cls, path, environ=None, headers=None, body=None, **kwargs):
@@ -946,12 +980,15 @@ class Request(object):
     @property
     def params(self):
         "Provides QUERY_STRING parameters as a dictionary"
-        if self._params_cache is None:
-            if 'QUERY_STRING' in self.environ:
+        query_string = self.environ.get('QUERY_STRING')
+        if self._params_cache is None or \
+                query_string != self._params_query_string:
+            if query_string is not None:
                 self._params_cache = dict(
-                    urllib.parse.parse_qsl(self.environ['QUERY_STRING'], True))
+                    urllib.parse.parse_qsl(query_string, True))
             else:
                 self._params_cache = {}
+            self._params_query_string = query_string
         return self._params_cache
     str_params = params
 
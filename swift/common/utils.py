@@ -1085,8 +1085,14 @@ class Timestamp(object):
     timestamp regardless of it's offset.  String comparison and ordering
     is guaranteed for the internalized string format, and is backwards
     compatible for normalized timestamps which do not include an offset.
+
+    Timestamps are made, compared and formatted for every backend request,
+    diskfile and container row, so the string forms are only formatted when
+    first asked for and then kept.
     """
 
+    __slots__ = ('timestamp', '_offset', '_raw', '_normal', '_internal')
+
     def __init__(self, timestamp, offset=0, delta=0):
         """
         Create a new Timestamp.
@@ -1101,41 +1107,68 @@ class Timestamp(object):
         :param delta: deca-microsecond difference from the base timestamp
                       param, an int
         """
-        if isinstance(timestamp, bytes):
+        self._raw = self._normal = self._internal = None
+        if six.PY3 and isinstance(timestamp, bytes):
+            # on py2, float() and int() already refuse non-ascii bytes
             timestamp = timestamp.decode('ascii')
         if isinstance(timestamp, six.string_types):
-            base, base_offset = timestamp.partition('_')[::2]
+            base, sep, base_offset = timestamp.partition('_')
             self.timestamp = float(base)
-            if '_' in base_offset:
+            if not sep:
+                self._offset = 0
+            elif '_' in base_offset:
                 raise ValueError('invalid literal for int() with base 16: '
                                  '%r' % base_offset)
-            if base_offset:
-                self.offset = int(base_offset, 16)
+            elif base_offset:
+                self._offset = int(base_offset, 16)
             else:
-                self.offset = 0
+                self._offset = 0
+        elif isinstance(timestamp, Timestamp):
+            self.timestamp = timestamp.timestamp
+            self._offset = timestamp._offset
         else:
             self.timestamp = float(timestamp)
-            self.offset = getattr(timestamp, 'offset', 0)
+            self._offset = 0
         # increment offset
-        if offset >= 0:
-            self.offset += offset
-        else:
+        if offset > 0:
+            self._offset += offset
+        elif offset < 0:
             raise ValueError('offset must be non-negative')
-        if self.offset > MAX_OFFSET:
+        if self._offset > MAX_OFFSET:
             raise ValueError('offset must be smaller than %d' % MAX_OFFSET)
-        self.raw = int(round(self.timestamp / PRECISION))
         # add delta
         if delta:
-            self.raw = self.raw + delta
-            if self.raw <= 0:
+            self._raw = self.raw + delta
+            if self._raw <= 0:
                 raise ValueError(
-                    'delta must be greater than %d' % (-1 * self.raw))
-            self.timestamp = float(self.raw * PRECISION)
+                    'delta must be greater than %d' % (-1 * self._raw))
+            self.timestamp = float(self._raw * PRECISION)
         if self.timestamp < 0:
             raise ValueError('timestamp cannot be negative')
         if self.timestamp >= 10000000000:
             raise ValueError('timestamp too large')
 
+    def __reduce__(self):
+        return Timestamp, (self.timestamp, self._offset)
+
+    @property
+    def offset(self):
+        return self._offset
+
+    @offset.setter
+    def offset(self, offset):
+        self._offset = offset
+        self._internal = None
+
+    @property
+    def raw(self):
+        """
+        The timestamp as an integer number of deca-microseconds.
+        """
+        if self._raw is None:
+            self._raw = int(round(self.timestamp / PRECISION))
+        return self._raw
+
     @classmethod
     def now(cls, offset=0, delta=0):
         return cls(time.time(), offset=offset, delta=delta)
@@ -1160,19 +1193,24 @@ class Timestamp(object):
 
     @property
     def normal(self):
-        return NORMAL_FORMAT % self.timestamp
+        if self._normal is None:
+            self._normal = NORMAL_FORMAT % self.timestamp
+        return self._normal
 
     @property
     def internal(self):
-        if self.offset or FORCE_INTERNAL:
-            return INTERNAL_FORMAT % (self.timestamp, self.offset)
+        if self._offset or FORCE_INTERNAL:
+            if self._internal is None:
+                self._internal = INTERNAL_FORMAT % (
+                    self.timestamp, self._offset)
+            return self._internal
         else:
             return self.normal
 
     @property
     def short(self):
-        if self.offset or FORCE_INTERNAL:
-            return SHORT_FORMAT % (self.timestamp, self.offset)
+        if self._offset or FORCE_INTERNAL:
+            return SHORT_FORMAT % (self.timestamp, self._offset)
         else:
             return self.normal
 
@@ -1286,6 +1324,13 @@ def decode_timestamps(encoded, explicit=False):
         ts = Timestamp(encoded)
         return ts, ts, ts
 
+    if '+' not in encoded and '-' not in encoded:
+        # most rows only have a data timestamp
+        t1 = Timestamp(encoded)
+        if explicit:
+            return t1, None, None
+        return t1, t1, t1
+
     parts = []
     signs = []
     pos_parts = encoded.split('+')
@@ -3094,6 +3139,14 @@ class GreenAsyncPile(object):
     def inflight(self):
         return self._inflight
 
+    @property
+    def pending(self):
+        """
+        The number of spawned jobs whose results have not yet been taken
+        from the pile.
+        """
+        return self._pending
+
     def spawn(self, func, *args, **kwargs):
         """
         Spawn a job in a green thread on the pile.
@@ -18,6 +18,8 @@ Pluggable Back-ends for Container Server
 import errno
 
 import os
+import re
+from collections import Counter
 from uuid import uuid4
 
 import six
@@ -29,12 +31,19 @@ from swift.common.constraints import CONTAINER_LISTING_LIMIT
 from swift.common.exceptions import LockTimeout
 from swift.common.utils import Timestamp, encode_timestamps, \
     decode_timestamps, extract_swift_bytes, storage_directory, hash_path, \
-    ShardRange, renamer, find_shard_range, MD5_OF_EMPTY_STRING, mkdirs, \
+    ShardRange, find_shard_range, MD5_OF_EMPTY_STRING, mkdirs, \
     get_db_files, parse_db_filename, make_db_file_path, split_path
 from swift.common.db import DatabaseBroker, utf8encode, BROKER_TIMEOUT, \
-    zero_like, DatabaseAlreadyExists
+    zero_like, DatabaseAlreadyExists, unlink_wal_files, \
+    replace_db_file
 
 SQLITE_ARG_LIMIT = 999
+#: merge_items resolves conflicts in SQL for lists of at least this many items
+BULK_MERGE_MIN_ITEMS = 1000
+# a created_at that holds only a data timestamp, with no offset, in its
+# internal form; only such values are written in a single fixed-width form, so
+# that comparing them as strings compares the timestamps
+SIMPLE_CREATED_AT = re.compile(r'^\d{10}\.\d{5}$')
 
 DATADIR = 'containers'
 
@@ -323,7 +332,7 @@ class ContainerBroker(DatabaseBroker):
     def __init__(self, db_file, timeout=BROKER_TIMEOUT, logger=None,
                  account=None, container=None, pending_timeout=None,
                  stale_reads_ok=False, skip_commits=False,
-                 force_db_file=False):
+                 force_db_file=False, connection_cache=None):
         self._init_db_file = db_file
         if db_file == ':memory:':
             base_db_file = db_file
@@ -331,7 +340,8 @@ class ContainerBroker(DatabaseBroker):
             base_db_file = make_db_file_path(db_file, None)
         super(ContainerBroker, self).__init__(
             base_db_file, timeout, logger, account, container, pending_timeout,
-            stale_reads_ok, skip_commits=skip_commits)
+            stale_reads_ok, skip_commits=skip_commits,
+            connection_cache=connection_cache)
         # the root account and container are populated on demand
         self._root_account = self._root_container = None
         self._force_db_file = force_db_file
@@ -421,7 +431,10 @@ class ContainerBroker(DatabaseBroker):
             return
         # reset connection so the next access will use the correct DB file
         self.conn = None
+        old_db_files = self._db_files or []
         self._db_files = get_db_files(self._init_db_file)
+        for db_file in set(old_db_files).difference(self._db_files):
+            self._invalidate_connections(db_file)
 
     @property
     def db_files(self):
@@ -1255,10 +1268,104 @@ class ContainerBroker(DatabaseBroker):
             return dict(zip(keys, rec))
         return None
 
+    def _bulk_merge_items(self, curs, item_list, query_mod):
+        """
+        Merge items whose created_at is a plain data timestamp without an
+        offset, and whose rows in the object table have one too, using
+        set-based SQL. Timestamps with offsets are stored in a short form
+        (see :func:`~swift.common.utils.encode_timestamps`) that doesn't
+        compare as a string with the form items carry, so those items and
+        rows are left to be merged one by one.
+
+        For such an item and row, either one is newer in every respect or
+        they are the same age, so the item replaces the row if its created_at
+        is greater. Items are loaded into a temporary table, then the rows
+        they replace are deleted and they are inserted, each with one
+        statement.
+
+        :param curs: a cursor, in a transaction
+        :param item_list: a list of items, as for :meth:`merge_items`
+        :param query_mod: a condition on the object table's ``deleted``
+                          column, so that its index is used
+        :returns: the items that must be merged one by one
+        """
+        name_counts = Counter((item['name'], item['storage_policy_index'])
+                              for item in item_list)
+        bulk_items = []
+        other_items = []
+        for item in item_list:
+            if (name_counts[(item['name'], item['storage_policy_index'])] == 1
+                    and not item.get('ctype_timestamp')
+                    and not item.get('meta_timestamp')
+                    and SIMPLE_CREATED_AT.match(item['created_at'])):
+                bulk_items.append(item)
+            else:
+                other_items.append(item)
+        if not bulk_items:
+            return item_list
+
+        curs.execute('''
+            CREATE TEMPORARY TABLE IF NOT EXISTS incoming_object (
+                seq INTEGER PRIMARY KEY,
+                name TEXT,
+                created_at TEXT,
+                size INTEGER,
+                content_type TEXT,
+                etag TEXT,
+                deleted INTEGER,
+                policy_index INTEGER
+            )
+        ''')
+        curs.execute('DELETE FROM incoming_object')
+        curs.executemany(
+            'INSERT INTO incoming_object (seq, name, created_at, size, '
+            'content_type, etag, deleted, policy_index) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ((seq, item['name'], item['created_at'], item['size'],
+              item['content_type'], item['etag'], item['deleted'],
+              item['storage_policy_index'])
+             for seq, item in enumerate(bulk_items)))
+        # storage_policy_index is left unqualified, so that a database that
+        # predates it fails with the error that merge_items migrates on
+        existing = '''
+            FROM incoming_object i CROSS JOIN object o
+            ON %s o.name = i.name
+            AND storage_policy_index = i.policy_index
+        ''' % query_mod.replace('deleted', 'o.deleted')
+        # rows with content-type or metadata timestamps, or offsets, are
+        # merged one by one
+        complex_seqs = [row[0] for row in curs.execute(
+            "SELECT i.seq " + existing + " WHERE o.created_at GLOB '*[+_]*'")]
+        if complex_seqs:
+            other_items.extend(bulk_items[seq] for seq in complex_seqs)
+            curs.executemany('DELETE FROM incoming_object WHERE seq = ?',
+                             ((seq,) for seq in complex_seqs))
+        curs.execute('''
+            DELETE FROM object WHERE ROWID IN (
+                SELECT o.ROWID %s WHERE o.created_at < i.created_at)
+        ''' % existing)
+        curs.execute('''
+            INSERT INTO object (name, created_at, size, content_type, etag,
+                                deleted, storage_policy_index)
+            SELECT name, created_at, size, content_type, etag, deleted,
+                   policy_index
+            FROM incoming_object i
+            WHERE NOT EXISTS (
+                SELECT 1 FROM object o
+                WHERE %s o.name = i.name
+                AND storage_policy_index = i.policy_index)
+            ORDER BY seq
+        ''' % query_mod.replace('deleted', 'o.deleted'))
+        curs.execute('DELETE FROM incoming_object')
+        return other_items
+
     def merge_items(self, item_list, source=None):
         """
         Merge items into the object table.
 
+        Lists of at least ``BULK_MERGE_MIN_ITEMS`` items are merged with
+        set-based SQL as far as possible; see :meth:`_bulk_merge_items`.
+
         :param item_list: list of dictionaries of {'name', 'created_at',
                           'size', 'content_type', 'etag', 'deleted',
                           'storage_policy_index', 'ctype_timestamp',
@@ -1276,12 +1383,18 @@ class ContainerBroker(DatabaseBroker):
             else:
                 query_mod = ''
             curs.execute('BEGIN IMMEDIATE')
-            # Get sqlite records for objects in item_list that already exist.
-            # We must chunk it up to avoid sqlite's limit of 999 args.
+            merge_list = item_list
+            if len(item_list) >= BULK_MERGE_MIN_ITEMS:
+                for item in item_list:
+                    item.setdefault('storage_policy_index', 0)  # legacy
+                merge_list = self._bulk_merge_items(
+                    curs, item_list, query_mod)
+            # Get sqlite records for objects in merge_list that already
+            # exist. We must chunk it up to avoid sqlite's limit of 999 args.
             records = {}
-            for offset in range(0, len(item_list), SQLITE_ARG_LIMIT):
+            for offset in range(0, len(merge_list), SQLITE_ARG_LIMIT):
                 chunk = [rec['name'] for rec in
-                         item_list[offset:offset + SQLITE_ARG_LIMIT]]
+                         merge_list[offset:offset + SQLITE_ARG_LIMIT]]
                 records.update(
                     ((rec[0], rec[6]), rec) for rec in curs.execute(
                         'SELECT name, created_at, size, content_type,'
@@ -1292,7 +1405,7 @@ class ContainerBroker(DatabaseBroker):
             # on results of created_at query.
             to_delete = set()
             to_add = {}
-            for item in item_list:
+            for item in merge_list:
                 item.setdefault('storage_policy_index', 0)  # legacy
                 item_ident = (item['name'], item['storage_policy_index'])
                 existing = self._record_to_dict(records.get(item_ident))
@@ -1906,9 +2019,14 @@ class ContainerBroker(DatabaseBroker):
                                   self.path, err)
                 return False
 
-        # Rename to the new database
+        # Rename to the new database, having put anything in its write-ahead
+        # log into the database file
+        fresh_broker.close()
         fresh_db_filename = make_db_file_path(self._db_file, epoch)
-        renamer(tmp_db_file, fresh_db_filename)
+        if not replace_db_file(tmp_db_file, fresh_db_filename, self.timeout):
+            self.logger.error('Failed to empty the write-ahead log of %s for '
+                              '%s', fresh_db_filename, self.path)
+            return False
         self.reload_db_files()
         return True
 
@@ -1934,8 +2052,10 @@ class ContainerBroker(DatabaseBroker):
             return False
 
         retiring_file = self.db_files[-2]
+        self._invalidate_connections(retiring_file)
         try:
             os.unlink(retiring_file)
+            unlink_wal_files(retiring_file)
             self.logger.debug('Unlinked retiring db %r', retiring_file)
         except OSError as err:
             if err.errno != errno.ENOENT:
@@ -1971,7 +2091,8 @@ class ContainerBroker(DatabaseBroker):
             sub_broker = ContainerBroker(
                 db_file, self.timeout, self.logger, self.account,
                 self.container, self.pending_timeout, self.stale_reads_ok,
-                force_db_file=True, skip_commits=bool(db_files))
+                force_db_file=True, skip_commits=bool(db_files),
+                connection_cache=self.connection_cache)
             brokers.append(sub_broker)
         return brokers
 
@@ -27,7 +27,7 @@ from swift.container.sync_store import ContainerSyncStore
 from swift.container.backend import ContainerBroker, DATADIR, \
     RECORD_TYPE_SHARD, UNSHARDED, SHARDING, SHARDED, SHARD_UPDATE_STATES
 from swift.container.replicator import ContainerReplicatorRpc
-from swift.common.db import DatabaseAlreadyExists
+from swift.common.db import ConnectionCache, DatabaseAlreadyExists
 from swift.common.container_sync_realms import ContainerSyncRealms
 from swift.common.request_helpers import get_param, \
     split_and_validate_path, is_sys_or_user_meta
@@ -122,6 +122,14 @@ class ContainerController(BaseStorageServer):
                                 'be ignored in a future release.')
         swift.common.db.DB_PREALLOCATION = \
             config_true_value(conf.get('db_preallocation', 'f'))
+        swift.common.db.BINARY_PENDING = \
+            config_true_value(conf.get('binary_pending', 'f'))
+        swift.common.db.WAL_MODE = \
+            config_true_value(conf.get('db_wal_mode', 'f'))
+        connection_cache_size = int(
+            conf.get('db_connection_cache_size', 0))
+        self.connection_cache = ConnectionCache(connection_cache_size) \
+            if connection_cache_size > 0 else None
         self.sync_store = ContainerSyncStore(self.root,
                                              self.logger,
                                              self.mount_check)
@@ -144,6 +152,7 @@ class ContainerController(BaseStorageServer):
         kwargs.setdefault('account', account)
         kwargs.setdefault('container', container)
         kwargs.setdefault('logger', self.logger)
+        kwargs.setdefault('connection_cache', self.connection_cache)
         return ContainerBroker(db_path, **kwargs)
 
     def get_and_validate_policy_index(self, req):
@@ -707,19 +716,23 @@ class ContainerController(BaseStorageServer):
             if value and (key.lower() in self.save_headers or
                           is_sys_or_user_meta('container', key)):
                 resp_headers[key] = value
-        listing = [self.update_data_record(record)
-                   for record in container_list]
+        # the listing is serialized as the response is sent, so that its
+        # records needn't all be turned into dicts and then into one big body
+        listing = (self.update_data_record(record)
+                   for record in container_list)
         if out_content_type.endswith('/xml'):
-            body = listing_formats.container_to_xml(listing, container)
+            app_iter = listing_formats.iter_container_xml(listing, container)
         elif out_content_type.endswith('/json'):
-            body = json.dumps(listing)
+            app_iter = listing_formats.iter_listing_json(listing)
+        elif container_list:
+            app_iter = listing_formats.iter_listing_text(listing)
         else:
-            body = listing_formats.listing_to_text(listing)
+            app_iter = None
 
-        ret = Response(request=req, headers=resp_headers, body=body,
+        ret = Response(request=req, headers=resp_headers, app_iter=app_iter,
                        content_type=out_content_type, charset='utf-8')
         ret.last_modified = math.ceil(float(resp_headers['X-PUT-Timestamp']))
-        if not ret.body:
+        if app_iter is None:
             ret.status_int = HTTP_NO_CONTENT
         return ret
 
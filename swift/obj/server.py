@@ -271,6 +271,8 @@ class ObjectController(BaseStorageServer):
             to which the update should be sent. If given this path will be used
             instead of constructing a path from the ``account`` and
             ``container`` params.
+        :returns: the path in the form `<account/container>` to which the
+            update was redirected, if it was
         """
         if logger_thread_locals:
             self.logger.thread_locals = logger_thread_locals
@@ -326,6 +328,8 @@ class ObjectController(BaseStorageServer):
                                     headers_out.get('x-timestamp'))
         self._diskfile_router[policy].pickle_async_update(
             objdevice, account, container, obj, data, timestamp, policy)
+        if redirect_data:
+            return container_path
 
     def container_update(self, op, account, container, obj, request,
                          headers_out, objdevice, policy):
@@ -341,6 +345,8 @@ class ObjectController(BaseStorageServer):
                             request(s)
         :param objdevice: device name that the object is in
         :param policy:  the BaseStoragePolicy instance
+        :returns: the path in the form `<account/container>` to which an
+            update was redirected, if one was
         """
         headers_in = request.headers
         conthosts = [h.strip() for h in
@@ -398,15 +404,17 @@ class ObjectController(BaseStorageServer):
         # after getting a successful response to the object create. The
         # `container_update_timeout` bounds the length of time we wait so that
         # one slow container server doesn't make the entire request lag.
+        redirect = None
         try:
             with Timeout(self.container_update_timeout):
                 for gt in update_greenthreads:
-                    gt.wait()
+                    redirect = gt.wait() or redirect
         except Timeout:
             # updates didn't go through, log it and return
             self.logger.debug(
                 'Container update timeout (%.4fs) waiting for %s',
                 self.container_update_timeout, updates)
+        return redirect
 
     def delete_at_update(self, op, delete_at, account, container, obj,
                          request, objdevice, policy):
@@ -722,7 +730,7 @@ class ObjectController(BaseStorageServer):
         self._check_container_override(update_headers, orig_metadata)
 
         # object POST updates are PUT to the container server
-        self.container_update(
+        redirect = self.container_update(
             'PUT', account, container, obj, request, update_headers,
             device, policy)
 
@@ -731,6 +739,10 @@ class ObjectController(BaseStorageServer):
         for key, value in orig_metadata.items():
             if is_sys_meta('object', key):
                 resp_headers[key] = value
+        if redirect:
+            # let the proxy know that its idea of the shard container for the
+            # object is out of date
+            resp_headers['X-Backend-Redirect'] = redirect
 
         return HTTPAccepted(request=request, headers=resp_headers)
 
@@ -981,7 +993,7 @@ class ObjectController(BaseStorageServer):
         # apply any container update header overrides sent with request
         self._check_container_override(update_headers, request.headers,
                                        footers_metadata)
-        self.container_update(
+        return self.container_update(
             'PUT', account, container, obj, request,
             update_headers, device, policy)
 
@@ -1022,10 +1034,13 @@ class ObjectController(BaseStorageServer):
             return HTTPRequestTimeout(request=request)
         finally:
             writer.close()
-        self._post_commit_updates(request, device,
-                                  account, container, obj, policy,
-                                  orig_metadata, footers_metadata, metadata)
-        return HTTPCreated(request=request, etag=etag)
+        redirect = self._post_commit_updates(
+            request, device, account, container, obj, policy,
+            orig_metadata, footers_metadata, metadata)
+        resp = HTTPCreated(request=request, etag=etag)
+        if redirect:
+            resp.headers['X-Backend-Redirect'] = redirect
+        return resp
 
     @public
     @timing_stats()
@@ -1220,18 +1235,20 @@ class ObjectController(BaseStorageServer):
             self.delete_at_update('DELETE', orig_delete_at, account,
                                   container, obj, request, device,
                                   policy)
+        redirect = None
         if orig_timestamp < req_timestamp:
             try:
                 disk_file.delete(req_timestamp)
             except DiskFileNoSpace:
                 return HTTPInsufficientStorage(drive=device, request=request)
-            self.container_update(
+            redirect = self.container_update(
                 'DELETE', account, container, obj, request,
                 HeaderKeyDict({'x-timestamp': req_timestamp.internal}),
                 device, policy)
-        return response_class(
-            request=request,
-            headers={'X-Backend-Timestamp': response_timestamp.internal})
+        resp_headers = {'X-Backend-Timestamp': response_timestamp.internal}
+        if redirect:
+            resp_headers['X-Backend-Redirect'] = redirect
+        return response_class(request=request, headers=resp_headers)
 
     @public
     @replication
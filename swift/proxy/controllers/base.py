@@ -33,11 +33,14 @@ import functools
 import inspect
 import itertools
 import operator
+import random
+from collections import OrderedDict
 from copy import deepcopy
 from sys import exc_info
 from swift import gettext_ as _
 
-from eventlet import sleep
+from eventlet import sleep, spawn_n
+from eventlet.event import Event
 from eventlet.timeout import Timeout
 import six
 
@@ -67,6 +70,8 @@ from swift.common.storage_policy import POLICIES
 
 DEFAULT_RECHECK_ACCOUNT_EXISTENCE = 60  # seconds
 DEFAULT_RECHECK_CONTAINER_EXISTENCE = 60  # seconds
+DEFAULT_RECHECK_UPDATING_SHARD_RANGES = 3600  # seconds
+DEFAULT_RECHECK_LISTING_SHARD_RANGES = 600  # seconds
 
 
 def update_headers(response, headers):
@@ -352,14 +357,7 @@ def get_container_info(env, app, swift_source=None):
         req = _prepare_pre_auth_info_request(
             env, ("/%s/%s/%s" % (version, account, container)),
             (swift_source or 'GET_CONTAINER_INFO'))
-        resp = req.get_response(app)
-        # Check in infocache to see if the proxy (or anyone else) already
-        # populated the cache for us. If they did, just use what's there.
-        #
-        # See similar comment in get_account_info() for justification.
-        info = _get_info_from_infocache(env, account, container)
-        if info is None:
-            info = set_info_cache(app, env, account, container, resp)
+        info = _get_info_from_backend(app, env, account, container, req)
 
     if info:
         info = deepcopy(info)  # avoid mutating what's in swift.infocache
@@ -407,24 +405,7 @@ def get_account_info(env, app, swift_source=None):
         req = _prepare_pre_auth_info_request(
             env, "/%s/%s" % (version, account),
             (swift_source or 'GET_ACCOUNT_INFO'))
-        resp = req.get_response(app)
-        # Check in infocache to see if the proxy (or anyone else) already
-        # populated the cache for us. If they did, just use what's there.
-        #
-        # The point of this is to avoid setting the value in memcached
-        # twice. Otherwise, we're needlessly sending requests across the
-        # network.
-        #
-        # If the info didn't make it into the cache, we'll compute it from
-        # the response and populate the cache ourselves.
-        #
-        # Note that this is taking "exists in infocache" to imply "exists in
-        # memcache". That's because we're trying to avoid superfluous
-        # network traffic, and checking in memcache prior to setting in
-        # memcache would defeat the purpose.
-        info = _get_info_from_infocache(env, account)
-        if info is None:
-            info = set_info_cache(app, env, account, None, resp)
+        info = _get_info_from_backend(app, env, account, None, req)
 
     if info:
         info = info.copy()  # avoid mutating what's in swift.infocache
@@ -440,7 +421,7 @@ def get_account_info(env, app, swift_source=None):
     return info
 
 
-def get_cache_key(account, container=None, obj=None):
+def get_cache_key(account, container=None, obj=None, shard=None):
     """
     Get the keys for both memcache and env['swift.infocache'] (cache_key)
     where info about accounts, containers, and objects is cached
@@ -448,10 +429,18 @@ def get_cache_key(account, container=None, obj=None):
     :param account: The name of the account
     :param container: The name of the container (or None if account)
     :param obj: The name of the object (or None if account or container)
+    :param shard: 'updating' or 'listing' for the key under which a
+                  container's shard ranges are cached (or None)
     :returns: a string cache_key
     """
 
-    if obj:
+    if shard:
+        if not (account and container):
+            raise ValueError('Shard cache key requires account and container')
+        if obj:
+            raise ValueError('Shard cache key cannot have an object name')
+        cache_key = 'shard-%s/%s/%s' % (shard, account, container)
+    elif obj:
         if not (account and container):
             raise ValueError('Object cache key requires account and container')
         cache_key = 'object/%s/%s/%s' % (account, container, obj)
@@ -468,6 +457,151 @@ def get_cache_key(account, container=None, obj=None):
     return cache_key
 
 
+class ProcessInfoCache(object):
+    """
+    A size bounded, short lived cache of account or container info that is
+    shared by all the requests handled by a proxy worker. It sits between
+    the per-request ``swift.infocache`` and memcache, so that hot accounts
+    and containers don't cost a memcache round trip on every request.
+
+    Each entry lives for at most ``ttl`` seconds, less a random fraction of
+    up to ``jitter`` so that entries cached together don't all expire
+    together. As in memcache, info for an account or container that doesn't
+    exist is cached too, but for only a tenth as long. Once ``max_entries``
+    is reached the least recently used entry is evicted.
+
+    :param server_type: 'account', 'container' or 'shard', used to name
+                        metrics
+    :param max_entries: the most entries to keep; 0 disables the cache
+    :param ttl: the most seconds an entry is kept for
+    :param jitter: the fraction of ``ttl`` by which to randomly shorten it
+    :param logger: a logger to which hit and miss metrics are emitted
+    """
+
+    def __init__(self, server_type, max_entries, ttl, jitter=0.1,
+                 logger=None):
+        self.server_type = server_type
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.jitter = jitter
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _count(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if self.logger:
+            self.logger.increment('%s.info_cache.%s' % (
+                self.server_type, 'hit' if hit else 'miss'))
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def get(self, cache_key):
+        """
+        Get cached info, counting a hit or miss.
+
+        :param cache_key: a key from :func:`get_cache_key`
+        :returns: the cached info, or None
+        """
+        if not self.max_entries:
+            return None
+        entry = self._entries.pop(cache_key, None)
+        if entry is None or entry[0] <= time.time():
+            self._count(False)
+            return None
+        # most recently used entries live at the end
+        self._entries[cache_key] = entry
+        self._count(True)
+        return entry[1]
+
+    def set(self, cache_key, info, ttl=None):
+        """
+        Cache info.
+
+        :param cache_key: a key from :func:`get_cache_key`
+        :param info: the info to cache
+        :param ttl: seconds to cache the info for, if less than ``self.ttl``
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if isinstance(info, dict) and \
+                info.get('status') in (HTTP_NOT_FOUND, HTTP_GONE):
+            ttl *= 0.1
+        if not self.max_entries or ttl <= 0:
+            return
+        ttl *= 1 - random.random() * self.jitter
+        self._entries.pop(cache_key, None)
+        while len(self._entries) >= self.max_entries:
+            self._entries.popitem(last=False)
+        self._entries[cache_key] = (time.time() + ttl, info)
+
+    def delete(self, cache_key):
+        self._entries.pop(cache_key, None)
+
+
+class SingleFlight(object):
+    """
+    Lets concurrent callers that want the same thing share one call for it,
+    so that e.g. a burst of requests for a hot object or container makes
+    only one set of backend requests.
+
+    The first caller for a key makes the call; callers for the same key
+    that arrive while it is in flight wait for it and are given its result.
+    A result of None can't be shared, so a waiting caller then makes the
+    call itself.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, func):
+        """
+        Call ``func``, or wait for a call already in flight for ``key``.
+
+        :param key: a hashable key for the call
+        :param func: a callable taking no arguments
+        :returns: the result of ``func``, or a result shared by another
+                  caller
+        """
+        event = self._calls.get(key)
+        if event is not None:
+            result = event.wait()
+            if result is not None:
+                return result
+            return func()
+        event = self._calls[key] = Event()
+        result = None
+        try:
+            result = func()
+            return result
+        finally:
+            del self._calls[key]
+            event.send(result)
+
+
+def _get_process_info_cache(app, server_type):
+    info_caches = getattr(app, 'info_caches', None)
+    if not isinstance(info_caches, dict):
+        # e.g. a middleware's app, or a proxy app without process caches
+        return None
+    process_cache = info_caches.get(server_type)
+    if process_cache is None or not process_cache.max_entries:
+        return None
+    return process_cache
+
+
 def set_info_cache(app, env, account, container, resp):
     """
     Cache info in both memcache and env.
@@ -499,10 +633,14 @@ def set_info_cache(app, env, account, container, resp):
         elif not is_success(resp.status_int):
             cache_time = None
 
-    # Next actually set both memcache and the env cache
+    # Next actually set memcache, the process cache and the env cache
     memcache = getattr(app, 'memcache', None) or env.get('swift.cache')
+    process_cache = _get_process_info_cache(
+        app, 'container' if container else 'account')
     if cache_time is None:
         infocache.pop(cache_key, None)
+        if process_cache is not None:
+            process_cache.delete(cache_key)
         if memcache:
             memcache.delete(cache_key)
         return
@@ -513,6 +651,8 @@ def set_info_cache(app, env, account, container, resp):
         info = headers_to_account_info(resp.headers, resp.status_int)
     if memcache:
         memcache.set(cache_key, info, time=cache_time)
+    if process_cache is not None:
+        process_cache.set(cache_key, info, cache_time)
     infocache[cache_key] = info
     return info
 
@@ -547,7 +687,7 @@ def set_object_info_cache(app, env, account, container, obj, resp):
 
 def clear_info_cache(app, env, account, container=None):
     """
-    Clear the cached info in both memcache and env
+    Clear the cached info in memcache, the process cache and env
 
     :param  app: the application object
     :param  env: the WSGI environment
@@ -557,6 +697,88 @@ def clear_info_cache(app, env, account, container=None):
     set_info_cache(app, env, account, container, None)
 
 
+def get_shard_ranges_from_cache(app, env, account, container, shard):
+    """
+    Get a container's shard ranges from env, the process cache or memcache
+    (if used), in that order.
+
+    Only the namespace of each shard range (its bounds and the name of its
+    shard container) is cached, so the returned shard ranges have no
+    timestamps, object stats or states of any use.
+
+    :param app: the application object
+    :param env: the environment used by the current request
+    :param account: the account name
+    :param container: the container name
+    :param shard: 'updating' or 'listing'
+    :returns: a list of :class:`~swift.common.utils.ShardRange`, sorted as
+              the container server sorts them, or None on a miss
+    """
+    cache_key = get_cache_key(account, container, shard=shard)
+    infocache = env.setdefault('swift.infocache', {})
+    if cache_key in infocache:
+        return infocache[cache_key]
+    process_cache = _get_process_info_cache(app, 'shard')
+    shard_ranges = None
+    if process_cache is not None:
+        shard_ranges = process_cache.get(cache_key)
+    if shard_ranges is None:
+        memcache = getattr(app, 'memcache', None) or env.get('swift.cache')
+        namespaces = memcache.get(cache_key) if memcache else None
+        if namespaces is None:
+            return None
+        try:
+            shard_ranges = [
+                ShardRange(name, Timestamp(0), lower, upper)
+                for lower, upper, name in namespaces]
+        except (ValueError, TypeError):
+            memcache.delete(cache_key)
+            return None
+        if process_cache is not None:
+            process_cache.set(cache_key, shard_ranges)
+    infocache[cache_key] = shard_ranges
+    return shard_ranges
+
+
+def set_shard_ranges_cache(app, env, account, container, shard,
+                           shard_ranges, cache_time=None):
+    """
+    Cache a container's shard ranges in memcache, the process cache and env,
+    as a compact list of ``[lower, upper, name]`` namespaces.
+
+    :param app: the application object
+    :param env: the environment used by the current request
+    :param account: the account name
+    :param container: the container name
+    :param shard: 'updating' or 'listing'
+    :param shard_ranges: a list of :class:`~swift.common.utils.ShardRange`
+                         sorted as the container server sorts them, or None if
+                         the cached shard ranges should be cleared
+    :param cache_time: seconds for which to cache the shard ranges
+    """
+    cache_key = get_cache_key(account, container, shard=shard)
+    infocache = env.setdefault('swift.infocache', {})
+    memcache = getattr(app, 'memcache', None) or env.get('swift.cache')
+    process_cache = _get_process_info_cache(app, 'shard')
+    if shard_ranges is None:
+        infocache.pop(cache_key, None)
+        if process_cache is not None:
+            process_cache.delete(cache_key)
+        if memcache:
+            memcache.delete(cache_key)
+        return
+
+    shard_ranges = [
+        ShardRange(sr.name, Timestamp(0), sr.lower, sr.upper)
+        for sr in shard_ranges]
+    if memcache:
+        memcache.set(cache_key, [[sr.lower_str, sr.upper_str, sr.name]
+                                 for sr in shard_ranges], time=cache_time)
+    if process_cache is not None:
+        process_cache.set(cache_key, shard_ranges, cache_time)
+    infocache[cache_key] = shard_ranges
+
+
 def _get_info_from_infocache(env, account, container=None):
     """
     Get cached account or container information from request-environment
@@ -590,25 +812,64 @@ def _get_info_from_memcache(app, env, account, container=None):
     memcache = getattr(app, 'memcache', None) or env.get('swift.cache')
     if memcache:
         info = memcache.get(cache_key)
-        if info and six.PY2:
-            # Get back to native strings
-            for key in info:
-                if isinstance(info[key], six.text_type):
-                    info[key] = info[key].encode("utf-8")
-                elif isinstance(info[key], dict):
-                    for subkey, value in info[key].items():
-                        if isinstance(value, six.text_type):
-                            info[key][subkey] = value.encode("utf-8")
-        if info:
-            env.setdefault('swift.infocache', {})[cache_key] = info
-        return info
+        return _cache_info_from_memcache(app, env, cache_key, info,
+                                         'container' if container else
+                                         'account')
     return None
 
 
+def _cache_info_from_memcache(app, env, cache_key, info, server_type):
+    """
+    Put account or container information fetched from memcache into
+    swift.infocache and the process cache.
+
+    :returns: the info, or None if it wasn't in memcache
+    """
+    if info and six.PY2:
+        # Get back to native strings
+        for key in info:
+            if isinstance(info[key], six.text_type):
+                info[key] = info[key].encode("utf-8")
+            elif isinstance(info[key], dict):
+                for subkey, value in info[key].items():
+                    if isinstance(value, six.text_type):
+                        info[key][subkey] = value.encode("utf-8")
+    if info:
+        env.setdefault('swift.infocache', {})[cache_key] = info
+        process_cache = _get_process_info_cache(app, server_type)
+        if process_cache is not None:
+            process_cache.set(cache_key, info)
+    return info
+
+
+def _get_info_from_process_cache(app, env, account, container=None):
+    """
+    Get cached account or container information from the proxy worker's
+    :class:`ProcessInfoCache`.
+
+    :param  app: the application object
+    :param  env: the environment used by the current request
+    :param  account: the account name
+    :param  container: the container name
+
+    :returns: a dictionary of cached info on cache hit, None on miss. Also
+      returns None if the process cache is not in use.
+    """
+    process_cache = _get_process_info_cache(
+        app, 'container' if container else 'account')
+    if process_cache is None:
+        return None
+    cache_key = get_cache_key(account, container)
+    info = process_cache.get(cache_key)
+    if info:
+        env.setdefault('swift.infocache', {})[cache_key] = info
+    return info
+
+
 def _get_info_from_caches(app, env, account, container=None):
     """
-    Get the cached info from env or memcache (if used) in that order.
-    Used for both account and container info.
+    Get the cached info from env, the process cache or memcache (if used) in
+    that order. Used for both account and container info.
 
     :param  app: the application object
     :param  env: the environment used by the current request
@@ -616,11 +877,98 @@ def _get_info_from_caches(app, env, account, container=None):
     """
 
     info = _get_info_from_infocache(env, account, container)
+    if info is None:
+        info = _get_info_from_process_cache(app, env, account, container)
     if info is None:
         info = _get_info_from_memcache(app, env, account, container)
     return info
 
 
+def prefetch_info(env, app, account, container):
+    """
+    Fetch the info for an account and one of its containers from memcache in
+    a single round trip, so that get_account_info and get_container_info will
+    then find it in swift.infocache. Info already in swift.infocache or the
+    process cache isn't fetched again.
+
+    This is only worthwhile for a memcache client with a ``get_many`` method
+    that can fetch keys held on different servers at once; otherwise it does
+    nothing.
+
+    :param  env: the environment used by the current request
+    :param  app: the application object
+    :param  account: the account name
+    :param  container: the container name
+    """
+    memcache = getattr(app, 'memcache', None) or env.get('swift.cache')
+    if not hasattr(memcache, 'get_many'):
+        return
+    wanted = []
+    for container_name in (None, container):
+        if _get_info_from_infocache(env, account, container_name) is None \
+                and _get_info_from_process_cache(
+                    app, env, account, container_name) is None:
+            wanted.append(container_name)
+    if len(wanted) < 2:
+        # one key is fetched just as quickly when it's needed
+        return
+    cache_keys = [get_cache_key(account, container_name)
+                  for container_name in wanted]
+    for container_name, cache_key, info in zip(
+            wanted, cache_keys, memcache.get_many(cache_keys)):
+        _cache_info_from_memcache(app, env, cache_key, info,
+                                  'container' if container_name else
+                                  'account')
+
+
+def _get_info_from_backend(app, env, account, container, req):
+    """
+    Get account or container info with a HEAD request, and populate the
+    caches with it.
+
+    If the app has an ``info_single_flight``, concurrent lookups of the same
+    account or container in a proxy worker share one HEAD request.
+
+    :param  app: the application object
+    :param  env: the environment used by the current request
+    :param  account: the account name
+    :param  container: the container name, or None for account info
+    :param  req: the pre authed HEAD request
+    :returns: the info, or None if the request status was not in
+              (404, 410, 2xx)
+    """
+    def head():
+        resp = req.get_response(app)
+        # Check in infocache to see if the proxy (or anyone else) already
+        # populated the cache for us. If they did, just use what's there.
+        #
+        # The point of this is to avoid setting the value in memcached
+        # twice. Otherwise, we're needlessly sending requests across the
+        # network.
+        #
+        # If the info didn't make it into the cache, we'll compute it from
+        # the response and populate the cache ourselves.
+        #
+        # Note that this is taking "exists in infocache" to imply "exists in
+        # memcache". That's because we're trying to avoid superfluous
+        # network traffic, and checking in memcache prior to setting in
+        # memcache would defeat the purpose.
+        info = _get_info_from_infocache(env, account, container)
+        if info is None:
+            info = set_info_cache(app, env, account, container, resp)
+        return info
+
+    single_flight = getattr(app, 'info_single_flight', None)
+    if not isinstance(single_flight, SingleFlight):
+        return head()
+    cache_key = get_cache_key(account, container)
+    info = single_flight.do(cache_key, head)
+    if info is not None:
+        # the info may have come from another request's HEAD
+        env.setdefault('swift.infocache', {}).setdefault(cache_key, info)
+    return info
+
+
 def _prepare_pre_auth_info_request(env, path, swift_source):
     """
     Prepares a pre authed request to obtain info using a HEAD.
@@ -1136,6 +1484,7 @@ class ResumingGetter(object):
         if self.header_provider:
             req_headers.update(self.header_provider())
         start_node_timing = time.time()
+        connect_timing = response_timing = None
         try:
             with ConnectionTimeout(self.app.conn_timeout):
                 conn = http_connect(
@@ -1143,18 +1492,25 @@ class ResumingGetter(object):
                     self.partition, self.req_method, self.path,
                     headers=req_headers,
                     query_string=self.req_query_string)
-            self.app.set_node_timing(node, time.time() - start_node_timing)
+            connect_timing = time.time() - start_node_timing
 
             with Timeout(node_timeout):
                 possible_source = conn.getresponse()
                 # See NOTE: swift_conn at top of file about this.
                 possible_source.swift_conn = conn
+            response_timing = time.time() - start_node_timing
         except (Exception, Timeout):
             self.app.exception_occurred(
                 node, self.server_type,
                 _('Trying to %(method)s %(path)s') %
                 {'method': self.req_method, 'path': self.req_path})
+        # timings are recorded outside the try, so that trouble keeping them
+        # isn't taken for trouble with the node
+        if connect_timing is not None:
+            self.app.set_node_timing(node, connect_timing)
+        if response_timing is None:
             return False
+        self.app.set_node_response_timing(node, response_timing)
         if self.is_good_source(possible_source):
             # 404 if we know we don't have a synced copy
             if not float(possible_source.getheader('X-PUT-Timestamp', 1)):
@@ -1220,6 +1576,12 @@ class ResumingGetter(object):
                      'type': self.server_type})
         return False
 
+    def _close_late_sources(self, pile, sources):
+        for _junk in pile:
+            pass
+        for src, _junk in sources:
+            close_swift_conn(src)
+
     def _get_source_and_node(self):
         self.statuses = []
         self.reasons = []
@@ -1238,7 +1600,7 @@ class ResumingGetter(object):
         for node in nodes:
             pile.spawn(self._make_node_request, node, node_timeout,
                        self.app.logger.thread_locals)
-            _timeout = self.app.concurrency_timeout \
+            _timeout = self.app.get_concurrency_timeout(node) \
                 if pile.inflight < self.concurrency else None
             if pile.waitfirst(_timeout):
                 break
@@ -1257,6 +1619,12 @@ class ResumingGetter(object):
             source, node = self.sources.pop()
             for src, _junk in self.sources:
                 close_swift_conn(src)
+            if pile.inflight:
+                # concurrent requests that are still in flight have lost the
+                # race; close whatever they turn up rather than leaving the
+                # connections for the garbage collector
+                self.sources = []
+                spawn_n(self._close_late_sources, pile, self.sources)
             self.used_nodes.append(node)
             src_headers = dict(
                 (k.lower(), v) for k, v in
@@ -14,8 +14,11 @@
 # limitations under the License.
 
 from swift import gettext_ as _
+import collections
 import json
 
+from eventlet import spawn
+
 from six.moves.urllib.parse import unquote
 from swift.common.utils import public, csv_append, Timestamp, \
     config_true_value, ShardRange
@@ -23,12 +26,17 @@ from swift.common.constraints import check_metadata, CONTAINER_LISTING_LIMIT
 from swift.common.http import HTTP_ACCEPTED, is_success
 from swift.common.request_helpers import get_sys_meta_prefix
 from swift.proxy.controllers.base import Controller, delay_denial, \
-    cors_validation, set_info_cache, clear_info_cache
+    cors_validation, set_info_cache, clear_info_cache, \
+    get_shard_ranges_from_cache, set_shard_ranges_cache
 from swift.common.storage_policy import POLICIES
 from swift.common.swob import HTTPBadRequest, HTTPForbidden, \
     HTTPNotFound, HTTPServerError
 
 
+def _listing_name(obj):
+    return obj.get('name', obj.get('subdir', u'')).encode('utf-8')
+
+
 class ContainerController(Controller):
     """WSGI controller for container requests"""
     server_type = 'Container'
@@ -103,7 +111,6 @@ class ContainerController(Controller):
             self.account_name, self.container_name)
         concurrency = self.app.container_ring.replica_count \
             if self.app.concurrent_gets else 1
-        node_iter = self.app.iter_nodes(self.app.container_ring, part)
         params = req.params
         params['format'] = 'json'
         record_type = req.headers.get('X-Backend-Record-Type', '').lower()
@@ -112,13 +119,22 @@ class ContainerController(Controller):
             req.headers['X-Backend-Record-Type'] = 'auto'
             params['states'] = 'listing'
         req.params = params
-        resp = self.GETorHEAD_base(
-            req, _('Container'), node_iter, part,
-            req.swift_entity_path, concurrency)
-        resp_record_type = resp.headers.get('X-Backend-Record-Type', '')
+        resp = None
         if all((req.method == "GET", record_type == 'auto',
-               resp_record_type.lower() == 'shard')):
-            resp = self._get_from_shards(req, resp)
+                self.app.recheck_listing_shard_ranges > 0)):
+            resp = self._GET_using_cache(req, part, concurrency)
+        if resp is None:
+            node_iter = self.app.iter_nodes(self.app.container_ring, part)
+            resp = self.GETorHEAD_base(
+                req, _('Container'), node_iter, part,
+                req.swift_entity_path, concurrency)
+            resp_record_type = resp.headers.get('X-Backend-Record-Type', '')
+            if all((req.method == "GET", record_type == 'auto',
+                   resp_record_type.lower() == 'shard')):
+                shard_ranges = [ShardRange.from_dict(data)
+                                for data in json.loads(resp.body)]
+                self._cache_listing_shard_ranges(req, resp, shard_ranges)
+                resp = self._get_from_shards(req, resp, shard_ranges)
 
         # Cache this. We just made a request to a storage node and got
         # up-to-date information for the container.
@@ -144,10 +160,71 @@ class ContainerController(Controller):
                                  'False'))
         return resp
 
-    def _get_from_shards(self, req, resp):
-        # construct listing using shards described by the response body
-        shard_ranges = [ShardRange.from_dict(data)
-                        for data in json.loads(resp.body)]
+    def _cache_listing_shard_ranges(self, req, resp, shard_ranges):
+        """
+        Cache the listing shard ranges of a sharded container, if they were
+        fetched for an unconstrained listing and so are all of them.
+        """
+        if self.app.recheck_listing_shard_ranges <= 0 or not shard_ranges:
+            return
+        if resp.headers.get('X-Backend-Sharding-State') != 'sharded':
+            # shard ranges are still being made
+            return
+        if any(req.params.get(param) for param in (
+                'marker', 'end_marker', 'includes', 'reverse')):
+            return
+        set_shard_ranges_cache(
+            self.app, req.environ, self.account_name, self.container_name,
+            'listing', shard_ranges, self.app.recheck_listing_shard_ranges)
+
+    def _GET_using_cache(self, req, part, concurrency):
+        """
+        Make a listing of a sharded container from its cached shard ranges.
+
+        The root container is still asked for its (empty) object listing, for
+        the container's headers and to check that it is still sharded.
+
+        :returns: a listing response, or None if the shard ranges aren't
+                  cached or the container is no longer sharded
+        """
+        shard_ranges = get_shard_ranges_from_cache(
+            self.app, req.environ, self.account_name, self.container_name,
+            'listing')
+        if shard_ranges is None:
+            return None
+        req.headers['X-Backend-Record-Type'] = 'object'
+        node_iter = self.app.iter_nodes(self.app.container_ring, part)
+        resp = self.GETorHEAD_base(
+            req, _('Container'), node_iter, part,
+            req.swift_entity_path, concurrency)
+        if not is_success(resp.status_int):
+            return resp
+        if resp.headers.get('X-Backend-Sharding-State') != 'sharded':
+            set_shard_ranges_cache(
+                self.app, req.environ, self.account_name,
+                self.container_name, 'listing', None)
+            req.headers['X-Backend-Record-Type'] = 'auto'
+            return None
+
+        # select the shard ranges as the container server would
+        reverse = config_true_value(req.params.get('reverse'))
+        marker = req.params.get('marker')
+        end_marker = req.params.get('end_marker')
+        if reverse:
+            marker, end_marker = end_marker, marker
+        if marker and end_marker and marker >= end_marker:
+            shard_ranges = []
+        if marker:
+            shard_ranges = [sr for sr in shard_ranges if marker < sr.upper]
+        if end_marker:
+            shard_ranges = [sr for sr in shard_ranges
+                            if end_marker > sr.lower]
+        if reverse:
+            shard_ranges = shard_ranges[::-1]
+        return self._get_from_shards(req, resp, shard_ranges)
+
+    def _get_from_shards(self, req, resp, shard_ranges):
+        # construct listing using the given shards
         self.app.logger.debug('GET listing from %s shards for: %s',
                               len(shard_ranges), req.path_qs)
         if not shard_ranges:
@@ -164,33 +241,32 @@ class ContainerController(Controller):
         marker = params.get('marker')
         end_marker = params.get('end_marker')
 
-        limit = req_limit
-        for shard_range in shard_ranges:
-            params['limit'] = limit
+        def make_params(shard_range, limit):
+            shard_params = dict(params, limit=limit)
             # Always set marker to ensure that object names less than or equal
             # to those already in the listing are not fetched; if the listing
             # is empty then the original request marker, if any, is used. This
             # allows misplaced objects below the expected shard range to be
             # included in the listing.
             if objects:
-                last_name = objects[-1].get('name',
-                                            objects[-1].get('subdir', u''))
-                params['marker'] = last_name.encode('utf-8')
+                shard_params['marker'] = _listing_name(objects[-1])
             elif marker:
-                params['marker'] = marker
+                shard_params['marker'] = marker
             else:
-                params['marker'] = ''
+                shard_params['marker'] = ''
             # Always set end_marker to ensure that misplaced objects beyond the
             # expected shard range are not fetched. This prevents a misplaced
             # object obscuring correctly placed objects in the next shard
             # range.
             if end_marker and end_marker in shard_range:
-                params['end_marker'] = end_marker
+                shard_params['end_marker'] = end_marker
             elif reverse:
-                params['end_marker'] = shard_range.lower_str
+                shard_params['end_marker'] = shard_range.lower_str
             else:
-                params['end_marker'] = shard_range.end_marker
+                shard_params['end_marker'] = shard_range.end_marker
+            return shard_params
 
+        def fetch(shard_range, shard_params):
             if (shard_range.account == self.account_name and
                     shard_range.container == self.container_name):
                 # directed back to same container - force GET of objects
@@ -199,25 +275,64 @@ class ContainerController(Controller):
                 headers = None
             self.app.logger.debug('Getting from %s %s with %s',
                                   shard_range, shard_range.name, headers)
-            objs, shard_resp = self._get_container_listing(
+            objs, _shard_resp = self._get_container_listing(
                 req, shard_range.account, shard_range.container,
-                headers=headers, params=params)
-
-            if not objs:
-                # tolerate errors or empty shard containers
-                continue
-
-            objects.extend(objs)
-            limit -= len(objs)
-
-            if limit <= 0:
-                break
-            elif (end_marker and reverse and
-                  end_marker >= objects[-1]['name'].encode('utf-8')):
-                break
-            elif (end_marker and not reverse and
-                  end_marker <= objects[-1]['name'].encode('utf-8')):
-                break
+                headers=headers, params=shard_params)
+            return objs
+
+        # Up to shard_listing_concurrency shard listings are fetched at once.
+        # Listings fetched ahead of the shards before them being processed use
+        # the marker and limit known when they were started, so once those
+        # shards are processed the listing is trimmed to what it would have
+        # been had it been fetched then; if trimming leaves too few objects,
+        # it's fetched again.
+        pending = collections.deque()
+        shard_range_iter = iter(shard_ranges)
+        limit = req_limit
+        try:
+            while True:
+                while len(pending) < self.app.shard_listing_concurrency:
+                    shard_range = next(shard_range_iter, None)
+                    if shard_range is None:
+                        break
+                    shard_params = make_params(shard_range, limit)
+                    pending.append((shard_range, shard_params, spawn(
+                        fetch, shard_range, shard_params)))
+                if not pending:
+                    break
+                shard_range, fetched_params, fetcher = pending.popleft()
+                objs = fetcher.wait()
+                shard_params = make_params(shard_range, limit)
+                if objs and shard_params != fetched_params:
+                    fetched_all = len(objs) < fetched_params['limit']
+                    if shard_params['marker']:
+                        objs = [obj for obj in objs if (
+                            _listing_name(obj) < shard_params['marker']
+                            if reverse else
+                            _listing_name(obj) > shard_params['marker'])]
+                    if fetched_all or len(objs) >= limit:
+                        objs = objs[:limit]
+                    else:
+                        objs = fetch(shard_range, shard_params)
+
+                if not objs:
+                    # tolerate errors or empty shard containers
+                    continue
+
+                objects.extend(objs)
+                limit -= len(objs)
+
+                if limit <= 0:
+                    break
+                elif (end_marker and reverse and
+                      end_marker >= objects[-1]['name'].encode('utf-8')):
+                    break
+                elif (end_marker and not reverse and
+                      end_marker <= objects[-1]['name'].encode('utf-8')):
+                    break
+        finally:
+            for _shard_range, _params, fetcher in pending:
+                fetcher.kill()
 
         resp.body = json.dumps(objects).encode('ascii')
         constrained = any(req.params.get(constraint) for constraint in (
@@ -27,6 +27,7 @@
 from six.moves.urllib.parse import unquote
 
 import collections
+import functools
 import itertools
 import json
 import mimetypes
@@ -37,7 +38,7 @@ from hashlib import md5
 from swift import gettext_ as _
 
 from greenlet import GreenletExit
-from eventlet import GreenPile
+from eventlet import GreenPile, spawn
 from eventlet.queue import Queue
 from eventlet.timeout import Timeout
 
@@ -46,34 +47,48 @@ from swift.common.utils import (
     GreenAsyncPile, GreenthreadSafeIterator, Timestamp,
     normalize_delete_at_timestamp, public, get_expirer_container,
     document_iters_to_http_response_body, parse_content_range,
-    quorum_size, reiterate, close_if_possible, safe_json_loads)
+    quorum_size, reiterate, close_if_possible, safe_json_loads,
+    find_shard_range, parse_content_type, FileLikeIter,
+    multipart_byteranges_to_document_iters,
+    document_iters_to_multipart_byteranges)
 from swift.common.bufferedhttp import http_connect
+from swift.common.ec_codec import ECCodecExecutor
 from swift.common.constraints import check_metadata, check_object_creation
 from swift.common import constraints
 from swift.common.exceptions import ChunkReadTimeout, \
     ChunkWriteTimeout, ConnectionTimeout, ResponseTimeout, \
     InsufficientStorage, FooterNotSupported, MultiphasePUTNotSupported, \
-    PutterConnectError, ChunkReadError
+    PutterConnectError, ChunkReadError, MimeInvalid
 from swift.common.header_key_dict import HeaderKeyDict
 from swift.common.http import (
     is_informational, is_success, is_client_error, is_server_error,
     is_redirection, HTTP_CONTINUE, HTTP_INTERNAL_SERVER_ERROR,
     HTTP_SERVICE_UNAVAILABLE, HTTP_INSUFFICIENT_STORAGE,
     HTTP_PRECONDITION_FAILED, HTTP_CONFLICT, HTTP_UNPROCESSABLE_ENTITY,
-    HTTP_REQUESTED_RANGE_NOT_SATISFIABLE)
+    HTTP_REQUESTED_RANGE_NOT_SATISFIABLE, HTTP_PARTIAL_CONTENT)
 from swift.common.storage_policy import (POLICIES, REPL_POLICY, EC_POLICY,
                                          ECDriverError, PolicyError)
 from swift.proxy.controllers.base import Controller, delay_denial, \
-    cors_validation, ResumingGetter, update_headers
+    cors_validation, ResumingGetter, update_headers, \
+    get_shard_ranges_from_cache, set_shard_ranges_cache
 from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPNotFound, \
     HTTPPreconditionFailed, HTTPRequestEntityTooLarge, HTTPRequestTimeout, \
     HTTPServerError, HTTPServiceUnavailable, HTTPClientDisconnect, \
     HTTPUnprocessableEntity, Response, HTTPException, \
-    HTTPRequestedRangeNotSatisfiable, Range, HTTPInternalServerError
+    HTTPRequestedRangeNotSatisfiable, Range, HTTPInternalServerError, \
+    Request
 from swift.common.request_helpers import update_etag_is_at_header, \
     resolve_etag_is_at_header
 
 
+# chunks of each part read ahead when a multi-range GET is split
+MULTI_RANGE_READ_AHEAD = 16
+
+# requests whose responses depend on more than the object
+COALESCE_SKIP_HEADERS = ('If-Match', 'If-None-Match', 'If-Modified-Since',
+                         'If-Unmodified-Since', 'X-Newest')
+
+
 def check_content_type(req):
     if not req.environ.get('swift.content_type_overridden') and \
             ';' in req.headers.get('content-type', ''):
@@ -245,13 +260,71 @@ class BaseObjectController(Controller):
             self.account_name, self.container_name, self.object_name)
         node_iter = self.app.iter_nodes(obj_ring, partition, policy=policy)
 
-        resp = self._get_or_head_response(req, node_iter, partition, policy)
+        resp = self._coalesced_get_or_head_response(
+            req, node_iter, partition, policy)
 
         if ';' in resp.headers.get('content-type', ''):
             resp.content_type = clean_content_type(
                 resp.headers['content-type'])
         return resp
 
+    def _coalesce_key(self, req):
+        """
+        Get the key under which a GET or HEAD may share its response with
+        identical requests in flight at the same time.
+
+        :returns: a key, or None if the response shouldn't be shared
+        """
+        if any(header in req.headers for header in COALESCE_SKIP_HEADERS):
+            return None
+        backend_headers = sorted(
+            (key.lower(), value) for key, value in req.headers.items()
+            if key.lower() == 'range' or
+            key.lower().startswith('x-backend-'))
+        return (req.method, req.path, req.environ.get('QUERY_STRING', ''),
+                tuple(backend_headers))
+
+    def _coalesced_get_or_head_response(self, req, node_iter, partition,
+                                        policy):
+        """
+        Get a GET or HEAD response, sharing it with identical requests if
+        ``coalesce_object_requests`` is set.
+
+        Only HEAD responses and GET responses with bodies of no more than
+        ``coalesce_max_body_size`` bytes are shared; requests waiting on
+        any other response make their own backend requests.
+        """
+        single_flight = self.app.object_single_flight
+        key = None if single_flight is None else self._coalesce_key(req)
+        if key is None:
+            return self._get_or_head_response(
+                req, node_iter, partition, policy)
+
+        own_resp = []
+
+        def get_or_head():
+            resp = self._get_or_head_response(
+                req, node_iter, partition, policy)
+            own_resp.append(resp)
+            if req.method == 'HEAD':
+                return resp.status, list(resp.headers.items()), None
+            if resp.content_length is None or \
+                    resp.content_length > self.app.coalesce_max_body_size:
+                return None
+            body = resp.body
+            if len(body) != resp.content_length:
+                # the read was cut short; don't pass that on
+                return None
+            return resp.status, list(resp.headers.items()), body
+
+        shared = single_flight.do(key, get_or_head)
+        if own_resp:
+            return own_resp[0]
+        self.app.logger.increment('object.coalesced')
+        status, headers, body = shared
+        return Response(request=req, status=status, headers=headers,
+                        body=body)
+
     @public
     @cors_validation
     @delay_denial
@@ -266,17 +339,59 @@ class BaseObjectController(Controller):
         """Handler for HTTP HEAD requests."""
         return self.GETorHEAD(req)
 
-    def _get_update_target(self, req, container_info):
-        # find the sharded container to which we'll send the update
-        db_state = container_info.get('sharding_state', 'unsharded')
-        if db_state in ('sharded', 'sharding'):
+    def _get_updating_shard_range(self, req):
+        """
+        Find the shard range to which an update for this object should go.
+
+        If ``recheck_updating_shard_ranges`` is set, all of the container's
+        updating shard ranges are fetched and cached, so that updates for
+        other objects in the container can be targeted without asking the
+        container servers again.
+        """
+        if self.app.recheck_updating_shard_ranges <= 0:
             shard_ranges = self._get_shard_ranges(
                 req, self.account_name, self.container_name,
                 includes=self.object_name, states='updating')
+            return shard_ranges[0] if shard_ranges else None
+
+        shard_ranges = get_shard_ranges_from_cache(
+            self.app, req.environ, self.account_name, self.container_name,
+            'updating')
+        if shard_ranges is None:
+            shard_ranges = self._get_shard_ranges(
+                req, self.account_name, self.container_name,
+                states='updating')
             if shard_ranges:
+                set_shard_ranges_cache(
+                    self.app, req.environ, self.account_name,
+                    self.container_name, 'updating', shard_ranges,
+                    self.app.recheck_updating_shard_ranges)
+        if not shard_ranges:
+            return None
+        return find_shard_range(self.object_name, shard_ranges)
+
+    def _clear_updating_shard_ranges(self, req, redirect):
+        """
+        Forget the cached updating shard ranges if an object server had a
+        container update redirected, as they must be out of date.
+
+        :param redirect: the value of an object server response's
+                         X-Backend-Redirect header
+        """
+        if redirect:
+            set_shard_ranges_cache(
+                self.app, req.environ, self.account_name, self.container_name,
+                'updating', None)
+
+    def _get_update_target(self, req, container_info):
+        # find the sharded container to which we'll send the update
+        db_state = container_info.get('sharding_state', 'unsharded')
+        if db_state in ('sharded', 'sharding'):
+            shard_range = self._get_updating_shard_range(req)
+            if shard_range:
                 partition, nodes = self.app.container_ring.get_nodes(
-                    shard_ranges[0].account, shard_ranges[0].container)
-                return partition, nodes, shard_ranges[0].name
+                    shard_range.account, shard_range.container)
+                return partition, nodes, shard_range.name
 
         return container_info['partition'], container_info['nodes'], None
 
@@ -320,7 +435,10 @@ class BaseObjectController(Controller):
             req, len(nodes), container_partition, container_nodes,
             delete_at_container, delete_at_part, delete_at_nodes,
             container_path=container_path)
-        return self._post_object(req, obj_ring, partition, headers)
+        resp = self._post_object(req, obj_ring, partition, headers)
+        self._clear_updating_shard_ranges(
+            req, resp.headers.get('X-Backend-Redirect'))
+        return resp
 
     def _backend_requests(self, req, n_outgoing,
                           container_partition, containers,
@@ -477,6 +595,9 @@ class BaseObjectController(Controller):
                      'body': body[:1024], 'path': req.path})
             elif is_success(response.status):
                 etags.add(response.getheader('etag').strip('"'))
+                if final_phase:
+                    self._clear_updating_shard_ranges(
+                        req, response.getheader('X-Backend-Redirect'))
 
         for (putter, response) in pile:
             if response:
@@ -874,13 +995,197 @@ class BaseObjectController(Controller):
         headers = self._backend_requests(
             req, node_count, container_partition, container_nodes,
             container_path=container_path)
-        return self._delete_object(req, obj_ring, partition, headers)
+        resp = self._delete_object(req, obj_ring, partition, headers)
+        self._clear_updating_shard_ranges(
+            req, resp.headers.get('X-Backend-Redirect'))
+        return resp
 
 
 @ObjectControllerRouter.register(REPL_POLICY)
 class ReplicatedObjectController(BaseObjectController):
 
+    def _should_split_ranges(self, req):
+        if req.method != 'GET' or self.app.multi_range_get_concurrency < 2:
+            return False
+        if any(key.lower().startswith('if-') for key in req.headers):
+            # every replica would have to agree on the condition
+            return False
+        return bool(req.range) and len(req.range.ranges) >= max(
+            2, self.app.multi_range_get_min_ranges)
+
+    def _iter_range_parts(self, resp):
+        """
+        Iterate over the parts of a 206 response to a GET for one or more
+        byte ranges.
+
+        :returns: an iterator of (first-byte, last-byte, length,
+                  content-type, part-iter) 5-tuples
+        """
+        content_type, params = parse_content_type(
+            resp.headers['Content-Type'])
+        if content_type != 'multipart/byteranges':
+            first_byte, last_byte, length = parse_content_range(
+                resp.headers.get('Content-Range'))
+            yield (first_byte, last_byte, length,
+                   resp.headers['Content-Type'], resp.app_iter)
+            return
+        for first_byte, last_byte, length, headers, body in \
+                multipart_byteranges_to_document_iters(
+                    FileLikeIter(resp.app_iter), dict(params)['boundary']):
+            yield (first_byte, last_byte, length,
+                   HeaderKeyDict(headers).get('Content-Type'),
+                   iter(functools.partial(
+                       body.read, self.app.client_chunk_size), b''))
+
+    def _read_parts_ahead(self, parts, parts_queue):
+        """
+        Read the parts of a response into a queue, so that it can be read
+        from its object server while earlier parts are sent to the client.
+
+        Each part is put in ``parts_queue`` with a queue of its chunks,
+        ended by None; the end of the parts is marked by None too.
+        """
+        chunks = None
+        try:
+            for first_byte, last_byte, length, content_type, part_iter \
+                    in parts:
+                chunks = Queue(MULTI_RANGE_READ_AHEAD)
+                parts_queue.put((first_byte, last_byte, length, content_type,
+                                 chunks))
+                for chunk in part_iter:
+                    chunks.put(chunk)
+                chunks.put(None)
+                chunks = None
+        except GreenletExit:
+            # the client went away
+            return
+        except (Exception, Timeout):
+            self.app.logger.exception(
+                _('Trouble reading byte ranges of %s'), self.object_name)
+            if chunks is not None:
+                chunks.put(None)
+        parts_queue.put(None)
+
+    def _get_split_ranges_response(self, req, node_iter, partition, policy):
+        """
+        Answer a GET for many byte ranges by splitting the ranges into
+        groups, each requested from a different replica at the same time.
+
+        The responses are read concurrently and their parts reassembled, in
+        order, into one multipart/byteranges response.
+
+        :returns: a swob.Response, or None if the responses can't be put
+                  together into the response one object server would have
+                  given to the whole request
+        """
+        ranges = req.range.ranges
+        primaries = list(node_iter.primary_nodes)
+        num_groups = min(self.app.multi_range_get_concurrency,
+                         len(primaries), len(ranges))
+        if num_groups < 2:
+            return None
+        group_size = int(math.ceil(float(len(ranges)) / num_groups))
+        obj_ring = self.app.get_object_ring(policy.idx)
+        pile = GreenPile(num_groups)
+        group_ranges = []
+        for i, start in enumerate(range(0, len(ranges), group_size)):
+            group_range = Range(str(req.range))
+            group_range.ranges = ranges[start:start + group_size]
+            group_ranges.append(group_range)
+            sub_req = Request(dict(req.environ))
+            sub_req.headers['Range'] = str(group_range)
+            group_node_iter = self.app.iter_nodes(
+                obj_ring, partition, policy=policy)
+            # start each group's requests at a different primary
+            group_node_iter.primary_nodes = primaries[i:] + primaries[:i]
+            pile.spawn(self.GETorHEAD_base, sub_req, _('Object'),
+                       group_node_iter, partition, req.swift_entity_path)
+        resps = list(pile)
+
+        def close_resps():
+            for resp in resps:
+                close_if_possible(resp.app_iter)
+
+        parts_iters = []
+        try:
+            for resp in resps:
+                if resp.status_int != HTTP_PARTIAL_CONTENT:
+                    raise ValueError('not a 206')
+                parts_iters.append(self._iter_range_parts(resp))
+            firsts = [next(parts) for parts in parts_iters]
+        except (ValueError, KeyError, StopIteration, MimeInvalid):
+            close_resps()
+            return None
+
+        # every response must be for the same object, and between them have
+        # the parts that one object server would have sent
+        length = firsts[0][2]
+        expected = req.range.ranges_for_length(length)
+        group_expected = [group_range.ranges_for_length(length)
+                          for group_range in group_ranges]
+        if any(resp.etag != resps[0].etag or
+               resp.headers.get('X-Timestamp') !=
+               resps[0].headers.get('X-Timestamp')
+               for resp in resps) or \
+                any(first[2] != length for first in firsts) or \
+                not expected or len(expected) < 2 or \
+                not all(group_expected) or \
+                sum(group_expected, []) != expected or \
+                any((first[0], first[1] + 1) != group[0]
+                    for first, group in zip(firsts, group_expected)):
+            close_resps()
+            return None
+
+        parts_queues = []
+        readers = []
+        for first, parts in zip(firsts, parts_iters):
+            parts_queue = Queue()
+            parts_queues.append(parts_queue)
+            readers.append(spawn(self._read_parts_ahead,
+                                 itertools.chain([first], parts),
+                                 parts_queue))
+
+        def iter_parts():
+            for parts_queue in parts_queues:
+                for first_byte, last_byte, entity_length, _junk, chunks in \
+                        iter(parts_queue.get, None):
+                    yield {'start_byte': first_byte, 'end_byte': last_byte,
+                           'entity_length': entity_length,
+                           'content_type': content_type,
+                           'part_iter': iter(chunks.get, None)}
+
+        def app_iter():
+            try:
+                for chunk in document_iters_to_multipart_byteranges(
+                        iter_parts(), resp.boundary):
+                    yield chunk
+            finally:
+                for reader in readers:
+                    reader.kill()
+                close_resps()
+
+        resp = Response(request=req, status=HTTP_PARTIAL_CONTENT)
+        for key, value in resps[0].headers.items():
+            if key.lower() not in ('content-type', 'content-length',
+                                   'content-range'):
+                resp.headers[key] = value
+        content_type = firsts[0][3]
+        resp.content_type = 'multipart/byteranges;boundary=%s' % resp.boundary
+        resp.app_iter = app_iter()
+        resp.content_length = sum(
+            len('--%s\r\nContent-Type: %s\r\n'
+                'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                    resp.boundary, content_type, start, end - 1, length)) +
+            end - start + len('\r\n')
+            for start, end in expected) + len('--%s--' % resp.boundary)
+        return resp
+
     def _get_or_head_response(self, req, node_iter, partition, policy):
+        if self._should_split_ranges(req):
+            resp = self._get_split_ranges_response(
+                req, node_iter, partition, policy)
+            if resp is not None:
+                return resp
         concurrency = self.app.get_object_ring(policy.idx).replica_count \
             if self.app.concurrent_gets else 1
         resp = self.GETorHEAD_base(
@@ -1062,9 +1367,12 @@ class ECAppIter(object):
         headers in the GET response from the object server.
 
     :param logger: a logger
+
+    :param ec_codec: an :class:`~swift.common.ec_codec.ECCodecExecutor` to
+        decode segments with; if None, segments are decoded inline
     """
     def __init__(self, path, policy, internal_parts_iters, range_specs,
-                 fa_length, obj_length, logger):
+                 fa_length, obj_length, logger, ec_codec=None):
         self.path = path
         self.policy = policy
         self.internal_parts_iters = internal_parts_iters
@@ -1073,6 +1381,7 @@ class ECAppIter(object):
         self.obj_length = obj_length if obj_length is not None else 0
         self.boundary = ''
         self.logger = logger
+        self.ec_codec = ec_codec or ECCodecExecutor()
 
         self.mime_boundary = None
         self.learned_content_type = None
@@ -1413,7 +1722,9 @@ class ECAppIter(object):
     def _decode_segments_from_fragments(self, fragment_iters):
         # Decodes the fragments from the object servers and yields one
         # segment at a time.
-        queues = [Queue(1) for _junk in range(len(fragment_iters))]
+        batch_segments = self.ec_codec.batch_segments(self.policy)
+        queues = [Queue(batch_segments)
+                  for _junk in range(len(fragment_iters))]
 
         def put_fragments_in_queue(frag_iter, queue):
             try:
@@ -1432,7 +1743,7 @@ class ECAppIter(object):
                 self.logger.exception(_("Exception fetching fragments for"
                                         " %r"), self.path)
             finally:
-                queue.resize(2)  # ensure there's room
+                queue.resize(batch_segments + 1)  # ensure there's room
                 queue.put(None)
                 frag_iter.close()
 
@@ -1440,29 +1751,42 @@ class ECAppIter(object):
             for frag_iter, queue in zip(fragment_iters, queues):
                 pool.spawn(put_fragments_in_queue, frag_iter, queue)
 
-            while True:
-                fragments = []
-                for queue in queues:
-                    fragment = queue.get()
-                    queue.task_done()
-                    fragments.append(fragment)
-
-                # If any object server connection yields out a None; we're
-                # done.  Either they are all None, and we've finished
-                # successfully; or some un-recoverable failure has left us
-                # with an un-reconstructible list of fragments - so we'll
-                # break out of the iter so WSGI can tear down the broken
-                # connection.
-                if not all(fragments):
+            done = False
+            while not done:
+                # decode the segments whose fragments have all arrived
+                # together, but don't wait for more than the first
+                fragment_sets = []
+                while len(fragment_sets) < batch_segments and not (
+                        fragment_sets and
+                        not all(queue.qsize() for queue in queues)):
+                    fragments = []
+                    for queue in queues:
+                        fragment = queue.get()
+                        queue.task_done()
+                        fragments.append(fragment)
+
+                    # If any object server connection yields out a None;
+                    # we're done.  Either they are all None, and we've
+                    # finished successfully; or some un-recoverable failure
+                    # has left us with an un-reconstructible list of
+                    # fragments - so we'll break out of the iter so WSGI can
+                    # tear down the broken connection.
+                    if not all(fragments):
+                        done = True
+                        break
+                    fragment_sets.append(fragments)
+                if not fragment_sets:
                     break
                 try:
-                    segment = self.policy.pyeclib_driver.decode(fragments)
+                    segments = self.ec_codec.decode(
+                        self.policy, fragment_sets)
                 except ECDriverError:
                     self.logger.exception(_("Error decoding fragments for"
                                             " %r"), self.path)
                     raise
 
-                yield segment
+                for segment in segments:
+                    yield segment
 
     def app_iter_range(self, start, end):
         return self
@@ -1915,41 +2239,38 @@ class MIMEPutter(Putter):
                    mime_boundary, multiphase=need_multiphase)
 
 
-def chunk_transformer(policy):
+def chunk_transformer(policy, ec_codec=None):
     """
     A generator to transform a source chunk to erasure coded chunks for each
     `send` call. The number of erasure coded chunks is as
     policy.ec_n_unique_fragments.
+
+    :param policy: the EC storage policy
+    :param ec_codec: an :class:`~swift.common.ec_codec.ECCodecExecutor` to
+                     encode segments with; if None, segments are encoded
+                     inline
     """
     segment_size = policy.ec_segment_size
+    if ec_codec is None:
+        ec_codec = ECCodecExecutor()
 
-    buf = collections.deque()
-    total_buf_len = 0
+    buf = bytearray()
 
     chunk = yield
     while chunk:
-        buf.append(chunk)
-        total_buf_len += len(chunk)
-        if total_buf_len >= segment_size:
-            chunks_to_encode = []
-            # extract as many chunks as we can from the input buffer
-            while total_buf_len >= segment_size:
-                to_take = segment_size
-                pieces = []
-                while to_take > 0:
-                    piece = buf.popleft()
-                    if len(piece) > to_take:
-                        buf.appendleft(piece[to_take:])
-                        piece = piece[:to_take]
-                    pieces.append(piece)
-                    to_take -= len(piece)
-                    total_buf_len -= len(piece)
-                chunks_to_encode.append(''.join(pieces))
-
-            frags_by_byte_order = []
-            for chunk_to_encode in chunks_to_encode:
-                frags_by_byte_order.append(
-                    policy.pyeclib_driver.encode(chunk_to_encode))
+        buf += chunk
+        if len(buf) >= segment_size:
+            # extract as many chunks as we can from the input buffer, copying
+            # each segment out of it just once
+            view = memoryview(buf)
+            consumed = len(buf) - len(buf) % segment_size
+            chunks_to_encode = [view[i:i + segment_size].tobytes()
+                                for i in range(0, consumed, segment_size)]
+            # the buffer can't be resized while there's a view of it
+            del view
+            del buf[:consumed]
+
+            frags_by_byte_order = ec_codec.encode(policy, chunks_to_encode)
             # Sequential calls to encode() have given us a list that
             # looks like this:
             #
@@ -1971,9 +2292,9 @@ def chunk_transformer(policy):
 
     # Now we've gotten an empty chunk, which indicates end-of-input.
     # Take any leftover bytes and encode them.
-    last_bytes = ''.join(buf)
+    last_bytes = bytes(buf)
     if last_bytes:
-        last_frags = policy.pyeclib_driver.encode(last_bytes)
+        last_frags = ec_codec.encode(policy, [last_bytes])[0]
         yield last_frags
     else:
         yield [''] * policy.ec_n_unique_fragments
@@ -2358,7 +2679,24 @@ class ECObjectController(BaseObjectController):
         # own specific implementation of concurrent gets to ec_ndata nodes.
         # So we don't need to  worry about plumbing and sending a
         # concurrency value to ResumingGetter.
-        with ContextPool(policy.ec_ndata) as pool:
+        #
+        # max_extra_requests is an arbitrary hard limit for spawning extra
+        # getters in case some unforeseen scenario, or a misbehaving object
+        # server, causes us to otherwise make endless requests e.g. if an
+        # object server were to ignore frag_prefs and always respond with
+        # a frag that is already in a bucket. Now we're assuming it should
+        # be limit at most 2 * replicas.
+        max_extra_requests = (
+            (policy.object_ring.replica_count * 2) - policy.ec_ndata)
+        # With an adaptive concurrency_timeout, extra getters are also
+        # spawned when the outstanding ones are slow to respond, so there
+        # must be room in the pool for them to start straight away.
+        hedging = (self.app.concurrent_gets and
+                   self.app.adaptive_concurrency_timeout)
+        pool_size = policy.ec_ndata
+        if hedging:
+            pool_size += max(max_extra_requests, 0)
+        with ContextPool(pool_size) as pool:
             pile = GreenAsyncPile(pool)
             buckets = ECGetResponseCollection(policy)
             node_iter.set_node_provider(buckets.provide_alternate_node)
@@ -2374,16 +2712,28 @@ class ECObjectController(BaseObjectController):
             bad_bucket.set_durable()
             best_bucket = None
             extra_requests = 0
-            # max_extra_requests is an arbitrary hard limit for spawning extra
-            # getters in case some unforeseen scenario, or a misbehaving object
-            # server, causes us to otherwise make endless requests e.g. if an
-            # object server were to ignore frag_prefs and always respond with
-            # a frag that is already in a bucket. Now we're assuming it should
-            # be limit at most 2 * replicas.
-            max_extra_requests = (
-                (policy.object_ring.replica_count * 2) - policy.ec_ndata)
-
-            for get, parts_iter in pile:
+            can_hedge = hedging
+
+            while pile.pending:
+                if can_hedge:
+                    result = pile.waitfirst(
+                        self.app.get_concurrency_timeout())
+                    if not result:
+                        # nothing turned up within the timeout; hedge the
+                        # slowest outstanding getter with an extra one
+                        if (extra_requests < max_extra_requests and
+                                (node_iter.nodes_left > 0 or
+                                 buckets.has_alternate_node())):
+                            extra_requests += 1
+                            pile.spawn(self._fragment_GET_request, req,
+                                       safe_iter, partition, policy,
+                                       buckets.get_extra_headers)
+                        else:
+                            can_hedge = False
+                        continue
+                    get, parts_iter = result
+                else:
+                    get, parts_iter = next(pile)
                 if get.last_status is None:
                     # We may have spawned getters that find the node iterator
                     # has been exhausted. Ignore them.
@@ -2409,7 +2759,7 @@ class ECObjectController(BaseObjectController):
                 if best_bucket:
                     shortfall = min(best_bucket.shortfall, shortfall)
                 if (extra_requests < max_extra_requests and
-                        shortfall > pile._pending and
+                        shortfall > pile.pending and
                         (node_iter.nodes_left > 0 or
                          buckets.has_alternate_node())):
                     # we need more matching responses to reach ec_ndata
@@ -2419,6 +2769,10 @@ class ECObjectController(BaseObjectController):
                     pile.spawn(self._fragment_GET_request, req,
                                safe_iter, partition, policy,
                                buckets.get_extra_headers)
+                elif hedging and best_bucket and best_bucket.shortfall <= 0:
+                    # enough fragments are in hand; don't wait on the getters
+                    # that lost the race, the pool will kill them on exit
+                    break
 
         req.range = orig_range
         if best_bucket and best_bucket.shortfall <= 0:
@@ -2437,7 +2791,7 @@ class ECObjectController(BaseObjectController):
                 [parts_iter for
                  _getter, parts_iter in best_bucket.get_responses()],
                 range_specs, fa_length, obj_length,
-                self.app.logger)
+                self.app.logger, self.app.ec_codec)
             resp = Response(
                 request=req,
                 conditional_response=True,
@@ -2571,7 +2925,7 @@ class ECObjectController(BaseObjectController):
         This method was added in the PUT method extraction change
         """
         bytes_transferred = 0
-        chunk_transform = chunk_transformer(policy)
+        chunk_transform = chunk_transformer(policy, self.app.ec_codec)
         chunk_transform.send(None)
         frag_hashers = collections.defaultdict(md5)
 
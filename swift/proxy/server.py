@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import math
 import mimetypes
 import os
 import socket
@@ -30,6 +31,8 @@ from eventlet import Timeout
 from swift import __canonical_version__ as swift_version
 from swift.common import constraints
 from swift.common.storage_policy import POLICIES
+from swift.common.ec_codec import ECCodecExecutor
+from swift.common.mmap_table import MmapTable
 from swift.common.ring import Ring
 from swift.common.utils import cache_from_env, get_logger, \
     get_remote_client, split_path, config_true_value, generate_trans_id, \
@@ -39,7 +42,9 @@ from swift.common.constraints import check_utf8, valid_api_version
 from swift.proxy.controllers import AccountController, ContainerController, \
     ObjectControllerRouter, InfoController
 from swift.proxy.controllers.base import get_container_info, NodeIter, \
-    DEFAULT_RECHECK_CONTAINER_EXISTENCE, DEFAULT_RECHECK_ACCOUNT_EXISTENCE
+    DEFAULT_RECHECK_CONTAINER_EXISTENCE, DEFAULT_RECHECK_ACCOUNT_EXISTENCE, \
+    DEFAULT_RECHECK_UPDATING_SHARD_RANGES, \
+    DEFAULT_RECHECK_LISTING_SHARD_RANGES, ProcessInfoCache, SingleFlight
 from swift.common.swob import HTTPBadRequest, HTTPForbidden, \
     HTTPMethodNotAllowed, HTTPNotFound, HTTPPreconditionFailed, \
     HTTPServerError, HTTPException, Request, HTTPServiceUnavailable
@@ -89,6 +94,12 @@ def _label_for_policy(policy):
 
 VALID_SORTING_METHODS = ('shuffle', 'timing', 'affinity')
 
+# how many response timings must be known for a node before they are used
+# for the adaptive concurrency_timeout
+MIN_NODE_RESPONSE_TIMING_SAMPLES = 10
+# error count, time of last error
+ERROR_LIMIT_RECORD_FORMAT = '<Id'
+
 
 class ProxyOverrideOptions(object):
     """
@@ -164,6 +175,160 @@ class ProxyOverrideOptions(object):
             'write_affinity_handoff_delete_count'))
 
 
+class NodeLatencyTracker(object):
+    """
+    Tracks the latency of backend nodes: for both connecting and getting the
+    first byte of a response, an exponentially weighted moving average and a
+    histogram.
+
+    The stats are kept in a :class:`~swift.common.mmap_table.MmapTable`; if
+    it is backed by a file, all the proxy workers on a host share (and keep
+    across restarts) what any of them learns about the nodes. The stats of
+    all nodes together, updated on every response, are kept by each worker
+    for itself so that workers don't contend for them.
+
+    Histogram buckets are a quarter of an octave wide, starting at 1ms.
+    Once a histogram holds HISTOGRAM_MAX_SAMPLES samples all its counts are
+    halved, so it reflects recent timings. Stats that haven't been updated
+    for ``expiry`` seconds are forgotten.
+
+    :param path: file to keep the stats in, or None to keep them in memory
+                 private to the process
+    :param expiry: seconds after which stats for a node are stale
+    :param num_slots: the number of nodes that can be tracked
+    :param logger: a logger for reporting a full table
+    """
+    EWMA_WEIGHT = 0.3
+    HISTOGRAM_BUCKETS = 48
+    HISTOGRAM_MAX_SAMPLES = 1000
+    # the stats of all nodes together are kept under this key
+    ALL_NODES = '*'
+
+    def __init__(self, path=None, expiry=300, num_slots=16384, logger=None):
+        self.expiry = expiry
+        # connect ewma, first byte ewma, last updated, connect histogram,
+        # first byte histogram
+        record_format = '<ddd%dI%dI' % (
+            self.HISTOGRAM_BUCKETS, self.HISTOGRAM_BUCKETS)
+        self.table = MmapTable(path, record_format, num_slots=num_slots,
+                               expired=self._expired, logger=logger)
+        self.all_nodes_table = MmapTable(None, record_format, num_slots=1)
+
+    def _expired(self, values):
+        return values[2] < time() - self.expiry
+
+    def _table(self, node_key):
+        if node_key == self.ALL_NODES:
+            return self.all_nodes_table
+        return self.table
+
+    def _bucket(self, timing):
+        ms = timing * 1000
+        if ms < 1:
+            return 0
+        return min(int(math.log(ms, 2) * 4), self.HISTOGRAM_BUCKETS - 1)
+
+    def _record(self, node_key, timing, first_byte):
+        now = time()
+        bucket = self._bucket(timing)
+        nbuckets = self.HISTOGRAM_BUCKETS
+
+        def update(values):
+            connect_ewma, first_byte_ewma, last_updated = values[:3]
+            hists = [list(values[3:3 + nbuckets]), list(values[3 + nbuckets:])]
+            if last_updated < now - self.expiry:
+                connect_ewma = first_byte_ewma = 0.0
+                hists = [[0] * nbuckets, [0] * nbuckets]
+            hist = hists[1 if first_byte else 0]
+            if sum(hist):
+                ewma = connect_ewma if not first_byte else first_byte_ewma
+                ewma += self.EWMA_WEIGHT * (timing - ewma)
+            else:
+                ewma = timing
+            if first_byte:
+                first_byte_ewma = ewma
+            else:
+                connect_ewma = ewma
+            hist[bucket] += 1
+            if sum(hist) >= self.HISTOGRAM_MAX_SAMPLES:
+                hist[:] = [count // 2 for count in hist]
+            return [connect_ewma, first_byte_ewma, now] + hists[0] + hists[1]
+
+        self._table(node_key).update(node_key, update)
+        if first_byte and node_key != self.ALL_NODES:
+            self._record(self.ALL_NODES, timing, first_byte)
+
+    def record_connect(self, node_key, timing):
+        """
+        Record how long it took to connect to a node.
+
+        :param node_key: a string identifying the node
+        :param timing: the time taken in seconds
+        """
+        self._record(node_key, timing, False)
+
+    def record_first_byte(self, node_key, timing):
+        """
+        Record how long it took from connecting to a node to getting its
+        response headers.
+
+        :param node_key: a string identifying the node
+        :param timing: the time taken in seconds
+        """
+        self._record(node_key, timing, True)
+
+    def _get_fresh(self, node_key):
+        values = self._table(node_key).get(node_key)
+        if values is None or self._expired(values):
+            return None
+        return values
+
+    def get_latency(self, node_key):
+        """
+        Get the typical latency of a node, the moving average of its first
+        byte timings or, failing that, of its connect timings.
+
+        :param node_key: a string identifying the node
+        :returns: the latency in seconds, or None if it is not known
+        """
+        values = self._get_fresh(node_key)
+        if values is None:
+            return None
+        nbuckets = self.HISTOGRAM_BUCKETS
+        if sum(values[3 + nbuckets:]):
+            return values[1]
+        if sum(values[3:3 + nbuckets]):
+            return values[0]
+        return None
+
+    def get_first_byte_percentile(self, node_key, percentile, min_samples=1):
+        """
+        Estimate a percentile of the first byte timings of a node.
+
+        :param node_key: a string identifying the node
+        :param percentile: the percentile to estimate, between 0 and 100
+        :param min_samples: the number of timings needed for an estimate
+        :returns: the upper bound of the histogram bucket the percentile
+                  falls in, in seconds, or None if too little is known
+        """
+        values = self._get_fresh(node_key)
+        if values is None:
+            return None
+        hist = values[3 + self.HISTOGRAM_BUCKETS:]
+        total = sum(hist)
+        if not total or total < min_samples:
+            return None
+        wanted = total * percentile / 100.0
+        count = 0
+        for bucket, bucket_count in enumerate(hist):
+            count += bucket_count
+            if count >= wanted:
+                break
+        if bucket == self.HISTOGRAM_BUCKETS - 1:
+            return float('inf')
+        return 2 ** ((bucket + 1) / 4.0) / 1000
+
+
 class Application(object):
     """WSGI application for the proxy server."""
 
@@ -179,8 +344,6 @@ class Application(object):
         self.sorts_by_timing = any(pc.sorting_method == 'timing'
                                    for pc in self._override_options.values())
 
-        self._error_limiting = {}
-
         swift_dir = conf.get('swift_dir', '/etc/swift')
         self.swift_dir = swift_dir
         self.node_timeout = float(conf.get('node_timeout', 10))
@@ -197,12 +360,38 @@ class Application(object):
             int(conf.get('error_suppression_interval', 60))
         self.error_suppression_limit = \
             int(conf.get('error_suppression_limit', 10))
+        self._error_limiting = MmapTable(
+            conf.get('error_limit_file') or None, ERROR_LIMIT_RECORD_FORMAT,
+            int(conf.get('error_limit_slots', 16384)),
+            expired=self._error_stats_expired, logger=self.logger)
         self.recheck_container_existence = \
             int(conf.get('recheck_container_existence',
                          DEFAULT_RECHECK_CONTAINER_EXISTENCE))
         self.recheck_account_existence = \
             int(conf.get('recheck_account_existence',
                          DEFAULT_RECHECK_ACCOUNT_EXISTENCE))
+        self.recheck_updating_shard_ranges = \
+            int(conf.get('recheck_updating_shard_ranges',
+                         DEFAULT_RECHECK_UPDATING_SHARD_RANGES))
+        self.recheck_listing_shard_ranges = \
+            int(conf.get('recheck_listing_shard_ranges',
+                         DEFAULT_RECHECK_LISTING_SHARD_RANGES))
+        info_cache_jitter = float(conf.get('info_cache_jitter', 0.1))
+        if not 0 <= info_cache_jitter <= 1:
+            raise ValueError('info_cache_jitter must be between 0 and 1')
+        self.info_caches = {
+            server_type: ProcessInfoCache(
+                server_type,
+                int(conf.get('%s_info_cache_size' % server_type, 0)),
+                float(conf.get('%s_info_cache_ttl' % server_type, 5)),
+                info_cache_jitter, self.logger)
+            for server_type in ('account', 'container', 'shard')}
+        self.info_single_flight = SingleFlight() if config_true_value(
+            conf.get('coalesce_info_requests', 'false')) else None
+        self.object_single_flight = SingleFlight() if config_true_value(
+            conf.get('coalesce_object_requests', 'false')) else None
+        self.coalesce_max_body_size = \
+            int(conf.get('coalesce_max_body_size', 65536))
         self.allow_account_management = \
             config_true_value(conf.get('allow_account_management', 'no'))
         self.container_ring = container_ring or Ring(swift_dir,
@@ -244,12 +433,32 @@ class Application(object):
             if a.strip()]
         self.strict_cors_mode = config_true_value(
             conf.get('strict_cors_mode', 't'))
-        self.node_timings = {}
         self.timing_expiry = int(conf.get('timing_expiry', 300))
         self.concurrent_gets = \
             config_true_value(conf.get('concurrent_gets'))
         self.concurrency_timeout = float(conf.get('concurrency_timeout',
                                                   self.conn_timeout))
+        self.adaptive_concurrency_timeout = config_true_value(
+            conf.get('adaptive_concurrency_timeout'))
+        self.concurrency_timeout_percentile = float(
+            conf.get('concurrency_timeout_percentile', 95))
+        if not 0 < self.concurrency_timeout_percentile <= 100:
+            raise ValueError(
+                'concurrency_timeout_percentile must be > 0 and <= 100, '
+                'not %r' % self.concurrency_timeout_percentile)
+        self.node_timing = NodeLatencyTracker(
+            conf.get('node_timing_file') or None, self.timing_expiry,
+            int(conf.get('node_timing_slots', 16384)), logger=self.logger)
+        self.multi_range_get_concurrency = int(
+            conf.get('multi_range_get_concurrency', 1))
+        self.multi_range_get_min_ranges = int(
+            conf.get('multi_range_get_min_ranges', 4))
+        self.shard_listing_concurrency = int(
+            conf.get('shard_listing_concurrency', 1))
+        if self.shard_listing_concurrency < 1:
+            raise ValueError('shard_listing_concurrency must be at least 1')
+        self.ec_codec = ECCodecExecutor(
+            int(conf.get('ec_codec_processes', 0)), logger=self.logger)
         value = conf.get('request_node_count', '2 * replicas').lower().split()
         if len(value) == 1:
             rnc_value = int(value[0])
@@ -560,26 +769,76 @@ class Application(object):
         shuffle(nodes)
         policy_options = self.get_policy_options(policy)
         if policy_options.sorting_method == 'timing':
-            now = time()
-
             def key_func(node):
-                timing, expires = self.node_timings.get(node['ip'], (-1.0, 0))
-                return timing if expires > now else -1.0
+                timing = self.node_timing.get_latency(
+                    self._error_limit_node_key(node))
+                if timing is None:
+                    return -1.0
+                return round(timing, 3)  # sort timings to the millisecond
             nodes.sort(key=key_func)
         elif policy_options.sorting_method == 'affinity':
             nodes.sort(key=policy_options.read_affinity_sort_key)
         return nodes
 
     def set_node_timing(self, node, timing):
-        if not self.sorts_by_timing:
+        """
+        Record how long it took to connect to a node.
+
+        :param node: dictionary of the node connected to
+        :param timing: seconds taken to connect
+        """
+        if not self.sorts_by_timing and not self.adaptive_concurrency_timeout:
             return
-        now = time()
-        timing = round(timing, 3)  # sort timings to the millisecond
-        self.node_timings[node['ip']] = (timing, now + self.timing_expiry)
+        self.node_timing.record_connect(
+            self._error_limit_node_key(node), timing)
+
+    def set_node_response_timing(self, node, timing):
+        """
+        Record how long a node took to respond with headers, for use in
+        sorting nodes and choosing an adaptive concurrency_timeout.
+
+        :param node: dictionary of the node that responded
+        :param timing: seconds taken from connecting to getting the response
+        """
+        if not self.sorts_by_timing and not self.adaptive_concurrency_timeout:
+            return
+        self.node_timing.record_first_byte(
+            self._error_limit_node_key(node), timing)
+
+    def get_concurrency_timeout(self, node=None):
+        """
+        Get how long to wait for a response before firing off the next
+        concurrent request.
+
+        If adaptive_concurrency_timeout is enabled and enough recent timings
+        are known, this is the concurrency_timeout_percentile of the
+        response timings of the given node (or of all nodes if no node is
+        given), capped at concurrency_timeout. Otherwise it is simply
+        concurrency_timeout.
+
+        :param node: dictionary of the node that was just sent a request
+        :returns: a timeout in seconds
+        """
+        if not self.adaptive_concurrency_timeout:
+            return self.concurrency_timeout
+        if node is None:
+            node_key = NodeLatencyTracker.ALL_NODES
+        else:
+            node_key = self._error_limit_node_key(node)
+        timeout = self.node_timing.get_first_byte_percentile(
+            node_key, self.concurrency_timeout_percentile,
+            MIN_NODE_RESPONSE_TIMING_SAMPLES)
+        if timeout is None:
+            return self.concurrency_timeout
+        return min(timeout, self.concurrency_timeout)
 
     def _error_limit_node_key(self, node):
         return "{ip}:{port}/{device}".format(**node)
 
+    def _error_stats_expired(self, error_stats):
+        # a node with no error for this long would have its count reset
+        return error_stats[1] < time() - self.error_suppression_interval
+
     def error_limited(self, node):
         """
         Check if the node is currently error limited.
@@ -589,15 +848,18 @@ class Application(object):
         """
         now = time()
         node_key = self._error_limit_node_key(node)
-        error_stats = self._error_limiting.get(node_key)
+        errors, last_error = self._error_limiting.get(node_key, (0, 0.0))
 
-        if error_stats is None or 'errors' not in error_stats:
+        if not errors:
             return False
-        if 'last_error' in error_stats and error_stats['last_error'] < \
-                now - self.error_suppression_interval:
-            self._error_limiting.pop(node_key, None)
+        if last_error < now - self.error_suppression_interval:
+            def reset(error_stats):
+                # another worker may have seen an error since we looked
+                if error_stats[1] < now - self.error_suppression_interval:
+                    return 0, 0.0
+            self._error_limiting.update(node_key, reset)
             return False
-        limited = error_stats['errors'] > self.error_suppression_limit
+        limited = errors > self.error_suppression_limit
         if limited:
             self.logger.debug(
                 _('Node error limited %(ip)s:%(port)s (%(device)s)'), node)
@@ -614,18 +876,16 @@ class Application(object):
         :param msg: error message
         """
         node_key = self._error_limit_node_key(node)
-        error_stats = self._error_limiting.setdefault(node_key, {})
-        error_stats['errors'] = self.error_suppression_limit + 1
-        error_stats['last_error'] = time()
+        self._error_limiting.set(
+            node_key, (self.error_suppression_limit + 1, time()))
         self.logger.error(_('%(msg)s %(ip)s:%(port)s/%(device)s'),
                           {'msg': msg, 'ip': node['ip'],
                           'port': node['port'], 'device': node['device']})
 
     def _incr_node_errors(self, node):
         node_key = self._error_limit_node_key(node)
-        error_stats = self._error_limiting.setdefault(node_key, {})
-        error_stats['errors'] = error_stats.get('errors', 0) + 1
-        error_stats['last_error'] = time()
+        self._error_limiting.update(
+            node_key, lambda error_stats: (error_stats[0] + 1, time()))
 
     def error_occurred(self, node, msg):
         """
@@ -60,6 +60,33 @@ class TestAccountController(unittest.TestCase):
             if err.errno != errno.ENOENT:
                 raise
 
+    def test_connection_cache(self):
+        self.assertIsNone(self.controller.connection_cache)
+        self.assertIsNone(self.controller._get_account_broker(
+            'sda1', 'p', 'a').connection_cache)
+
+        controller = AccountController(
+            {'devices': self.testdir, 'mount_check': 'false',
+             'db_connection_cache_size': '2'})
+        cache = controller.connection_cache
+        self.assertEqual(2, cache.size)
+        self.assertIs(cache, controller._get_account_broker(
+            'sda1', 'p', 'a').connection_cache)
+        req = Request.blank('/sda1/p/a', method='PUT',
+                            headers={'X-Timestamp': normalize_timestamp(1)})
+        self.assertEqual(201, req.get_response(controller).status_int)
+        req = Request.blank('/sda1/p/a', method='HEAD')
+        self.assertEqual(204, req.get_response(controller).status_int)
+        self.assertEqual(1, len(cache))
+        # later requests reuse the cached connection
+        with mock.patch('swift.common.db.get_db_connection') as mock_connect:
+            for _ in range(3):
+                req = Request.blank('/sda1/p/a', method='HEAD')
+                self.assertEqual(
+                    204, req.get_response(controller).status_int)
+        self.assertFalse(mock_connect.called)
+        self.assertEqual(1, len(cache))
+
     def test_OPTIONS(self):
         server_handler = AccountController(
             {'devices': self.testdir, 'mount_check': 'false'})
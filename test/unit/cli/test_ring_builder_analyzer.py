@@ -17,6 +17,7 @@
 import os
 import json
 import mock
+import re
 from six import StringIO
 import unittest
 from test.unit import with_tempdir
@@ -48,6 +49,14 @@ class TestRunScenario(unittest.TestCase):
         # useful is good enough.
         self.assertIn('Rebalance', fake_stdout.getvalue())
         self.assertTrue(os.path.exists(builder_path))
+        # timing and memory are reported for every rebalance
+        rebalance_lines = [line for line in
+                           fake_stdout.getvalue().splitlines()
+                           if 'Rebalance' in line]
+        self.assertTrue(rebalance_lines)
+        for line in rebalance_lines:
+            self.assertIsNotNone(re.search(
+                r'took \d+\.\d{3}s, peak memory \d+\.\d MiB$', line), line)
 
 
 class TestParseScenario(unittest.TestCase):
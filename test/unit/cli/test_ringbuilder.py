@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import array
 import errno
 import itertools
 import logging
@@ -30,7 +31,7 @@ import time
 from swift.cli import ringbuilder
 from swift.cli.ringbuilder import EXIT_SUCCESS, EXIT_WARNING, EXIT_ERROR
 from swift.common import exceptions
-from swift.common.ring import RingBuilder
+from swift.common.ring import RingBuilder, RingData
 from swift.common.ring.composite_builder import CompositeRingBuilder
 
 from test.unit import Timeout, write_stub_builder
@@ -2232,6 +2233,31 @@ class TestCommands(unittest.TestCase, RunSwiftRingBuilderMixin):
         argv = ["", self.tmpfile, "write_ring"]
         self.assertSystemExit(EXIT_SUCCESS, ringbuilder.main, argv)
 
+    def test_write_ring_format_version(self):
+        self.create_sample_ring()
+        ring_file = self.tmpfile + '.ring.gz'
+        argv = ["", self.tmpfile, "rebalance", "--format-version", "2"]
+        self.assertSystemExit(EXIT_SUCCESS, ringbuilder.main, argv)
+        with open(ring_file, 'rb') as fp:
+            self.assertEqual(b'R1NG\x00\x02', fp.read(6))
+        ring_data = RingData.load(ring_file)
+        builder = RingBuilder.load(self.tmpfile)
+        self.assertEqual(builder.get_ring().to_dict(), ring_data.to_dict())
+
+        argv = ["", self.tmpfile, "write_ring"]
+        self.assertSystemExit(EXIT_SUCCESS, ringbuilder.main, argv)
+        with open(ring_file, 'rb') as fp:
+            # gzipped
+            self.assertEqual(b'\x1f\x8b', fp.read(2))
+
+        argv = ["", self.tmpfile, "write_ring", "--format-version", "2"]
+        self.assertSystemExit(EXIT_SUCCESS, ringbuilder.main, argv)
+        with open(ring_file, 'rb') as fp:
+            self.assertEqual(b'R1NG\x00\x02', fp.read(6))
+
+        argv = ["", self.tmpfile, "write_ring", "--format-version", "3"]
+        self.assertSystemExit(2, ringbuilder.main, argv)
+
     def test_write_empty_ring(self):
         ring = RingBuilder(6, 3, 1)
         ring.save(self.tmpfile)
@@ -2267,6 +2293,24 @@ class TestCommands(unittest.TestCase, RunSwiftRingBuilderMixin):
         # reflects the reality that we have an extra replica for 12 of 64 parts
         self.assertEqual(builder.replicas, 1.1875)
 
+    def test_write_builder_format_version_2(self):
+        self.create_sample_ring()
+        argv = ["", self.tmpfile, "rebalance", "--format-version", "2"]
+        self.assertSystemExit(EXIT_SUCCESS, ringbuilder.main, argv)
+        orig_builder = RingBuilder.load(self.tmpfile)
+
+        ring_file = os.path.join(os.path.dirname(self.tmpfile),
+                                 os.path.basename(self.tmpfile) + ".ring.gz")
+        os.remove(self.tmpfile)  # loses file...
+
+        argv = ["", ring_file, "write_builder", "24"]
+        self.assertIsNone(ringbuilder.main(argv))
+        builder = RingBuilder.load(self.tmpfile + '.builder')
+        self.assertEqual(orig_builder._replica2part2dev,
+                         builder._replica2part2dev)
+        for part2dev in builder._replica2part2dev:
+            self.assertIsInstance(part2dev, array.array)
+
     def test_write_builder_after_device_removal(self):
         # Test regenerating builder file after having removed a device
         # and lost the builder file
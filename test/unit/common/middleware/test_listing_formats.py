@@ -21,6 +21,28 @@ from swift.common.middleware import listing_formats
 from test.unit.common.middleware.helpers import FakeSwift
 
 
+class FakeStreamingApp(object):
+    """
+    Responds with a JSON listing in chunks, with no Content-Length.
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.query_string = None
+        self.closed = False
+
+    def __call__(self, env, start_response):
+        self.query_string = env['QUERY_STRING']
+        self.closed = False
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return self
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
 class TestListingFormats(unittest.TestCase):
     def setUp(self):
         self.fake_swift = FakeSwift()
@@ -216,6 +238,86 @@ class TestListingFormats(unittest.TestCase):
         self.assertEqual(self.fake_swift.calls[-1], (
             'GET', '/v1/a/c?format=json'))
 
+    def test_streamed_container(self):
+        # a listing with no Content-Length is converted as it is read
+        listing = self.fake_container_listing
+        streaming_app = FakeStreamingApp(
+            [listing[i:i + 7] for i in range(0, len(listing), 7)])
+        app = listing_formats.ListingFilter(streaming_app)
+
+        req = Request.blank('/v1/a/c')
+        resp = req.get_response(app)
+        self.assertEqual(resp.body, b'bar\nfoo/\n')
+        self.assertEqual(resp.headers['Content-Type'],
+                         'text/plain; charset=utf-8')
+        # clients still get a Content-Length
+        self.assertEqual(resp.headers['Content-Length'], '9')
+        self.assertEqual('format=json', streaming_app.query_string)
+        self.assertTrue(streaming_app.closed)
+
+        req = Request.blank('/v1/a/c?format=json')
+        resp = req.get_response(app)
+        self.assertEqual(resp.body, listing)
+        self.assertEqual(resp.headers['Content-Type'],
+                         'application/json; charset=utf-8')
+
+        req = Request.blank('/v1/a/c?format=xml')
+        resp = req.get_response(app)
+        self.assertEqual(
+            resp.body,
+            b'<?xml version="1.0" encoding="UTF-8"?>\n'
+            b'<container name="c">'
+            b'<object><name>bar</name><hash>etag</hash><bytes>0</bytes>'
+            b'<content_type>text/plain</content_type>'
+            b'<last_modified>1970-01-01T00:00:00.000000</last_modified>'
+            b'</object>'
+            b'<subdir name="foo/"><name>foo/</name></subdir>'
+            b'</container>'
+        )
+        self.assertEqual(resp.headers['Content-Type'],
+                         'application/xml; charset=utf-8')
+
+        # the same documents are made as from a listing read whole
+        self.fake_swift.register('GET', '/v1/a', HTTPOk, {
+            'Content-Length': str(len(self.fake_account_listing)),
+            'Content-Type': 'application/json'}, self.fake_account_listing)
+        app = listing_formats.ListingFilter(
+            FakeStreamingApp([self.fake_account_listing]))
+        for query_string in ('', '?format=xml'):
+            whole = Request.blank('/v1/a' + query_string).get_response(
+                self.app)
+            streamed = Request.blank('/v1/a' + query_string).get_response(app)
+            self.assertEqual(whole.body, streamed.body)
+
+        # empty listings
+        app = listing_formats.ListingFilter(FakeStreamingApp([b'[', b']']))
+        resp = Request.blank('/v1/a/c').get_response(app)
+        self.assertEqual(resp.status, '204 No Content')
+        self.assertEqual(resp.body, b'')
+        resp = Request.blank('/v1/a/c?format=xml').get_response(app)
+        self.assertEqual(resp.status, '200 OK')
+        self.assertEqual(resp.body.split(b'\n'), [
+            b'<?xml version="1.0" encoding="UTF-8"?>',
+            b'<container name="c" />',
+        ])
+
+    def test_streamed_bad_json(self):
+        def do_test(chunks):
+            streaming_app = FakeStreamingApp(chunks)
+            app = listing_formats.ListingFilter(streaming_app)
+            for query_string in ('', '?format=xml'):
+                resp = Request.blank(
+                    '/v1/staticweb/bad-json' + query_string).get_response(app)
+                self.assertEqual(resp.body, b''.join(chunks))
+                self.assertEqual(resp.headers['Content-Type'],
+                                 'application/json')
+                self.assertTrue(streaming_app.closed)
+
+        do_test([b'{}'])
+        do_test([b'[0', b']'])
+        do_test([b'[{"no name": ', b'"nor subdir"}]'])
+        do_test([b'[{"name": "trunc'])
+
     def test_pass_through(self):
         def do_test(path):
             self.fake_swift.register(
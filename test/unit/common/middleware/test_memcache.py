@@ -18,10 +18,11 @@ from textwrap import dedent
 import unittest
 
 import mock
+from eventlet import sleep
 from six.moves.configparser import NoSectionError, NoOptionError
 
 from swift.common.middleware import memcache
-from swift.common.memcached import MemcacheRing
+from swift.common.memcached import MemcacheRing, NearCache
 from swift.common.swob import Request
 from swift.common.wsgi import loadapp
 
@@ -263,6 +264,74 @@ class TestCacheMiddleware(unittest.TestCase):
         self.assertEqual(
             thefilter.memcache._client_cache['10.10.10.10:10'].max_size, 3)
 
+    def test_near_cache(self):
+        factory = memcache.filter_factory(
+            {}, memcache_servers='10.10.10.10:10',
+            near_cache_ttls='account/:10, container/:5',
+            near_cache_max_entries='100', near_cache_negative_ttl='1',
+            near_cache_stale_ttl='2.5')
+        thefilter = factory('myapp')
+        self.assertIsInstance(thefilter.memcache, NearCache)
+        self.assertEqual({'account/': 10.0, 'container/': 5.0},
+                         dict(thefilter.memcache.ttls))
+        self.assertEqual(100, thefilter.memcache.max_entries)
+        self.assertEqual(1.0, thefilter.memcache.negative_ttl)
+        self.assertEqual(2.5, thefilter.memcache.stale_ttl)
+        self.assertIsInstance(thefilter.memcache.memcache, MemcacheRing)
+        self.assertEqual(['10.10.10.10:10'],
+                         list(thefilter.memcache._client_cache))
+
+        # not used unless some prefixes are given
+        thefilter = memcache.filter_factory({}, near_cache_ttls='')('myapp')
+        self.assertIsInstance(thefilter.memcache, MemcacheRing)
+
+        with self.assertRaises(ValueError):
+            memcache.filter_factory({}, near_cache_ttls='account/')('myapp')
+
+    def test_server_weights(self):
+        factory = memcache.filter_factory(
+            {}, memcache_servers='10.10.10.10:10/2, [::1]:11211/0.5,'
+            '10.10.10.11:10', ketama_hashing='yes')
+        thefilter = factory('myapp')
+        self.assertEqual(
+            ['10.10.10.10:10', '10.10.10.11:10', '[::1]:11211'],
+            sorted(thefilter.memcache._client_cache))
+        self.assertTrue(thefilter.memcache._ketama)
+        servers = list(thefilter.memcache._ring.values())
+        self.assertEqual(68 * 4, servers.count('10.10.10.10:10'))
+        self.assertEqual(34 * 4, servers.count('10.10.10.11:10'))
+        self.assertEqual(17 * 4, servers.count('[::1]:11211'))
+
+        for bad in ('10.10.10.10:10/0', '10.10.10.10:10/x'):
+            with self.assertRaises(ValueError):
+                memcache.filter_factory({}, memcache_servers=bad)('myapp')
+
+    def test_prewarm_and_health_check(self):
+        thefilter = memcache.filter_factory(
+            {}, prewarm_connections='true',
+            health_check_interval='30')(FakeApp())
+        req = Request.blank('/something', environ={'REQUEST_METHOD': 'GET'})
+        with mock.patch.object(MemcacheRing, 'prewarm') as prewarm, \
+                mock.patch.object(
+                    MemcacheRing, 'start_health_check') as start:
+            # nothing is done until the worker handles a request
+            self.assertFalse(prewarm.called)
+            self.assertFalse(start.called)
+            thefilter(req.environ, start_response)
+            thefilter(req.environ, start_response)
+            sleep(0)
+        self.assertEqual([mock.call()], prewarm.mock_calls)
+        self.assertEqual([mock.call(30.0)], start.mock_calls)
+
+        # neither is done by default
+        with mock.patch.object(MemcacheRing, 'prewarm') as prewarm, \
+                mock.patch.object(
+                    MemcacheRing, 'start_health_check') as start:
+            self.app(req.environ, start_response)
+            sleep(0)
+        self.assertFalse(prewarm.called)
+        self.assertFalse(start.called)
+
     @patch_policies
     def _loadapp(self, proxy_config_path):
         """
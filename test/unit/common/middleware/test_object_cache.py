@@ -0,0 +1,304 @@
+# Copyright (c) 2018 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import mock
+
+from swift.common import swob
+from swift.common.middleware import object_cache
+from swift.common.swob import Request
+from test.unit import FakeMemcache, debug_logger
+from test.unit.common.middleware.helpers import FakeSwift
+
+
+OBJ_PATH = '/v1/a/c/o'
+OBJ_HEADERS = {
+    'Content-Type': 'image/png',
+    'Content-Length': '10',
+    'Etag': 'etag1',
+    'X-Timestamp': '1500000000.00000',
+    'X-Backend-Timestamp': '1500000000.00000',
+    'Last-Modified': 'Fri, 14 Jul 2017 02:40:00 GMT',
+    'X-Object-Meta-Color': 'blue',
+}
+
+
+class TestObjectCache(unittest.TestCase):
+
+    def setUp(self):
+        self.app = FakeSwift()
+        self.app.register('GET', OBJ_PATH, swob.HTTPOk, OBJ_HEADERS,
+                          b'0123456789')
+        self.logger = debug_logger()
+        self.memcache = FakeMemcache()
+
+    def _make_mw(self, **conf):
+        return object_cache.ObjectCacheMiddleware(
+            self.app, conf, logger=self.logger)
+
+    def _get(self, mw, path=OBJ_PATH, **kwargs):
+        environ = kwargs.pop('environ', {})
+        environ.setdefault('swift.cache', self.memcache)
+        req = Request.blank(path, environ=environ, **kwargs)
+        return req.get_response(mw)
+
+    def _check_caching(self, mw):
+        resp = self._get(mw)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual(b'0123456789', resp.body)
+        self.assertEqual([('GET', OBJ_PATH)], self.app.calls)
+        resp = self._get(mw)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual(b'0123456789', resp.body)
+        self.assertEqual('blue', resp.headers['X-Object-Meta-Color'])
+        self.assertEqual('etag1', resp.etag)
+        self.assertEqual('image/png', resp.content_type)
+        self.assertEqual([('GET', OBJ_PATH)], self.app.calls)
+        self.assertEqual({'hit': 1, 'miss': 1},
+                         self.logger.get_increment_counts())
+        self.assertEqual({}, self.app.unclosed_requests)
+
+    def test_memory_backend(self):
+        self._check_caching(self._make_mw())
+        self.assertFalse(self.memcache.store)
+
+    def test_memcache_backend(self):
+        mw = self._make_mw(backend='memcache')
+        self._check_caching(mw)
+        self.assertEqual(['object_cache%s' % OBJ_PATH],
+                         list(self.memcache.store))
+        # entries are shared through memcache
+        other_mw = self._make_mw(backend='memcache')
+        resp = self._get(other_mw)
+        self.assertEqual(b'0123456789', resp.body)
+        self.assertEqual('blue', resp.headers['X-Object-Meta-Color'])
+        self.assertEqual(1, len(self.app.calls))
+
+    def test_memcache_backend_without_memcache(self):
+        mw = self._make_mw(backend='memcache')
+        for _junk in range(2):
+            resp = self._get(mw, environ={'swift.cache': None})
+            self.assertEqual(b'0123456789', resp.body)
+        self.assertEqual(2, len(self.app.calls))
+
+    def test_bad_backend(self):
+        with self.assertRaises(ValueError):
+            self._make_mw(backend='disk')
+
+    def test_range_and_conditional_requests_served_from_cache(self):
+        mw = self._make_mw()
+        self._get(mw)
+        resp = self._get(mw, headers={'Range': 'bytes=2-4'})
+        self.assertEqual(206, resp.status_int)
+        self.assertEqual(b'234', resp.body)
+        self.assertEqual('bytes 2-4/10', resp.headers['Content-Range'])
+        resp = self._get(mw, headers={'Range': 'bytes=20-30'})
+        self.assertEqual(416, resp.status_int)
+        resp = self._get(mw, headers={'If-None-Match': 'etag1'})
+        self.assertEqual(304, resp.status_int)
+        resp = self._get(mw, headers={'If-Match': 'etag2'})
+        self.assertEqual(412, resp.status_int)
+        resp = self._get(mw, headers={
+            'If-Modified-Since': 'Fri, 14 Jul 2017 02:40:00 GMT'})
+        self.assertEqual(304, resp.status_int)
+        self.assertEqual(1, len(self.app.calls))
+
+    def test_conditional_requests_with_etag_is_at(self):
+        headers = dict(OBJ_HEADERS, **{'X-Object-Sysmeta-Crypto-Etag-Mac':
+                                       'hmac'})
+        self.app.register('GET', OBJ_PATH, swob.HTTPOk, headers,
+                          b'0123456789')
+        mw = self._make_mw()
+        self._get(mw)
+        is_at = {'X-Backend-Etag-Is-At': 'X-Object-Sysmeta-Crypto-Etag-Mac'}
+        resp = self._get(mw, headers=dict(is_at, **{'If-Match': 'hmac'}))
+        self.assertEqual(200, resp.status_int)
+        resp = self._get(mw, headers=dict(is_at, **{'If-Match': 'etag1'}))
+        self.assertEqual(412, resp.status_int)
+        resp = self._get(mw, headers=dict(
+            is_at, **{'If-None-Match': 'hmac'}))
+        self.assertEqual(304, resp.status_int)
+        self.assertEqual(1, len(self.app.calls))
+
+    def test_partial_and_conditional_misses_not_cached(self):
+        mw = self._make_mw()
+        resp = self._get(mw, headers={'Range': 'bytes=2-4'})
+        self.assertEqual(b'234', resp.body)
+        resp = self._get(mw, headers={'If-None-Match': 'etag1'})
+        self.assertEqual(304, resp.status_int)
+        self._get(mw)
+        self.assertEqual(3, len(self.app.calls))
+        self._get(mw)
+        self.assertEqual(3, len(self.app.calls))
+
+    def test_uncacheable_requests(self):
+        mw = self._make_mw()
+        self._get(mw)
+        self.app.register('GET', OBJ_PATH + '?symlink=get', swob.HTTPOk,
+                          OBJ_HEADERS, b'0123456789')
+        for path, headers in (
+                (OBJ_PATH + '?symlink=get', {}),
+                (OBJ_PATH, {'X-Newest': 'true'}),
+                (OBJ_PATH, {'Origin': 'http://example.com'}),
+                (OBJ_PATH, {'X-Backend-Storage-Policy-Index': '1'})):
+            self._get(mw, path=path, headers=headers)
+        self.assertEqual(5, len(self.app.calls))
+        resp = self._get(mw, environ={'REQUEST_METHOD': 'HEAD'})
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual([('GET', OBJ_PATH)] * 4 + [('GET', OBJ_PATH),
+                                                    ('HEAD', OBJ_PATH)],
+                         [(m, p.split('?')[0]) for m, p in self.app.calls])
+
+    def test_uncacheable_responses(self):
+        mw = self._make_mw(max_object_size=5)
+        for _junk in range(2):
+            resp = self._get(mw)
+            self.assertEqual(b'0123456789', resp.body)
+        self.assertEqual(2, len(self.app.calls))
+
+        self.app.register('GET', OBJ_PATH, swob.HTTPNotFound, {})
+        mw = self._make_mw()
+        for _junk in range(2):
+            resp = self._get(mw)
+            self.assertEqual(404, resp.status_int)
+        self.assertEqual(4, len(self.app.calls))
+
+        headers = dict(OBJ_HEADERS)
+        del headers['X-Timestamp']
+        del headers['X-Backend-Timestamp']
+        self.app.register('GET', OBJ_PATH, swob.HTTPOk, headers,
+                          b'0123456789')
+        for _junk in range(2):
+            self._get(mw)
+        self.assertEqual(6, len(self.app.calls))
+
+    def test_invalidated_by_writes(self):
+        mw = self._make_mw()
+        self.app.register('PUT', OBJ_PATH, swob.HTTPCreated, {})
+        self.app.register('POST', OBJ_PATH, swob.HTTPAccepted, {})
+        self.app.register('DELETE', OBJ_PATH, swob.HTTPNoContent, {})
+        for method in ('PUT', 'POST', 'DELETE'):
+            self._get(mw)
+            self.assertIsNotNone(mw.memory_store.get(
+                'object_cache%s' % OBJ_PATH))
+            resp = self._get(mw, environ={'REQUEST_METHOD': method})
+            self.assertEqual(2, resp.status_int // 100)
+            self.assertIsNone(mw.memory_store.get(
+                'object_cache%s' % OBJ_PATH))
+
+    def test_revalidate(self):
+        mw = self._make_mw(cache_ttl=10)
+        now = [1000.0]
+        with mock.patch('swift.common.middleware.object_cache.time.time',
+                        lambda: now[0]):
+            self._get(mw)
+            now[0] += 9
+            self._get(mw)
+            self.assertEqual(1, len(self.app.calls))
+            # a HEAD shows the object is unchanged
+            now[0] += 2
+            resp = self._get(mw)
+            self.assertEqual(b'0123456789', resp.body)
+            self.assertEqual([('GET', OBJ_PATH), ('HEAD', OBJ_PATH)],
+                             self.app.calls)
+            self.assertEqual('OC', self.app.swift_sources[-1])
+            # and the entry is good for another cache_ttl
+            now[0] += 9
+            self._get(mw)
+            self.assertEqual(2, len(self.app.calls))
+            # the object changed
+            headers = dict(OBJ_HEADERS, **{
+                'X-Backend-Timestamp': '1500000001.00000', 'Etag': 'etag2'})
+            self.app.register('GET', OBJ_PATH, swob.HTTPOk, headers,
+                              b'abcdefghij')
+            now[0] += 2
+            resp = self._get(mw)
+            self.assertEqual(b'abcdefghij', resp.body)
+            self.assertEqual([('GET', OBJ_PATH), ('HEAD', OBJ_PATH),
+                              ('HEAD', OBJ_PATH), ('GET', OBJ_PATH)],
+                             self.app.calls)
+        self.assertEqual({'hit': 3, 'miss': 2,
+                          'revalidate': 2},
+                         self.logger.get_increment_counts())
+        self.assertEqual(30, sum(
+            args[1] for args, _kwargs in self.logger.log_dict['update_stats']
+            if args[0] == 'hit_bytes'))
+
+    def test_no_revalidate(self):
+        mw = self._make_mw(cache_ttl=10, revalidate='false')
+        now = [1000.0]
+        with mock.patch('swift.common.middleware.object_cache.time.time',
+                        lambda: now[0]):
+            self._get(mw)
+            now[0] += 11
+            self._get(mw)
+        self.assertEqual([('GET', OBJ_PATH)] * 2, self.app.calls)
+
+    def test_memory_store_bounded(self):
+        store = object_cache.MemoryStore(100)
+        entry = {'headers': [('Etag', 'x' * 6)], 'body': b'x' * 40}
+        store.set('a', dict(entry))
+        store.set('b', dict(entry))
+        self.assertEqual(100, store.size)
+        store.get('a')
+        store.set('c', dict(entry))
+        self.assertEqual(100, store.size)
+        self.assertIsNone(store.get('b'))
+        self.assertIsNotNone(store.get('a'))
+        self.assertIsNotNone(store.get('c'))
+        # too big to cache at all
+        store.set('d', {'headers': [], 'body': b'x' * 101})
+        self.assertIsNone(store.get('d'))
+        store.delete('a')
+        self.assertEqual(50, store.size)
+
+    def test_authorization(self):
+        self.app.register('HEAD', '/v1/a', swob.HTTPNoContent, {})
+        self.app.register('HEAD', '/v1/a/c', swob.HTTPNoContent,
+                          {'X-Container-Read': 'reader'})
+        mw = self._make_mw()
+        self._get(mw)
+        self.assertEqual(1, len(self.app.calls))
+
+        def authorize(req):
+            if req.acl != 'reader':
+                return swob.HTTPForbidden(request=req)
+
+        resp = self._get(mw, environ={'swift.authorize': authorize})
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual(b'0123456789', resp.body)
+        self.assertEqual([('GET', OBJ_PATH), ('HEAD', '/v1/a'),
+                          ('HEAD', '/v1/a/c')], self.app.calls)
+
+        def deny(req):
+            return swob.HTTPForbidden(request=req)
+
+        resp = self._get(mw, environ={'swift.authorize': deny})
+        self.assertEqual(403, resp.status_int)
+
+    def test_filter_factory(self):
+        factory = object_cache.filter_factory({}, backend='memcache',
+                                              max_object_size='1024')
+        mw = factory(self.app)
+        self.assertIsInstance(mw, object_cache.ObjectCacheMiddleware)
+        self.assertEqual('memcache', mw.backend)
+        self.assertEqual(1024, mw.max_object_size)
+        self.assertEqual(10, mw.cache_ttl)
+        self.assertTrue(mw.revalidate)
+
+
+if __name__ == '__main__':
+    unittest.main()
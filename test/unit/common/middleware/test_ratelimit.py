@@ -133,6 +133,16 @@ class TestRateLimit(unittest.TestCase):
             self.assertEqual(round(total_time, 1), round(time_ticker, 1))
         return time_diff
 
+    def test_statsd_prefix(self):
+        conf = {'log_statsd_host': 'localhost', 'log_name': 'proxy-server'}
+        rate_mid = ratelimit.filter_factory(conf)(FakeApp())
+        self.assertEqual(
+            'ratelimit.', rate_mid.logger.logger.statsd_client._prefix)
+        conf['log_statsd_metric_prefix'] = 'cluster'
+        rate_mid = ratelimit.filter_factory(conf)(FakeApp())
+        self.assertEqual(
+            'cluster.ratelimit.', rate_mid.logger.logger.statsd_client._prefix)
+
     def test_get_maxrate(self):
         conf_dict = {'container_ratelimit_10': 200,
                      'container_ratelimit_50': 100,
@@ -211,6 +221,28 @@ class TestRateLimit(unittest.TestCase):
             tuples = the_app.get_ratelimitable_key_tuples(req, 'a', 'c', 'o')
             self.assertEqual(tuples, [('ratelimit/a/c', 200.0)])
 
+    def test_prefetch_info(self):
+        conf_dict = {'container_ratelimit_0': 200}
+        the_app = ratelimit.filter_factory(conf_dict)(FakeApp())
+        for path, expected in (('/v1/a/c/o', [('a', 'c')]),
+                               ('/v1/a/c', [('a', 'c')]),
+                               ('/v1/a', [])):
+            req = Request.blank(path, method='PUT')
+            req.environ['swift.cache'] = FakeMemcache()
+            with mock.patch('swift.common.middleware.ratelimit.'
+                            'prefetch_info') as mock_prefetch, \
+                    mock.patch('swift.common.middleware.ratelimit.'
+                               'get_account_info',
+                               lambda *args, **kwargs: {}), \
+                    mock.patch('swift.common.middleware.ratelimit.'
+                               'get_container_info',
+                               lambda *args, **kwargs: {}):
+                the_app(req.environ, start_response)
+            self.assertEqual(
+                [mock.call(req.environ, the_app.app, account, container)
+                 for account, container in expected],
+                mock_prefetch.mock_calls)
+
     def test_account_ratelimit(self):
         current_rate = 5
         num_calls = 50
@@ -251,6 +283,81 @@ class TestRateLimit(unittest.TestCase):
             self._run(make_app_call, num_calls, current_rate, check_time=False)
             self.assertEqual(round(time.time() - begin, 1), 9.8)
 
+    def test_local_ratelimit(self):
+        current_rate = 5
+        num_calls = 50
+        conf_dict = {'account_ratelimit': current_rate,
+                     'memcache_sync_interval': 1}
+        self.test_ratelimit = ratelimit.filter_factory(conf_dict)(FakeApp())
+        self.test_ratelimit.logger = FakeLogger()
+        req = Request.blank('/v1/a/c')
+        req.method = 'PUT'
+        memcache = req.environ['swift.cache'] = FakeMemcache()
+        make_app_call = lambda: self.test_ratelimit(req.environ,
+                                                    start_response)
+        begin = time.time()
+        with mock.patch('swift.common.middleware.ratelimit.get_account_info',
+                        lambda *args, **kwargs: {}), \
+                mock.patch.object(memcache, 'incr',
+                                  side_effect=memcache.incr) as mock_incr:
+            self._run(make_app_call, num_calls, current_rate, check_time=False)
+            self.assertEqual(round(time.time() - begin, 1), 9.8)
+        # memcache is updated about once a second, not once a request
+        self.assertEqual(10, mock_incr.call_count)
+        # and lags by less than the sync interval
+        self.assertLess(time.time() * 1000 - memcache.store['ratelimit/a'],
+                        1000)
+        self.assertEqual(
+            49, self.test_ratelimit.logger.get_increment_counts()['sleeps'])
+
+    def test_local_ratelimit_workers(self):
+        current_rate = 10
+        conf_dict = {'account_ratelimit': current_rate,
+                     'memcache_sync_interval': 1}
+        workers = [ratelimit.filter_factory(conf_dict)(FakeApp())
+                   for _junk in range(2)]
+        req = Request.blank('/v1/a/c')
+        req.method = 'PUT'
+        req.environ['swift.cache'] = FakeMemcache()
+        begin = time.time()
+        with mock.patch('swift.common.middleware.ratelimit.get_account_info',
+                        lambda *args, **kwargs: {}):
+            for i in range(200):
+                workers[i % 2](req.environ, start_response)
+        # the workers only see each others' requests once a second, so
+        # between them go a little over the limit, but by no more than the
+        # limit times the sync interval for each other worker
+        elapsed = time.time() - begin
+        self.assertGreaterEqual(elapsed, 200.0 / (2 * current_rate))
+        self.assertLess(elapsed, 200.0 / current_rate)
+
+    def test_local_ratelimit_max_sleep(self):
+        global time_override
+        conf_dict = {'account_ratelimit': 2,
+                     'clock_accuracy': 100,
+                     'max_sleep_time_seconds': 1,
+                     'memcache_sync_interval': 1}
+        self.test_ratelimit = ratelimit.filter_factory(conf_dict)(FakeApp())
+        self.test_ratelimit.logger = FakeLogger()
+        req = Request.blank('/v1/a/c')
+        req.method = 'PUT'
+        req.environ['swift.cache'] = FakeMemcache()
+
+        time_override = [0, 0, 0, 0, None]
+        # simulates 4 requests coming in at same time, then sleeping
+        with mock.patch('swift.common.middleware.ratelimit.get_account_info',
+                        lambda *args, **kwargs: {}):
+            responses = []
+            for _junk in range(5):
+                responses.append(
+                    self.test_ratelimit(req.environ, start_response)[0])
+                mock_sleep(.1)
+        self.assertEqual(['204 No Content', '204 No Content', 'Slow down',
+                          'Slow down', '204 No Content'], responses)
+        self.assertEqual(
+            {'sleeps': 2, 'rejections': 2},
+            self.test_ratelimit.logger.get_increment_counts())
+
     def test_ratelimit_old_white_black_list(self):
         global time_ticker
         current_rate = 2
@@ -2481,6 +2481,60 @@ class TestRingBuilder(unittest.TestCase):
             (0, 0, '127.0.0.1', 3): [0, 256, 0, 0],
         })
 
+    def _assert_dispersion_graph_rebuilds_same(self, rb):
+        rebuilt = ring.RingBuilder.from_dict(copy.deepcopy(rb.to_dict()))
+        rebuilt._build_dispersion_graph()
+        self.assertEqual(rebuilt._dispersion_graph, rb._dispersion_graph)
+        self.assertAlmostEqual(rebuilt.dispersion, rb.dispersion)
+
+    def test_dispersion_graph_updated_for_changed_parts(self):
+        rb = ring.RingBuilder(8, 3, 1)
+        for z in range(2):
+            for d in range(3):
+                rb.add_dev({'region': 0, 'zone': z, 'weight': 1,
+                            'ip': '127.0.0.%d' % z, 'port': 10000,
+                            'device': 'sd%d' % d})
+        rb.rebalance(seed=1)
+        self.assertTrue(rb._dispersion_graph)
+        self._assert_dispersion_graph_rebuilds_same(rb)
+
+        # new devices, a removed device and a weight change only need the
+        # parts that moved counted again, even after a save and load
+        rb.add_dev({'region': 0, 'zone': 2, 'weight': 1,
+                    'ip': '127.0.0.2', 'port': 10000, 'device': 'sda'})
+        rb.add_dev({'region': 0, 'zone': 2, 'weight': 1,
+                    'ip': '127.0.0.2', 'port': 10000, 'device': 'sdb'})
+        rb.remove_dev(0)
+        rb.set_dev_weight(1, 2)
+        rb = ring.RingBuilder.from_dict(copy.deepcopy(rb.to_dict()))
+        rb.pretend_min_part_hours_passed()
+        with mock.patch.object(rb, '_rebuild_dispersion_graph') as rebuild:
+            changed_parts, _balance, removed_devs = rb.rebalance(seed=2)
+        self.assertFalse(rebuild.called)
+        self.assertEqual(1, removed_devs)
+        self.assertGreater(changed_parts, 0)
+        self.assertIn((0, 2), rb._dispersion_graph)
+        self.assertNotIn((0, 0, '127.0.0.0', 0), rb._dispersion_graph)
+        self._assert_dispersion_graph_rebuilds_same(rb)
+
+        # a device changing tiers means counting every part again
+        rb.devs[2]['ip'] = '127.0.0.3'
+        rb.pretend_min_part_hours_passed()
+        with mock.patch.object(rb, '_update_dispersion_graph') as update:
+            rb.rebalance(seed=3)
+        self.assertFalse(update.called)
+        self.assertIn((0, 0, '127.0.0.3'), rb._dispersion_graph)
+        self._assert_dispersion_graph_rebuilds_same(rb)
+
+        # as does changing the assignments behind the builder's back
+        rb._replica2part2dev[0][0], rb._replica2part2dev[1][0] = \
+            rb._replica2part2dev[1][0], rb._replica2part2dev[0][0]
+        rb.pretend_min_part_hours_passed()
+        with mock.patch.object(rb, '_update_dispersion_graph') as update:
+            rb.rebalance(seed=4)
+        self.assertFalse(update.called)
+        self._assert_dispersion_graph_rebuilds_same(rb)
+
     @unittest.skipIf(sys.version_info >= (3,),
                      "Seed-specific tests don't work well on py3")
     def test_undispersable_zone_converge_on_balance(self):
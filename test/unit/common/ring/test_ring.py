@@ -135,6 +135,64 @@ class TestRingData(unittest.TestCase):
         rd2 = ring.RingData.load(ring_fname)
         self.assert_ring_data_equal(rd1, rd2)
 
+    def test_roundtrip_serialization_v2(self):
+        ring_fname = os.path.join(self.testdir, 'foo.ring.gz')
+        # a fractional replica count leaves the last replica short
+        rd = ring.RingData(
+            [array.array('H', [0, 1, 0, 1]), array.array('H', [1, 0, 1])],
+            [{'id': 0, 'zone': 0}, {'id': 1, 'zone': 1}], 30,
+            next_part_power=3)
+        rd.save(ring_fname, format_version=2)
+        with open(ring_fname, 'rb') as fp:
+            self.assertEqual(b'R1NG\x00\x02', fp.read(6))
+        meta_only = ring.RingData.load(ring_fname, metadata_only=True)
+        self.assertEqual([
+            {'id': 0, 'zone': 0, 'region': 1},
+            {'id': 1, 'zone': 1, 'region': 1},
+        ], meta_only.devs)
+        self.assertEqual([], meta_only._replica2part2dev_id)
+        rd2 = ring.RingData.load(ring_fname)
+        self.assert_ring_data_equal(rd, rd2)
+        self.assertEqual(3, rd2.next_part_power)
+        self.assertEqual(1.75, rd2.replica_count)
+
+        rd3 = ring.RingData.load(ring_fname, map_data=True)
+        self.assertEqual([[0, 1, 0, 1], [1, 0, 1]],
+                         [list(part2dev_id)
+                          for part2dev_id in rd3._replica2part2dev_id])
+        self.assertEqual(rd.devs, rd3.devs)
+        self.assertEqual(1.75, rd3.replica_count)
+        # the data really is mapped from the file...
+        self.assertNotIsInstance(rd3._replica2part2dev_id[0], array.array)
+        # ...but writing to it doesn't change the file
+        rd3._replica2part2dev_id[0][0] = 1
+        self.assert_ring_data_equal(rd, ring.RingData.load(ring_fname))
+
+        with self.assertRaises(ValueError):
+            rd.save(ring_fname, format_version=3)
+
+    def test_byteswapped_serialization_v2(self):
+        ring_fname = os.path.join(self.testdir, 'foo.ring.gz')
+        data = [array.array('H', [0, 1, 0, 1]), array.array('H', [0, 1, 0, 1])]
+        swapped_data = copy.deepcopy(data)
+        for x in swapped_data:
+            x.byteswap()
+
+        with mock.patch.object(sys, 'byteorder',
+                               'big' if sys.byteorder == 'little'
+                               else 'little'):
+            rds = ring.RingData(swapped_data,
+                                [{'id': 0, 'zone': 0}, {'id': 1, 'zone': 1}],
+                                30)
+            rds.save(ring_fname, format_version=2)
+
+        rd1 = ring.RingData(data, [{'id': 0, 'zone': 0}, {'id': 1, 'zone': 1}],
+                            30)
+        self.assert_ring_data_equal(rd1, ring.RingData.load(ring_fname))
+        # byteswapped data can't be mapped, so gets read instead
+        self.assert_ring_data_equal(
+            rd1, ring.RingData.load(ring_fname, map_data=True))
+
     def test_deterministic_serialization(self):
         """
         Two identical rings should produce identical .gz files on disk.
@@ -236,6 +294,26 @@ class TestRing(TestRingBase):
                 mock.patch.object(utils, 'SWIFT_CONF_FILE', ''):
             self.assertRaises(SystemExit, ring.Ring, self.testdir, 'whatever')
 
+    def test_v2_ring(self):
+        ring.RingData(
+            self.intended_replica2part2dev_id,
+            self.intended_devs, self.intended_part_shift).save(
+                self.testgz, format_version=2)
+        v2_ring = ring.Ring(self.testdir, ring_name='whatever')
+        self.assertEqual(
+            [list(part2dev_id)
+             for part2dev_id in self.intended_replica2part2dev_id],
+            [list(part2dev_id)
+             for part2dev_id in v2_ring._replica2part2dev_id])
+        self.assertEqual(self.intended_devs, v2_ring.devs)
+        self.assertEqual(3, v2_ring.replica_count)
+        self.assertEqual(4, v2_ring.partition_count)
+        for name in ('a', 'aa', 'a4'):
+            part, nodes = self.ring.get_nodes(name)
+            self.assertEqual((part, nodes), v2_ring.get_nodes(name))
+            self.assertEqual(list(self.ring.get_more_nodes(part)),
+                             list(v2_ring.get_more_nodes(part)))
+
     def test_replica_count(self):
         self.assertEqual(self.ring.replica_count, 3)
         self.ring._replica2part2dev_id.append([0])
@@ -490,6 +568,42 @@ class TestRing(TestRingBase):
                          enumerate([self.intended_devs[0],
                                     self.intended_devs[3]])])
 
+    def test_get_nodes_many(self):
+        names = [('a',), ('a', 'c1'), ('a', 'c0'), ('a', 'c', 'o1'),
+                 ('a', 'c', 'o5'), ('a', None, None)]
+        results = self.ring.get_nodes_many(names)
+        self.assertEqual([self.ring.get_nodes(*name) for name in names],
+                         results)
+        self.assertEqual([0, 0, 3, 1, 0, 0], [part for part, _ in results])
+        # each result has its own node dicts
+        results[0][1][0]['mutated'] = True
+        self.assertNotIn('mutated', results[1][1][0])
+        self.assertNotIn('mutated', results[4][1][0])
+        self.assertEqual([], self.ring.get_nodes_many([]))
+
+    def test_get_more_nodes_remembered(self):
+        handoffs = list(self.ring.get_more_nodes(0))
+        self.assertIn(0, self.ring._handoff_cache)
+        with mock.patch.object(self.ring, '_iter_handoff_dev_ids') as mocked:
+            self.assertEqual(handoffs, list(self.ring.get_more_nodes(0)))
+        self.assertFalse(mocked.called)
+
+        # interleaved callers see the same sequence
+        iter1 = self.ring.get_more_nodes(1)
+        iter2 = self.ring.get_more_nodes(1)
+        first = next(iter1)
+        self.assertEqual(first, next(iter2))
+        self.assertEqual(list(iter1), list(iter2))
+
+        # the cache is bounded...
+        with mock.patch('swift.common.ring.ring.HANDOFF_CACHE_SIZE', 2):
+            list(self.ring.get_more_nodes(2))
+            self.assertEqual([2], list(self.ring._handoff_cache))
+        # ...and starts again when the ring changes
+        self.ring._rebuild_tier_data()
+        self.assertEqual({}, self.ring._handoff_cache)
+        self.assertEqual(handoffs, list(self.ring.get_more_nodes(0)))
+
     def add_dev_to_ring(self, new_dev):
         self.ring.devs.append(new_dev)
         self.ring._rebuild_tier_data()
@@ -15,9 +15,12 @@
 
 """Tests for swift.common.db"""
 
+import errno
 import os
+import struct
 import sys
 import unittest
+from io import BytesIO
 from tempfile import mkdtemp
 from shutil import rmtree, copy
 from uuid import uuid4
@@ -41,12 +44,13 @@ from swift.common.constraints import \
     MAX_META_VALUE_LENGTH, MAX_META_COUNT, MAX_META_OVERALL_SIZE
 from swift.common.db import chexor, dict_factory, get_db_connection, \
     DatabaseBroker, DatabaseConnectionError, DatabaseAlreadyExists, \
-    GreenDBConnection, PICKLE_PROTOCOL, zero_like
+    GreenDBConnection, PICKLE_PROTOCOL, zero_like, unlink_wal_files, \
+    ConnectionCache, replace_db_file
 from swift.common.utils import normalize_timestamp, mkdirs, Timestamp
 from swift.common.exceptions import LockTimeout
 from swift.common.swob import HTTPException
 
-from test.unit import with_tempdir
+from test.unit import with_tempdir, debug_logger
 
 
 class TestHelperFunctions(unittest.TestCase):
@@ -208,6 +212,210 @@ class TestGetDBConnection(unittest.TestCase):
                              list((mock_db_cmd.call_args,) *
                                   mock_db_cmd.call_count))
 
+    @with_tempdir
+    def test_wal_mode(self, tempdir):
+        db_file = os.path.join(tempdir, 'test.db')
+        conn = get_db_connection(db_file, okay_to_create=True)
+        self.assertEqual('delete', conn.execute(
+            'PRAGMA journal_mode').fetchone()[0])
+        conn.close()
+
+        with patch('swift.common.db.WAL_MODE', True):
+            wal_conn = get_db_connection(db_file)
+        self.assertEqual('wal', wal_conn.execute(
+            'PRAGMA journal_mode').fetchone()[0])
+        self.assertEqual(2, wal_conn.execute(
+            'PRAGMA synchronous').fetchone()[0])  # FULL
+        wal_conn.execute('CREATE TABLE test (value)')
+        wal_conn.commit()
+        self.assertTrue(os.path.exists(db_file + '-wal'))
+
+        # with the option off, a connection leaves the db in WAL mode
+        # rather than waiting for the other connection to close
+        conn = get_db_connection(db_file, timeout=0.1)
+        self.assertEqual('wal', conn.execute(
+            'PRAGMA journal_mode').fetchone()[0])
+        self.assertEqual(1, conn.execute(
+            'PRAGMA synchronous').fetchone()[0])  # NORMAL
+        conn.close()
+        wal_conn.close()
+        self.assertFalse(os.path.exists(db_file + '-wal'))
+
+        with patch('swift.common.db.WAL_MODE', True):
+            conn = get_db_connection(':memory:')
+        self.assertEqual('memory', conn.execute(
+            'PRAGMA journal_mode').fetchone()[0])
+
+    @with_tempdir
+    def test_unlink_wal_files(self, tempdir):
+        db_file = os.path.join(tempdir, 'test.db')
+        unlink_wal_files(db_file)
+        for suffix in ('', '-wal', '-shm'):
+            with open(db_file + suffix, 'w'):
+                pass
+        unlink_wal_files(db_file)
+        self.assertEqual(['test.db'], os.listdir(tempdir))
+
+    def _make_wal_db(self, db_file, value):
+        with patch('swift.common.db.WAL_MODE', True):
+            conn = get_db_connection(db_file, okay_to_create=True)
+        conn.execute('CREATE TABLE test (value)')
+        conn.execute('INSERT INTO test VALUES (?)', (value,))
+        conn.commit()
+        return conn
+
+    def _read_values(self, db_file):
+        conn = get_db_connection(db_file)
+        try:
+            return [row[0] for row in conn.execute('SELECT value FROM test')]
+        finally:
+            conn.close()
+
+    @with_tempdir
+    def test_replace_db_file(self, tempdir):
+        db_file = os.path.join(tempdir, 'test.db')
+        new_db_file = os.path.join(tempdir, 'new.db')
+        # an idle connection keeps the existing db's log, with its pages
+        old_conn = self._make_wal_db(db_file, 'old')
+        self.assertTrue(os.path.getsize(db_file + '-wal'))
+        self._make_wal_db(new_db_file, 'new').close()
+
+        def check_renamer(old, new):
+            # nothing can be written while the db is being replaced
+            conn = get_db_connection(db_file, timeout=0.01)
+            with self.assertRaises(LockTimeout):
+                conn.execute('INSERT INTO test VALUES (?)', ('late',))
+            conn.close()
+            self.assertEqual(0, os.path.getsize(db_file + '-wal'))
+            os.rename(old, new)
+
+        with patch('swift.common.db.renamer', check_renamer):
+            self.assertTrue(replace_db_file(new_db_file, db_file))
+        self.assertEqual(['new'], self._read_values(db_file))
+        old_conn.close()
+        self.assertEqual(['new'], self._read_values(db_file))
+        self.assertFalse(os.path.exists(new_db_file))
+
+    @with_tempdir
+    def test_replace_db_file_missing(self, tempdir):
+        db_file = os.path.join(tempdir, 'test.db')
+        new_db_file = os.path.join(tempdir, 'new.db')
+        # a log left behind by a db that has gone
+        self._make_wal_db(db_file, 'old')
+        os.unlink(db_file)
+        self._make_wal_db(new_db_file, 'new').close()
+        self.assertTrue(replace_db_file(new_db_file, db_file))
+        self.assertEqual(['test.db'], os.listdir(tempdir))
+        self.assertEqual(['new'], self._read_values(db_file))
+
+    @with_tempdir
+    def test_replace_db_file_log_not_emptied(self, tempdir):
+        db_file = os.path.join(tempdir, 'test.db')
+        new_db_file = os.path.join(tempdir, 'new.db')
+        self._make_wal_db(db_file, 'old').close()
+        self._make_wal_db(new_db_file, 'new').close()
+
+        # a reader keeps the log from being emptied
+        reader = get_db_connection(db_file)
+        reader.execute('INSERT INTO test VALUES (?)', ('more',))
+        reader.commit()
+        reader.execute('BEGIN')
+        reader.execute('SELECT * FROM test').fetchall()
+        self.assertFalse(replace_db_file(new_db_file, db_file))
+        reader.close()
+        self.assertEqual(['old', 'more'], self._read_values(db_file))
+        self.assertTrue(os.path.exists(new_db_file))
+
+        # a writer gets in between the checkpoint and the lock
+        with patch('swift.common.db._wal_has_pages', return_value=True):
+            self.assertFalse(replace_db_file(new_db_file, db_file))
+        self.assertEqual(['old', 'more'], self._read_values(db_file))
+        self.assertTrue(replace_db_file(new_db_file, db_file))
+        self.assertEqual(['new'], self._read_values(db_file))
+
+
+class TestConnectionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        self.db_files = []
+        for i in range(3):
+            db_file = os.path.join(self.testdir, '%d.db' % i)
+            get_db_connection(db_file, okay_to_create=True).close()
+            self.db_files.append(db_file)
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=1)
+
+    def assertClosed(self, conn):
+        self.assertRaises(sqlite3.ProgrammingError, conn.execute, 'SELECT 1')
+
+    def test_get_and_put(self):
+        cache = ConnectionCache(2)
+        conn = cache.get(self.db_files[0], 5)
+        self.assertEqual(5, conn.timeout)
+        self.assertEqual(0, len(cache))
+        cache.put(conn)
+        self.assertEqual(1, len(cache))
+        self.assertIs(conn, cache.get(self.db_files[0], 10))
+        self.assertEqual(10, conn.timeout)
+        self.assertEqual(0, len(cache))
+        # a second user of the same db gets a connection of its own
+        other_conn = cache.get(self.db_files[0], 10)
+        self.assertIsNot(conn, other_conn)
+        cache.put(conn)
+        cache.put(other_conn)
+        self.assertEqual(2, len(cache))
+
+    def test_least_recently_used_closed(self):
+        cache = ConnectionCache(2)
+        conns = [cache.get(db_file, 5) for db_file in self.db_files]
+        for conn in conns:
+            cache.put(conn)
+        self.assertEqual(2, len(cache))
+        self.assertClosed(conns[0])
+        self.assertIs(conns[1], cache.get(self.db_files[1], 5))
+        self.assertIs(conns[2], cache.get(self.db_files[2], 5))
+
+        # connections that didn't come from the cache aren't kept
+        conn = get_db_connection(self.db_files[0])
+        cache.put(conn)
+        self.assertEqual(0, len(cache))
+        self.assertClosed(conn)
+        conn = ConnectionCache(0).get(self.db_files[0], 5)
+        ConnectionCache(0).put(conn)
+        self.assertClosed(conn)
+
+    def test_replaced_db_file(self):
+        cache = ConnectionCache(2)
+        conn = cache.get(self.db_files[0], 5)
+        cache.put(conn)
+        os.rename(self.db_files[1], self.db_files[0])
+        new_conn = cache.get(self.db_files[0], 5)
+        self.assertIsNot(conn, new_conn)
+        self.assertClosed(conn)
+        self.assertEqual(0, len(cache))
+
+        cache.put(new_conn)
+        os.unlink(self.db_files[0])
+        self.assertRaises(DatabaseConnectionError, cache.get,
+                          self.db_files[0], 5)
+        with patch('os.stat', side_effect=OSError(errno.EACCES, 'denied')):
+            self.assertRaises(OSError, cache.get, self.db_files[1], 5)
+
+    def test_invalidate(self):
+        cache = ConnectionCache(3)
+        conns = [cache.get(self.db_files[0], 5) for _ in range(2)]
+        other_conn = cache.get(self.db_files[1], 5)
+        for conn in conns + [other_conn]:
+            cache.put(conn)
+        cache.invalidate(self.db_files[0])
+        cache.invalidate(self.db_files[2])
+        self.assertEqual(1, len(cache))
+        for conn in conns:
+            self.assertClosed(conn)
+        self.assertIs(other_conn, cache.get(self.db_files[1], 5))
+
 
 class ExampleBroker(DatabaseBroker):
     """
@@ -651,6 +859,96 @@ class TestDatabaseBroker(unittest.TestCase):
         swift.common.db.DB_PREALLOCATION = True
         self.assertRaises(OSError, b._preallocate)
 
+    @with_tempdir
+    def test_checkpoint(self, tempdir):
+        db_file = os.path.join(tempdir, 'test.db')
+        broker = ExampleBroker(db_file, account='a')
+        broker.initialize(Timestamp.now().internal)
+        self.assertTrue(broker.checkpoint())  # not in WAL mode
+        self.assertFalse(os.path.exists(db_file + '-wal'))
+        broker.close()
+        self.assertIsNone(broker.conn)
+        broker.close()
+
+        with patch('swift.common.db.WAL_MODE', True):
+            broker = ExampleBroker(db_file, account='a')
+            broker.merge_items([{'name': 'o', 'created_at': '1',
+                                 'deleted': 0}])
+            wal_size = os.path.getsize(db_file + '-wal')
+            self.assertGreater(wal_size, 0)
+            # the broker's own idle connection doesn't stop a checkpoint
+            self.assertTrue(broker.checkpoint('PASSIVE'))
+            self.assertEqual(wal_size, os.path.getsize(db_file + '-wal'))
+            self.assertTrue(broker.checkpoint())
+            self.assertEqual(0, os.path.getsize(db_file + '-wal'))
+
+            # a reader keeps a TRUNCATE checkpoint from emptying the log
+            broker.merge_items([{'name': 'o2', 'created_at': '1',
+                                 'deleted': 0}])
+            reader = get_db_connection(db_file)
+            reader.execute('BEGIN')
+            reader.execute('SELECT * FROM test').fetchall()
+            broker.merge_items([{'name': 'o3', 'created_at': '1',
+                                 'deleted': 0}])
+            self.assertFalse(broker.checkpoint())
+            reader.rollback()
+            reader.close()
+            self.assertTrue(broker.checkpoint())
+
+            broker.close()
+            self.assertFalse(os.path.exists(db_file + '-wal'))
+        conn = get_db_connection(db_file)
+        self.assertEqual(['o', 'o2', 'o3'], [row[0] for row in conn.execute(
+            'SELECT name FROM test ORDER BY name')])
+
+    @with_tempdir
+    def test_connection_cache(self, tempdir):
+        db_file = os.path.join(tempdir, 'test.db')
+        cache = ConnectionCache(2)
+        broker = ExampleBroker(db_file, account='a', connection_cache=cache)
+        broker.initialize(Timestamp.now().internal)
+        broker.put_test('o', Timestamp.now().internal)
+        # the connection initialize opened isn't cached...
+        with broker.get() as conn:
+            pass
+        self.assertIsNone(broker.conn)
+        self.assertEqual(0, len(cache))
+        # ...but the ones taken from the cache are
+        with broker.get() as conn:
+            pass
+        self.assertIsNone(broker.conn)
+        self.assertEqual(1, len(cache))
+
+        # the next request's broker reuses the connection
+        broker = ExampleBroker(db_file, account='a', connection_cache=cache)
+        with broker.get() as conn2:
+            self.assertIs(conn, conn2)
+            self.assertEqual(0, len(cache))
+        with broker.lock():
+            self.assertEqual(0, len(cache))
+        self.assertEqual(1, len(cache))
+        self.assertIs(conn, cache.get(db_file, 5))
+        cache.put(conn)
+
+        broker.delete_db(Timestamp.now().internal)
+        self.assertEqual(0, len(cache))
+        with broker.get() as conn:
+            pass
+        self.assertEqual(1, len(cache))
+        with patch('swift.common.db.renamer'), \
+                self.assertRaises(sqlite3.DatabaseError):
+            broker.quarantine('testing')
+        self.assertEqual(0, len(cache))
+
+        # the db goes between the broker's check and the cache's
+        broker = ExampleBroker(os.path.join(tempdir, 'missing.db'),
+                               account='a', connection_cache=cache)
+        with patch('os.path.exists', return_value=True), \
+                self.assertRaises(DatabaseConnectionError) as caught:
+            with broker.get():
+                pass
+        self.assertIn("DB doesn't exist", str(caught.exception))
+
     def test_memory_db_init(self):
         broker = DatabaseBroker(':memory:')
         self.assertEqual(broker.db_file, ':memory:')
@@ -1509,6 +1807,54 @@ class TestDatabaseBroker(unittest.TestCase):
             pending = fd.read()
         self.assertFalse(pending)
 
+    def test_put_record_binary(self):
+        db_file = os.path.join(self.testdir, '1.db')
+        broker = DatabaseBroker(db_file)
+        broker._initialize = MagicMock()
+        broker.initialize(Timestamp.now())
+        broker.make_tuple_for_pickle = lambda x: x.upper()
+        with patch('swift.common.db.BINARY_PENDING', True):
+            broker.put_record('pinky')
+            broker.put_record('perky')
+        with open(broker.pending_file, 'rb') as fd:
+            pending = fd.read()
+        data = pickle.dumps('PINKY', protocol=PICKLE_PROTOCOL)
+        self.assertEqual(
+            b'\x00\x01' + struct.pack('!I', len(data)) + data,
+            pending[:6 + len(data)])
+        errors = []
+        self.assertEqual(
+            [['PINKY', 'PERKY']],
+            list(swift.common.db.iter_pending_records(
+                BytesIO(pending), errors.append)))
+        self.assertFalse(errors)
+
+    def test_commit_puts_mixed_formats(self):
+        db_file = os.path.join(self.testdir, '1.db')
+        broker = DatabaseBroker(db_file)
+        broker._initialize = MagicMock()
+        broker.initialize(Timestamp.now())
+        broker._commit_puts_load = lambda l, e: l.append(e)
+        broker.logger = debug_logger()
+        with open(broker.pending_file, 'wb') as fd:
+            for i, binary in enumerate((False, True, True, False, True)):
+                with patch('swift.common.db.BINARY_PENDING', binary):
+                    fd.write(swift.common.db.dump_pending_entry(
+                        (u'o\u062a%d' % i, 'x' * 1000 * i, i)))
+            fd.write(b'\x00\x02' + struct.pack('!I', 2) + b'xx')
+            fd.write(b'\x00\x01' + struct.pack('!I', 200) + b'truncated')
+        # entries may straddle reads
+        with patch('swift.common.db.PENDING_READ_SIZE', 7), \
+                patch.object(broker, 'merge_items') as mock_merge_items:
+            broker._commit_puts()
+        mock_merge_items.assert_called_once_with(
+            [(u'o\u062a%d' % i, 'x' * 1000 * i, i) for i in range(5)])
+        self.assertEqual(0, os.path.getsize(broker.pending_file))
+        self.assertEqual(
+            [line.split(':')[0] for line in
+             broker.logger.get_lines_for_level('error')],
+            ['Invalid pending entry %s' % broker.pending_file] * 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -32,7 +32,7 @@ from mock import patch, call
 from six.moves import reload_module
 
 from swift.container.backend import DATADIR
-from swift.common import db_replicator
+from swift.common import db, db_replicator
 from swift.common.utils import (normalize_timestamp, hash_path,
                                 storage_directory, Timestamp)
 from swift.common.exceptions import DriveNotMounted
@@ -265,6 +265,12 @@ class FakeBroker(object):
     def newid(self, remote_d):
         pass
 
+    def close(self):
+        pass
+
+    def checkpoint(self, mode='TRUNCATE'):
+        return True
+
     def update_metadata(self, metadata):
         self.metadata = metadata
 
@@ -485,6 +491,36 @@ class TestDBReplicator(unittest.TestCase):
                 replicator._rsync_db(broker, fake_device, ReplHttp(), 'abcd')
                 self.assertEqual(2, replicator._rsync_file_call_count)
 
+        # with pages in a write-ahead log
+        with patch('os.path.exists', lambda *args: False), \
+                patch('os.path.getmtime', lambda *args: 1), \
+                patch('swift.common.db_replicator._wal_has_pages',
+                      lambda *args: True):
+            broker = FakeBroker()
+            checkpoints = []
+
+            def checkpoint(mode='TRUNCATE'):
+                checkpoints.append((mode, broker.locked))
+                return mode != 'PASSIVE' or checkpoint_ok
+
+            broker.checkpoint = checkpoint
+            checkpoint_ok = True
+            replicator = MyTestReplicator(broker)
+            self.assertTrue(replicator._rsync_db(
+                broker, fake_device, ReplHttp(), 'abcd'))
+            self.assertEqual(2, replicator._rsync_file_call_count)
+            self.assertEqual([('TRUNCATE', False), ('PASSIVE', True)],
+                             checkpoints)
+
+            checkpoint_ok = False
+            del checkpoints[:]
+            replicator = MyTestReplicator(broker)
+            self.assertFalse(replicator._rsync_db(
+                broker, fake_device, ReplHttp(), 'abcd'))
+            self.assertEqual(1, replicator._rsync_file_call_count)
+            self.assertEqual([('TRUNCATE', False), ('PASSIVE', True)],
+                             checkpoints)
+
     def test_in_sync(self):
         replicator = TestReplicator({})
         self.assertEqual(replicator._in_sync(
@@ -1180,7 +1216,8 @@ class TestDBReplicator(unittest.TestCase):
         rpc = db_replicator.ReplicatorRpc('/', '/', FakeBroker,
                                           mount_check=False)
 
-        self._patch(patch.object, db_replicator, 'renamer', lambda *args: True)
+        self._patch(patch.object, db_replicator, 'replace_db_file',
+                    lambda *args: True)
 
         with patch('swift.common.db_replicator.os',
                    new=mock.MagicMock(wraps=os)) as mock_os, \
@@ -1201,7 +1238,8 @@ class TestDBReplicator(unittest.TestCase):
         rpc = db_replicator.ReplicatorRpc('/', '/', FakeBroker,
                                           mount_check=False)
 
-        self._patch(patch.object, db_replicator, 'renamer', lambda *args: True)
+        self._patch(patch.object, db_replicator, 'replace_db_file',
+                    lambda *args: True)
 
         with patch('swift.common.db_replicator.os',
                    new=mock.MagicMock(wraps=os)) as mock_os, \
@@ -1263,12 +1301,14 @@ class TestDBReplicator(unittest.TestCase):
         rpc = db_replicator.ReplicatorRpc('/', '/', FakeBroker,
                                           mount_check=False)
 
-        def mock_renamer(old, new):
+        def mock_replace_db_file(old, new):
             self.assertEqual('/drive/tmp/arg1', old)
             # FakeBroker uses module filename as db_file!
             self.assertEqual(__file__, new)
+            return True
 
-        self._patch(patch.object, db_replicator, 'renamer', mock_renamer)
+        self._patch(patch.object, db_replicator, 'replace_db_file',
+                    mock_replace_db_file)
 
         with patch('swift.common.db_replicator.os',
                    new=mock.MagicMock(wraps=os)) as mock_os, \
@@ -1279,6 +1319,22 @@ class TestDBReplicator(unittest.TestCase):
             self.assertEqual('204 No Content', response.status)
             self.assertEqual(204, response.status_int)
 
+    def test_rsync_then_merge_log_not_checkpointed(self):
+        rpc = db_replicator.ReplicatorRpc('/', '/', FakeBroker,
+                                          mount_check=False)
+        mock_replace = mock.MagicMock(return_value=False)
+        self._patch(patch.object, db_replicator, 'replace_db_file',
+                    mock_replace)
+
+        with patch('swift.common.db_replicator.os',
+                   new=mock.MagicMock(wraps=os)) as mock_os, \
+                unit.mock_check_drive(isdir=True):
+            mock_os.path.exists.return_value = True
+            response = rpc.rsync_then_merge('drive', '/data/db.db',
+                                            ['arg1', 'arg2'])
+        self.assertEqual(503, response.status_int)
+        mock_replace.assert_called_once_with('/drive/tmp/arg1', __file__)
+
     def test_complete_rsync_db_exists(self):
         rpc = db_replicator.ReplicatorRpc('/', '/', FakeBroker,
                                           mount_check=False)
@@ -1337,7 +1393,7 @@ class TestDBReplicator(unittest.TestCase):
         def mock_renamer(old, new):
             renamer_calls.append((old, new))
 
-        self._patch(patch.object, db_replicator, 'renamer', mock_renamer)
+        self._patch(patch.object, db, 'renamer', mock_renamer)
 
         renamer_calls = []
         with patch('swift.common.db_replicator.os',
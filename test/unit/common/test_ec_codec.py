@@ -0,0 +1,160 @@
+# Copyright (c) 2018 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import eventlet
+import mock
+
+from swift.common import ec_codec
+from swift.common.ec_codec import ECCodecExecutor
+from swift.common.storage_policy import ECStoragePolicy, ECDriverError
+
+from test.unit import DEFAULT_TEST_EC_TYPE, debug_logger
+
+
+class TestECCodecExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = ECStoragePolicy(0, 'ec4-2', ec_type=DEFAULT_TEST_EC_TYPE,
+                                      ec_ndata=4, ec_nparity=2,
+                                      ec_segment_size=4096)
+        self.segments = [chr(i + 97).encode('ascii') * 4096 for i in range(3)]
+        self.executors = []
+
+    def tearDown(self):
+        for executor in self.executors:
+            if executor._idle is not None:
+                while not executor._idle.empty():
+                    proc = executor._idle.get()
+                    if proc is not None:
+                        proc.kill()
+
+    def _make_executor(self, processes):
+        executor = ECCodecExecutor(processes, logger=debug_logger())
+        self.executors.append(executor)
+        return executor
+
+    def _check_encode_decode(self, executor):
+        frag_sets = executor.encode(self.policy, self.segments)
+        self.assertEqual(
+            [self.policy.pyeclib_driver.encode(segment)
+             for segment in self.segments], frag_sets)
+        # any ec_ndata fragments will do
+        self.assertEqual(self.segments, executor.decode(
+            self.policy, [frags[2:] for frags in frag_sets]))
+        self.assertEqual([], executor.encode(self.policy, []))
+
+    def test_inline(self):
+        executor = self._make_executor(0)
+        with mock.patch.object(ec_codec, '_CodecProcess') as mock_proc:
+            self._check_encode_decode(executor)
+        self.assertFalse(mock_proc.called)
+
+    def test_processes(self):
+        executor = self._make_executor(2)
+        # helpers aren't started until they're needed
+        self.assertIsNone(executor._idle)
+        with mock.patch.object(ec_codec, '_CodecProcess') as mock_proc:
+            executor.encode(self.policy, [])
+        self.assertFalse(mock_proc.called)
+        # nothing is encoded or decoded in this process
+        with mock.patch.object(ec_codec, '_run', side_effect=AssertionError):
+            frag_sets = executor.encode(self.policy, self.segments)
+            segments = executor.decode(
+                self.policy, [frags[2:] for frags in frag_sets])
+        self.assertEqual(
+            [self.policy.pyeclib_driver.encode(segment)
+             for segment in self.segments], frag_sets)
+        self.assertEqual(self.segments, segments)
+        self.assertEqual(2, executor._idle.qsize())
+
+    def test_batch_segments(self):
+        self.assertEqual(1, self._make_executor(0).batch_segments(self.policy))
+        executor = self._make_executor(2)
+        self.assertEqual(128, executor.batch_segments(self.policy))
+        big_policy = ECStoragePolicy(
+            1, 'big', ec_type=DEFAULT_TEST_EC_TYPE, ec_ndata=4, ec_nparity=2,
+            ec_segment_size=1048576)
+        self.assertEqual(1, executor.batch_segments(big_policy))
+
+    def test_concurrent_calls(self):
+        executor = self._make_executor(2)
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(
+            lambda segment: executor.encode(self.policy, [segment]),
+            self.segments * 3))
+        self.assertEqual(
+            [[self.policy.pyeclib_driver.encode(segment)]
+             for segment in self.segments * 3], results)
+        self.assertEqual(2, executor._idle.qsize())
+
+    def test_driver_error(self):
+        executor = self._make_executor(1)
+        frags = executor.encode(self.policy, self.segments[:1])[0]
+        with self.assertRaises(ECDriverError):
+            executor.decode(self.policy, [frags[:1]])
+        # the helper is still usable
+        self.assertEqual(self.segments[:1], executor.decode(
+            self.policy, [frags[:4]]))
+        self.assertFalse(executor.logger.get_lines_for_level('error'))
+
+    def test_process_dies(self):
+        executor = self._make_executor(1)
+        executor.encode(self.policy, self.segments[:1])
+        dead = executor._idle.get()
+        dead.kill()
+        executor._idle.put(dead)
+        # falls back to encoding inline, and starts a new helper
+        self.assertEqual(
+            [self.policy.pyeclib_driver.encode(self.segments[0])],
+            executor.encode(self.policy, self.segments[:1]))
+        error_lines = executor.logger.get_lines_for_level('error')
+        self.assertEqual(1, len(error_lines))
+        self.assertIn('EC codec process failed', error_lines[0])
+        self.assertIsNone(executor._idle.get())
+        executor._idle.put(None)
+        self.assertEqual(
+            [self.policy.pyeclib_driver.encode(self.segments[0])],
+            executor.encode(self.policy, self.segments[:1]))
+        self.assertIsNot(dead, executor._idle.get())
+
+    def test_interrupted_call(self):
+        executor = self._make_executor(1)
+        expected = [self.policy.pyeclib_driver.encode(self.segments[0])]
+        self.assertEqual(expected,
+                         executor.encode(self.policy, self.segments[:1]))
+        first = executor._idle.get()
+        executor._idle.put(first)
+        for exc in (eventlet.Timeout, eventlet.greenlet.GreenletExit,
+                    ValueError):
+            # the request is written, but the caller gives up on the reply
+            with mock.patch.object(ec_codec, '_read_message',
+                                   side_effect=exc):
+                with self.assertRaises(exc):
+                    executor.encode(self.policy, self.segments[1:2])
+            # the helper, with its unread reply, is gone
+            self.assertIsNotNone(first.proc.poll())
+            self.assertEqual(expected,
+                             executor.encode(self.policy, self.segments[:1]))
+            proc = executor._idle.get()
+            self.assertIsNot(first, proc)
+            executor._idle.put(proc)
+            first = proc
+        self.assertFalse(executor.logger.get_lines_for_level('error'))
+
+
+if __name__ == '__main__':
+    unittest.main()
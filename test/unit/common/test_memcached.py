@@ -16,16 +16,18 @@
 
 """Tests for swift.common.utils"""
 
-from collections import defaultdict
+from collections import defaultdict, Counter
 import errno
 from hashlib import md5
 import six
 import socket
+import struct
 import time
 import unittest
 from uuid import uuid4
 import os
 
+import eventlet
 import mock
 
 from eventlet import GreenPool, sleep, Queue
@@ -154,6 +156,9 @@ class MockMemcached(object):
         else:
             self.outbuf += b'NOT_FOUND\r\n'
 
+    def handle_version(self):
+        self.outbuf += b'VERSION 1.4.2\r\n'
+
     def readline(self):
         if self.read_return_empty_str:
             return b''
@@ -554,6 +559,230 @@ class TestMemcached(unittest.TestCase):
                 None)
             self.assertFalse(not_expected in mock_stderr.getvalue())
 
+    def test_get_many(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211', '1.2.3.6:11211']
+        memcache_client = memcached.MemcacheRing(servers)
+        mocks = {}
+        for server in servers:
+            mocks[server] = MockMemcached()
+            memcache_client._client_cache[server] = MockedMemcachePool(
+                [(mocks[server], mocks[server])] * 2)
+        keys = ['key%d' % i for i in range(20)]
+        for i, key in enumerate(keys):
+            memcache_client.set(key, [i])
+        # each key is where get would look for it
+        for server in servers:
+            self.assertTrue(mocks[server].cache)
+            for cache_key in mocks[server].cache:
+                self.assertEqual(server, memcache_client._get_servers(
+                    cache_key)[0])
+
+        sent = defaultdict(list)
+        for server in servers:
+            orig_sendall = mocks[server].sendall
+
+            def sendall(data, server=server, orig_sendall=orig_sendall):
+                sent[server].append(data)
+                return orig_sendall(data)
+            mocks[server].sendall = sendall
+        self.assertEqual(
+            [[19], None, [0], [5], [19]],
+            memcache_client.get_many(
+                ['key19', 'missing', 'key0', 'key5', 'key19']))
+        self.assertEqual([[i] for i in range(20)],
+                         memcache_client.get_many(keys))
+        # one request to each server for each call
+        for server in servers:
+            self.assertEqual(2, len(sent[server]))
+            self.assertEqual(1, sent[server][1].count(b'get '))
+            self.assertEqual(len(mocks[server].cache),
+                             len(sent[server][1].split()) - 1)
+        self.assertEqual([], memcache_client.get_many([]))
+
+    def test_get_many_retry(self):
+        memcache_client = memcached.MemcacheRing(
+            ['1.2.3.4:11211', '1.2.3.5:11211'])
+        mock1 = ExplodingMockMemcached()
+        mock2 = MockMemcached()
+        memcache_client._client_cache['1.2.3.4:11211'] = MockedMemcachePool(
+            [(mock2, mock2)])
+        memcache_client._client_cache['1.2.3.5:11211'] = MockedMemcachePool(
+            [(mock1, mock1), (mock1, mock1)])
+        memcache_client.set('some_key', [1, 2, 3])
+        self.logger.clear()
+        self.assertEqual([[1, 2, 3], None],
+                         memcache_client.get_many(['some_key', 'other']))
+        self.assertEqual(mock1.exploded, True)
+        self.assertEqual(self.logger.get_lines_for_level('error'), [
+            'Error talking to memcached: 1.2.3.5:11211: '
+            '[Errno 32] Broken pipe',
+        ])
+
+        # when no server answers, nothing is found
+        mock2.read_return_empty_str = True
+        self.assertEqual([None, None],
+                         memcache_client.get_many(['some_key', 'other']))
+
+    def test_get_many_fewer_servers_than_tries(self):
+        memcache_client = memcached.MemcacheRing(
+            ['1.2.3.4:11211', '1.2.3.5:11211'])
+        mock1 = ExplodingMockMemcached()
+        mock2 = MockMemcached()
+        memcache_client._client_cache['1.2.3.4:11211'] = MockedMemcachePool(
+            [(mock2, mock2)])
+        memcache_client._client_cache['1.2.3.5:11211'] = MockedMemcachePool(
+            [(mock1, mock1)])
+        memcache_client.set('some_key', [1, 2, 3])
+        # e.g. a server with no points on the ring is never among a key's
+        # servers
+        with mock.patch.object(memcache_client, '_get_servers',
+                               return_value=['1.2.3.5:11211']):
+            self.assertEqual([None, None],
+                             memcache_client.get_many(['some_key', 'other']))
+        self.assertEqual(mock1.exploded, True)
+
+    def _key_servers(self, memcache_client, num_keys=2000):
+        return dict(
+            (key, memcache_client._get_servers(memcached.md5hash(key))[0])
+            for key in ('key%d' % i for i in range(num_keys)))
+
+    def test_ketama(self):
+        servers = ['1.2.3.%d:11211' % i for i in range(4)]
+        memcache_client = memcached.MemcacheRing(servers, ketama=True)
+        self.assertEqual(len(memcache_client._sorted), 4 * 160)
+        # the continuum is libketama's
+        for i in (0, 39):
+            for point in struct.unpack(
+                    '<4I', md5(b'1.2.3.0:11211-%d' % i).digest()):
+                self.assertEqual('1.2.3.0:11211', memcache_client._ring[point])
+        key_servers = self._key_servers(memcache_client)
+        counts = Counter(key_servers.values())
+        self.assertEqual(sorted(counts), servers)
+        for count in counts.values():
+            self.assertTrue(350 < count < 650, counts)
+        for key, server in list(key_servers.items())[:10]:
+            hashed = memcached.md5hash(key)
+            point = memcached.ketama_hash(hashed)
+            expected = [p for p in memcache_client._sorted if p >= point]
+            expected = expected[0] if expected else memcache_client._sorted[0]
+            self.assertEqual(server, memcache_client._ring[expected])
+            self.assertEqual(3, len(set(
+                memcache_client._get_servers(hashed))))
+
+        # adding a server only moves keys to it
+        more_servers = servers + ['1.2.3.4:11211']
+        new_key_servers = self._key_servers(
+            memcached.MemcacheRing(more_servers, ketama=True))
+        moved = [key for key in key_servers
+                 if key_servers[key] != new_key_servers[key]]
+        self.assertTrue(250 < len(moved) < 550, len(moved))
+        for key in moved:
+            self.assertEqual('1.2.3.4:11211', new_key_servers[key])
+
+    def test_weights(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211']
+        for ketama in (False, True):
+            memcache_client = memcached.MemcacheRing(
+                servers, weights={'1.2.3.4:11211': 3}, ketama=ketama)
+            counts = Counter(self._key_servers(memcache_client).values())
+            self.assertTrue(1300 < counts['1.2.3.4:11211'] < 1700, counts)
+
+        # a weight of 1 places servers as before
+        self.assertEqual(
+            memcached.MemcacheRing(servers)._ring,
+            memcached.MemcacheRing(
+                servers, weights={'1.2.3.4:11211': 1})._ring)
+
+    def test_tiny_weights_still_place_server(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211']
+        for ketama in (False, True):
+            memcache_client = memcached.MemcacheRing(
+                servers, weights={'1.2.3.5:11211': 0.0001}, ketama=ketama)
+            self.assertEqual(set(servers),
+                             set(memcache_client._ring.values()))
+            # so every try has a server to go to
+            self.assertEqual(
+                sorted(servers),
+                sorted(memcache_client._get_servers(
+                    memcached.md5hash('some_key'))))
+
+    def test_check_health(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211', '1.2.3.6:11211']
+        memcache_client = memcached.MemcacheRing(servers)
+        mocks = dict((server, MockMemcached()) for server in servers)
+        for server, mock_conn in mocks.items():
+            memcache_client._client_cache[server] = MockedMemcachePool(
+                [(mock_conn, mock_conn)] * 10)
+        key = memcached.md5hash('some_key')
+        before = memcache_client._get_servers(key)
+
+        mocks[before[0]].down = True
+        memcache_client.check_health()
+        self.assertEqual(set([before[0]]), memcache_client._unhealthy)
+        self.assertEqual(before[1:] + before[:1],
+                         memcache_client._get_servers(key))
+        self.assertEqual(self.logger.get_lines_for_level('error'), [
+            'Memcached server %s is down; taking it out of the ring'
+            % before[0]])
+        # the check's connections aren't pooled
+        for pool in memcache_client._client_cache.values():
+            self.assertEqual(0, pool.current_size)
+        self.assertTrue(mocks[before[1]].close_called)
+
+        # when all are down, all are tried
+        for mock_conn in mocks.values():
+            mock_conn.down = True
+        memcache_client.check_health()
+        self.assertEqual(set(servers), memcache_client._unhealthy)
+        self.assertEqual(before, memcache_client._get_servers(key))
+
+        for mock_conn in mocks.values():
+            mock_conn.down = False
+        memcache_client.check_health()
+        self.assertEqual(set(), memcache_client._unhealthy)
+        self.assertEqual(before, memcache_client._get_servers(key))
+        self.assertEqual(
+            sorted(self.logger.get_lines_for_level('warning')),
+            ['Memcached server %s is back' % server for server in servers])
+
+    def test_start_health_check(self):
+        memcache_client = memcached.MemcacheRing(['1.2.3.4:11211'])
+        with mock.patch.object(memcache_client, 'check_health') as check:
+            memcache_client.start_health_check(0)
+            self.assertIsNone(memcache_client._health_check)
+            memcache_client.start_health_check(0.01)
+            health_check = memcache_client._health_check
+            memcache_client.start_health_check(0.01)
+            self.assertIs(health_check, memcache_client._health_check)
+            sleep(0.05)
+            health_check.kill()
+        self.assertTrue(check.called)
+
+    def test_prewarm(self):
+        memcache_client = memcached.MemcacheRing(
+            ['1.2.3.4:11211', '1.2.3.5:11211'])
+        mock1 = MockMemcached()
+        memcache_client._client_cache['1.2.3.4:11211'] = MockedMemcachePool(
+            [(mock1, mock1)] * 2)
+        memcache_client._client_cache['1.2.3.5:11211'] = MockedMemcachePool(
+            [])
+        memcache_client.prewarm()
+        pool = memcache_client._client_cache['1.2.3.4:11211']
+        self.assertEqual(2, pool.current_size)
+        self.assertEqual(2, len(pool.free_items))
+        self.assertEqual([], pool.mocks)
+        # a server that can't be reached is left alone
+        pool = memcache_client._client_cache['1.2.3.5:11211']
+        self.assertEqual(0, pool.current_size)
+        self.assertEqual(self.logger.get_lines_for_level('error'), [
+            'Error connecting to memcached: 1.2.3.5:11211: '])
+
+        # it's harmless to do again
+        memcache_client._client_cache['1.2.3.4:11211'].mocks.append(None)
+        memcache_client.prewarm()
+        self.assertEqual(
+            [None], memcache_client._client_cache['1.2.3.4:11211'].mocks)
+
     def test_serialization(self):
         memcache_client = memcached.MemcacheRing(['1.2.3.4:11211'],
                                                  allow_pickle=True)
@@ -696,5 +925,173 @@ class TestMemcached(unittest.TestCase):
         self.assertEqual(connections['1.2.3.4'].qsize(), 2)
 
 
+class FakeRingForNearCache(object):
+    def __init__(self):
+        self.store = {}
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append(('get', key))
+        return self.store.get(key)
+
+    def get_many(self, keys):
+        self.calls.append(('get_many', keys))
+        return [self.store.get(key) for key in keys]
+
+    def set(self, key, value, serialize=True, time=0, min_compress_len=0):
+        self.calls.append(('set', key))
+        self.store[key] = value
+
+    def incr(self, key, delta=1, time=0):
+        self.calls.append(('incr', key))
+        self.store[key] = self.store.get(key, 0) + delta
+        return self.store[key]
+
+    def delete(self, key):
+        self.calls.append(('delete', key))
+        self.store.pop(key, None)
+
+    def get_multi(self, keys, server_key):
+        self.calls.append(('get_multi', keys))
+        return [self.store.get(key) for key in keys]
+
+
+class TestNearCache(unittest.TestCase):
+    def setUp(self):
+        self.ring = FakeRingForNearCache()
+        self.logger = debug_logger()
+        self.now = 1000.0
+        patcher = mock.patch('swift.common.memcached.time.time',
+                             lambda: self.now)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def _get_calls(self):
+        calls = [call for call in self.ring.calls
+                 if call[0] in ('get', 'get_many')]
+        del self.ring.calls[:]
+        return calls
+
+    def test_parse_near_cache_ttls(self):
+        self.assertEqual({}, memcached.parse_near_cache_ttls(None))
+        self.assertEqual({}, memcached.parse_near_cache_ttls(''))
+        self.assertEqual(
+            {'account/': 10.0, 'AUTH_/token/': 2.5},
+            memcached.parse_near_cache_ttls(
+                ' account/:10, AUTH_/token/:2.5,'))
+        for bad in ('account/', ':10', 'account/:x', 'account/:-1'):
+            with self.assertRaises(ValueError):
+                memcached.parse_near_cache_ttls(bad)
+
+    def test_get(self):
+        cache = memcached.NearCache(
+            self.ring, {'account/': 10, 'account/AUTH_test2': 0,
+                        'container/': 5}, logger=self.logger)
+        self.ring.store.update({'account/AUTH_test': {'status': 200},
+                                'account/AUTH_test2': {'status': 200},
+                                'container/AUTH_test/c': {'status': 200},
+                                'other': 'x'})
+        for _junk in range(2):
+            self.assertEqual({'status': 200}, cache.get('account/AUTH_test'))
+            self.assertEqual({'status': 200},
+                             cache.get('container/AUTH_test/c'))
+            self.assertEqual({'status': 200}, cache.get('account/AUTH_test2'))
+            self.assertEqual('x', cache.get('other'))
+        self.assertEqual([('get', 'account/AUTH_test'),
+                          ('get', 'container/AUTH_test/c'),
+                          ('get', 'account/AUTH_test2'),
+                          ('get', 'other'),
+                          ('get', 'account/AUTH_test2'),
+                          ('get', 'other')], self._get_calls())
+        # each caller gets its own copy
+        cache.get('account/AUTH_test')['status'] = 500
+        self.assertEqual({'status': 200}, cache.get('account/AUTH_test'))
+
+        # entries last as long as their prefix's ttl
+        self.now += 5
+        cache.get('account/AUTH_test')
+        cache.get('container/AUTH_test/c')
+        self.assertEqual([('get', 'container/AUTH_test/c')],
+                         self._get_calls())
+        self.assertEqual({
+            'near_cache.account.hit': 4,
+            'near_cache.account.miss': 1,
+            'near_cache.container.hit': 1,
+            'near_cache.container.miss': 2,
+        }, self.logger.get_increment_counts())
+
+        # misses aren't remembered by default
+        cache.get('account/missing')
+        cache.get('account/missing')
+        self.assertEqual([('get', 'account/missing')] * 2, self._get_calls())
+
+    def test_negative_entries(self):
+        cache = memcached.NearCache(self.ring, {'account/': 10},
+                                    negative_ttl=2)
+        self.assertIsNone(cache.get('account/a'))
+        self.assertIsNone(cache.get('account/a'))
+        self.assertEqual([('get', 'account/a')], self._get_calls())
+        self.now += 2
+        self.ring.store['account/a'] = {'status': 200}
+        self.assertEqual({'status': 200}, cache.get('account/a'))
+        self.assertEqual([('get', 'account/a')], self._get_calls())
+
+    def test_stale_while_revalidate(self):
+        cache = memcached.NearCache(self.ring, {'account/': 10},
+                                    stale_ttl=5, logger=self.logger)
+        self.ring.store['account/a'] = 1
+        self.assertEqual(1, cache.get('account/a'))
+        self.ring.store['account/a'] = 2
+        self.now += 11
+        # the stale entry is served while it's fetched again
+        self.assertEqual(1, cache.get('account/a'))
+        self.assertEqual(1, cache.get('account/a'))
+        eventlet.sleep(0)
+        self.assertEqual(2, cache.get('account/a'))
+        self.assertEqual([('get', 'account/a')] * 2, self._get_calls())
+        self.assertEqual(2, self.logger.get_increment_counts()[
+            'near_cache.account.stale_hit'])
+        # entries too stale to serve are fetched before answering
+        self.ring.store['account/a'] = 3
+        self.now += 16
+        self.assertEqual(3, cache.get('account/a'))
+
+    def test_changes_drop_entries(self):
+        cache = memcached.NearCache(self.ring, {'account/': 10})
+        self.ring.store['account/a'] = 1
+        cache.get('account/a')
+        cache.set('account/a', 2)
+        self.assertEqual(2, cache.get('account/a'))
+        cache.incr('account/a')
+        self.assertEqual(3, cache.get('account/a'))
+        cache.delete('account/a')
+        self.assertIsNone(cache.get('account/a'))
+        self.assertEqual(4, len(self._get_calls()))
+        # other methods are passed through
+        self.assertEqual([None], cache.get_multi(['account/a'], 'a'))
+
+    def test_max_entries(self):
+        cache = memcached.NearCache(self.ring, {'k': 10}, max_entries=2)
+        for key in ('k1', 'k2', 'k1', 'k3', 'k1', 'k2'):
+            self.ring.store[key] = key
+            cache.get(key)
+        self.assertEqual([('get', 'k1'), ('get', 'k2'), ('get', 'k3'),
+                          ('get', 'k2')], self._get_calls())
+
+    def test_get_many(self):
+        cache = memcached.NearCache(self.ring, {'account/': 10},
+                                    logger=self.logger)
+        self.ring.store.update({'account/a': 1, 'account/b': 2,
+                                'other': 3})
+        cache.get('account/a')
+        self._get_calls()
+        self.assertEqual([1, 2, 3, None], cache.get_many(
+            ['account/a', 'account/b', 'other', 'account/c']))
+        self.assertEqual([('get_many', ['account/b', 'other', 'account/c'])],
+                         self._get_calls())
+        self.assertEqual([1, 2], cache.get_many(['account/a', 'account/b']))
+        self.assertEqual([], self._get_calls())
+
+
 if __name__ == '__main__':
     unittest.main()
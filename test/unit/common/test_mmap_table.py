@@ -0,0 +1,226 @@
+# Copyright (c) 2018 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import time
+import unittest
+import zlib
+from hashlib import md5
+from tempfile import mkdtemp
+
+import mock
+import six
+
+from swift.common.mmap_table import MmapTable
+
+from test.unit import debug_logger
+
+
+class TestMmapTable(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.path = os.path.join(self.tempdir, 'sub', 'table')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def _check_get_update(self, table):
+        self.assertIsNone(table.get('foo'))
+        self.assertEqual('x', table.get('foo', 'x'))
+        self.assertEqual((1, 2.5), table.set('foo', (1, 2.5)))
+        self.assertEqual((1, 2.5), table.get('foo'))
+        self.assertEqual((3, 2.5), table.update(
+            'foo', lambda values: (values[0] + 2, values[1])))
+        self.assertEqual((3, 2.5), table.get('foo'))
+        # new keys start out as zeros
+        self.assertEqual((1, 0.0), table.update(
+            u'b\xe4r', lambda values: (values[0] + 1, values[1])))
+        # returning None leaves the record alone
+        self.assertIsNone(table.update('foo', lambda values: None))
+        self.assertEqual((3, 2.5), table.get('foo'))
+        unicode_key = u'b\xe4r'
+        if six.PY2:
+            unicode_key = unicode_key.encode('utf-8')
+        self.assertEqual(sorted([('foo', (3, 2.5)), (unicode_key, (1, 0.0))]),
+                         sorted(table.items()))
+
+    def test_anonymous(self):
+        table = MmapTable(None, '<Id', num_slots=8)
+        self._check_get_update(table)
+        table.close()
+
+    def test_file_backed(self):
+        table = MmapTable(self.path, '<Id', num_slots=8)
+        self._check_get_update(table)
+        self.assertTrue(os.path.exists(self.path))
+        table.close()
+
+    def test_shared_between_instances(self):
+        table1 = MmapTable(self.path, '<Id', num_slots=8)
+        table2 = MmapTable(self.path, '<Id', num_slots=8)
+        table1.set('foo', (1, 1.0))
+        self.assertEqual((1, 1.0), table2.get('foo'))
+        table2.update('foo', lambda values: (values[0] + 1, values[1]))
+        self.assertEqual((2, 1.0), table1.get('foo'))
+        table1.close()
+        table2.close()
+        # the contents outlive the instances
+        table3 = MmapTable(self.path, '<Id', num_slots=8)
+        self.assertEqual((2, 1.0), table3.get('foo'))
+        table3.close()
+
+    def test_reinitialised_when_parameters_change(self):
+        table = MmapTable(self.path, '<Id', num_slots=8)
+        table.set('foo', (1, 1.0))
+        table.close()
+        table = MmapTable(self.path, '<Idd', num_slots=8)
+        self.assertIsNone(table.get('foo'))
+        table.close()
+        table = MmapTable(self.path, '<Idd', num_slots=16)
+        table.set('foo', (1, 1.0, 2.0))
+        table.close()
+        table = MmapTable(self.path, '<Idd', num_slots=8)
+        self.assertIsNone(table.get('foo'))
+        table.close()
+        # garbage in the file
+        with open(self.path, 'wb') as fd:
+            fd.write(b'junk')
+        table = MmapTable(self.path, '<Idd', num_slots=8)
+        self.assertIsNone(table.get('foo'))
+        table.set('foo', (1, 1.0, 2.0))
+        self.assertEqual((1, 1.0, 2.0), table.get('foo'))
+        table.close()
+
+    def test_replaced_not_resized(self):
+        table1 = MmapTable(self.path, '<Id', num_slots=8)
+        table1.set('foo', (1, 1.0))
+        inode = os.stat(self.path).st_ino
+        table2 = MmapTable(self.path, '<Id', num_slots=4)
+        # the file table1 has mapped is left alone
+        self.assertNotEqual(inode, os.stat(self.path).st_ino)
+        self.assertEqual((1, 1.0), table1.get('foo'))
+        self.assertIsNone(table2.get('foo'))
+        table2.set('bar', (2, 2.0))
+        self.assertEqual((2, 2.0),
+                         MmapTable(self.path, '<Id', num_slots=4).get('bar'))
+        # no temporary files are left behind
+        self.assertEqual(['table'], os.listdir(os.path.dirname(self.path)))
+        table1.close()
+        table2.close()
+
+    def test_full(self):
+        logger = debug_logger()
+        table = MmapTable(None, '<I', num_slots=4, logger=logger)
+        for i in range(4):
+            self.assertEqual((i,), table.set('key%d' % i, (i,)))
+        self.assertIsNone(table.set('another', (5,)))
+        self.assertIsNone(table.get('another'))
+        for i in range(4):
+            self.assertEqual((i,), table.get('key%d' % i))
+        self.assertEqual(4, len(list(table.items())))
+        self.assertEqual(['Table (anonymous) is full; no room for more keys'],
+                         logger.get_lines_for_level('error'))
+        # it's only logged once in a while
+        self.assertIsNone(table.set('yet another', (6,)))
+        self.assertEqual(1, len(logger.get_lines_for_level('error')))
+        with mock.patch('swift.common.mmap_table.time.time',
+                        return_value=time.time() + 60):
+            self.assertIsNone(table.set('yet another', (6,)))
+        self.assertEqual(2, len(logger.get_lines_for_level('error')))
+
+    def test_probes_limited(self):
+        logger = debug_logger()
+        with mock.patch('swift.common.mmap_table.MAX_PROBES', 3):
+            table = MmapTable(None, '<I', num_slots=16, logger=logger)
+        self.assertEqual(3, table.max_probes)
+        # keys that all hash to the same slot
+        keys = [key for key in ('key%d' % i for i in range(1000))
+                if zlib.crc32(key.encode('ascii')) % 16 == 3][:5]
+        for i, key in enumerate(keys[:3]):
+            self.assertEqual((i,), table.set(key, (i,)))
+        # there's room elsewhere, but not near where the key hashes to
+        self.assertIsNone(table.set(keys[3], (3,)))
+        self.assertEqual(['Table (anonymous) is full; no room for more keys'],
+                         logger.get_lines_for_level('error'))
+        self.assertIsNone(table.get(keys[3]))
+        self.assertIsNone(table.get(keys[4]))
+        for i, key in enumerate(keys[:3]):
+            self.assertEqual((i,), table.get(key))
+        self.assertEqual((9,), table.set('other', (9,)))
+        self.assertEqual(4, len(list(table.items())))
+
+        # an expired record near the key can still be taken over
+        with mock.patch('swift.common.mmap_table.MAX_PROBES', 3):
+            table = MmapTable(None, '<I', num_slots=16,
+                              expired=lambda values: values[0] == 1)
+        for i, key in enumerate(keys[:3]):
+            table.set(key, (i,))
+        self.assertEqual((3,), table.set(keys[3], (3,)))
+        self.assertIsNone(table.get(keys[1]))
+        self.assertIsNone(table.set(keys[4], (4,)))
+
+    def test_full_reuses_expired(self):
+        logger = debug_logger()
+        table = MmapTable(self.path, '<Id', num_slots=4,
+                          expired=lambda values: values[1] < 10,
+                          logger=logger)
+        for i in range(4):
+            table.set('key%d' % i, (i, 10 + i))
+        self.assertIsNone(table.set('another', (4, 1.0)))
+        table.set('key2', (2, 5))
+        # a new key takes over the expired slot, and starts out as zeros
+        self.assertEqual((1, 0.0), table.update(
+            'another', lambda values: (values[0] + 1, values[1])))
+        self.assertEqual((1, 0.0), table.get('another'))
+        self.assertIsNone(table.get('key2'))
+        self.assertEqual(['another', 'key0', 'key1', 'key3'],
+                         sorted(key for key, _junk in table.items()))
+        # records that haven't expired stay
+        table.set('another', (1, 30))
+        self.assertIsNone(table.set('key2', (2, 20)))
+        self.assertEqual((1, 30), table.get('another'))
+        self.assertEqual((3, 13), table.get('key3'))
+        self.assertEqual(1, len(logger.get_lines_for_level('error')))
+        table.close()
+
+    def test_clear(self):
+        table = MmapTable(self.path, '<I', num_slots=4)
+        for i in range(4):
+            table.set('key%d' % i, (i,))
+        table.clear()
+        self.assertEqual([], list(table.items()))
+        self.assertIsNone(table.get('key0'))
+        self.assertEqual((1,), table.set('another', (1,)))
+        table.close()
+
+    def test_long_keys(self):
+        table = MmapTable(None, '<I', num_slots=4, key_size=8)
+        table.set('x' * 8, (1,))
+        self.assertEqual((1,), table.get('x' * 8))
+        # longer keys are kept as (part of) their hash
+        table.set('x' * 9, (2,))
+        self.assertEqual((2,), table.get('x' * 9))
+        self.assertEqual((1,), table.get('x' * 8))
+        table.set('y' * 100, (3,))
+        self.assertEqual((3,), table.get('y' * 100))
+        self.assertEqual(sorted(['x' * 8, md5(b'x' * 9).hexdigest()[:8],
+                                 md5(b'y' * 100).hexdigest()[:8]]),
+                         sorted(key for key, _junk in table.items()))
+
+
+if __name__ == '__main__':
+    unittest.main()
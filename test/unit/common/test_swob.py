@@ -20,6 +20,7 @@ import unittest
 import re
 import time
 
+import mock
 import six
 from six import BytesIO
 from six.moves.urllib.parse import quote
@@ -98,6 +99,24 @@ class TestHeaderEnvironProxy(unittest.TestCase):
             set(proxy.keys()),
             set(('Content-Length', 'Content-Type', 'Something-Else')))
 
+    def test_environ_key_cache(self):
+        cache = swift.common.swob._environ_key_cache
+        cache.clear()
+        self.assertEqual('HTTP_X_FOO',
+                         swift.common.swob.header_to_environ_key('x-foo'))
+        self.assertEqual('CONTENT_TYPE',
+                         swift.common.swob.header_to_environ_key(
+                             'Content-Type'))
+        self.assertEqual({'x-foo': 'HTTP_X_FOO',
+                          'Content-Type': 'CONTENT_TYPE'}, cache)
+        self.assertEqual('HTTP_X_FOO',
+                         swift.common.swob.header_to_environ_key('x-foo'))
+        with mock.patch('swift.common.swob.ENVIRON_KEY_CACHE_SIZE', 3):
+            for i in range(5):
+                swift.common.swob.header_to_environ_key('x-bar-%d' % i)
+            self.assertLessEqual(len(cache), 3)
+        self.assertEqual('HTTP_X_BAR_4', cache['x-bar-4'])
+
 
 class TestRange(unittest.TestCase):
     def test_range(self):
@@ -565,6 +584,34 @@ class TestRequest(unittest.TestCase):
         req.params = new_params
         self.assertDictEqual(dict(new_params), req.params)
 
+        # the same dict is handed back until the query string changes
+        self.assertIs(req.params, req.params)
+        req.environ['QUERY_STRING'] = 'm=n'
+        self.assertEqual({'m': 'n'}, req.params)
+        del req.environ['QUERY_STRING']
+        self.assertEqual({}, req.params)
+
+    def test_fancy_properties_cached(self):
+        req = swift.common.swob.Request.blank(
+            '/', headers={'Range': 'bytes=1-2', 'If-Match': '"abc"'})
+        self.assertIs(req.range, req.range)
+        self.assertEqual([(1, 2)], req.range.ranges)
+        self.assertIs(req.if_match, req.if_match)
+        self.assertIn('abc', req.if_match)
+        # changes to the headers are noticed, however they're made
+        req.range = 'bytes=3-4'
+        self.assertEqual([(3, 4)], req.range.ranges)
+        req.environ['HTTP_RANGE'] = 'bytes=5-6'
+        self.assertEqual([(5, 6)], req.range.ranges)
+        req.headers['Range'] = 'bytes=junk'
+        self.assertIsNone(req.range)
+        del req.headers['Range']
+        self.assertIsNone(req.range)
+        del req.headers['If-Match']
+        self.assertIsNone(req.if_match)
+        # unless they're absent, accept is always parsed
+        self.assertIsNotNone(req.accept)
+
     def test_timestamp_missing(self):
         req = swift.common.swob.Request.blank('/')
         self.assertRaises(exceptions.InvalidTimestamp,
@@ -23,6 +23,7 @@ from test.unit import temptree, debug_logger, make_timestamp_iter, \
 
 import ctypes
 import contextlib
+import copy
 import errno
 import eventlet
 import eventlet.debug
@@ -50,6 +51,7 @@ from six import BytesIO, StringIO
 from six.moves.queue import Queue, Empty
 from six.moves import http_client
 from six.moves import range
+from six.moves import cPickle as pickle
 from textwrap import dedent
 
 import tempfile
@@ -852,6 +854,40 @@ class TestTimestamp(unittest.TestCase):
         self.assertIn(ts_0, d)  # sanity
         self.assertIn(ts_0_also, d)
 
+    def test_string_forms_cached(self):
+        ts = utils.Timestamp('1402444821.72589')
+        self.assertIs(ts.normal, ts.normal)
+        self.assertIs(ts.internal, ts.normal)
+        ts_offset = utils.Timestamp(ts, offset=1)
+        self.assertEqual('1402444821.72589_0000000000000001',
+                         ts_offset.internal)
+        self.assertIs(ts_offset.internal, ts_offset.internal)
+        # changing the offset is noticed
+        ts_offset.offset = 2
+        self.assertEqual('1402444821.72589_0000000000000002',
+                         ts_offset.internal)
+        ts_offset.offset = 0
+        self.assertEqual('1402444821.72589', ts_offset.internal)
+        with mock.patch('swift.common.utils.FORCE_INTERNAL', True):
+            self.assertEqual('1402444821.72589_0000000000000000',
+                             ts.internal)
+        self.assertEqual('1402444821.72589', ts.internal)
+
+    def test_no_instance_dict(self):
+        ts = utils.Timestamp(time.time())
+        with self.assertRaises(AttributeError):
+            ts.foo = 'bar'
+
+    def test_copy_and_pickle(self):
+        ts = utils.Timestamp(1402444821.725891, offset=3)
+        for copied in (copy.copy(ts), copy.deepcopy(ts),
+                       pickle.loads(pickle.dumps(ts)),
+                       pickle.loads(pickle.dumps(ts, 2))):
+            self.assertEqual(ts, copied)
+            self.assertEqual(ts.internal, copied.internal)
+            self.assertEqual(float(ts), float(copied))
+            self.assertEqual(ts.raw, copied.raw)
+
 
 class TestTimestampEncoding(unittest.TestCase):
 
@@ -5797,6 +5833,28 @@ class TestGreenAsyncPile(unittest.TestCase):
                 events[x].send()
                 self.assertEqual(next(pile), x)
 
+    def test_pending_until_taken(self):
+        def run_test(index):
+            events[index].wait()
+            return index
+
+        events = [eventlet.event.Event(), eventlet.event.Event()]
+        pile = utils.GreenAsyncPile(2)
+        self.assertEqual(0, pile.pending)
+        for x in range(2):
+            pile.spawn(run_test, x)
+        self.assertEqual(2, pile.pending)
+        events[1].send()
+        eventlet.sleep()
+        # a finished job is pending until its result is taken
+        self.assertEqual(1, pile.inflight)
+        self.assertEqual(2, pile.pending)
+        self.assertEqual(1, next(pile))
+        self.assertEqual(1, pile.pending)
+        events[0].send()
+        self.assertEqual([0], list(pile))
+        self.assertEqual(0, pile.pending)
+
     def test_next_when_empty(self):
         def run_test():
             pass
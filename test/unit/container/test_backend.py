@@ -32,7 +32,8 @@ from swift.common.exceptions import LockTimeout
 from swift.container.backend import ContainerBroker, \
     update_new_item_from_existing, UNSHARDED, SHARDING, SHARDED, \
     COLLAPSED, SHARD_LISTING_STATES, SHARD_UPDATE_STATES
-from swift.common.db import DatabaseAlreadyExists, GreenDBConnection
+from swift.common.db import DatabaseAlreadyExists, GreenDBConnection, \
+    ConnectionCache
 from swift.common.utils import Timestamp, encode_timestamps, hash_path, \
     ShardRange, make_db_file_path
 from swift.common.storage_policy import POLICIES
@@ -2963,6 +2964,125 @@ class TestContainerBroker(unittest.TestCase):
             broker.get_info()
         mock_tpool.execute.assert_called_once()
 
+    @patch_policies
+    def test_merge_items_bulk(self):
+        ts = make_timestamp_iter()
+        ts_existing = [next(ts) for _ in range(3)]
+        ts_merge = [next(ts) for _ in range(3)]
+
+        def make_item(name, t, policy=0, deleted=0, ctype_timestamp=None,
+                      meta_timestamp=None):
+            return {'name': name, 'created_at': t.internal, 'size': len(name),
+                    'content_type': 'text/plain', 'etag': name,
+                    'deleted': deleted, 'storage_policy_index': policy,
+                    'ctype_timestamp': ctype_timestamp,
+                    'meta_timestamp': meta_timestamp}
+
+        def make_broker():
+            broker = ContainerBroker(':memory:', account='a', container='c')
+            broker.initialize(Timestamp('1').internal, 0)
+            for name in ('newer', 'same', 'older', 'dup', 'deleted'):
+                broker.put_object(name, ts_existing[1].internal, 1,
+                                  'text/plain', 'x', storage_policy_index=0)
+            broker.put_object('other-policy', ts_existing[1].internal, 1,
+                              'text/plain', 'x', storage_policy_index=1)
+            broker.put_object('complex-row', ts_existing[1].internal, 1,
+                              'text/plain', 'x',
+                              ctype_timestamp=ts_existing[2].internal,
+                              meta_timestamp=ts_existing[2].internal)
+            return broker
+
+        def items():
+            return [
+                make_item('new', ts_merge[0]),
+                make_item('newer', ts_merge[0]),
+                make_item('same', ts_existing[1]),
+                make_item('older', ts_existing[0]),
+                make_item('dup', ts_merge[0]),
+                make_item('dup', ts_merge[1]),
+                make_item('deleted', ts_merge[0], deleted=1),
+                make_item('other-policy', ts_merge[0], policy=0),
+                make_item('complex-row', ts_existing[0]),
+                make_item('complex-item', ts_merge[0],
+                          ctype_timestamp=ts_merge[1].internal,
+                          meta_timestamp=ts_merge[2].internal),
+                make_item('new-deleted', ts_merge[0], deleted=1),
+            ]
+
+        def merged_state(min_items):
+            broker = make_broker()
+            with mock.patch('swift.container.backend.BULK_MERGE_MIN_ITEMS',
+                            min_items), \
+                    mock.patch.object(broker, '_bulk_merge_items',
+                                      wraps=broker._bulk_merge_items) as bulk:
+                broker.merge_items(items())
+            with broker.get() as conn:
+                rows = conn.execute(
+                    'SELECT name, created_at, size, content_type, etag, '
+                    'deleted, storage_policy_index FROM object '
+                    'ORDER BY name, storage_policy_index').fetchall()
+            return (bulk.call_count, [tuple(row) for row in rows],
+                    broker.get_info(), broker.get_policy_stats())
+
+        bulk_calls, bulk_rows, bulk_info, bulk_stats = merged_state(1)
+        self.assertEqual(1, bulk_calls)
+        calls, rows, info, stats = merged_state(len(items()) + 1)
+        self.assertEqual(0, calls)
+        self.assertEqual(rows, bulk_rows)
+        for key in ('object_count', 'bytes_used', 'hash'):
+            self.assertEqual(info[key], bulk_info[key])
+        self.assertEqual(stats, bulk_stats)
+        self.assertEqual(ts_merge[1].internal,
+                         [row[1] for row in rows if row[0] == 'dup'][0])
+        self.assertEqual(ts_existing[1].internal,
+                         [row[1] for row in rows if row[0] == 'older'][0])
+        self.assertEqual(2, len([row for row in rows
+                                 if row[0] == 'other-policy']))
+
+    def test_merge_items_bulk_offsets(self):
+        def make_item(name, t):
+            return {'name': name, 'created_at': t.internal, 'size': 0,
+                    'content_type': 'text/plain', 'etag': name,
+                    'deleted': 0, 'storage_policy_index': 0}
+
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+        broker.merge_items([make_item('o', Timestamp(5, offset=1))])
+        with mock.patch('swift.container.backend.BULK_MERGE_MIN_ITEMS', 1):
+            broker.merge_items([make_item('o', Timestamp(5, offset=2))])
+        self.assertEqual([Timestamp(5, offset=2)], [
+            Timestamp(item['created_at'])
+            for item in broker.get_items_since(-1, 10)])
+
+        # bulk and one by one merges of a mix of timestamps, with and
+        # without offsets, end up in the same state
+        rand = random.Random(48)
+
+        def random_timestamp():
+            return Timestamp(rand.choice((5, 6)),
+                             offset=rand.choice((0, 0, 1, 2, 17)))
+
+        existing = [make_item('o%d' % i, random_timestamp())
+                    for i in range(50)]
+        incoming = [make_item('o%d' % rand.randrange(60), random_timestamp())
+                    for i in range(100)]
+
+        def merged_state(min_items):
+            broker = ContainerBroker(':memory:', account='a', container='c')
+            broker.initialize(Timestamp('1').internal, 0)
+            for item in existing:
+                broker.merge_items([dict(item)])
+            with mock.patch('swift.container.backend.BULK_MERGE_MIN_ITEMS',
+                            min_items):
+                broker.merge_items([dict(item) for item in incoming])
+            with broker.get() as conn:
+                rows = conn.execute(
+                    'SELECT name, created_at FROM object '
+                    'ORDER BY name').fetchall()
+            return [tuple(row) for row in rows], broker.get_info()['hash']
+
+        self.assertEqual(merged_state(len(incoming) + 1), merged_state(1))
+
     def test_merge_items_overwrite_unicode(self):
         # test DatabaseBroker.merge_items
         snowman = u'\N{SNOWMAN}'.encode('utf-8')
@@ -4168,6 +4288,55 @@ class TestContainerBroker(unittest.TestCase):
         self.assertIn('Failed to set matching', lines[0])
         self.assertFalse(lines[1:])
 
+        broker.logger.clear()
+        with mock.patch('swift.container.backend.replace_db_file',
+                        return_value=False):
+            res = broker.set_sharding_state()
+        self.assertFalse(res)
+        lines = broker.logger.get_lines_for_level('error')
+        self.assertIn('Failed to empty the write-ahead log', lines[0])
+        self.assertFalse(lines[1:])
+        self.assertEqual(UNSHARDED, broker.get_db_state())
+
+    @with_tempdir
+    def test_sharding_invalidates_cached_connections(self, tempdir):
+        ts_iter = make_timestamp_iter()
+        retiring_db_path = os.path.join(
+            tempdir, 'part', 'suffix', 'hash', 'container.db')
+        cache = ConnectionCache(4)
+        broker = ContainerBroker(retiring_db_path, account='a', container='c',
+                                 logger=FakeLogger(), connection_cache=cache)
+        broker.initialize(next(ts_iter).internal, 0)
+        broker.enable_sharding(next(ts_iter))
+        broker.get_info()
+        broker.get_info()
+        self.assertEqual(1, len(cache))
+        self.assertTrue(broker.set_sharding_state())
+        fresh_db_path = broker.db_file
+        self.assertNotEqual(retiring_db_path, fresh_db_path)
+        # the brokers for the retiring and fresh dbs share the cache
+        for sub_broker in broker.get_brokers():
+            self.assertIs(cache, sub_broker.connection_cache)
+            sub_broker.get_info()
+        self.assertEqual(2, len(cache))
+
+        # a broker that finds the retiring db gone drops its connections
+        other_broker = ContainerBroker(
+            retiring_db_path, account='a', container='c',
+            connection_cache=cache)
+        self.assertEqual([retiring_db_path, fresh_db_path],
+                         other_broker.db_files)
+        self.assertTrue(broker.set_sharded_state())
+        self.assertEqual(1, len(cache))
+        self.assertFalse(os.path.exists(retiring_db_path))
+        other_broker.reload_db_files()
+        self.assertEqual([fresh_db_path], other_broker.db_files)
+        self.assertEqual(1, len(cache))
+        with mock.patch.object(cache, 'invalidate') as mock_invalidate:
+            other_broker._db_files.append(retiring_db_path)
+            other_broker.reload_db_files()
+        mock_invalidate.assert_called_once_with(retiring_db_path)
+
     @with_tempdir
     def test_set_sharded_state_errors(self, tempdir):
         ts_iter = make_timestamp_iter()
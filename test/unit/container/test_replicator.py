@@ -233,6 +233,52 @@ class TestReplicatorSync(test_db_replicator.TestReplicatorSync):
                              "mismatch remote %s %r != %r" % (
                                  k, remote_info[k], v))
 
+    @mock.patch('swift.common.db.WAL_MODE', True)
+    def test_sync_remote_missing_most_rows_wal_mode(self):
+        put_timestamp = time.time()
+        broker = self._get_broker('a', 'c', node_index=0)
+        broker.initialize(put_timestamp, POLICIES.default.idx)
+        remote_broker = self._get_broker('a', 'c', node_index=1)
+        remote_broker.initialize(put_timestamp, POLICIES.default.idx)
+        for i in range(3):
+            broker.put_object('/a/c/o%d' % i, time.time(), 0, 'content-type',
+                              'etag',
+                              storage_policy_index=broker.storage_policy_index)
+        # the rows are only in the local db's write-ahead log, which the
+        # broker's open connection keeps in place
+        local_info = broker.get_info()
+        self.assertGreater(os.path.getsize(broker.db_file + '-wal'), 0)
+        remote_broker.get_info()
+        self.assertTrue(os.path.exists(remote_broker.db_file + '-wal'))
+
+        node = {'device': 'sdc', 'replication_ip': '127.0.0.1'}
+        daemon = replicator.ContainerReplicator({'per_diff': 1})
+        rsynced = []
+
+        def _rsync_file(db_file, remote_file, **kwargs):
+            remote_server, remote_path = remote_file.split('/', 1)
+            dest_path = os.path.join(self.root, remote_path)
+            shutil.copy(db_file, dest_path)
+            rsynced.append(dest_path)
+            return True
+        daemon._rsync_file = _rsync_file
+        part, node = self._get_broker_part_node(remote_broker)
+        info = broker.get_replication_info()
+        success = daemon._repl_to_node(node, broker, part, info)
+        self.assertTrue(success)
+        self.assertEqual(1, daemon.stats['remote_merge'])
+        # the received db was renamed into place with its log applied
+        self.assertFalse(os.path.exists(rsynced[0]))
+        self.assertFalse(os.path.exists(rsynced[0] + '-wal'))
+        remote_info = self._get_broker(
+            'a', 'c', node_index=1).get_info()
+        for k, v in local_info.items():
+            if k == 'id':
+                continue
+            self.assertEqual(remote_info[k], v,
+                             "mismatch remote %s %r != %r" % (
+                                 k, remote_info[k], v))
+
     def test_sync_remote_missing_one_rows(self):
         put_timestamp = time.time()
         # create "local" broker
@@ -119,6 +119,33 @@ class TestContainerController(unittest.TestCase):
             {'node_timeout': '3.5'})
         self.assertEqual(replicator.node_timeout, 3.5)
 
+    def test_connection_cache(self):
+        self.assertIsNone(self.controller.connection_cache)
+        self.assertIsNone(self.controller._get_container_broker(
+            'sda1', 'p', 'a', 'c').connection_cache)
+
+        controller = container_server.ContainerController(
+            {'devices': self.testdir, 'mount_check': 'false',
+             'db_connection_cache_size': '2'}, logger=self.logger)
+        cache = controller.connection_cache
+        self.assertEqual(2, cache.size)
+        self.assertIs(cache, controller._get_container_broker(
+            'sda1', 'p', 'a', 'c').connection_cache)
+        req = Request.blank('/sda1/p/a/c', method='PUT',
+                            headers={'X-Timestamp': Timestamp(1).internal})
+        self.assertEqual(201, req.get_response(controller).status_int)
+        req = Request.blank('/sda1/p/a/c', method='HEAD')
+        self.assertEqual(204, req.get_response(controller).status_int)
+        self.assertEqual(1, len(cache))
+        # later requests reuse the cached connection
+        with mock.patch('swift.common.db.get_db_connection') as mock_connect:
+            for _ in range(3):
+                req = Request.blank('/sda1/p/a/c', method='HEAD')
+                self.assertEqual(
+                    204, req.get_response(controller).status_int)
+        self.assertFalse(mock_connect.called)
+        self.assertEqual(1, len(cache))
+
     def test_get_and_validate_policy_index(self):
         # no policy is OK
         req = Request.blank('/sda1/p/a/container_default', method='PUT',
@@ -3571,6 +3598,46 @@ class TestContainerController(unittest.TestCase):
         self.assertEqual(resp.content_type, 'text/plain')
         self.assertEqual(resp.body, plain_body)
 
+    def test_GET_streamed(self):
+        # listings are serialized as they are sent, in chunks
+        req = Request.blank(
+            '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+                                    'HTTP_X_TIMESTAMP': '0'})
+        resp = req.get_response(self.controller)
+        for i in range(250):
+            req = Request.blank(
+                '/sda1/p/a/c/%03d' % i, environ={
+                    'REQUEST_METHOD': 'PUT',
+                    'HTTP_X_TIMESTAMP': '1',
+                    'HTTP_X_CONTENT_TYPE': 'text/plain',
+                    'HTTP_X_ETAG': 'x',
+                    'HTTP_X_SIZE': 0})
+            self._update_object_put_headers(req)
+            resp = req.get_response(self.controller)
+            self.assertEqual(resp.status_int, 201)
+        names = ['%03d' % i for i in range(250)]
+
+        for fmt in ('json', 'xml', 'plain'):
+            req = Request.blank('/sda1/p/a/c?format=%s' % fmt,
+                                environ={'REQUEST_METHOD': 'GET'})
+            resp = req.get_response(self.controller)
+            self.assertEqual(resp.status_int, 200)
+            self.assertIsNone(resp.content_length)
+            chunks = list(resp.app_iter)
+            with annotate_failure(fmt):
+                self.assertEqual(3, len(chunks))
+            body = b''.join(chunks)
+            if fmt == 'json':
+                self.assertEqual(names,
+                                 [obj['name'] for obj in json.loads(body)])
+            elif fmt == 'xml':
+                dom = minidom.parseString(body)
+                self.assertEqual(names, [
+                    node.firstChild.nodeValue
+                    for node in dom.getElementsByTagName('name')])
+            else:
+                self.assertEqual(names, body.decode('ascii').splitlines())
+
     def test_GET_json_last_modified(self):
         # make a container
         req = Request.blank(
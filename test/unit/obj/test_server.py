@@ -1172,6 +1172,42 @@ class TestObjectController(unittest.TestCase):
     def test_PUT_redirected_async_pending_with_container_path(self):
         self._check_PUT_redirected_async_pending(container_path='.another/c')
 
+    def test_container_update_redirect_in_response(self):
+        # wait for container updates to complete
+        self.object_controller.container_update_timeout = 1
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'X-Container-Host': 'chost:3200',
+            'X-Container-Partition': '99',
+            'X-Container-Device': 'cdevice'}
+        redirect_headers = {
+            'Location': '/.sharded_a/c_shard_1/o',
+            'X-Backend-Redirect-Timestamp': next(self.ts).internal}
+
+        # an update that isn't redirected
+        req = Request.blank('/sda1/p/a/c/o', method='PUT', body='test',
+                            headers=dict(headers, **{
+                                'X-Timestamp': next(self.ts).internal}))
+        with mocked_http_conn(201), fake_spawn():
+            resp = req.get_response(self.object_controller)
+        self.assertEqual(201, resp.status_int)
+        self.assertNotIn('X-Backend-Redirect', resp.headers)
+
+        # the proxy is told where redirected updates went
+        for method, status in (('PUT', 201), ('POST', 202), ('DELETE', 204)):
+            req = Request.blank('/sda1/p/a/c/o', method=method,
+                                headers=dict(headers, **{
+                                    'X-Timestamp': next(self.ts).internal}))
+            if method == 'PUT':
+                req.body = 'test'
+            with mocked_http_conn(301, headers=[redirect_headers]), \
+                    mock.patch('swift.common.utils.HASH_PATH_PREFIX', ''), \
+                    fake_spawn():
+                resp = req.get_response(self.object_controller)
+            self.assertEqual(status, resp.status_int)
+            self.assertEqual('.sharded_a/c_shard_1',
+                             resp.headers['X-Backend-Redirect'])
+
     def test_POST_quarantine_zbyte(self):
         timestamp = normalize_timestamp(time())
         req = Request.blank('/sda1/p/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
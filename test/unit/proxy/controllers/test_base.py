@@ -18,10 +18,13 @@ import json
 from collections import defaultdict
 import unittest
 import mock
+from eventlet import GreenPool, sleep
 from swift.proxy.controllers.base import headers_to_container_info, \
     headers_to_account_info, headers_to_object_info, get_container_info, \
     get_cache_key, get_account_info, get_info, get_object_info, \
-    Controller, GetOrHeadHandler, bytes_to_skip
+    Controller, GetOrHeadHandler, bytes_to_skip, ProcessInfoCache, \
+    clear_info_cache, get_shard_ranges_from_cache, set_shard_ranges_cache, \
+    SingleFlight, prefetch_info
 from swift.common.swob import Request, HTTPException, RESPONSE_REASONS
 from swift.common import exceptions
 from swift.common.utils import split_path, ShardRange, Timestamp
@@ -30,7 +33,7 @@ from swift.common.http import is_success
 from swift.common.storage_policy import StoragePolicy, StoragePolicyCollection
 from test.unit import (
     fake_http_connect, FakeRing, FakeMemcache, PatchPolicies, FakeLogger,
-    make_timestamp_iter,
+    make_timestamp_iter, debug_logger,
     mocked_http_conn)
 from swift.proxy import server as proxy_server
 from swift.common.request_helpers import (
@@ -410,6 +413,302 @@ class TestFuncs(unittest.TestCase):
         self.assertEqual(1, len(got_infocaches))
         self.assertIs(ic, got_infocaches[0])
 
+    def test_process_info_cache(self):
+        logger = debug_logger()
+        cache = ProcessInfoCache('container', 2, 10, jitter=0, logger=logger)
+        now = [1000.0]
+        with mock.patch('swift.proxy.controllers.base.time.time',
+                        lambda: now[0]):
+            self.assertIsNone(cache.get('container/a/c1'))
+            cache.set('container/a/c1', {'status': 200, 'bytes': 1})
+            self.assertEqual({'status': 200, 'bytes': 1},
+                             cache.get('container/a/c1'))
+            # ttl is capped at the cache's ttl
+            cache.set('container/a/c2', {'status': 200}, ttl=60)
+            now[0] += 9.9
+            self.assertIsNotNone(cache.get('container/a/c2'))
+            now[0] += 0.1
+            self.assertIsNone(cache.get('container/a/c2'))
+            self.assertIsNone(cache.get('container/a/c1'))
+            # negative info is cached for a tenth as long
+            cache.set('container/a/c3', {'status': 404})
+            now[0] += 0.9
+            self.assertIsNotNone(cache.get('container/a/c3'))
+            now[0] += 0.1
+            self.assertIsNone(cache.get('container/a/c3'))
+            # shorter ttls are respected
+            cache.set('container/a/c1', {'status': 200}, ttl=1)
+            now[0] += 1
+            self.assertIsNone(cache.get('container/a/c1'))
+            # least recently used entries are evicted
+            cache.set('container/a/c1', {'status': 200})
+            cache.set('container/a/c2', {'status': 200})
+            cache.get('container/a/c1')
+            cache.set('container/a/c3', {'status': 200})
+            self.assertEqual(2, len(cache))
+            self.assertIsNone(cache.get('container/a/c2'))
+            self.assertIsNotNone(cache.get('container/a/c1'))
+            self.assertIsNotNone(cache.get('container/a/c3'))
+            cache.delete('container/a/c3')
+            self.assertIsNone(cache.get('container/a/c3'))
+        self.assertEqual(6, cache.hits)
+        self.assertEqual(7, cache.misses)
+        self.assertAlmostEqual(6.0 / 13, cache.hit_rate)
+        self.assertEqual({'container.info_cache.hit': 6,
+                          'container.info_cache.miss': 7},
+                         logger.get_increment_counts())
+
+        # entries expire early by up to the jitter
+        cache = ProcessInfoCache('account', 10, 10, jitter=0.5)
+        with mock.patch('swift.proxy.controllers.base.time.time',
+                        lambda: 1000.0), \
+                mock.patch('swift.proxy.controllers.base.random.random',
+                           lambda: 1.0):
+            cache.set('account/a', {'status': 200})
+        with mock.patch('swift.proxy.controllers.base.time.time',
+                        lambda: 1004.9):
+            self.assertIsNotNone(cache.get('account/a'))
+        with mock.patch('swift.proxy.controllers.base.time.time',
+                        lambda: 1005.0):
+            self.assertIsNone(cache.get('account/a'))
+
+        # a cache of no size caches nothing
+        cache = ProcessInfoCache('account', 0, 10)
+        cache.set('account/a', {'status': 200})
+        self.assertIsNone(cache.get('account/a'))
+        self.assertEqual(0, cache.hits + cache.misses)
+
+    def test_get_info_process_cache(self):
+        app = FakeApp()
+        app.info_caches = {
+            'account': ProcessInfoCache('account', 10, 10),
+            'container': ProcessInfoCache('container', 10, 10)}
+        memcache = FakeCache({})
+        req = Request.blank("/v1/a/c", environ={'swift.cache': memcache})
+        info = get_container_info(req.environ, app)
+        self.assertEqual(200, info['status'])
+        self.assertEqual(1, app.responses.stats['account'])
+        self.assertEqual(1, app.responses.stats['container'])
+        self.assertEqual(1, len(app.info_caches['account']))
+        self.assertEqual(1, len(app.info_caches['container']))
+
+        # a new request finds the info without going to memcache
+        memcache.stub = {'status': 500}
+        req = Request.blank("/v1/a/c", environ={'swift.cache': memcache})
+        info = get_container_info(req.environ, app)
+        self.assertEqual(200, info['status'])
+        self.assertEqual(1, app.responses.stats['account'])
+        self.assertEqual(1, app.responses.stats['container'])
+        self.assertEqual(1, app.info_caches['container'].hits)
+        self.assertIn(get_cache_key('a', 'c'), req.environ['swift.infocache'])
+
+        # clearing the info cache clears the process cache too
+        clear_info_cache(app, req.environ, 'a', 'c')
+        memcache.stub = None
+        req = Request.blank("/v1/a/c", environ={'swift.cache': memcache})
+        get_container_info(req.environ, app)
+        self.assertEqual(1, app.responses.stats['account'])
+        self.assertEqual(2, app.responses.stats['container'])
+
+        # info found in memcache is cached in the process too
+        app.info_caches['account'].delete(get_cache_key('a'))
+        memcache = FakeCache({'status': 200, 'container_count': 42})
+        req = Request.blank("/v1/a", environ={'swift.cache': memcache})
+        self.assertEqual(42, get_account_info(
+            req.environ, app)['container_count'])
+        self.assertEqual({'status': 200, 'container_count': 42},
+                         app.info_caches['account'].get(get_cache_key('a')))
+
+    def test_prefetch_info(self):
+        class ManyCache(FakeCache):
+            def __init__(self, *args, **kwargs):
+                super(ManyCache, self).__init__(*args, **kwargs)
+                self.get_many_calls = []
+
+            def get(self, key):
+                raise AssertionError('unexpected get of %r' % key)
+
+            def get_many(self, keys):
+                self.get_many_calls.append(keys)
+                return [self.store.get(key) for key in keys]
+
+        app = FakeApp()
+        memcache = ManyCache(**{
+            get_cache_key('a'): {'status': 200, 'container_count': 1},
+            get_cache_key('a', 'c'): {'status': 200, 'object_count': 2,
+                                      'versions': u'\u1F4A9'}})
+        req = Request.blank("/v1/a/c/o", environ={'swift.cache': memcache})
+        prefetch_info(req.environ, app, 'a', 'c')
+        self.assertEqual([[get_cache_key('a'), get_cache_key('a', 'c')]],
+                         memcache.get_many_calls)
+        self.assertEqual(1, get_account_info(
+            req.environ, app)['container_count'])
+        info = get_container_info(req.environ, app)
+        self.assertEqual(2, info['object_count'])
+        self.assertEqual('\xe1\xbd\x8a\x39', info['versions'])
+        self.assertEqual(0, app.responses.stats['account'])
+        self.assertEqual(0, app.responses.stats['container'])
+
+        # info that's already to hand isn't fetched again
+        prefetch_info(req.environ, app, 'a', 'c')
+        self.assertEqual(1, len(memcache.get_many_calls))
+        del req.environ['swift.infocache'][get_cache_key('a', 'c')]
+        prefetch_info(req.environ, app, 'a', 'c')
+        self.assertEqual(1, len(memcache.get_many_calls))
+
+        # misses are left for the usual lookup
+        req = Request.blank("/v1/a/c2", environ={'swift.cache': memcache})
+        prefetch_info(req.environ, app, 'a', 'c2')
+        self.assertEqual(2, len(memcache.get_many_calls))
+        self.assertEqual([get_cache_key('a')],
+                         list(req.environ['swift.infocache']))
+
+        # a memcache client without get_many isn't used
+        memcache = FakeCache({'status': 200})
+        req = Request.blank("/v1/a/c", environ={'swift.cache': memcache})
+        prefetch_info(req.environ, app, 'a', 'c')
+        self.assertNotIn('swift.infocache', req.environ)
+
+    def test_single_flight(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        def func(result):
+            calls.append(result)
+            sleep(0.01)
+            return result
+
+        pool = GreenPool()
+        results = [pool.spawn(single_flight.do, 'key', lambda: func(1)),
+                   pool.spawn(single_flight.do, 'key', lambda: func(2)),
+                   pool.spawn(single_flight.do, 'other', lambda: func(3))]
+        self.assertEqual([1, 1, 3], [gt.wait() for gt in results])
+        self.assertEqual([1, 3], calls)
+        self.assertEqual(0, len(single_flight))
+
+        # callers make their own calls once the first is done...
+        self.assertEqual(4, single_flight.do('key', lambda: func(4)))
+        # ...or if it has nothing to share
+        del calls[:]
+        results = [pool.spawn(single_flight.do, 'key', lambda: func(None)),
+                   pool.spawn(single_flight.do, 'key', lambda: func(5))]
+        self.assertEqual([None, 5], [gt.wait() for gt in results])
+        self.assertEqual([None, 5], calls)
+
+        # nor is an error shared
+        def fail():
+            sleep(0.01)
+            raise ValueError('boom')
+
+        def do_fail():
+            try:
+                single_flight.do('key', fail)
+            except ValueError as err:
+                return err
+
+        results = [pool.spawn(do_fail),
+                   pool.spawn(single_flight.do, 'key', lambda: func(6))]
+        self.assertIsInstance(results[0].wait(), ValueError)
+        self.assertEqual(6, results[1].wait())
+        self.assertEqual(0, len(single_flight))
+
+    def test_get_info_single_flight(self):
+        class SlowApp(FakeApp):
+            def __call__(self, environ, start_response):
+                sleep(0.01)
+                return super(SlowApp, self).__call__(environ, start_response)
+
+        app = SlowApp()
+        app.info_single_flight = SingleFlight()
+        envs = [Request.blank('/v1/a/c').environ for _junk in range(3)]
+        pool = GreenPool()
+        results = [pool.spawn(get_container_info, env, app) for env in envs]
+        for gt in results:
+            self.assertEqual(200, gt.wait()['status'])
+        self.assertEqual(1, app.responses.stats['account'])
+        self.assertEqual(1, app.responses.stats['container'])
+        for env in envs:
+            self.assertIn(get_cache_key('a', 'c'), env['swift.infocache'])
+            self.assertIn(get_cache_key('a'), env['swift.infocache'])
+
+        # without single flight, each lookup makes its own requests
+        app = SlowApp()
+        envs = [Request.blank('/v1/a/c').environ for _junk in range(3)]
+        results = [pool.spawn(get_container_info, env, app) for env in envs]
+        for gt in results:
+            self.assertEqual(200, gt.wait()['status'])
+        self.assertEqual(3, app.responses.stats['account'])
+        self.assertEqual(3, app.responses.stats['container'])
+
+    def test_get_cache_key_shard(self):
+        self.assertEqual('shard-updating/a/c',
+                         get_cache_key('a', 'c', shard='updating'))
+        self.assertEqual('shard-listing/a/c',
+                         get_cache_key('a', 'c', shard='listing'))
+        with self.assertRaises(ValueError):
+            get_cache_key('a', shard='updating')
+        with self.assertRaises(ValueError):
+            get_cache_key('a', 'c', 'o', shard='updating')
+
+    def test_shard_ranges_cache(self):
+        app = FakeApp()
+        app.info_caches = {'shard': ProcessInfoCache('shard', 10, 10)}
+        memcache = FakeCache()
+        shard_ranges = [
+            ShardRange('.shards_a/c_m', Timestamp.now(), '', 'm',
+                       object_count=3, state=ShardRange.ACTIVE),
+            ShardRange('.shards_a/c_', Timestamp.now(), 'm', '',
+                       object_count=4, state=ShardRange.ACTIVE)]
+        req = Request.blank('/v1/a/c', environ={'swift.cache': memcache})
+        self.assertIsNone(get_shard_ranges_from_cache(
+            app, req.environ, 'a', 'c', 'updating'))
+        set_shard_ranges_cache(app, req.environ, 'a', 'c', 'updating',
+                               shard_ranges, 60)
+        # only the namespaces are kept in memcache
+        self.assertEqual([['', 'm', '.shards_a/c_m'],
+                          ['m', '', '.shards_a/c_']],
+                         memcache.store['shard-updating/a/c'])
+
+        def check(cached):
+            self.assertEqual(
+                [(sr.name, sr.lower, sr.upper) for sr in shard_ranges],
+                [(sr.name, sr.lower, sr.upper) for sr in cached])
+
+        check(get_shard_ranges_from_cache(
+            app, req.environ, 'a', 'c', 'updating'))
+        self.assertIn('shard-updating/a/c', req.environ['swift.infocache'])
+
+        # a new request finds them in the process cache...
+        req = Request.blank('/v1/a/c', environ={'swift.cache': memcache})
+        check(get_shard_ranges_from_cache(
+            app, req.environ, 'a', 'c', 'updating'))
+        self.assertEqual(1, app.info_caches['shard'].hits)
+
+        # ...or in memcache
+        app.info_caches['shard'].delete('shard-updating/a/c')
+        req = Request.blank('/v1/a/c', environ={'swift.cache': memcache})
+        check(get_shard_ranges_from_cache(
+            app, req.environ, 'a', 'c', 'updating'))
+        self.assertIsNotNone(app.info_caches['shard'].get(
+            'shard-updating/a/c'))
+        # listing shard ranges are cached separately
+        self.assertIsNone(get_shard_ranges_from_cache(
+            app, req.environ, 'a', 'c', 'listing'))
+
+        # clearing them clears every cache
+        set_shard_ranges_cache(app, req.environ, 'a', 'c', 'updating', None)
+        self.assertNotIn('shard-updating/a/c', memcache.store)
+        self.assertNotIn('shard-updating/a/c', req.environ['swift.infocache'])
+        self.assertIsNone(app.info_caches['shard'].get('shard-updating/a/c'))
+        self.assertIsNone(get_shard_ranges_from_cache(
+            app, req.environ, 'a', 'c', 'updating'))
+
+        # junk in memcache is a miss
+        memcache.store['shard-updating/a/c'] = ['junk']
+        self.assertIsNone(get_shard_ranges_from_cache(
+            app, {'swift.cache': memcache}, 'a', 'c', 'updating'))
+        self.assertNotIn('shard-updating/a/c', memcache.store)
+
     def test_get_account_info_no_cache(self):
         app = FakeApp()
         req = Request.blank("/v1/AUTH_account",
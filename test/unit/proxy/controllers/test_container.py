@@ -18,7 +18,7 @@ import mock
 import socket
 import unittest
 
-from eventlet import Timeout
+from eventlet import Timeout, sleep
 from six.moves import urllib
 
 from swift.common.constraints import CONTAINER_LISTING_LIMIT
@@ -296,7 +296,7 @@ class TestContainerController(TestRingBase):
 
         for method in ('PUT', 'DELETE', 'POST'):
             def test_status_map(statuses, expected):
-                self.app._error_limiting = {}
+                self.app._error_limiting.clear()
                 req = Request.blank('/v1/a/c', method=method)
                 with mocked_http_conn(*statuses) as fake_conn:
                     resp = req.get_response(self.app)
@@ -448,6 +448,8 @@ class TestContainerController(TestRingBase):
                 self.assertGreater(name(prev), name(next_))
             else:
                 self.assertLess(name(prev), name(next_))
+        # these listings fetch their shard ranges from the root container
+        self.app.memcache.store.clear()
         container_path = '/v1/a/c' + query_string
         codes = (resp[0] for resp in mock_responses)
         bodies = iter([json.dumps(resp[1]) for resp in mock_responses])
@@ -822,6 +824,192 @@ class TestContainerController(TestRingBase):
             query_string='?delimiter=/')
         self.check_response(resp, root_resp_hdrs)
 
+    def test_GET_sharded_container_concurrent_shard_listings(self):
+        shard_bounds = (('', 'ham'), ('ham', 'pie'), ('pie', ''))
+        shard_ranges = [
+            ShardRange('.shards_a/c_%s' % upper, Timestamp.now(), lower, upper)
+            for lower, upper in shard_bounds]
+        sr_dicts = [dict(sr) for sr in shard_ranges]
+        sr_objs = [self._make_shard_objects(sr) for sr in shard_ranges]
+        # some misplaced objects below the second shard's range, which a
+        # listing that has reached the end of the first shard must skip
+        sr_objs[1] = sorted(sr_objs[1] + [
+            dict(sr_objs[1][0], name=name)
+            for name in ('d0', 'd1', 'e0', 'e1', 'f0', 'f1')],
+            key=lambda obj: obj['name'])
+        objects_by_container = {
+            sr.container: objs for sr, objs in zip(shard_ranges, sr_objs)}
+        root_shard_resp_hdrs = {'X-Backend-Sharding-State': 'sharded',
+                                'X-Backend-Record-Type': 'shard',
+                                'X-Container-Object-Count': 100,
+                                'X-Container-Bytes-Used': 1000,
+                                'X-Backend-Storage-Policy-Index': 0}
+        backend_calls = []
+
+        def fake_get_container_listing(req, account, container, headers=None,
+                                       params=None):
+            # yield so that concurrent fetches interleave
+            sleep(0)
+            backend_calls.append((container, dict(params)))
+            reverse = params.get('reverse') == 'true'
+            objs = objects_by_container[container]
+            if reverse:
+                objs = list(reversed(objs))
+            marker = params.get('marker')
+            end_marker = params.get('end_marker')
+            prefix = params.get('prefix')
+            if marker:
+                objs = [o for o in objs if (o['name'] < marker if reverse
+                                            else o['name'] > marker)]
+            if end_marker:
+                objs = [o for o in objs if (o['name'] > end_marker if reverse
+                                            else o['name'] < end_marker)]
+            if prefix:
+                objs = [o for o in objs if o['name'].startswith(prefix)]
+            return objs[:int(params['limit'])], None
+
+        def do_listing(query_string, concurrency):
+            self.app.shard_listing_concurrency = concurrency
+            del backend_calls[:]
+            req = Request.blank('/v1/a/c' + query_string)
+            with mocked_http_conn(
+                    200, body_iter=[json.dumps(sr_dicts)],
+                    headers=[root_shard_resp_hdrs]), \
+                    mock.patch.object(
+                        proxy_server.ContainerController,
+                        '_get_container_listing',
+                        side_effect=fake_get_container_listing):
+                resp = req.get_response(self.app)
+            self.assertEqual(200, resp.status_int)
+            return json.loads(resp.body), list(backend_calls)
+
+        query_strings = [
+            '', '?reverse=true', '?limit=3', '?limit=45', '?prefix=j',
+            '?marker=c', '?marker=c&limit=8', '?marker=c&limit=45',
+            '?end_marker=k', '?end_marker=k&limit=44',
+            '?marker=c&end_marker=r&limit=20',
+            '?marker=k&end_marker=c&limit=20&reverse=true',
+            '?marker=s&limit=8&reverse=true',
+        ]
+        for query_string in query_strings:
+            with annotate_failure(query_string):
+                expected, serial_calls = do_listing(query_string, 1)
+                self.assertTrue(expected)
+                for concurrency in (2, 3, 4):
+                    actual, calls = do_listing(query_string, concurrency)
+                    self.assertEqual(expected, actual)
+
+        # shards after the first are fetched before the first is processed
+        actual, calls = do_listing('', 3)
+        self.assertEqual(
+            [(sr.container, '') for sr in shard_ranges],
+            [(container, params['marker']) for container, params in calls])
+
+        # a listing fetched ahead is fetched again when skipping misplaced
+        # objects leaves too few
+        actual, calls = do_listing('?marker=c&limit=8', 2)
+        self.assertEqual(
+            ['d', 'e', 'f', 'g', 'h', 'i', 'j', 'k'],
+            [obj['name'] for obj in actual])
+        self.assertEqual([
+            (shard_ranges[0].container, 'c', 8),
+            (shard_ranges[1].container, 'c', 8),
+            (shard_ranges[1].container, 'h', 3),
+        ], [(container, params['marker'], params['limit'])
+            for container, params in calls])
+
+    def test_GET_sharded_container_with_cache(self):
+        shard_bounds = (('', 'ham'), ('ham', 'pie'), ('pie', ''))
+        shard_ranges = [
+            ShardRange('.shards_a/c_%s' % upper, Timestamp.now(), lower, upper)
+            for lower, upper in shard_bounds]
+        sr_dicts = [dict(sr) for sr in shard_ranges]
+        sr_objs = [self._make_shard_objects(sr) for sr in shard_ranges]
+        objects_by_container = {
+            sr.container: objs for sr, objs in zip(shard_ranges, sr_objs)}
+        root_resp_hdrs = {'X-Backend-Sharding-State': 'sharded',
+                          'X-Backend-Record-Type': 'object',
+                          'X-Container-Object-Count': 100,
+                          'X-Container-Bytes-Used': 1000,
+                          'X-Backend-Storage-Policy-Index': 0}
+        root_shard_resp_hdrs = dict(root_resp_hdrs,
+                                    **{'X-Backend-Record-Type': 'shard'})
+        shard_calls = []
+
+        def fake_get_container_listing(req, account, container, headers=None,
+                                       params=None):
+            shard_calls.append((container, params['marker'],
+                                params['end_marker']))
+            objs = [o for o in objects_by_container[container]
+                    if o['name'] > params['marker'] and
+                    (not params['end_marker'] or
+                     o['name'] < params['end_marker'])]
+            return objs[:int(params['limit'])], None
+
+        def do_listing(query_string, *root_responses):
+            del shard_calls[:]
+            req = Request.blank('/v1/a/c' + query_string)
+            with mocked_http_conn(
+                    *[status for status, _body, _hdrs in root_responses],
+                    body_iter=[json.dumps(body)
+                               for _status, body, _hdrs in root_responses],
+                    headers=[hdrs for _status, _body, hdrs
+                             in root_responses]) as fake_conn, \
+                    mock.patch.object(
+                        proxy_server.ContainerController,
+                        '_get_container_listing',
+                        side_effect=fake_get_container_listing):
+                resp = req.get_response(self.app)
+            self.assertEqual(200, resp.status_int)
+            return (json.loads(resp.body),
+                    [req['headers']['X-Backend-Record-Type']
+                     for req in fake_conn.requests])
+
+        # a constrained listing doesn't fill the cache
+        objs, root_requests = do_listing(
+            '?marker=j', (200, sr_dicts[1:], root_shard_resp_hdrs))
+        self.assertEqual(['auto'], root_requests)
+        self.assertNotIn('shard-listing/a/c', self.app.memcache.store)
+
+        # an unconstrained listing does
+        objs, root_requests = do_listing(
+            '', (200, sr_dicts, root_shard_resp_hdrs))
+        self.assertEqual(['auto'], root_requests)
+        self.assertEqual(sum(sr_objs, []), objs)
+        self.assertEqual(
+            [[sr.lower_str, sr.upper_str, sr.name] for sr in shard_ranges],
+            self.app.memcache.store['shard-listing/a/c'])
+
+        # then the root is only asked for its headers
+        objs, root_requests = do_listing(
+            '?marker=j', (200, [], root_resp_hdrs))
+        self.assertEqual(['object'], root_requests)
+        self.assertEqual([o for o in sum(sr_objs, []) if o['name'] > 'j'],
+                         objs)
+        self.assertEqual([('c_pie', 'j', 'pie\x00'), ('c_', 'p', '')],
+                         shard_calls)
+        objs, root_requests = do_listing(
+            '?marker=j&end_marker=c&reverse=true', (200, [], root_resp_hdrs))
+        self.assertEqual(['object'], root_requests)
+        self.assertEqual(['c_pie', 'c_ham'],
+                         [call[0] for call in shard_calls])
+
+        # the cache is forgotten once the root is no longer sharded
+        unsharded_hdrs = dict(root_resp_hdrs,
+                              **{'X-Backend-Sharding-State': 'unsharded'})
+        objs, root_requests = do_listing(
+            '', (200, [], unsharded_hdrs), (200, [], unsharded_hdrs))
+        self.assertEqual(['object', 'auto'], root_requests)
+        self.assertEqual([], shard_calls)
+        self.assertNotIn('shard-listing/a/c', self.app.memcache.store)
+
+        # or when the cache is disabled
+        self.app.recheck_listing_shard_ranges = 0
+        objs, root_requests = do_listing(
+            '', (200, sr_dicts, root_shard_resp_hdrs))
+        self.assertEqual(['auto'], root_requests)
+        self.assertNotIn('shard-listing/a/c', self.app.memcache.store)
+
     def test_GET_sharded_container_overlapping_shards(self):
         # verify ordered listing even if unexpected overlapping shard ranges
         shard_bounds = (('', 'ham', ShardRange.CLEAVED),
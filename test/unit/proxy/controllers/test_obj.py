@@ -27,17 +27,18 @@ import json
 from hashlib import md5
 
 import mock
-from eventlet import Timeout
+from eventlet import GreenPool, Timeout, sleep
 from six import BytesIO
 from six.moves import range
 
 import swift
 from swift.common import utils, swob, exceptions
+from swift.common.ec_codec import ECCodecExecutor
 from swift.common.exceptions import ChunkWriteTimeout
 from swift.common.utils import Timestamp, list_from_csv
 from swift.proxy import server as proxy_server
 from swift.proxy.controllers import obj
-from swift.proxy.controllers.base import \
+from swift.proxy.controllers.base import SingleFlight, \
     get_container_info as _real_get_container_info
 from swift.common.storage_policy import POLICIES, ECDriverError, \
     StoragePolicy, ECStoragePolicy
@@ -1180,7 +1181,7 @@ class TestReplicatedObjController(CommonObjectControllerMixin,
         self.app.sort_nodes = lambda n, *args, **kwargs: n  # disable shuffle
 
         def test_status_map(statuses, expected):
-            self.app._error_limiting = {}
+            self.app._error_limiting.clear()
             req = swob.Request.blank('/v1/a/c/o.jpg', method='PUT',
                                      body='test body')
             with set_http_connect(*statuses):
@@ -1450,6 +1451,58 @@ class TestReplicatedObjController(CommonObjectControllerMixin,
         self.assertIn('Accept-Ranges', resp.headers)
         self.assertNotIn('Connection', resp.headers)
 
+    def test_GET_coalesced(self):
+        self.app.object_single_flight = SingleFlight()
+
+        def app(env, start_response):
+            # PatchedObjControllerApp's patching isn't safe for concurrent
+            # requests, so give them the container info up front
+            env['swift.infocache'] = {
+                'container/a/c': dict(self.app.container_info)}
+            return proxy_server.Application.__call__(
+                self.app, env, start_response)
+
+        def do_requests(*headers_list, **kwargs):
+            pool = GreenPool()
+            threads = [pool.spawn(swob.Request.blank(
+                '/v1/a/c/o', headers=headers, **kwargs).get_response, app)
+                for headers in headers_list]
+            return [gt.wait() for gt in threads]
+
+        # identical requests share one backend request, but conditional
+        # requests make their own
+        with set_http_connect(200, 200, body=b'hello', slow_connect=True):
+            resps = do_requests({}, {}, {'If-None-Match': 'x'}, {})
+        for resp in resps:
+            self.assertEqual(resp.status_int, 200)
+            self.assertEqual(resp.body, b'hello')
+            self.assertEqual(resp.headers['Content-Length'], '5')
+        self.assertEqual(2, self.app.logger.get_increment_counts()[
+            'object.coalesced'])
+        self.assertEqual(0, len(self.app.object_single_flight))
+
+        # as do requests for different ranges
+        with set_http_connect(206, 206, body=b'h', slow_connect=True,
+                              headers={'Content-Range': 'bytes 0-0/5'}):
+            resps = do_requests({'Range': 'bytes=0-0'},
+                                {'Range': 'bytes=0-0'},
+                                {'Range': 'bytes=1-1'})
+        self.assertEqual([206] * 3, [resp.status_int for resp in resps])
+
+        # bodies too big to share aren't
+        self.app.coalesce_max_body_size = 4
+        with set_http_connect(200, 200, body=b'hello', slow_connect=True):
+            resps = do_requests({}, {})
+        self.assertEqual([b'hello'] * 2, [resp.body for resp in resps])
+
+        # but HEADs always are
+        with set_http_connect(200, body=b'hello', slow_connect=True):
+            resps = do_requests({}, {}, method='HEAD')
+        for resp in resps:
+            self.assertEqual(resp.status_int, 200)
+            self.assertEqual(resp.headers['Content-Length'], '5')
+            self.assertEqual(resp.body, b'')
+
     def test_GET_transfer_encoding_chunked(self):
         req = swift.common.swob.Request.blank('/v1/a/c/o')
         with set_http_connect(200, headers={'transfer-encoding': 'chunked'}):
@@ -2285,6 +2338,29 @@ class TestECObjController(ECObjectControllerMixin, unittest.TestCase):
         self.assertEqual(len(real_body), len(resp.body))
         self.assertEqual(real_body, resp.body)
 
+    def test_GET_with_body_decoded_in_batches(self):
+        self.app.ec_codec = mock.MagicMock(
+            wraps=ECCodecExecutor(), **{'batch_segments.return_value': 3})
+        req = swift.common.swob.Request.blank('/v1/a/c/o')
+        segment_size = self.policy.ec_segment_size
+        real_body = ('asdf' * segment_size)[:-10]
+        frag_archives = self._make_ec_archive_bodies(real_body)
+        headers = {'X-Object-Sysmeta-Ec-Content-Length': str(len(real_body))}
+        responses = [(200, frag_archives[i], headers)
+                     for i in range(self.policy.ec_ndata)]
+        status_codes, body_iter, headers = zip(*responses)
+        with set_http_connect(*status_codes, body_iter=body_iter,
+                              headers=headers):
+            resp = req.get_response(self.app)
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(real_body, resp.body)
+        # fragments that have all arrived are decoded together
+        batches = [len(call[0][1])
+                   for call in self.app.ec_codec.decode.call_args_list]
+        self.assertEqual(4, sum(batches))
+        self.assertLess(len(batches), 4)
+        self.assertLessEqual(max(batches), 3)
+
     def test_GET_with_frags_swapped_around(self):
         segment_size = self.policy.ec_segment_size
         test_data = ('test' * segment_size)[:-657]
@@ -3521,6 +3597,48 @@ class TestECObjController(ECObjectControllerMixin, unittest.TestCase):
         self.assertEqual(1, len(error_lines))
         self.assertIn('retrying', error_lines[0])
 
+    def _test_GET_with_slow_first_fragment(self, response_sleep):
+        obj1 = self._make_ec_object_stub()
+        node_frags = [{'obj': obj1, 'frag': i}
+                      for i in range(self.replicas())]
+        fake_response = self._fake_ec_node_response(node_frags)
+        calls = []
+
+        def get_response(req):
+            calls.append(req)
+            if len(calls) == 1:
+                sleep(response_sleep)
+            return fake_response(req)
+
+        req = swob.Request.blank('/v1/a/c/o')
+        start = time.time()
+        with capture_http_requests(get_response) as log:
+            resp = req.get_response(self.app)
+            self.assertEqual(resp.status_int, 200)
+            self.assertEqual(md5(resp.body).hexdigest(), obj1['etag'])
+        return time.time() - start, log
+
+    def test_GET_hedges_slow_fragment_getter(self):
+        self.app.concurrent_gets = True
+        self.app.adaptive_concurrency_timeout = True
+        self.app.concurrency_timeout = 0.5
+        # the app has learned that responses usually come back quickly
+        for _junk in range(proxy_server.MIN_NODE_RESPONSE_TIMING_SAMPLES):
+            self.app.node_timing.record_first_byte(
+                proxy_server.NodeLatencyTracker.ALL_NODES, 0.01)
+        elapsed, log = self._test_GET_with_slow_first_fragment(2.0)
+        # an extra fragment was fetched rather than waiting for the slow one
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(self.policy.ec_ndata + 1, len(log))
+        self.assertFalse(self.logger.get_lines_for_level('error'))
+
+    def test_GET_no_hedging_without_adaptive_concurrency_timeout(self):
+        self.app.concurrent_gets = True
+        self.app.concurrency_timeout = 0.01
+        elapsed, log = self._test_GET_with_slow_first_fragment(0.1)
+        self.assertGreaterEqual(elapsed, 0.1)
+        self.assertEqual(self.policy.ec_ndata, len(log))
+
     def test_fix_response_HEAD(self):
         headers = {'X-Object-Sysmeta-Ec-Content-Length': '10',
                    'X-Object-Sysmeta-Ec-Etag': 'foo'}
@@ -3672,6 +3790,41 @@ class TestECFunctions(unittest.TestCase):
         do_test(1)
         do_test(2)
 
+    def test_chunk_transformer_unaligned_chunks(self):
+        policy = ECStoragePolicy(0, 'ec8-2', ec_type=DEFAULT_TEST_EC_TYPE,
+                                 ec_ndata=8, ec_nparity=2,
+                                 object_ring=FakeRing(replicas=10),
+                                 ec_segment_size=1024)
+        body = ''.join(chr(i % 26 + 97) * 100 for i in range(30))
+        segments = [body[i:i + 1024] for i in range(0, len(body), 1024)]
+        frag_sets = [policy.pyeclib_driver.encode(segment)
+                     for segment in segments]
+        ec_codec = mock.MagicMock(wraps=ECCodecExecutor())
+
+        transform = obj.chunk_transformer(policy, ec_codec)
+        transform.send(None)
+        results = []
+        for i in range(0, len(body), 700):
+            results.append(transform.send(body[i:i + 700]))
+        # segments are encoded as soon as they're complete, and a chunk that
+        # completes more than one segment has them encoded in one batch
+        self.assertEqual([None] + [[''.join(frags) for frags in zip(
+            *frag_sets[i:j])] for i, j in ((0, 1), (1, 2))],
+            results[:3])
+        self.assertEqual([mock.call(policy, segments[0:1]),
+                          mock.call(policy, segments[1:2])],
+                         ec_codec.encode.call_args_list[:2])
+        self.assertEqual([None, None], results[3:])
+        self.assertEqual(frag_sets[-1], transform.send(''))
+
+        # a single chunk of several segments is encoded in one call
+        ec_codec.reset_mock()
+        transform = obj.chunk_transformer(policy, ec_codec)
+        transform.send(None)
+        transform.send(body)
+        self.assertEqual([mock.call(policy, segments[:-1])],
+                         ec_codec.encode.call_args_list)
+
 
 @patch_policies([ECStoragePolicy(0, name='ec', is_default=True,
                                  ec_type=DEFAULT_TEST_EC_TYPE, ec_ndata=10,
@@ -72,7 +72,7 @@ from swift.common.utils import hash_path, storage_directory, \
 from swift.common.wsgi import monkey_patch_mimetools, loadapp, ConfigString
 from swift.proxy.controllers import base as proxy_base
 from swift.proxy.controllers.base import get_cache_key, cors_validation, \
-    get_account_info, get_container_info
+    get_account_info, get_container_info, SingleFlight
 import swift.proxy.controllers
 import swift.proxy.controllers.obj
 from swift.common.header_key_dict import HeaderKeyDict
@@ -150,22 +150,20 @@ def node_error_count(proxy_app, ring_node):
     # Reach into the proxy's internals to get the error count for a
     # particular node
     node_key = proxy_app._error_limit_node_key(ring_node)
-    return proxy_app._error_limiting.get(node_key, {}).get('errors', 0)
+    return proxy_app._error_limiting.get(node_key, (0, 0.0))[0]
 
 
 def node_last_error(proxy_app, ring_node):
     # Reach into the proxy's internals to get the last error for a
     # particular node
     node_key = proxy_app._error_limit_node_key(ring_node)
-    return proxy_app._error_limiting.get(node_key, {}).get('last_error')
+    return proxy_app._error_limiting.get(node_key, (0, 0.0))[1] or None
 
 
 def set_node_errors(proxy_app, ring_node, value, last_error):
     # Set the node's error count to value
     node_key = proxy_app._error_limit_node_key(ring_node)
-    stats = proxy_app._error_limiting.setdefault(node_key, {})
-    stats['errors'] = value
-    stats['last_error'] = last_error
+    proxy_app._error_limiting.set(node_key, (value, last_error or 0.0))
 
 
 class FakeMemcacheReturnsNone(FakeMemcache):
@@ -767,28 +765,170 @@ class TestProxyServer(unittest.TestCase):
                                            FakeMemcache(),
                                            container_ring=FakeRing(),
                                            account_ring=FakeRing())
-        self.assertEqual(baseapp.node_timings, {})
+        self.assertEqual(list(baseapp.node_timing.table.items()), [])
 
         req = Request.blank('/v1/account', environ={'REQUEST_METHOD': 'HEAD'})
         baseapp.update_request(req)
-        resp = baseapp.handle_request(req)
+        with mocked_http_conn(*([Timeout()] * 3)):
+            resp = baseapp.handle_request(req)
         self.assertEqual(resp.status_int, 503)  # couldn't connect to anything
-        exp_timings = {}
-        self.assertEqual(baseapp.node_timings, exp_timings)
+        self.assertEqual(list(baseapp.node_timing.table.items()), [])
 
-        times = [time.time()]
-        exp_timings = {'127.0.0.1': (0.1, times[0] + baseapp.timing_expiry)}
-        with mock.patch('swift.proxy.server.time', lambda: times.pop(0)):
-            baseapp.set_node_timing({'ip': '127.0.0.1'}, 0.1)
-        self.assertEqual(baseapp.node_timings, exp_timings)
-
-        nodes = [{'ip': '127.0.0.1'}, {'ip': '127.0.0.2'}, {'ip': '127.0.0.3'}]
+        # nodes that connect but don't respond have only a connect timing
+        with mocked_http_conn(200, 200, 200, raise_timeout_exc=True), \
+                mock.patch.object(baseapp, 'set_node_response_timing') as \
+                mock_response_timing:
+            resp = baseapp.handle_request(req)
+        self.assertEqual(resp.status_int, 503)
+        self.assertEqual(3, len(list(baseapp.node_timing.table.items())))
+        self.assertFalse(mock_response_timing.called)
+        baseapp.node_timing.table.clear()
+        baseapp._error_limiting.clear()
+
+        node = {'ip': '127.0.0.1', 'port': 6202, 'device': 'sda'}
+        node_key = baseapp._error_limit_node_key(node)
+        now = time.time()
+        with mock.patch('swift.proxy.server.time', lambda: now):
+            baseapp.set_node_timing(node, 0.1)
+        self.assertEqual([node_key], [
+            key for key, _junk in baseapp.node_timing.table.items()])
+        self.assertEqual(0.1, baseapp.node_timing.get_latency(node_key))
+
+        nodes = [node, dict(node, ip='127.0.0.2'), dict(node, ip='127.0.0.3')]
         with mock.patch('swift.proxy.server.shuffle', lambda l: l):
-            res = baseapp.sort_nodes(nodes)
-        exp_sorting = [{'ip': '127.0.0.2'}, {'ip': '127.0.0.3'},
-                       {'ip': '127.0.0.1'}]
+            res = baseapp.sort_nodes(list(nodes))
+        exp_sorting = [nodes[1], nodes[2], nodes[0]]
         self.assertEqual(res, exp_sorting)
 
+        # first byte timings trump connect timings
+        with mock.patch('swift.proxy.server.time',
+                        lambda: now + baseapp.timing_expiry):
+            baseapp.set_node_timing(nodes[1], 0.01)
+            baseapp.set_node_response_timing(nodes[1], 0.5)
+            baseapp.set_node_timing(nodes[2], 0.2)
+        with mock.patch('swift.proxy.server.shuffle', lambda l: l):
+            res = baseapp.sort_nodes(list(nodes))
+        self.assertEqual(res, [nodes[0], nodes[2], nodes[1]])
+
+        # timings expire
+        with mock.patch('swift.proxy.server.time',
+                        lambda: now + baseapp.timing_expiry + 1):
+            self.assertIsNone(baseapp.node_timing.get_latency(node_key))
+            with mock.patch('swift.proxy.server.shuffle', lambda l: l):
+                res = baseapp.sort_nodes(list(nodes))
+        self.assertEqual(res, [nodes[0], nodes[2], nodes[1]])
+        with mock.patch('swift.proxy.server.time',
+                        lambda: now + baseapp.timing_expiry * 2 + 1):
+            with mock.patch('swift.proxy.server.shuffle', lambda l: l):
+                res = baseapp.sort_nodes(list(nodes))
+        self.assertEqual(res, nodes)
+
+    def test_node_timing_shared_between_apps(self):
+        swift_dir = mkdtemp()
+        try:
+            conf = {'sorting_method': 'timing',
+                    'node_timing_file': os.path.join(swift_dir, 'timings')}
+            apps = [proxy_server.Application(conf,
+                                             FakeMemcache(),
+                                             container_ring=FakeRing(),
+                                             account_ring=FakeRing())
+                    for _junk in range(2)]
+            nodes = [{'ip': '127.0.0.%d' % i, 'port': 6202, 'device': 'sda'}
+                     for i in range(3)]
+            for i, node in enumerate(nodes):
+                apps[0].set_node_timing(node, 0.1 * (3 - i))
+            # what one worker learned is used by another
+            with mock.patch('swift.proxy.server.shuffle', lambda l: l):
+                res = apps[1].sort_nodes(list(nodes))
+            self.assertEqual(res, nodes[::-1])
+            # ... and survives a restart
+            apps[0].node_timing.table.close()
+            app = proxy_server.Application(conf,
+                                           FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           account_ring=FakeRing())
+            with mock.patch('swift.proxy.server.shuffle', lambda l: l):
+                res = app.sort_nodes(list(nodes))
+            self.assertEqual(res, nodes[::-1])
+        finally:
+            rmtree(swift_dir, ignore_errors=True)
+
+    def test_node_latency_tracker(self):
+        tracker = proxy_server.NodeLatencyTracker(expiry=60)
+        self.assertIsNone(tracker.get_latency('n'))
+        self.assertIsNone(tracker.get_first_byte_percentile('n', 50))
+        tracker.record_connect('n', 0.1)
+        self.assertEqual(0.1, tracker.get_latency('n'))
+        self.assertIsNone(tracker.get_first_byte_percentile('n', 50))
+        tracker.record_connect('n', 0.2)
+        self.assertAlmostEqual(0.13, tracker.get_latency('n'))
+        tracker.record_first_byte('n', 1.0)
+        self.assertEqual(1.0, tracker.get_latency('n'))
+        tracker.record_first_byte('n', 0.5)
+        self.assertAlmostEqual(0.85, tracker.get_latency('n'))
+        # histogram buckets are a quarter octave wide
+        self.assertAlmostEqual(
+            0.5, tracker.get_first_byte_percentile('n', 50), delta=0.1)
+        self.assertAlmostEqual(
+            1.0, tracker.get_first_byte_percentile('n', 100), delta=0.2)
+        self.assertIsNone(tracker.get_first_byte_percentile(
+            'n', 50, min_samples=3))
+        # aggregate of first byte timings
+        tracker.record_first_byte('m', 0.001)
+        self.assertAlmostEqual(0.001, tracker.get_first_byte_percentile(
+            tracker.ALL_NODES, 10), delta=0.001)
+        # old counts decay
+        for i in range(tracker.HISTOGRAM_MAX_SAMPLES):
+            tracker.record_first_byte('m', 0.1)
+        self.assertAlmostEqual(
+            0.1, tracker.get_first_byte_percentile('m', 1), delta=0.02)
+        values = tracker.table.get('m')
+        self.assertLess(sum(values[3 + tracker.HISTOGRAM_BUCKETS:]),
+                        tracker.HISTOGRAM_MAX_SAMPLES)
+        # very slow nodes fall in the last bucket
+        tracker.record_first_byte('slow', 100)
+        self.assertEqual(float('inf'),
+                         tracker.get_first_byte_percentile('slow', 50))
+
+    def test_node_latency_tracker_shared(self):
+        swift_dir = mkdtemp()
+        try:
+            path = os.path.join(swift_dir, 'timings')
+            trackers = [proxy_server.NodeLatencyTracker(path, expiry=60)
+                        for _junk in range(2)]
+            trackers[0].record_first_byte('n', 0.1)
+            self.assertEqual(0.1, trackers[1].get_latency('n'))
+            # each worker keeps the stats of all nodes to itself
+            self.assertIsNotNone(trackers[0].get_first_byte_percentile(
+                trackers[0].ALL_NODES, 50))
+            self.assertIsNone(trackers[1].get_first_byte_percentile(
+                trackers[1].ALL_NODES, 50))
+            self.assertEqual(['n'], [
+                key for key, _junk in trackers[1].table.items()])
+            # keys too long for the table are still tracked
+            node_key = '[2001:db8:85a3:8d3:1319:8a2e:370:7348]:6201/' \
+                'wwn-0x5000c500a1b2c3d4-part1'
+            trackers[0].record_connect(node_key, 0.2)
+            self.assertEqual(0.2, trackers[1].get_latency(node_key))
+        finally:
+            rmtree(swift_dir, ignore_errors=True)
+
+    def test_node_latency_tracker_full(self):
+        logger = debug_logger()
+        tracker = proxy_server.NodeLatencyTracker(
+            expiry=60, num_slots=2, logger=logger)
+        now = time.time()
+        with mock.patch('swift.proxy.server.time', lambda: now):
+            tracker.record_connect('a', 0.1)
+            tracker.record_connect('b', 0.1)
+            tracker.record_connect('c', 0.1)
+        self.assertIsNone(tracker.get_latency('c'))
+        self.assertIn('is full', logger.get_lines_for_level('error')[0])
+        # stale stats make way for new ones
+        with mock.patch('swift.proxy.server.time', lambda: now + 61):
+            tracker.record_connect('c', 0.1)
+            self.assertEqual(0.1, tracker.get_latency('c'))
+
     def _do_sort_nodes(self, conf, policy_conf, nodes, policy,
                        node_timings=None):
         # Note with shuffling mocked out, sort_nodes will by default return
@@ -830,7 +970,7 @@ class TestProxyServer(unittest.TestCase):
         self.assertEqual([nodes[2], nodes[0], nodes[1]], actual)
         # check that node timings are not collected if sorting_method != timing
         self.assertFalse(app.sorts_by_timing)  # sanity check
-        self.assertFalse(app.node_timings)  # sanity check
+        self.assertFalse(list(app.node_timing.table.items()))
 
         # proxy-server affinity conf is to prefer region 1
         conf = {'sorting_method': 'affinity', 'read_affinity': 'r1=1'}
@@ -891,9 +1031,12 @@ class TestProxyServer(unittest.TestCase):
 
     def test_sort_nodes_by_affinity_per_policy_overrides(self):
         # default setting is to sort by timing but policy 0 uses read affinity
-        nodes = [{'region': 0, 'zone': 1, 'ip': '127.0.0.3'},
-                 {'region': 1, 'zone': 1, 'ip': '127.0.0.1'},
-                 {'region': 2, 'zone': 2, 'ip': '127.0.0.2'}]
+        nodes = [{'region': 0, 'zone': 1, 'ip': '127.0.0.3',
+                  'port': 6200, 'device': 'sda'},
+                 {'region': 1, 'zone': 1, 'ip': '127.0.0.1',
+                  'port': 6200, 'device': 'sda'},
+                 {'region': 2, 'zone': 2, 'ip': '127.0.0.2',
+                  'port': 6200, 'device': 'sda'}]
         node_timings = [10, 1, 100]
         conf = {'sorting_method': 'timing'}
         per_policy = {'0': {'sorting_method': 'affinity',
@@ -903,7 +1046,7 @@ class TestProxyServer(unittest.TestCase):
         self.assertEqual([nodes[1], nodes[2], nodes[0]], actual)
         # check that timings are collected despite one policy using affinity
         self.assertTrue(app.sorts_by_timing)
-        self.assertEqual(3, len(app.node_timings))
+        self.assertEqual(3, len(list(app.node_timing.table.items())))
         # check app defaults to sorting by timing when no policy specified
         app, actual = self._do_sort_nodes(conf, per_policy, nodes, None,
                                           node_timings=node_timings)
@@ -913,9 +1056,12 @@ class TestProxyServer(unittest.TestCase):
                      StoragePolicy(1, 'one', False, object_ring=FakeRing())])
     def test_sort_nodes_by_timing_per_policy(self):
         # default setting is to sort by affinity but policy 0 uses timing
-        nodes = [{'region': 0, 'zone': 1, 'ip': '127.0.0.3'},
-                 {'region': 1, 'zone': 1, 'ip': '127.0.0.1'},
-                 {'region': 2, 'zone': 2, 'ip': '127.0.0.2'}]
+        nodes = [{'region': 0, 'zone': 1, 'ip': '127.0.0.3',
+                  'port': 6200, 'device': 'sda'},
+                 {'region': 1, 'zone': 1, 'ip': '127.0.0.1',
+                  'port': 6200, 'device': 'sda'},
+                 {'region': 2, 'zone': 2, 'ip': '127.0.0.2',
+                  'port': 6200, 'device': 'sda'}]
         node_timings = [10, 1, 100]
 
         conf = {'sorting_method': 'affinity', 'read_affinity': 'r1=1,r2=2'}
@@ -927,7 +1073,7 @@ class TestProxyServer(unittest.TestCase):
                                           node_timings=node_timings)
         self.assertEqual([nodes[1], nodes[0], nodes[2]], actual)
         self.assertTrue(app.sorts_by_timing)
-        self.assertEqual(3, len(app.node_timings))
+        self.assertEqual(3, len(list(app.node_timing.table.items())))
 
         # policy 1 uses policy specific read affinity
         app, actual = self._do_sort_nodes(conf, per_policy, nodes, POLICIES[1],
@@ -1021,6 +1167,186 @@ class TestProxyServer(unittest.TestCase):
                 # Should get 127.0.0.2 as this has a wait of 1 seconds.
                 self.assertEqual(resp.body, 'Response from 127.0.0.2')
 
+    def test_info_cache_config(self):
+        app = proxy_server.Application({}, FakeMemcache(),
+                                       container_ring=FakeRing(),
+                                       account_ring=FakeRing())
+        for server_type in ('account', 'container'):
+            info_cache = app.info_caches[server_type]
+            self.assertEqual(server_type, info_cache.server_type)
+            self.assertEqual(0, info_cache.max_entries)
+            self.assertEqual(5, info_cache.ttl)
+            self.assertEqual(0.1, info_cache.jitter)
+
+        conf = {'account_info_cache_size': '100',
+                'account_info_cache_ttl': '2.5',
+                'container_info_cache_size': '1000',
+                'container_info_cache_ttl': '10',
+                'info_cache_jitter': '0.2'}
+        app = proxy_server.Application(conf, FakeMemcache(),
+                                       container_ring=FakeRing(),
+                                       account_ring=FakeRing())
+        self.assertEqual(100, app.info_caches['account'].max_entries)
+        self.assertEqual(2.5, app.info_caches['account'].ttl)
+        self.assertEqual(1000, app.info_caches['container'].max_entries)
+        self.assertEqual(10, app.info_caches['container'].ttl)
+        self.assertEqual(0.2, app.info_caches['container'].jitter)
+
+        for bad in ('-0.1', '1.1'):
+            conf['info_cache_jitter'] = bad
+            with self.assertRaises(ValueError):
+                proxy_server.Application(conf, FakeMemcache(),
+                                         container_ring=FakeRing(),
+                                         account_ring=FakeRing())
+
+    def test_coalesce_config(self):
+        app = proxy_server.Application({}, FakeMemcache(),
+                                       container_ring=FakeRing(),
+                                       account_ring=FakeRing())
+        self.assertIsNone(app.info_single_flight)
+        self.assertIsNone(app.object_single_flight)
+        self.assertEqual(65536, app.coalesce_max_body_size)
+
+        conf = {'coalesce_info_requests': 'yes',
+                'coalesce_object_requests': 'true',
+                'coalesce_max_body_size': '1024'}
+        app = proxy_server.Application(conf, FakeMemcache(),
+                                       container_ring=FakeRing(),
+                                       account_ring=FakeRing())
+        self.assertIsInstance(app.info_single_flight, SingleFlight)
+        self.assertIsInstance(app.object_single_flight, SingleFlight)
+        self.assertIsNot(app.info_single_flight, app.object_single_flight)
+        self.assertEqual(1024, app.coalesce_max_body_size)
+
+    def test_shard_listing_concurrency_config(self):
+        app = proxy_server.Application({}, FakeMemcache(),
+                                       container_ring=FakeRing(),
+                                       account_ring=FakeRing())
+        self.assertEqual(1, app.shard_listing_concurrency)
+        app = proxy_server.Application({'shard_listing_concurrency': '4'},
+                                       FakeMemcache(),
+                                       container_ring=FakeRing(),
+                                       account_ring=FakeRing())
+        self.assertEqual(4, app.shard_listing_concurrency)
+        with self.assertRaises(ValueError):
+            proxy_server.Application({'shard_listing_concurrency': '0'},
+                                     FakeMemcache(),
+                                     container_ring=FakeRing(),
+                                     account_ring=FakeRing())
+
+    def test_adaptive_concurrency_timeout(self):
+        nodes = [{'ip': '127.0.0.%d' % i, 'port': 6010, 'device': 'sda'}
+                 for i in range(1, 3)]
+        app_conf = {'concurrent_gets': 'on',
+                    'concurrency_timeout': 0.5}
+        baseapp = proxy_server.Application(app_conf,
+                                           FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        self.assertFalse(baseapp.adaptive_concurrency_timeout)
+        baseapp.set_node_response_timing(nodes[0], 0.1)
+        self.assertFalse(list(baseapp.node_timing.table.items()))
+        self.assertEqual(0.5, baseapp.get_concurrency_timeout(nodes[0]))
+
+        app_conf['adaptive_concurrency_timeout'] = 'on'
+        baseapp = proxy_server.Application(app_conf,
+                                           FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        self.assertTrue(baseapp.adaptive_concurrency_timeout)
+        self.assertEqual(95, baseapp.concurrency_timeout_percentile)
+        # not enough samples yet
+        for i in range(proxy_server.MIN_NODE_RESPONSE_TIMING_SAMPLES - 1):
+            baseapp.set_node_response_timing(nodes[0], 0.01)
+        self.assertEqual(0.5, baseapp.get_concurrency_timeout(nodes[0]))
+        self.assertEqual(0.5, baseapp.get_concurrency_timeout())
+        for i in range(100 - proxy_server.MIN_NODE_RESPONSE_TIMING_SAMPLES):
+            baseapp.set_node_response_timing(nodes[0], 0.01)
+        baseapp.set_node_response_timing(nodes[0], 0.2)
+        # timings are bucketed to a quarter of an octave
+        self.assertAlmostEqual(
+            0.01, baseapp.get_concurrency_timeout(nodes[0]), delta=0.002)
+        self.assertAlmostEqual(
+            0.01, baseapp.get_concurrency_timeout(), delta=0.002)
+        # nothing is known about the other node
+        self.assertEqual(0.5, baseapp.get_concurrency_timeout(nodes[1]))
+        # a slow node's timeout is capped at concurrency_timeout
+        for i in range(100):
+            baseapp.set_node_response_timing(nodes[1], 0.2 + i * 0.01)
+        self.assertEqual(0.5, baseapp.get_concurrency_timeout(nodes[1]))
+        baseapp.concurrency_timeout = 2
+        self.assertAlmostEqual(
+            1.14, baseapp.get_concurrency_timeout(nodes[1]), delta=0.2)
+
+        for bad in ('0', '-1', '101'):
+            app_conf['concurrency_timeout_percentile'] = bad
+            with self.assertRaises(ValueError):
+                proxy_server.Application(app_conf,
+                                         FakeMemcache(),
+                                         container_ring=FakeRing(),
+                                         account_ring=FakeRing())
+
+    def test_adaptive_concurrency_timeout_closes_losing_sources(self):
+        nodes = [{'region': 1, 'zone': 1, 'ip': '127.0.0.1', 'port': 6010,
+                  'device': 'sda'},
+                 {'region': 2, 'zone': 2, 'ip': '127.0.0.2', 'port': 6010,
+                  'device': 'sda'},
+                 {'region': 3, 'zone': 3, 'ip': '127.0.0.3', 'port': 6010,
+                  'device': 'sda'}]
+        timings = {'127.0.0.1': 0.3, '127.0.0.2': 0.01, '127.0.0.3': 0.2}
+        responses = []
+        req = Request.blank('/v1/account', environ={'REQUEST_METHOD': 'GET'})
+
+        def fake_iter_nodes(*arg, **karg):
+            return iter(nodes)
+
+        class FakeConn(object):
+            def __init__(self, ip, *args, **kargs):
+                self.ip = ip
+
+            def getresponse(self):
+                resp = mock.Mock()
+                resp.read.side_effect = ['Response from %s' % self.ip, '']
+                resp.getheader = lambda header, *args: (
+                    '' if header == 'Content-Type' else 1)
+                resp.getheaders.return_value = {}
+                resp.reason = ''
+                resp.status = 200
+                sleep(timings[self.ip])
+                responses.append((self.ip, resp))
+                return resp
+
+        app_conf = {'concurrent_gets': 'on',
+                    'adaptive_concurrency_timeout': 'on',
+                    'concurrency_timeout': 1}
+        baseapp = proxy_server.Application(app_conf,
+                                           FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        for node in nodes:
+            for i in range(proxy_server.MIN_NODE_RESPONSE_TIMING_SAMPLES):
+                baseapp.set_node_response_timing(node, 0.05)
+
+        with mock.patch('swift.proxy.server.Application.iter_nodes',
+                        fake_iter_nodes), \
+                mock.patch('swift.common.bufferedhttp.http_connect_raw',
+                           FakeConn):
+            baseapp.update_request(req)
+            resp = baseapp.handle_request(req)
+            # the first node is slow, so the second is tried after 0.05s
+            # rather than after the 1s concurrency_timeout
+            self.assertEqual(resp.body, 'Response from 127.0.0.2')
+            # let the losers finish
+            sleep(0.4)
+
+        self.assertEqual(['127.0.0.2', '127.0.0.1'],
+                         [ip for ip, _junk in responses])
+        # the loser was closed...
+        self.assertEqual([mock.call()],
+                         responses[1][1].nuke_from_orbit.mock_calls)
+        # ... and the third node was never bothered
+        self.assertNotIn('127.0.0.3', [ip for ip, _junk in responses])
+
     def test_info_defaults(self):
         app = proxy_server.Application({}, FakeMemcache(),
                                        account_ring=FakeRing(),
@@ -1057,14 +1383,13 @@ class TestProxyServer(unittest.TestCase):
                                            container_ring=FakeRing(),
                                            logger=logger)
             node = app.container_ring.get_part_nodes(0)[0]
-            node_key = app._error_limit_node_key(node)
-            self.assertNotIn(node_key, app._error_limiting)  # sanity
+            self.assertEqual(0, node_error_count(app, node))  # sanity
             try:
                 raise Exception('kaboom1!')
             except Exception as err:
                 app.exception_occurred(node, 'server-type', additional_info)
 
-            self.assertEqual(1, app._error_limiting[node_key]['errors'])
+            self.assertEqual(1, node_error_count(app, node))
             line = logger.get_lines_for_level('error')[-1]
             self.assertIn('server-type server', line)
             self.assertIn(additional_info.decode('utf8'), line)
@@ -1087,12 +1412,11 @@ class TestProxyServer(unittest.TestCase):
                                            container_ring=FakeRing(),
                                            logger=logger)
             node = app.container_ring.get_part_nodes(0)[0]
-            node_key = app._error_limit_node_key(node)
-            self.assertNotIn(node_key, app._error_limiting)  # sanity
+            self.assertEqual(0, node_error_count(app, node))  # sanity
 
             app.error_occurred(node, msg)
 
-            self.assertEqual(1, app._error_limiting[node_key]['errors'])
+            self.assertEqual(1, node_error_count(app, node))
             line = logger.get_lines_for_level('error')[-1]
             self.assertIn(msg.decode('utf8'), line)
             self.assertIn(node['ip'], line)
@@ -1103,6 +1427,72 @@ class TestProxyServer(unittest.TestCase):
         do_test('succès')
         do_test(u'success')
 
+    def test_error_limiting_shared_between_apps(self):
+        swift_dir = mkdtemp()
+        try:
+            conf = {'error_limit_file': os.path.join(swift_dir, 'errors')}
+            apps = [proxy_server.Application(conf, FakeMemcache(),
+                                             account_ring=FakeRing(),
+                                             container_ring=FakeRing(),
+                                             logger=debug_logger())
+                    for _junk in range(2)]
+            node = apps[0].container_ring.get_part_nodes(0)[0]
+            apps[0].error_occurred(node, 'test msg')
+            apps[1].error_occurred(node, 'test msg')
+            self.assertEqual(2, node_error_count(apps[0], node))
+            self.assertFalse(apps[1].error_limited(node))
+            # one worker error limiting a node protects the others
+            apps[0].error_limit(node, 'test msg')
+            self.assertTrue(apps[1].error_limited(node))
+            # ...even after a restart
+            app = proxy_server.Application(conf, FakeMemcache(),
+                                           account_ring=FakeRing(),
+                                           container_ring=FakeRing(),
+                                           logger=debug_logger())
+            self.assertTrue(app.error_limited(node))
+            # and the error limit expires for all of them
+            with mock.patch('swift.proxy.server.time', lambda: time.time() +
+                            app.error_suppression_interval + 1):
+                self.assertFalse(app.error_limited(node))
+            self.assertFalse(apps[0].error_limited(node))
+            self.assertEqual(0, node_error_count(apps[1], node))
+        finally:
+            rmtree(swift_dir, ignore_errors=True)
+
+    def test_error_limiting_long_node_keys(self):
+        app = proxy_server.Application({}, FakeMemcache(),
+                                       account_ring=FakeRing(),
+                                       container_ring=FakeRing(),
+                                       logger=debug_logger())
+        node = {'ip': '2001:db8:85a3:8d3:1319:8a2e:370:7348', 'port': 6201,
+                'device': 'wwn-0x5000c500a1b2c3d4-part1', 'id': 0}
+        self.assertGreater(len(app._error_limit_node_key(node)), 64)
+        app.error_occurred(node, 'test msg')
+        self.assertEqual(1, node_error_count(app, node))
+        self.assertFalse(app.error_limited(node))
+        app.error_limit(node, 'test msg')
+        self.assertTrue(app.error_limited(node))
+
+    def test_error_limiting_table_full(self):
+        logger = debug_logger()
+        app = proxy_server.Application({'error_limit_slots': '2'},
+                                       FakeMemcache(),
+                                       account_ring=FakeRing(),
+                                       container_ring=FakeRing(),
+                                       logger=logger)
+        nodes = app.container_ring.get_part_nodes(0)
+        app.error_limit(nodes[0], 'test msg')
+        app.error_limit(nodes[1], 'test msg')
+        app.error_limit(nodes[2], 'test msg')
+        self.assertFalse(app.error_limited(nodes[2]))
+        self.assertIn('is full', logger.get_lines_for_level('error')[-2])
+        # once a node's errors are old enough to be forgotten, its slot can
+        # go to another node
+        later = time.time() + app.error_suppression_interval + 1
+        with mock.patch('swift.proxy.server.time', lambda: later):
+            app.error_limit(nodes[2], 'test msg')
+            self.assertTrue(app.error_limited(nodes[2]))
+
     def test_error_limit_methods(self):
         logger = debug_logger('test')
         app = proxy_server.Application({}, FakeMemcache(),
@@ -2333,6 +2723,80 @@ class TestReplicatedObjectController(
                          'bytes 4123-4523/5800')
         self.assertEqual(second_range_body, obj[4123:4524])
 
+    @unpatch_policies
+    def test_GET_ranges_split(self):
+        prolis = _test_sockets[0]
+        prosrv = _test_servers[0]
+        sock = connect_tcp(('localhost', prolis.getsockname()[1]))
+        fd = sock.makefile()
+        obj = (''.join(
+            ('beans lots of beans lots of beans lots of beans yeah %04d ' % i)
+            for i in range(100)))
+
+        path = '/v1/a/c/o.split.beans'
+        fd.write('PUT %s HTTP/1.1\r\n'
+                 'Host: localhost\r\n'
+                 'Connection: close\r\n'
+                 'X-Storage-Token: t\r\n'
+                 'Content-Length: %s\r\n'
+                 'Content-Type: application/octet-stream\r\n'
+                 '\r\n%s' % (path, str(len(obj)), obj))
+        fd.flush()
+        headers = readuntil2crlfs(fd)
+        exp = 'HTTP/1.1 201'
+        self.assertEqual(headers[:len(exp)], exp)
+
+        def get_parts(range_header):
+            req = Request.blank(path, headers={'Range': range_header})
+            res = req.get_response(prosrv)
+            self.assertEqual(res.status_int, 206)
+            self.assertEqual(int(res.headers['Content-Length']),
+                             len(res.body))
+            ct, params = parse_content_type(res.headers['Content-Type'])
+            self.assertEqual(ct, 'multipart/byteranges')
+            parts = []
+            for mime_doc_fh in iter_multipart_mime_documents(
+                    StringIO(res.body), dict(params)['boundary']):
+                headers = parse_mime_headers(mime_doc_fh)
+                parts.append((headers['Content-Type'],
+                              headers['Content-Range'], mime_doc_fh.read()))
+            return parts
+
+        range_header = 'bytes=10-200,1000-1099,2000-,-100,4123-4523'
+        expected = get_parts(range_header)
+        self.assertEqual(5, len(expected))
+
+        backend_ranges = []
+        orig_GETorHEAD_base = ReplicatedObjectController.GETorHEAD_base
+
+        def fake_GETorHEAD_base(controller, req, *args, **kwargs):
+            backend_ranges.append(req.headers.get('Range'))
+            return orig_GETorHEAD_base(controller, req, *args, **kwargs)
+
+        with mock.patch.object(prosrv, 'multi_range_get_concurrency', 3), \
+                mock.patch.object(ReplicatedObjectController,
+                                  'GETorHEAD_base', fake_GETorHEAD_base):
+            self.assertEqual(expected, get_parts(range_header))
+            # the object has two replicas, so the ranges are split in two
+            self.assertEqual(['bytes=10-200,1000-1099,2000-',
+                              'bytes=-100,4123-4523'], backend_ranges)
+
+            # too few ranges to split
+            del backend_ranges[:]
+            self.assertEqual(expected[:2], get_parts('bytes=10-200,1000-1099'))
+            self.assertEqual(['bytes=10-200,1000-1099'], backend_ranges)
+
+            # ranges that an object server wouldn't serve as asked aren't
+            # split
+            del backend_ranges[:]
+            req = Request.blank(path, headers={
+                'Range': 'bytes=0-100,50-150,60-160,70-170'})
+            res = req.get_response(prosrv)
+            self.assertEqual(res.status_int, 416)
+            self.assertEqual(['bytes=0-100,50-150', 'bytes=60-160,70-170',
+                              'bytes=0-100,50-150,60-160,70-170'],
+                             backend_ranges)
+
     @unpatch_policies
     def test_GET_bad_range_zero_byte(self):
         prolis = _test_sockets[0]
@@ -2484,7 +2948,7 @@ class TestReplicatedObjectController(
         bytes_before_timeout[0] = 700
         kaboomed[0] = 0
         sabotaged[0] = False
-        prosrv._error_limiting = {}  # clear out errors
+        prosrv._error_limiting.clear()  # clear out errors
         with mock.patch.object(proxy_base,
                                'http_response_to_document_iters',
                                sabotaged_hrtdi):  # perma-broken
@@ -2522,7 +2986,7 @@ class TestReplicatedObjectController(
         bytes_before_timeout[0] = 300
         kaboomed[0] = 0
         sabotaged[0] = False
-        prosrv._error_limiting = {}  # clear out errors
+        prosrv._error_limiting.clear()  # clear out errors
         with mock.patch.object(proxy_base,
                                'http_response_to_document_iters',
                                single_sabotage_hrtdi):
@@ -2560,7 +3024,7 @@ class TestReplicatedObjectController(
         bytes_before_timeout[0] = 501
         kaboomed[0] = 0
         sabotaged[0] = False
-        prosrv._error_limiting = {}  # clear out errors
+        prosrv._error_limiting.clear()  # clear out errors
         with mock.patch.object(proxy_base,
                                'http_response_to_document_iters',
                                single_sabotage_hrtdi):
@@ -2598,7 +3062,7 @@ class TestReplicatedObjectController(
         bytes_before_timeout[0] = 750
         kaboomed[0] = 0
         sabotaged[0] = False
-        prosrv._error_limiting = {}  # clear out errors
+        prosrv._error_limiting.clear()  # clear out errors
         with mock.patch.object(proxy_base,
                                'http_response_to_document_iters',
                                single_sabotage_hrtdi):
@@ -3394,7 +3858,7 @@ class TestReplicatedObjectController(
         self.app.obj_controller_router = proxy_server.ObjectControllerRouter()
         self.app.sort_nodes = lambda nodes, *args, **kwargs: nodes
 
-        def do_test(method, sharding_state):
+        def do_test(method, sharding_state, expected_params):
             self.app.memcache.store = {}
             req = Request.blank('/v1/a/c/o', {}, method=method, body='',
                                 headers={'Content-Type': 'text/plain'})
@@ -3442,7 +3906,9 @@ class TestReplicatedObjectController(
             container_request_shard = backend_requests[2]
             check_request(
                 container_request_shard, method='GET', path='/sda/0/a/c',
-                params={'includes': 'o'})
+                params=expected_params)
+            if 'includes' not in expected_params:
+                self.assertNotIn('includes', container_request_shard['qs'])
 
             # make sure backend requests included expected container headers
             container_headers = {}
@@ -3469,12 +3935,79 @@ class TestReplicatedObjectController(
                 expected[device] = '10.0.0.%d:100%d' % (i, i)
             self.assertEqual(container_headers, expected)
 
-        do_test('POST', 'sharding')
-        do_test('POST', 'sharded')
-        do_test('DELETE', 'sharding')
-        do_test('DELETE', 'sharded')
-        do_test('PUT', 'sharding')
-        do_test('PUT', 'sharded')
+        # all the updating shard ranges are fetched, to be cached
+        for method in ('POST', 'DELETE', 'PUT'):
+            for sharding_state in ('sharding', 'sharded'):
+                do_test(method, sharding_state, {'states': 'updating'})
+            self.assertIn('shard-updating/a/c', self.app.memcache.store)
+
+        # without the cache, only the shard range for the object is fetched
+        self.app.recheck_updating_shard_ranges = 0
+        for method in ('POST', 'DELETE', 'PUT'):
+            for sharding_state in ('sharding', 'sharded'):
+                do_test(method, sharding_state,
+                        {'states': 'updating', 'includes': 'o'})
+            self.assertNotIn('shard-updating/a/c', self.app.memcache.store)
+
+    @patch_policies([
+        StoragePolicy(0, 'zero', is_default=True, object_ring=FakeRing()),
+        StoragePolicy(1, 'one', object_ring=FakeRing()),
+    ])
+    def test_backend_headers_update_shard_container_cached(self):
+        # verify that the updating shard ranges are cached, and forgotten
+        # once an object server says an update was redirected
+        self.app.obj_controller_router = proxy_server.ObjectControllerRouter()
+        self.app.sort_nodes = lambda nodes, *args, **kwargs: nodes
+        self.app.memcache.store = {}
+        shard_ranges = [
+            utils.ShardRange('.shards_a/c_m', utils.Timestamp.now(), '', 'm'),
+            utils.ShardRange('.shards_a/c_', utils.Timestamp.now(), 'm', '')]
+        resp_headers = {'X-Backend-Storage-Policy-Index': 1,
+                        'x-backend-sharding-state': 'sharded',
+                        'X-Backend-Record-Type': 'shard'}
+
+        def do_post(obj, status_codes, headers=None):
+            req = Request.blank('/v1/a/c/%s' % obj, method='POST',
+                                headers={'Content-Type': 'text/plain'})
+            with mocked_http_conn(
+                    *status_codes, headers=headers or resp_headers,
+                    body=json.dumps([dict(sr) for sr in shard_ranges])
+            ) as fake_conn:
+                resp = req.get_response(self.app)
+            self.assertEqual(resp.status_int, 202)
+            return fake_conn.requests
+
+        # acc HEAD, cont HEAD, cont shard GET, obj POSTs
+        requests = do_post('a', (200, 200, 200, 202, 202, 202))
+        self.assertEqual('states=updating&format=json', requests[2]['qs'])
+        self.assertEqual(
+            ['.shards_a/c_m'] * 3,
+            [req['headers']['X-Backend-Container-Path']
+             for req in requests[3:]])
+        self.assertIn('shard-updating/a/c', self.app.memcache.store)
+
+        # other objects' updates are targeted using the cached shard ranges
+        requests = do_post('x', (202, 202, 202))
+        self.assertEqual(
+            ['.shards_a/c_'] * 3,
+            [req['headers']['X-Backend-Container-Path'] for req in requests])
+
+        # a redirected update clears the cache
+        do_post('x', (202, 202, 202),
+                headers={'X-Backend-Redirect': '.shards_a/c_x'})
+        self.assertNotIn('shard-updating/a/c', self.app.memcache.store)
+        requests = do_post('x', (200, 202, 202, 202))
+        self.assertEqual('GET', requests[0]['method'])
+        self.assertIn('shard-updating/a/c', self.app.memcache.store)
+
+        # as does a redirected PUT update
+        req = Request.blank('/v1/a/c/x', method='PUT', body='',
+                            headers={'Content-Type': 'text/plain'})
+        with mocked_http_conn(201, 201, 201, headers={
+                'X-Backend-Redirect': '.shards_a/c_x'}):
+            resp = req.get_response(self.app)
+        self.assertEqual(resp.status_int, 201)
+        self.assertNotIn('shard-updating/a/c', self.app.memcache.store)
 
     def test_DELETE(self):
         with save_globals():
@@ -4007,7 +4540,7 @@ class TestReplicatedObjectController(
                 self.app.log_handoffs = True
                 self.app.logger = FakeLogger()
                 self.app.request_node_count = lambda r: 7
-                self.app._error_limiting = {}  # clear out errors
+                self.app._error_limiting.clear()  # clear out errors
                 set_node_errors(self.app, object_ring._devs[0], 999,
                                 last_error=(2 ** 63 - 1))
 
@@ -4024,7 +4557,7 @@ class TestReplicatedObjectController(
                 self.app.log_handoffs = True
                 self.app.logger = FakeLogger()
                 self.app.request_node_count = lambda r: 7
-                self.app._error_limiting = {}  # clear out errors
+                self.app._error_limiting.clear()  # clear out errors
                 for i in range(2):
                     set_node_errors(self.app, object_ring._devs[i], 999,
                                     last_error=(2 ** 63 - 1))
@@ -4046,7 +4579,7 @@ class TestReplicatedObjectController(
                 self.app.logger = FakeLogger()
                 self.app.request_node_count = lambda r: 10
                 object_ring.set_replicas(4)  # otherwise we run out of handoffs
-                self.app._error_limiting = {}  # clear out errors
+                self.app._error_limiting.clear()  # clear out errors
                 for i in range(4):
                     set_node_errors(self.app, object_ring._devs[i], 999,
                                     last_error=(2 ** 63 - 1))
@@ -4291,7 +4824,7 @@ class TestReplicatedObjectController(
     def test_acc_or_con_missing_returns_404(self):
         with save_globals():
             self.app.memcache = FakeMemcacheReturnsNone()
-            self.app._error_limiting = {}
+            self.app._error_limiting.clear()
             controller = ReplicatedObjectController(
                 self.app, 'account', 'container', 'object')
             set_http_connect(200, 200, 200, 200, 200, 200)
@@ -6630,7 +7163,7 @@ class TestECMismatchedFA(unittest.TestCase):
     def tearDown(self):
         prosrv = _test_servers[0]
         # don't leak error limits and poison other tests
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
 
     def test_mixing_different_objects_fragment_archives(self):
         (prosrv, acc1srv, acc2srv, con1srv, con2srv, obj1srv,
@@ -6668,7 +7201,7 @@ class TestECMismatchedFA(unittest.TestCase):
 
         # Server obj1 will have the first version of the object (obj2 also
         # gets it, but that gets stepped on later)
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         with mock.patch.object(obj3srv, 'PUT', bad_disk), \
                 mock.patch(
                     'swift.common.storage_policy.ECStoragePolicy.quorum'):
@@ -6677,7 +7210,7 @@ class TestECMismatchedFA(unittest.TestCase):
         self.assertEqual(resp.status_int, 201)
 
         # Servers obj2 and obj3 will have the second version of the object.
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         with mock.patch.object(obj1srv, 'PUT', bad_disk), \
                 mock.patch(
                     'swift.common.storage_policy.ECStoragePolicy.quorum'):
@@ -6689,7 +7222,7 @@ class TestECMismatchedFA(unittest.TestCase):
         get_req = Request.blank("/v1/a/ec-crazytown/obj",
                                 environ={"REQUEST_METHOD": "GET"},
                                 headers={"X-Auth-Token": "t"})
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         with mock.patch.object(obj1srv, 'GET', bad_disk), \
                 mock.patch.object(obj2srv, 'GET', bad_disk):
             resp = get_req.get_response(prosrv)
@@ -6699,7 +7232,7 @@ class TestECMismatchedFA(unittest.TestCase):
         get_req = Request.blank("/v1/a/ec-crazytown/obj",
                                 environ={"REQUEST_METHOD": "GET"},
                                 headers={"X-Auth-Token": "t"})
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         with mock.patch.object(obj1srv, 'GET', bad_disk):
             resp = get_req.get_response(prosrv)
         self.assertEqual(resp.status_int, 200)
@@ -6709,7 +7242,7 @@ class TestECMismatchedFA(unittest.TestCase):
         get_req = Request.blank("/v1/a/ec-crazytown/obj",
                                 environ={"REQUEST_METHOD": "GET"},
                                 headers={"X-Auth-Token": "t"})
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         with mock.patch.object(obj2srv, 'GET', bad_disk):
             resp = get_req.get_response(prosrv)
         self.assertEqual(resp.status_int, 503)
@@ -6750,7 +7283,7 @@ class TestECMismatchedFA(unittest.TestCase):
 
         # First subset of object server will have the first version of the
         # object
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         with mock.patch.object(obj4srv, 'PUT', bad_disk), \
                 mock.patch.object(obj5srv, 'PUT', bad_disk), \
                 mock.patch.object(obj6srv, 'PUT', bad_disk), \
@@ -6761,7 +7294,7 @@ class TestECMismatchedFA(unittest.TestCase):
         self.assertEqual(resp.status_int, 201)
 
         # Second subset will have the second version of the object.
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         with mock.patch.object(obj1srv, 'PUT', bad_disk), \
                 mock.patch.object(obj2srv, 'PUT', bad_disk), \
                 mock.patch.object(obj3srv, 'PUT', bad_disk), \
@@ -6775,7 +7308,7 @@ class TestECMismatchedFA(unittest.TestCase):
         get_req = Request.blank("/v1/a/ec-dup-crazytown/obj",
                                 environ={"REQUEST_METHOD": "GET"},
                                 headers={"X-Auth-Token": "t"})
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         with mock.patch.object(obj2srv, 'GET', bad_disk), \
                 mock.patch.object(obj3srv, 'GET', bad_disk), \
                 mock.patch.object(obj4srv, 'GET', bad_disk), \
@@ -6788,7 +7321,7 @@ class TestECMismatchedFA(unittest.TestCase):
         get_req = Request.blank("/v1/a/ec-dup-crazytown/obj",
                                 environ={"REQUEST_METHOD": "GET"},
                                 headers={"X-Auth-Token": "t"})
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         with mock.patch.object(obj1srv, 'GET', bad_disk), \
                 mock.patch.object(obj2srv, 'GET', bad_disk), \
                 mock.patch.object(obj3srv, 'GET', bad_disk), \
@@ -6801,7 +7334,7 @@ class TestECMismatchedFA(unittest.TestCase):
         get_req = Request.blank("/v1/a/ec-dup-crazytown/obj",
                                 environ={"REQUEST_METHOD": "GET"},
                                 headers={"X-Auth-Token": "t"})
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         with mock.patch.object(obj2srv, 'GET', bad_disk), \
                 mock.patch.object(obj3srv, 'GET', bad_disk), \
                 mock.patch.object(obj4srv, 'GET', bad_disk), \
@@ -6820,7 +7353,7 @@ class TestECGets(unittest.TestCase):
         rmtree(self.tempdir, ignore_errors=True)
         prosrv = _test_servers[0]
         # don't leak error limits and poison other tests
-        prosrv._error_limiting = {}
+        prosrv._error_limiting.clear()
         super(TestECGets, self).tearDown()
 
     def _setup_nodes_and_do_GET(self, objs, node_state):
@@ -8181,7 +8714,7 @@ class TestContainerController(unittest.TestCase):
         for meth in ('DELETE', 'PUT'):
             with save_globals():
                 self.app.memcache = FakeMemcacheReturnsNone()
-                self.app._error_limiting = {}
+                self.app._error_limiting.clear()
                 controller = proxy_server.ContainerController(self.app,
                                                               'account',
                                                               'container')